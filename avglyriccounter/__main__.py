@@ -1,50 +1,415 @@
 import avglyriccounter
+import cache
+import server
+import mbindex
+import analytics
+import state
+import journal
+import lyricstore
+import rescore
+import resolver
+import functools
+import signal
 import sys
+import json
+import time
 import logging
 
 logging.basicConfig(level=logging.WARNING,
                     format="%(asctime)s %(levelname)s %(filename)s:%(lineno)s %(funcName)s() %(message)s")
 log = logging.getLogger("avglyriccounter")
 
+usage_str = ("Usage:\n\n"
+             "avglyriccounter <artist_name> <options>\n"
+             "avglyriccounter --batch <file> <options>\n"
+             "avglyriccounter --serve [<host>:]<port> <options>\n"
+             "avglyriccounter --build-mb-index <dump_dir> --mb-index <path>\n"
+             "avglyriccounter --stats artist|release|year <options>\n"
+             "avglyriccounter --rescore --lyric-store <dir> [--processes <n>]\n\n"
+             "Options:\n"
+             "-h --help\t\tThis help text\n"
+             "-v\t\t\tIncrease log level to INFO\n"
+             "-vv\t\t\tIncrease log level to DEBUG\n"
+             "-j --workers <n>\tNumber of concurrent LyricsOvh requests (default 8)\n"
+             "--timeout <s>\t\tSeconds to wait for a single LyricsOvh response (default 10)\n"
+             "--cache <path>\t\tResponse cache database (default ~/.cache/avglyriccounter/responses.sqlite3)\n"
+             "--no-cache\t\tDo not read or write the response cache\n"
+             "--lyric-store <dir>\tKeep the text of the lyrics in a compressed store in <dir> and read them from it\n"
+             "--stream-responses\tDecode the large MusicBrainz responses while they are received, keeping only the fields used\n"
+             "--mbid <mbid>\t\tCount the songs of the artist with this MusicBrainz ID instead of searching for <artist_name>, and\n"
+             "\t\t\tresolve <artist_name> to it from now on, e.g. when another artist has the same name\n"
+             "--batch <file>\t\tRead artist names from a file, one per line, or from stdin if <file> is -\n"
+             "--artists <n>\t\tNumber of artists processed at the same time in batch and server mode (default 4)\n"
+             "--serve [<host>:]<port>\tServe average lyric counts over HTTP (host defaults to 127.0.0.1)\n"
+             "--mb-index <path>\tAnswer MusicBrainz queries from a local index instead of the MusicBrainz API\n"
+             "--build-mb-index <dump_dir>\tBuild the --mb-index from a MusicBrainz JSON data dump\n"
+             "--report <file>\t\tWrite a JSON report of the requests, cache use and time spent per phase when done\n"
+             "--refresh\t\tOnly request the new releases and missing lyrics of previously processed artists\n"
+             "--state-dir <path>\tDirectory of the artist states of --refresh, implies --refresh (default ~/.local/state/avglyriccounter/artists)\n"
+             "--journal <dir>\t\tRecord the progress of each artist in <dir> and resume from it after an interruption\n"
+             "--approximate <tolerance>\n\t\t\tEstimate the average from a random sample of songs, until the 95% confidence interval is within\n"
+             "\t\t\t<tolerance> of it, e.g. 0.05 for +-5%\n"
+             "--budget <n>\t\tRequest the lyrics of at most <n> songs per artist with --approximate\n"
+             "--stats <group>\t\tPrint word count statistics per artist, release or year from the response cache (requires NumPy)\n"
+             "--rescore\t\tCount the words of the lyrics in the --lyric-store again and print the average per artist\n"
+             "--processes <n>\t\tNumber of processes counting the words with --rescore (default the number of CPUs)")
+
 # Handle command line arguments
 def handle_command_line_args():
     """
     Processes command line arguments
 
-    :returns    the artist name
+    :returns    the artist name and a dict of options
     """
 
     artist_name = ''
+    options = {
+        'max_workers': 8,
+        'lyrics_timeout': 10,
+        'cache_path': cache.default_cache_path(),
+        'batch_file': None,
+        'max_artists': 4,
+        'serve_address': None,
+        'mb_index': None,
+        'mb_dump_dir': None,
+        'stats_by': None,
+        'state_dir': None,
+        'report_path': None,
+        'journal_dir': None,
+        'lyric_store_dir': None,
+        'stream_responses': False,
+        'artist_mbid': None,
+        'rescore': False,
+        'processes': None,
+        'tolerance': None,
+        'budget': None
+    }
 
-    usage_str = "Usage:\n\navglyriccounter <artist_name> <options>\n\nOptions:\n-h --help\tThis help text\n-v\t\tIncrease log level to INFO\n-vv\t\tIncrease log level to DEBUG"
+    args = sys.argv[1:]
+    i = 0
+    try:
+        while i < len(args):
+            arg = args[i]
+            if arg == "-h" or arg == "--help":
+                raise ValueError
+            elif arg == "-v":
+                log.setLevel(logging.INFO)
+            elif arg == "-vv":
+                log.setLevel(logging.DEBUG)
+            elif arg == "-j" or arg == "--workers":
+                i += 1
+                options['max_workers'] = int(args[i])
+                if options['max_workers'] < 1:
+                    raise ValueError
+            elif arg == "--timeout":
+                i += 1
+                options['lyrics_timeout'] = float(args[i])
+            elif arg == "--cache":
+                i += 1
+                options['cache_path'] = args[i]
+            elif arg == "--no-cache":
+                options['cache_path'] = None
+            elif arg == "--lyric-store":
+                i += 1
+                options['lyric_store_dir'] = args[i]
+            elif arg == "--stream-responses":
+                options['stream_responses'] = True
+            elif arg == "--mbid":
+                i += 1
+                options['artist_mbid'] = args[i].lower()
+                if not resolver.is_mbid(options['artist_mbid']):
+                    raise ValueError
+            elif arg == "--rescore":
+                options['rescore'] = True
+            elif arg == "--processes":
+                i += 1
+                options['processes'] = int(args[i])
+                if options['processes'] < 1:
+                    raise ValueError
+            elif arg == "--batch":
+                i += 1
+                options['batch_file'] = args[i]
+            elif arg == "--artists":
+                i += 1
+                options['max_artists'] = int(args[i])
+                if options['max_artists'] < 1:
+                    raise ValueError
+            elif arg == "--serve":
+                i += 1
+                host, separator, port = args[i].rpartition(':')
+                options['serve_address'] = (host if host != '' else '127.0.0.1', int(port))
+            elif arg == "--mb-index":
+                i += 1
+                options['mb_index'] = args[i]
+            elif arg == "--build-mb-index":
+                i += 1
+                options['mb_dump_dir'] = args[i]
+            elif arg == "--report":
+                i += 1
+                options['report_path'] = args[i]
+            elif arg == "--refresh":
+                if options['state_dir'] == None:
+                    options['state_dir'] = state.default_state_dir()
+            elif arg == "--state-dir":
+                i += 1
+                options['state_dir'] = args[i]
+            elif arg == "--approximate":
+                i += 1
+                options['tolerance'] = float(args[i])
+                if options['tolerance'] <= 0:
+                    raise ValueError
+            elif arg == "--budget":
+                i += 1
+                options['budget'] = int(args[i])
+                if options['budget'] < 1:
+                    raise ValueError
+            elif arg == "--journal":
+                i += 1
+                options['journal_dir'] = args[i]
+            elif arg == "--stats":
+                i += 1
+                options['stats_by'] = args[i]
+                if options['stats_by'] not in analytics.GROUP_BY:
+                    raise ValueError
+            elif artist_name == '' and arg != '' and not arg.startswith('-'):
+                artist_name = arg
+            else:
+                raise ValueError
+            i += 1
 
-    if len(sys.argv) > 1 and sys.argv[1] != '' and sys.argv[1] != '-h' and sys.argv[1] != '--help':
-        artist_name = sys.argv[1]
-    else:
+        # Exactly one of the artist name, the batch file, the server address, the dump directory, the statistics grouping and --rescore must be given
+        modes = [artist_name != '', options['batch_file'] != None, options['serve_address'] != None, options['mb_dump_dir'] != None,
+                 options['stats_by'] != None, options['rescore']]
+        if modes.count(True) != 1:
+            raise ValueError
+
+        if options['rescore'] and options['lyric_store_dir'] == None:
+            raise ValueError
+
+        if options['processes'] != None and not options['rescore']:
+            raise ValueError
+
+        if options['stats_by'] != None and options['cache_path'] == None:
+            raise ValueError
+
+        if options['mb_dump_dir'] != None and options['mb_index'] == None:
+            raise ValueError
+
+        # There are no responses to stream from the local index
+        if options['stream_responses'] and options['mb_index'] != None:
+            raise ValueError
+
+        # The MBID is of the one artist given by name
+        if options['artist_mbid'] != None and artist_name == '':
+            raise ValueError
+
+        if options['journal_dir'] != None and options['state_dir'] != None:
+            raise ValueError
+
+        # Estimates are not stored, served or journaled
+        if options['tolerance'] != None and (options['state_dir'] != None or options['journal_dir'] != None or options['serve_address'] != None):
+            raise ValueError
+
+        if options['budget'] != None and options['tolerance'] == None:
+            raise ValueError
+    except (IndexError, ValueError):
         print(usage_str)
         exit()
 
-    for i, arg in enumerate(sys.argv[2:]):
-        if arg == "-v":
-            log.setLevel(logging.INFO)
-        elif arg == "-vv":
-            log.setLevel(logging.DEBUG)
+    return artist_name, options
+
+def read_artist_names(batch_file):
+    """
+    Reads the artist names for batch mode, skipping empty lines
+
+    :param      batch_file      path of the file to read, or - for stdin
+
+    :returns    list of artist names
+    """
+
+    if batch_file == '-':
+        lines = sys.stdin.readlines()
+    else:
+        with open(batch_file) as f:
+            lines = f.readlines()
+
+    return [line.strip() for line in lines if line.strip() != '']
+
+def run_batch(alc, options):
+    """
+    Processes all of the artists in the batch file, printing a JSON line per artist as they finish
+
+    An artist that failed, for whatever reason, gets a line with the name of the error.
+    """
+
+    artist_names = read_artist_names(options['batch_file'])
+
+    get_average = None
+    if options['tolerance'] != None:
+        get_average = functools.partial(alc.estimate_average_lyric_count, tolerance=options['tolerance'], budget=options['budget'])
+
+    for artist_name, average_word_count, error in alc.get_average_lyric_counts(artist_names, options['max_artists'], get_average):
+        if error != None:
+            result = {'artist': artist_name, 'error': type(error).__name__}
+            if isinstance(error, avglyriccounter.IncompleteData):
+                result.update(error.to_dict())
+        elif options['tolerance'] != None:
+            result = dict({'artist': artist_name}, **average_word_count.to_dict())
         else:
-            print(usage_str)
-            exit()
+            result = {'artist': artist_name, 'average_word_count': average_word_count}
+
+        print(json.dumps(result), flush=True)
+
+def format_estimate(estimate):
+    """
+    :returns    the estimate as a line of text, e.g. "178 +-6.2 (95% confidence, 57 of 950 songs requested)"
+    """
+
+    if estimate.exact:
+        return str(round(estimate.mean)) + " (exact, all " + str(estimate.track_count) + " songs requested)"
+
+    half_width = "+-" + str(round(estimate.half_width, 1)) if estimate.half_width != None else "+-?"
+
+    return (str(round(estimate.mean)) + " " + half_width + " (" + str(round(estimate.confidence * 100)) + "% confidence, " +
+            str(estimate.lyrics_requests) + " of " + str(estimate.track_count) + " songs requested)")
+
+def run_server(alc, options):
+    """
+    Serves average lyric counts over HTTP until interrupted
+    """
 
-    return artist_name
+    httpd = server.LyricCountServer(options['serve_address'], alc, max_artists=options['max_artists'])
+
+    print("Serving on http://" + options['serve_address'][0] + ":" + str(httpd.server_address[1]), flush=True)
+
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+
+def write_report(alc, report_path, started):
+    """
+    Writes the run report of the AvgLyricCounter as JSON
+    """
+
+    report = {'started': started, 'duration': time.time() - started}
+    report.update(alc.report())
+
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+
+def run_stats(options):
+    """
+    Prints a JSON line of word count statistics per artist, release or year, using only the responses in the cache
+    """
+
+    if analytics.np == None:
+        print("--stats requires NumPy, install it with: pip install numpy")
+        exit()
+
+    response_cache = cache.ResponseCache(options['cache_path'])
+
+    try:
+        corpus = analytics.load_corpus(response_cache, vocabulary=True)
+    finally:
+        response_cache.close()
+
+    for result in analytics.describe(corpus, by=options['stats_by']):
+        print(json.dumps(result))
+
+def run_rescore(options):
+    """
+    Prints a JSON line of the average word count per artist, counted again from the lyrics in the lyric store
+    """
+
+    with lyricstore.LyricStore(options['lyric_store_dir']) as lyric_store:
+        results = rescore.rescore(lyric_store, processes=options['processes'])
+
+    for result in results:
+        print(json.dumps(result))
 
 # ------------------------------------------------------------------------------------------------
 
-alc = avglyriccounter.AvgLyricCounter()
+artist_name, options = handle_command_line_args()
 
-artist_name = handle_command_line_args()
+if options['mb_dump_dir'] != None:
+    mbindex.build_index(options['mb_dump_dir'], options['mb_index'])
+    exit()
 
-try:
-    average_word_count = alc.get_average_lyric_count(artist_name)
-except avglyriccounter.MissingData:
-    print("Exiting...")
+if options['stats_by'] != None:
+    run_stats(options)
     exit()
 
-print(average_word_count)
+if options['rescore']:
+    run_rescore(options)
+    exit()
+
+response_cache = None
+if options['cache_path'] != None:
+    response_cache = cache.ResponseCache(options['cache_path'])
+
+mb_client = None
+if options['mb_index'] != None:
+    mb_client = mbindex.LocalMusicBrainzClient(options['mb_index'])
+
+state_store = None
+if options['state_dir'] != None:
+    state_store = state.StateStore(options['state_dir'])
+
+journal_store = None
+if options['journal_dir'] != None:
+    journal_store = journal.JournalStore(options['journal_dir'])
+
+lyric_store = None
+if options['lyric_store_dir'] != None:
+    lyric_store = lyricstore.LyricStore(options['lyric_store_dir'])
+
+# Exit cleanly on SIGTERM, e.g. when a preemptible node is shut down, so that the journals are synced and the report is written
+signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+
+started = time.time()
+
+try:
+    with avglyriccounter.AvgLyricCounter(max_workers=options['max_workers'], lyrics_timeout=options['lyrics_timeout'], response_cache=response_cache,
+                                         mb_client=mb_client, state_store=state_store, journal_store=journal_store, lyric_store=lyric_store,
+                                         stream_responses=options['stream_responses'], max_artists=options['max_artists']) as alc:
+        try:
+            if options['batch_file'] != None:
+                run_batch(alc, options)
+                exit()
+
+            if options['serve_address'] != None:
+                run_server(alc, options)
+                exit()
+
+            try:
+                if options['tolerance'] != None:
+                    estimate = alc.estimate_average_lyric_count(artist_name, tolerance=options['tolerance'], budget=options['budget'],
+                                                                artist_mbid=options['artist_mbid'])
+                else:
+                    average_word_count = alc.get_average_lyric_count(artist_name, artist_mbid=options['artist_mbid'])
+            except avglyriccounter.IncompleteData as e:
+                print(str(e.average_word_count) + " (incomplete, " + str(e) + ")")
+                print("Exiting...")
+                exit()
+            except avglyriccounter.MissingData:
+                print("Exiting...")
+                exit()
+            except Exception as e:
+                log.error("Could not get the average word count of artist '" + artist_name + "': " + type(e).__name__ + " " + str(e))
+                print("Exiting...")
+                exit()
+
+            if options['tolerance'] != None:
+                print(format_estimate(estimate))
+            else:
+                print(average_word_count)
+        finally:
+            if options['report_path'] != None:
+                write_report(alc, options['report_path'], started)
+finally:
+    # Only once the lyric requests in flight have finished
+    if lyric_store != None:
+        lyric_store.close()
@@ -0,0 +1,357 @@
+try:
+    from . import lyrics
+    from . import resolver
+    from . import titles
+except ImportError:
+    # Running as a script, e.g. "python3 avglyriccounter", instead of as a package
+    import lyrics
+    import resolver
+    import titles
+from urllib.parse import urlsplit, parse_qsl, unquote
+from array import array
+import re
+import logging
+
+try:
+    import numpy as np
+except ImportError:
+    # NumPy is only needed for the analytics
+    np = None
+
+log = logging.getLogger("avglyriccounter")
+
+# Percentiles of the word counts reported in addition to the median
+DEFAULT_PERCENTILES = (10, 25, 75, 90)
+
+# Lower edges of the word count histogram bins, the last bin has no upper edge
+DEFAULT_BINS = (0, 50, 100, 150, 200, 250, 300, 400, 500, 750, 1000)
+
+GROUP_BY = ('artist', 'release', 'year')
+
+# Tracks with any of these in their title are left out, like in AvgLyricCounter
+DEFAULT_EXCLUSION_FILTERS = ('(instrumental)', '(live)')
+
+class Corpus():
+    """
+    Word counts of tracks, stored column-wise for vectorized aggregations.
+
+    Each track belongs to an artist and a release, and has the year of the release (0 if unknown).
+    The artist names and release ids are stored once, and the tracks refer to them by index.
+
+    With vocabulary=True, the distinct words of each track are stored as well, as (track index,
+    word id) pairs, so that vocabulary sizes can be calculated for any grouping of the tracks.
+    """
+
+    def __init__(self, vocabulary=False):
+        if np == None:
+            raise ImportError("The analytics require NumPy, install it with: pip install numpy")
+
+        self.artists = []
+        self.releases = []
+        self.release_artists = []
+        self.artist_indices = {}
+        self.release_indices = {}
+
+        # Columns of the tracks, converted into NumPy arrays by columns()
+        self.track_artists = array('i')
+        self.track_releases = array('i')
+        self.track_years = array('i')
+        self.word_counts = array('i')
+
+        self.vocabulary = {} if vocabulary else None
+        self.token_tracks = array('i')
+        self.token_words = array('i')
+
+    def __len__(self):
+        return len(self.word_counts)
+
+    def add_track(self, artist, release_id, year, word_count, words=None):
+        """
+        Adds a track to the corpus
+
+        :param      artist          name of the artist
+        :param      release_id      MBID of the release the track is on
+        :param      year            year of the release, 0 if unknown
+        :param      word_count      word count of the track's lyrics
+        :param      words           iterable of the words of the lyrics, only used with vocabulary=True
+        """
+
+        artist_index = self.artist_indices.get(artist)
+        if artist_index == None:
+            artist_index = len(self.artists)
+            self.artist_indices[artist] = artist_index
+            self.artists.append(artist)
+
+        release_index = self.release_indices.get(release_id)
+        if release_index == None:
+            release_index = len(self.releases)
+            self.release_indices[release_id] = release_index
+            self.releases.append(release_id)
+            self.release_artists.append(artist_index)
+
+        track = len(self.word_counts)
+        self.track_artists.append(artist_index)
+        self.track_releases.append(release_index)
+        self.track_years.append(year)
+        self.word_counts.append(word_count)
+
+        if self.vocabulary != None and words != None:
+            for word in set(words):
+                word_id = self.vocabulary.get(word)
+                if word_id == None:
+                    word_id = len(self.vocabulary)
+                    self.vocabulary[word] = word_id
+                self.token_tracks.append(track)
+                self.token_words.append(word_id)
+
+    def columns(self):
+        """
+        :returns    dict of NumPy arrays 'artist', 'release', 'year' and 'word_count' with a value per
+                    track, and 'token_track' and 'token_word' with a value per distinct word of each track
+        """
+
+        return {
+            'artist': np.array(self.track_artists, dtype=np.int32),
+            'release': np.array(self.track_releases, dtype=np.int32),
+            'year': np.array(self.track_years, dtype=np.int32),
+            'word_count': np.array(self.word_counts, dtype=np.int64),
+            'token_track': np.array(self.token_tracks, dtype=np.int64),
+            'token_word': np.array(self.token_words, dtype=np.int64)
+        }
+
+def group_stats(groups, values, n_groups, percentiles):
+    """
+    Calculates the count, mean, minimum, maximum and percentiles of the values of each group
+
+    The values are sorted by group and value with a single sort of a combined key, after which
+    every statistic is calculated for all of the groups at once.
+
+    :param      groups          array of the group index of each value
+    :param      values          array of non-negative integer values
+    :param      n_groups        number of groups
+    :param      percentiles     percentiles to calculate, between 0 and 100
+
+    :returns    dict of arrays with a value per group: 'count', 'mean', 'min', 'max' and
+                'percentiles', which has a column per percentile. Empty groups have NaNs.
+    """
+
+    keys = (groups.astype(np.int64) << 32) | values.astype(np.int64)
+    keys.sort()
+    sorted_values = (keys & 0xffffffff).astype(np.float64)
+
+    counts = np.bincount(groups, minlength=n_groups)
+    starts = np.cumsum(counts) - counts
+    nonempty = counts > 0
+
+    stats = {
+        'count': counts,
+        'mean': np.full(n_groups, np.nan),
+        'min': np.full(n_groups, np.nan),
+        'max': np.full(n_groups, np.nan),
+        'percentiles': np.full((n_groups, len(percentiles)), np.nan)
+    }
+
+    counts = counts[nonempty]
+    starts = starts[nonempty]
+
+    stats['mean'][nonempty] = np.bincount(groups, weights=values, minlength=n_groups)[nonempty] / counts
+    stats['min'][nonempty] = sorted_values[starts]
+    stats['max'][nonempty] = sorted_values[starts + counts - 1]
+
+    for i, percentile in enumerate(percentiles):
+        # Linear interpolation between the closest ranks, like numpy.percentile
+        position = starts + (counts - 1) * (percentile / 100)
+        low = np.floor(position).astype(np.int64)
+        high = np.minimum(low + 1, starts + counts - 1)
+        stats['percentiles'][nonempty, i] = sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (position - low)
+
+    return stats
+
+def group_histograms(groups, values, n_groups, bins):
+    """
+    :param      groups      array of the group index of each value
+    :param      values      array of values
+    :param      n_groups    number of groups
+    :param      bins        ascending lower edges of the bins, the last bin has no upper edge
+
+    :returns    array with a row per group and a column per bin, containing the number of values in
+                the bin. Values below the first edge are not counted.
+    """
+
+    bin_indices = np.searchsorted(np.asarray(bins), values, side='right') - 1
+    counted = bin_indices >= 0
+
+    flat = groups[counted].astype(np.int64) * len(bins) + bin_indices[counted]
+    return np.bincount(flat, minlength=n_groups * len(bins)).reshape(n_groups, len(bins))
+
+def group_vocabulary_sizes(groups, token_tracks, token_words, n_groups):
+    """
+    :param      groups          array of the group index of each track
+    :param      token_tracks    array of the track index of each (track, word) pair
+    :param      token_words     array of the word id of each (track, word) pair
+    :param      n_groups        number of groups
+
+    :returns    array of the number of distinct words in each group
+    """
+
+    # Sorting in place and comparing neighbours is much faster than numpy.unique for large inputs
+    pairs = (groups[token_tracks].astype(np.int64) << 32) | token_words
+    pairs.sort()
+
+    is_first = np.empty(len(pairs), dtype=bool)
+    is_first[:1] = True
+    np.not_equal(pairs[1:], pairs[:-1], out=is_first[1:])
+
+    return np.bincount(pairs[is_first] >> 32, minlength=n_groups)
+
+def describe(corpus, by='artist', percentiles=DEFAULT_PERCENTILES, bins=DEFAULT_BINS):
+    """
+    Calculates the word count distribution of each artist, release or year
+
+    :param      corpus          Corpus of the tracks
+    :param      by              'artist', 'release' or 'year'
+    :param      percentiles     percentiles to report in addition to the median
+    :param      bins            lower edges of the histogram bins
+
+    :returns    list of dicts, one per group with tracks, ordered like the groups were first seen
+                (by year for years)
+    :raises     ValueError if by is not one of GROUP_BY
+    """
+
+    if by not in GROUP_BY:
+        raise ValueError("Unsupported grouping '" + str(by) + "'")
+
+    columns = corpus.columns()
+
+    if by == 'artist':
+        groups = columns['artist']
+        labels = [{'artist': artist} for artist in corpus.artists]
+    elif by == 'release':
+        groups = columns['release']
+        labels = [{'artist': corpus.artists[artist_index], 'release': release_id}
+                  for release_id, artist_index in zip(corpus.releases, corpus.release_artists)]
+    else:
+        years, groups = np.unique(columns['year'], return_inverse=True)
+        labels = [{'year': int(year) if year != 0 else None} for year in years]
+
+    n_groups = len(labels)
+
+    stats = group_stats(groups, columns['word_count'], n_groups, (50,) + tuple(percentiles))
+    histograms = group_histograms(groups, columns['word_count'], n_groups, bins)
+
+    if corpus.vocabulary != None:
+        vocabulary_sizes = group_vocabulary_sizes(groups, columns['token_track'], columns['token_word'], n_groups)
+
+    results = []
+    for i in np.flatnonzero(stats['count']):
+        result = dict(labels[i])
+        result['tracks'] = int(stats['count'][i])
+        result['mean'] = round(float(stats['mean'][i]), 1)
+        result['median'] = round(float(stats['percentiles'][i, 0]), 1)
+        for j, percentile in enumerate(percentiles):
+            result['p' + str(percentile)] = round(float(stats['percentiles'][i, j + 1]), 1)
+        result['min'] = int(stats['min'][i])
+        result['max'] = int(stats['max'][i])
+        result['histogram'] = histograms[i].tolist()
+        if corpus.vocabulary != None:
+            result['vocabulary'] = int(vocabulary_sizes[i])
+        results.append(result)
+
+    return results
+
+def _search_artist_name(url):
+    """
+    :returns    the lower case artist name searched for in a MusicBrainz search URL, or None
+    """
+
+    query = dict(parse_qsl(urlsplit(url).query)).get('query', '')
+    match = re.match(r"artist:(.*?)(?: AND |$)", query)
+    return match.group(1).strip().lower() if match != None else None
+
+def _release_year(date):
+    """
+    :returns    the year of a MusicBrainz date, e.g. "1992-05-11", or 0 if it is unknown
+    """
+
+    year = (date or '')[:4]
+    return int(year) if year.isdigit() else 0
+
+def load_corpus(response_cache, vocabulary=False, exclusion_filters=DEFAULT_EXCLUSION_FILTERS):
+    """
+    Builds a Corpus from the responses stored in a response cache, without any requests
+
+    The release group searches tell which releases belong to which artist, and the year of each
+    release. The track titles come from the cached releases and the words from the cached lyrics.
+    Like in AvgLyricCounter, only the first version found of each of an artist's songs is counted,
+    see titles.TitleIndex, and instrumentals and tracks without cached lyrics are left out.
+
+    :param      response_cache      ResponseCache to read the responses from
+    :param      vocabulary          whether to collect the words of the lyrics for vocabulary sizes
+    :param      exclusion_filters   sequence of strings to use to exclude tracks with at least one of them in the title
+
+    :returns    the Corpus
+    """
+
+    # Lower case artist name -> MBID of the best match of the artist search, see MusicBrainzHandler.find_artist
+    artist_mbids = {}
+    for url, artist_json in response_cache.iter_entries('artist'):
+        artist_name = _search_artist_name(url)
+        if artist_name != None and len(artist_json.get('artists', [])) > 0:
+            artist_mbids[artist_name] = resolver.rank_candidates(artist_json['artists'], artist_name)[0]['id']
+
+    # Release MBID -> (artist name, year)
+    release_artists = {}
+    for url, artist_json in response_cache.iter_entries('release-group'):
+        artist_name = _search_artist_name(url)
+        if artist_name == None:
+            continue
+
+        # The artist the name was resolved to, which may have been given by MBID instead of searched for
+        resolution = response_cache.get_artist_resolution(resolver.name_key(artist_name))
+        artist_mbid = resolution[0] if resolution != None else artist_mbids.get(artist_name)
+        for release_group in artist_json.get('release-groups', []):
+            # Without a known MBID, fall back to comparing the credited names
+            is_by_artist = any(artist_credit['artist']['id'] == artist_mbid if artist_mbid != None
+                               else artist_credit['artist']['name'].lower() == artist_name
+                               for artist_credit in release_group['artist-credit'])
+
+            if is_by_artist and len(release_group.get('releases', [])) > 0:
+                release_id = release_group['releases'][0]['id']
+                if release_id not in release_artists:
+                    release_artists[release_id] = (artist_name, _release_year(release_group.get('first-release-date')))
+
+    # "artist/title", the path of the track's lyrics URL -> (artist name, release MBID, year) of the
+    # first release the song was seen on
+    tracks = {}
+    # Artist name -> titles.TitleIndex of the artist's songs
+    title_indexes = {}
+    for url, release_json in response_cache.iter_entries('release'):
+        # Either a single release or a page of browsed releases
+        for release in release_json.get('releases', [release_json]):
+            if release.get('id') not in release_artists:
+                continue
+
+            artist_name, year = release_artists[release['id']]
+            title_index = title_indexes.setdefault(artist_name, titles.TitleIndex())
+            for media in release.get('media', []):
+                for track in media.get('tracks', []):
+                    title = track['title'].lower()
+                    # Only the lyrics of the first version of each song are requested
+                    if not any(x in title for x in exclusion_filters) and title_index.add(title, track.get('recording', {}).get('id')):
+                        tracks[artist_name + "/" + title] = (artist_name, release['id'], year)
+
+    corpus = Corpus(vocabulary=vocabulary)
+
+    for url, lyrics_json in response_cache.iter_entries('lyrics'):
+        # The path is /v1/<artist>/<title>
+        track = tracks.get(unquote(urlsplit(url).path)[len('/v1/'):].lower())
+        if track == None or lyrics.is_instrumental(lyrics_json['lyrics']):
+            continue
+
+        artist_name, release_id, year = track
+        words = lyrics.iter_words(lyrics_json['lyrics']) if vocabulary else None
+        corpus.add_track(artist_name, release_id, year, lyrics.count_words(lyrics_json['lyrics']), words)
+
+    log.info("Loaded " + str(len(corpus)) + " tracks of " + str(len(corpus.artists)) + " artists from the cache")
+
+    return corpus
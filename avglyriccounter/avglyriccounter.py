@@ -1,7 +1,25 @@
-import musicbrainz
-import lyricsovh
+try:
+    from . import musicbrainz
+    from . import lyricsovh
+    from . import sessions
+    from . import state
+    from . import metrics
+    from . import sampling
+    from . import titles
+except ImportError:
+    # Running as a script, e.g. "python3 avglyriccounter", instead of as a package
+    import musicbrainz
+    import lyricsovh
+    import sessions
+    import state
+    import metrics
+    import sampling
+    import titles
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+import asyncio
+import itertools
 import logging
-import requests
+import random
 
 log = logging.getLogger("avglyriccounter")
 
@@ -9,35 +27,262 @@ log = logging.getLogger("avglyriccounter")
 class MissingData(Exception):
     pass
 
+# Raised instead of returning an average when the lyrics of some tracks or the tracks of some releases
+# could not be got, e.g. because LyricsOvh timed out, so that a partial average is not taken as complete
+class IncompleteData(MissingData):
+    def __init__(self, average_word_count, failed_lyrics, skipped_releases):
+        """
+        :param      average_word_count  the average word count of the songs whose lyrics were got,
+                                        rounded, or None if there were none
+        :param      failed_lyrics       number of tracks whose lyrics could not be got
+        :param      skipped_releases    number of releases whose tracks could not be got
+        """
+
+        super().__init__(str(failed_lyrics) + " lyrics and " + str(skipped_releases) + " releases could not be got")
+        self.average_word_count = average_word_count
+        self.failed_lyrics = failed_lyrics
+        self.skipped_releases = skipped_releases
+
+    def to_dict(self):
+        return {'partial_average_word_count': self.average_word_count, 'failed_lyrics': self.failed_lyrics,
+                'skipped_releases': self.skipped_releases}
+
+def calculate_average_word_count(word_counts):
+    """
+    Calculates the average of the given word counts
+
+    :param      word_counts     list of word counts of the tracks with lyrics
+
+    :returns    the average word count, or 0 if there are no word counts
+    """
+
+    total_word_count = sum(word_counts)
+    found_lyrics = len(word_counts)
+
+    # Check that we're not dividing by zero, then calculate the average word count of the found lyrics
+    if total_word_count > 0 and found_lyrics > 0:
+        return total_word_count / found_lyrics
+
+    return 0
+
+def _check_complete(artist_name, word_counts, failed_lyrics, skipped_releases):
+    """
+    Raises IncompleteData if any lyrics or releases of an artist could not be got
+
+    :param      artist_name         name of the artist
+    :param      word_counts         list of word counts of the tracks with lyrics that were got
+    :param      failed_lyrics       number of tracks whose lyrics could not be got
+    :param      skipped_releases    number of releases whose tracks could not be got
+
+    :raises     IncompleteData with the average of the word counts that were got
+    """
+
+    if failed_lyrics == 0 and skipped_releases == 0:
+        return
+
+    average_word_count = None
+    if len(word_counts) > 0:
+        average_word_count = round(calculate_average_word_count(word_counts))
+
+    log.error("The lyrics of " + str(failed_lyrics) + " tracks and the tracks of " + str(skipped_releases) +
+              " releases of artist '" + artist_name + "' could not be got, the average of the rest is " + str(average_word_count))
+    raise IncompleteData(average_word_count, failed_lyrics, skipped_releases)
+
 class AvgLyricCounter():
-    def __init__(self):
+    def __init__(self, max_workers=8, lyrics_timeout=10, response_cache=None, keep_alive=True, mb_client=None, state_store=None, registry=None,
+                 mb_base_url=None, lyrics_base_url=None, journal_store=None, lyric_store=None, stream_responses=False, max_artists=4):
+        """
+        :param      max_workers     maximum number of LyricsOvh requests in flight at the same time
+        :param      lyrics_timeout  seconds to wait for a single LyricsOvh response
+        :param      response_cache  optional cache.ResponseCache shared by the MusicBrainz and LyricsOvh clients
+        :param      keep_alive      whether the clients keep their connections open between requests
+        :param      mb_client       optional MusicBrainzClient compatible object to use instead of the
+                                    MusicBrainz API, e.g. a mbindex.LocalMusicBrainzClient
+        :param      state_store     optional state.StateStore, with which previously processed artists
+                                    are updated incrementally instead of being processed from scratch
+        :param      registry        optional metrics.Registry to record the requests and the phases in,
+                                    by default a new one
+        :param      mb_base_url     optional url to send the MusicBrainz requests to instead of the
+                                    MusicBrainz API, e.g. a local stub server's. Not used with mb_client.
+        :param      lyrics_base_url optional url to send the LyricsOvh requests to instead of the
+                                    LyricsOvh API, e.g. a local stub server's
+        :param      journal_store   optional journal.JournalStore, to which the progress of each artist
+                                    is recorded so that an interrupted run can resume from where it
+                                    stopped. Can't be used together with a state_store.
+        :param      lyric_store     optional lyricstore.LyricStore to keep the text of the lyrics in
+        :param      stream_responses    whether the large MusicBrainz responses are decoded while they
+                                        are received, keeping only the fields that are used, see
+                                        MusicBrainzClient. Not used with mb_client.
+        :param      max_artists     number of artists processed at the same time, by default, by
+                                    get_average_lyric_counts or by a server, see server.JobManager
+        """
+
+        if max_workers < 1:
+            raise ValueError("max_workers must be at least 1")
+
+        if max_artists < 1:
+            raise ValueError("max_artists must be at least 1")
+
+        if state_store != None and journal_store != None:
+            raise ValueError("state_store and journal_store can't be used together")
+
+        self.max_workers = max_workers
+        self.max_artists = max_artists
+
+        # Shared by all of the lyric requests, also when several artists are processed at the same time
+        self.lyrics_executor = ThreadPoolExecutor(max_workers=max_workers)
+
+        # exclude tracks with these strings in their titles
+        self.exclusion_filters = ['(instrumental)', '(live)']
+        self.response_cache = response_cache
+        self.state_store = state_store
+        self.journal_store = journal_store
+
+        if registry == None:
+            registry = metrics.Registry()
+        self.registry = registry
+
+        # The rate limiter spaces the MusicBrainz requests by when they are sent, so every artist processed
+        # at the same time may have one in flight while a slow response is received. More artists than
+        # max_artists wait for a connection instead of opening one that would be discarded.
+        self.mb_session = sessions.create_session(pool_size=max_artists, keep_alive=keep_alive, pool_block=True)
+        self.lo_session = sessions.create_session(pool_size=max_workers, keep_alive=keep_alive)
+
         # Create MusicBrainz handler
-        self.mb_client = musicbrainz.MusicBrainzClient()
-        self.mb_handler = musicbrainz.MusicBrainzHandler(self.mb_client)
+        if mb_client == None:
+            mb_client = musicbrainz.MusicBrainzClient(cache=response_cache, session=self.mb_session, registry=registry, base_url=mb_base_url,
+                                                      streaming=stream_responses)
+        self.mb_client = mb_client
+        self.mb_handler = musicbrainz.MusicBrainzHandler(self.mb_client, registry=registry, cache=response_cache)
 
         # Create LyricsOvh handler
-        self.lo_client = lyricsovh.LyricsOvhClient()
-        self.lo_handler = lyricsovh.LyricsOvhHandler(self.lo_client)
+        self.lo_client = lyricsovh.LyricsOvhClient(timeout=lyrics_timeout, cache=response_cache, session=self.lo_session, registry=registry,
+                                                   base_url=lyrics_base_url, store=lyric_store)
+        self.lo_handler = lyricsovh.LyricsOvhHandler(self.lo_client, registry=registry)
+
+    def __enter__(self):
+        return self
 
-    def get_all_unique_track_names(self, release_ids):
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Shuts down the LyricsOvh worker pool, waiting for the requests in flight to finish, and
+        closes the clients' connections
         """
-        Gets all unique track names for the given list of release_ids
 
-        :param      release_ids     list of release_id values to get tracks for
+        self.lyrics_executor.shutdown(wait=True)
+        self.mb_session.close()
+        self.lo_session.close()
 
-        :returns    a list of unique track names from the given ids, empty if none found
+    def report(self):
         """
+        Gets a run report of everything processed with this object so far
 
-        # exclude tracks with these strings in their titles
-        exclusion_filters = ['(instrumental)', '(live)']
+        :returns    dict with the 'counters' and 'histograms' of the metrics registry, the number of
+                    'coalesced_requests' per API, the response 'cache' counters, if there is a cache, and
+                    the 'lyric_store' stats, if there is a lyric store
+        """
+
+        retval = self.registry.report()
+
+        retval['coalesced_requests'] = {'lyricsovh': self.lo_client.in_flight.coalesced}
+        if isinstance(self.mb_client, musicbrainz.MusicBrainzClient):
+            retval['coalesced_requests']['musicbrainz'] = self.mb_client.in_flight.coalesced
+
+        if self.response_cache != None:
+            retval['cache'] = self.response_cache.stats()
+
+        if self.lo_client.store != None:
+            retval['lyric_store'] = self.lo_client.store.stats()
+
+        return retval
+
+    def __iter_releases(self, release_ids, artist_mbid, skipped=None):
+        """
+        Yields a model.Release per release, browsing the releases in bulk if the artist MBID is known
+
+        The releases whose tracks could not be got are skipped, so a failure late in a long run of
+        rate limited requests doesn't throw away the tracks already received. Their IDs are appended
+        to the skipped list, if one is given.
+        """
+
+        if artist_mbid != None:
+            yield from self.mb_handler.iter_releases(artist_mbid, release_ids, self.exclusion_filters, skipped=skipped)
+            return
 
-        # Get the names of all of the tracks on the record
-        tracks = []
         for release_id in release_ids:
-            tracks += self.mb_handler.get_tracks(release_id, exclusion_filters)
+            try:
+                release = self.mb_handler.get_release(release_id, self.exclusion_filters)
+            except musicbrainz.MusicBrainzHandlerError:
+                log.warning("Skipping release " + release_id + ", whose tracks could not be got from MusicBrainz")
+                self.registry.inc('releases_skipped_total')
+                if skipped != None:
+                    skipped.append(release_id)
+                continue
+
+            yield release
+
+    def __iter_release_pages(self, release_id_pages, artist_mbid, skipped=None):
+        """
+        Yields a model.Release per release of each page of release IDs, see __iter_releases and
+        MusicBrainzHandler.iter_releases_by_page
+        """
+
+        if artist_mbid != None:
+            yield from self.mb_handler.iter_releases_by_page(artist_mbid, release_id_pages, self.exclusion_filters, skipped=skipped)
+            return
 
-        # Filter out duplicate track names
-        return list(set(tracks))
+        for release_ids in release_id_pages:
+            yield from self.__iter_releases(release_ids, None, skipped)
+
+    def __iter_unique_tracks(self, releases):
+        """
+        Yields the unique track names on the given model.Releases, see iter_unique_track_names
+        """
+
+        title_index = titles.TitleIndex()
+
+        for release in releases:
+            for track in release.tracks:
+                # Filter out duplicate track names and other versions of the same song, e.g. "song (remastered)"
+                if title_index.add(track.title, track.recording_mbid):
+                    yield track.title
+                else:
+                    self.registry.inc('duplicate_tracks_total')
+
+    def iter_unique_track_names(self, release_ids, artist_mbid=None):
+        """
+        Yields the unique track names for the given list of release_ids
+
+        Tracks are unique by their titles.title_key and their recording MBID, so only the first
+        version found of each song, e.g. of "song", "song (remastered)" and "song - 2015 remaster",
+        is yielded.
+
+        The tracks of each release are yielded as soon as the release has been received from
+        MusicBrainz, so the caller can start working on them while the next release is requested.
+
+        :param      release_ids     list of release_id values to get tracks for
+        :param      artist_mbid     optional MBID of the artist the releases belong to, which allows
+                                    getting the tracks of many releases with a single request
+
+        :returns    generator of unique track names from the given ids, in the order they were found
+        """
+
+        return self.__iter_unique_tracks(self.__iter_releases(release_ids, artist_mbid))
+
+    def get_all_unique_track_names(self, release_ids, artist_mbid=None):
+        """
+        Gets all unique track names for the given list of release_ids
+
+        :param      release_ids     list of release_id values to get tracks for
+        :param      artist_mbid     optional MBID of the artist the releases belong to
+
+        :returns    a list of unique track names from the given ids, empty if none found
+        """
+
+        return list(self.iter_unique_track_names(release_ids, artist_mbid))
 
     def get_lyric_counts_for_tracks(self, artist_name, tracks):
         """
@@ -46,30 +291,386 @@ class AvgLyricCounter():
         If no lyrics were found for any given track, it is skipped and not added to
         the returned list.
 
+        LyricsOvh has no rate limit, so up to max_workers requests are sent concurrently.
+        The word counts are returned in the order of the given tracks regardless of the
+        order in which the responses arrive.
+
         :param      artist_name     name of the artist whose tracks to search
         :param      tracks          list of tracks to search word counts for
 
         :returns    a list containing the word counts of each track with lyrics
+        :raises     lyricsovh.LyricsOvhHandlerError if the lyrics of a track could not be got
         """
         word_counts = []
 
-        for track in tracks:
-            word_count =  self.lo_handler.get_lyric_word_count(artist_name, track)
+        results = self.lyrics_executor.map(lambda track: self.lo_handler.get_lyric_word_count(artist_name, track), tracks)
 
+        for word_count in results:
             # Only add word count if lyrics were found for the track
             if word_count != None:
                 word_counts.append(word_count)
 
         return word_counts
 
-    def get_average_lyric_count(self, artist_name):
+    def get_lyric_counts_for_releases(self, artist_name, release_ids, artist_mbid=None, failed=None, skipped=None):
+        """
+        Gets the lyric counts for all unique tracks found on the given releases
+
+        Works as a pipeline: each new track name received from MusicBrainz is handed straight to
+        the LyricsOvh worker pool, so the lyrics are fetched during the rate limited MusicBrainz
+        requests instead of after all of them.
+
+        If no lyrics were found for a track, it is skipped and not added to the returned list.
+
+        :param      artist_name     name of the artist whose tracks to search
+        :param      release_ids     list of release_id values to get tracks for
+        :param      artist_mbid     optional MBID of the artist the releases belong to
+        :param      failed          optional list to append the tracks whose lyrics could not be got
+                                    to, instead of raising
+        :param      skipped         optional list to append the IDs of the releases whose tracks could
+                                    not be got to
+
+        :returns    tuple of (number of unique tracks found, list of word counts of each track with lyrics)
+        :raises     lyricsovh.LyricsOvhHandlerError if the lyrics of a track could not be got and no
+                    failed list was given
+        """
+
+        return self.__get_lyric_counts(artist_name, self.__iter_releases(release_ids, artist_mbid, skipped), failed)
+
+    def get_lyric_counts_for_release_pages(self, artist_name, release_id_pages, artist_mbid=None, failed=None, skipped=None):
+        """
+        Gets the lyric counts for all unique tracks found on the given pages of releases, see
+        get_lyric_counts_for_releases
+
+        The next page of release IDs is only taken once the tracks of the previous page's releases
+        have been handed to the LyricsOvh worker pool, so with a generator such as
+        MusicBrainzHandler.iter_release_id_pages the lyrics are fetched while the later pages are
+        still being searched for.
+
+        :param      artist_name         name of the artist whose tracks to search
+        :param      release_id_pages    iterable of lists of release_id values to get tracks for
+        :param      artist_mbid         optional MBID of the artist the releases belong to
+        :param      failed              optional list to append the tracks whose lyrics could not be got to
+        :param      skipped             optional list to append the IDs of the releases whose tracks could
+                                        not be got to
+
+        :returns    tuple of (number of unique tracks found, list of word counts of each track with lyrics)
+        :raises     lyricsovh.LyricsOvhHandlerError if the lyrics of a track could not be got and no
+                    failed list was given
+        """
+
+        return self.__get_lyric_counts(artist_name, self.__iter_release_pages(release_id_pages, artist_mbid, skipped), failed)
+
+    def __get_lyric_counts(self, artist_name, releases, failed=None):
+        """
+        Gets the lyric counts for all unique tracks found on the given model.Releases as they arrive,
+        see get_lyric_counts_for_releases
+        """
+
+        futures = {}
+
+        try:
+            for track in self.__iter_unique_tracks(releases):
+                futures[track] = self.lyrics_executor.submit(self.lo_handler.get_lyric_word_count, artist_name, track)
+        except:
+            # Don't leave the lyric requests of a failed artist in the queue
+            for future in futures.values():
+                future.cancel()
+            raise
+
+        word_counts = []
+        for track, future in futures.items():
+            try:
+                word_counts.append(future.result())
+            except lyricsovh.LyricsOvhHandlerError:
+                if failed == None:
+                    raise
+                failed.append(track)
+
+        # Only count the tracks whose lyrics were found
+        return len(futures), [word_count for word_count in word_counts if word_count != None]
+
+    def update_artist_state(self, artist_state, release_ids, failed=None, skipped=None):
+        """
+        Brings an artist's state up to date with the artist's current releases
+
+        Only the releases that are not in the state yet are requested from MusicBrainz, and only the
+        lyrics of their new tracks, and of the tracks whose lyrics were not found before, are
+        requested from LyricsOvh. The releases that are no longer among the artist's releases are
+        dropped, along with the tracks that were only on them. Like get_lyric_counts_for_releases,
+        the lyrics of new tracks are requested while the next release is requested from MusicBrainz.
+
+        The tracks whose lyrics could not be got are left without a word count, and the releases whose
+        tracks could not be got are left out of the state, so both are requested again by the next update.
+
+        :param      artist_state    state.ArtistState of the artist, updated in place
+        :param      release_ids     list of the artist's current release_id values
+        :param      failed          optional list to append the tracks whose lyrics could not be got
+                                    to, instead of raising
+        :param      skipped         optional list to append the IDs of the releases whose tracks could
+                                    not be got to
+
+        :raises     lyricsovh.LyricsOvhHandlerError if the lyrics of a track could not be got and no
+                    failed list was given
+        """
+
+        current_release_ids = set(release_ids)
+        for release_id in list(artist_state.releases):
+            if release_id not in current_release_ids:
+                log.info("Release " + release_id + " is no longer one of the releases of artist '" + artist_state.artist_name + "'")
+                del artist_state.releases[release_id]
+
+        known_tracks = set(track for tracks in artist_state.releases.values() for track in tracks)
+        title_index = titles.TitleIndex()
+        for track in list(artist_state.word_counts):
+            # Also drops the other versions of a song counted by states saved before they were de-duplicated
+            if track not in known_tracks or not title_index.add(track):
+                artist_state.remove_track(track)
+
+        new_release_ids = [release_id for release_id in release_ids if release_id not in artist_state.releases]
+
+        log.info("Found " + str(len(new_release_ids)) + " new releases for artist '" + artist_state.artist_name + "'")
+
+        futures = {}
+        for track in artist_state.tracks_without_lyrics():
+            futures[track] = self.lyrics_executor.submit(self.lo_handler.get_lyric_word_count, artist_state.artist_name, track)
+
+        def submit_new_songs(titles, recording_mbids):
+            for title, recording_mbid in zip(titles, recording_mbids):
+                if title_index.add(title, recording_mbid):
+                    futures[title] = self.lyrics_executor.submit(self.lo_handler.get_lyric_word_count, artist_state.artist_name, title)
+
+        try:
+            # A song whose counted version was only on a dropped release is counted by another version
+            # The recordings of the stored releases are not known
+            for tracks in artist_state.releases.values():
+                submit_new_songs(tracks, [None] * len(tracks))
+
+            for release in self.__iter_releases(new_release_ids, artist_state.artist_mbid, skipped):
+                artist_state.releases[release.mbid] = release.track_titles()
+                submit_new_songs(artist_state.releases[release.mbid], [track.recording_mbid for track in release.tracks])
+        except:
+            # Don't leave the lyric requests of a failed artist in the queue
+            for future in futures.values():
+                future.cancel()
+            raise
+
+        for track, future in futures.items():
+            try:
+                word_count = future.result()
+            except lyricsovh.LyricsOvhHandlerError:
+                if failed == None:
+                    raise
+                failed.append(track)
+                continue
+
+            artist_state.set_word_count(track, word_count)
+
+    def __get_artist_mbid(self, artist_name, artist_mbid):
+        """
+        Gets the MBID of the artist an artist name resolves to, or pins the name to the given MBID
+
+        :param      artist_name     name of the artist
+        :param      artist_mbid     MBID of the artist if it was given, otherwise None
+
+        :returns    the artist MBID
+        :raises     MissingData if the artist was not found
+        """
+
+        with self.registry.timer('phase_seconds', phase='artist_search'):
+            if artist_mbid != None:
+                return self.mb_handler.pin_artist(artist_name, artist_mbid).mbid
+
+            artist_mbid = self.mb_handler.get_artist_mbid(artist_name)
+
+        if artist_mbid == '':
+            log.error("Could not find MBID for artist '" + artist_name + "'.")
+            raise MissingData()
+
+        return artist_mbid
+
+    def __get_average_lyric_count_incrementally(self, artist_name, artist_mbid):
+        """
+        Gets the average lyric count of an artist's songs, updating the artist's stored state
+
+        :returns    the average word count of the artist's songs with lyrics, rounded
+        :raises     MissingData if any of the required data values are missing
+        """
+
+        artist_state = self.state_store.load(artist_name)
+        if artist_state != None and artist_mbid != None and artist_state.artist_mbid not in (None, artist_mbid):
+            log.info("The stored state of artist '" + artist_name + "' is of artist MBID " + artist_state.artist_mbid + ", starting over")
+            artist_state = None
+        if artist_state == None:
+            artist_state = state.ArtistState(artist_name)
+
+        # The artist search is only needed the first time
+        if artist_state.artist_mbid == None:
+            artist_state.artist_mbid = self.__get_artist_mbid(artist_name, artist_mbid)
+
+        # The search results are cached for days, which would hide the releases that came out since the
+        # previous run
+        with self.registry.timer('phase_seconds', phase='release_ids'):
+            release_ids = self.mb_handler.get_release_ids(artist_name, artist_state.artist_mbid, refresh=True)
+
+        if len(release_ids) == 0:
+            log.error("No releases found for artist '" + artist_name + "'")
+            raise MissingData()
+
+        failed = []
+        skipped = []
+        with self.registry.timer('phase_seconds', phase='tracks_and_lyrics'):
+            self.update_artist_state(artist_state, release_ids, failed, skipped)
+
+        if len(failed) > 0 or len(skipped) > 0:
+            # What was got is kept, the rest is requested again by the next update
+            self.state_store.save(artist_state)
+            _check_complete(artist_name, [word_count for word_count in artist_state.word_counts.values() if word_count != None],
+                            len(failed), len(skipped))
+
+        if len(artist_state.word_counts) == 0:
+            log.error("No tracks found for artist '" + artist_name + "'")
+            raise MissingData()
+
+        self.state_store.save(artist_state)
+
+        log.info("Found " + str(len(artist_state.word_counts)) + " songs, of which " + str(artist_state.lyrics_count) + " had recorded lyrics")
+
+        average_word_count = artist_state.average_word_count()
+
+        log.info("The average word count of the found songs is " + str(average_word_count))
+
+        return round(average_word_count)
+
+    def __get_average_lyric_count_resumably(self, artist_name, artist_mbid):
+        """
+        Gets the average lyric count of an artist's songs, recording the progress to the artist's journal
+
+        Whatever an interrupted run already recorded in the journal, the artist MBID, the release IDs,
+        the tracks of each release and the word counts, is not requested again. The journal is
+        removed once the average has been calculated, and also when it is of another artist than
+        the given MBID. It is kept when some lyrics or releases could not be got, so that the next
+        run requests only those.
+
+        :returns    the average word count of the artist's songs with lyrics, rounded
+        :raises     MissingData if any of the required data values are missing
+        """
+
+        if artist_mbid != None:
+            with self.journal_store.open(artist_name) as artist_journal:
+                journaled_mbid = artist_journal.crawl.artist_mbid
+
+            if journaled_mbid not in (None, artist_mbid):
+                log.info("The journal of artist '" + artist_name + "' is of artist MBID " + journaled_mbid + ", starting over")
+                self.journal_store.remove(artist_name)
+
+        with self.journal_store.open(artist_name) as artist_journal:
+            crawl = artist_journal.crawl
+
+            if crawl.release_ids != None:
+                log.info("Resuming artist '" + artist_name + "' with " + str(len(crawl.releases)) + " of " + str(len(crawl.release_ids)) +
+                         " releases and " + str(len(crawl.word_counts)) + " lyrics done")
+
+            if crawl.artist_mbid == None:
+                artist_journal.set_artist_mbid(self.__get_artist_mbid(artist_name, artist_mbid))
+
+            if crawl.release_ids == None:
+                with self.registry.timer('phase_seconds', phase='release_ids'):
+                    release_ids = self.mb_handler.get_release_ids(artist_name, crawl.artist_mbid)
+
+                if len(release_ids) == 0:
+                    log.error("No releases found for artist '" + artist_name + "'")
+                    raise MissingData()
+
+                artist_journal.set_release_ids(release_ids)
+
+            with self.registry.timer('phase_seconds', phase='tracks_and_lyrics'):
+                failed_lyrics, skipped_releases = self.__resume_tracks_and_lyrics(artist_journal)
+
+            word_counts = [word_count for word_count in crawl.word_counts.values() if word_count != None]
+            _check_complete(artist_name, word_counts, failed_lyrics, skipped_releases)
+
+            if len(crawl.word_counts) == 0:
+                log.error("No tracks found for artist '" + artist_name + "'")
+                raise MissingData()
+
+        self.journal_store.remove(artist_name)
+
+        log.info("Found " + str(len(crawl.word_counts)) + " songs, of which " + str(len(word_counts)) + " had recorded lyrics")
+
+        average_word_count = calculate_average_word_count(word_counts)
+
+        log.info("The average word count of the found songs is " + str(average_word_count))
+
+        return round(average_word_count)
+
+    def __resume_tracks_and_lyrics(self, artist_journal):
+        """
+        Gets the tracks of the releases and the word counts of the tracks that are not in the journal yet
+
+        Like get_lyric_counts_for_releases, the lyrics of each release's tracks are requested while
+        the next release is requested from MusicBrainz. Each word count is recorded as soon as it
+        has been received. The tracks whose lyrics could not be got, and the releases whose tracks
+        could not be got, are not recorded, so that they are requested again when resumed.
+
+        :returns    tuple of (number of tracks whose lyrics could not be got, number of releases
+                    whose tracks could not be got)
+        """
+
+        crawl = artist_journal.crawl
+        futures = []
+        skipped = []
+
+        def get_and_record_word_count(track):
+            artist_journal.set_word_count(track, self.lo_handler.get_lyric_word_count(crawl.artist_name, track))
+
+        def submit(track):
+            futures.append(self.lyrics_executor.submit(get_and_record_word_count, track))
+
+        # The songs whose word counts were recorded come first, so that no other version of them is requested
+        title_index = titles.TitleIndex(crawl.word_counts)
+        for track in crawl.tracks():
+            if title_index.add(track):
+                submit(track)
+
+        remaining = [release_id for release_id in crawl.release_ids if release_id not in crawl.releases]
+
+        try:
+            for release in self.__iter_releases(remaining, crawl.artist_mbid, skipped):
+                artist_journal.add_release(release.mbid, release.track_titles())
+                for track in release.tracks:
+                    if title_index.add(track.title, track.recording_mbid):
+                        submit(track.title)
+        except:
+            # Don't leave the lyric requests of a failed artist in the queue
+            for future in futures:
+                future.cancel()
+            raise
+
+        failed_lyrics = 0
+        for future in futures:
+            try:
+                future.result()
+            except lyricsovh.LyricsOvhHandlerError:
+                failed_lyrics += 1
+
+        return failed_lyrics, len(skipped)
+
+    @metrics.timed('artist_seconds')
+    def get_average_lyric_count(self, artist_name, artist_mbid=None):
         """
         Gets the average lyric count of an artist's songs
 
+        With a state store, an artist that has been processed before is updated incrementally: only
+        the new releases and the lyrics that are still missing are requested.
+
         :param      artist_name     name of the artist to get the average lyric count for
+        :param      artist_mbid     optional MBID of the artist, to use instead of the artist the
+                                    name resolves to, e.g. when another artist has the same name
 
         :raises     MissingData if any of the required data values for calculating the
-                    average word count are missing
+                    average word count are missing, or IncompleteData if the lyrics of some tracks
+                    or the tracks of some releases could not be got
 
         :returns    the average word count of the artist's songs with lyrics, rounded
         """
@@ -78,40 +679,430 @@ class AvgLyricCounter():
             log.error("Given artist name was empty")
             raise MissingData()
 
+        if self.state_store != None:
+            return self.__get_average_lyric_count_incrementally(artist_name, artist_mbid)
+
+        if self.journal_store != None:
+            return self.__get_average_lyric_count_resumably(artist_name, artist_mbid)
+
         # Get the artist's MusicBrainz ID
-        artist_mbid =  self.mb_handler.get_artist_mbid(artist_name)
+        artist_mbid = self.__get_artist_mbid(artist_name, artist_mbid)
 
-        if artist_mbid == '':
-            log.error("Could not find MBID for artist '" + artist_name + "'.")
+        # Get the first page of the artist's release IDs, the later pages are searched for while the
+        # tracks and lyrics of the earlier ones are got
+        release_id_pages = self.mb_handler.iter_release_id_pages(artist_name, artist_mbid)
+        with self.registry.timer('phase_seconds', phase='release_ids'):
+            first_page = next(release_id_pages, None)
+
+        if first_page == None:
+            log.error("No releases found for artist '" + artist_name + "'")
+            raise MissingData()
+
+        # Get the word counts of all of the unique tracks found on the releases
+        failed = []
+        skipped = []
+        with self.registry.timer('phase_seconds', phase='tracks_and_lyrics'):
+            track_count, word_counts = self.get_lyric_counts_for_release_pages(artist_name, itertools.chain([first_page], release_id_pages), artist_mbid,
+                                                                               failed, skipped)
+
+        _check_complete(artist_name, word_counts, len(failed), len(skipped))
+
+        if track_count == 0:
+            log.error("No tracks found for artist '" + artist_name + "'")
             raise MissingData()
 
-        # Get all the release IDs for the artist
-        release_ids = self.mb_handler.get_release_ids(artist_name, artist_mbid)
+        log.info("Found " + str(track_count) + " songs, of which " + str(len(word_counts)) + " had recorded lyrics")
+
+        average_word_count = calculate_average_word_count(word_counts)
+
+        log.info("The average word count of the found songs is " + str(average_word_count))
+
+        if self.response_cache != None:
+            log.info("Response cache stats: " + str(self.response_cache.stats()))
+
+        return round(average_word_count)
+
+    @metrics.timed('artist_seconds')
+    def estimate_average_lyric_count(self, artist_name, tolerance=0.05, budget=None, confidence=0.95, min_sample_size=20, rng=None,
+                                     artist_mbid=None):
+        """
+        Estimates the average lyric count of an artist's songs from a random sample of the songs
+
+        All of the artist's tracks are found like in get_average_lyric_count, but the lyrics are
+        requested for the tracks in random order, max_workers at a time. A running mean and its
+        confidence interval are kept as the word counts arrive, and no more lyrics are requested
+        once the interval is within tolerance of the mean or the budget of lyrics requests has been
+        used. If neither happens before every track has been requested, the result is exact.
+
+        :param      artist_name         name of the artist to estimate the average lyric count for
+        :param      tolerance           half width of the confidence interval to stop at, relative to
+                                        the mean, e.g. 0.05 for +-5%
+        :param      budget              maximum number of lyrics requests, None for no limit
+        :param      confidence          confidence level of the interval
+        :param      min_sample_size     number of tracks with lyrics needed before stopping early
+        :param      rng                 optional random.Random to pick the sample with
+        :param      artist_mbid         optional MBID of the artist, see get_average_lyric_count
+
+        :raises     MissingData if any of the required data values for estimating the average word
+                    count are missing, or IncompleteData if the lyrics of some sampled tracks or
+                    the tracks of some releases could not be got
+
+        :returns    sampling.Estimate
+        """
+
+        if artist_name == '':
+            log.error("Given artist name was empty")
+            raise MissingData()
+
+        artist_mbid = self.__get_artist_mbid(artist_name, artist_mbid)
+
+        with self.registry.timer('phase_seconds', phase='release_ids'):
+            release_ids = self.mb_handler.get_release_ids(artist_name, artist_mbid)
 
         if len(release_ids) == 0:
             log.error("No releases found for artist '" + artist_name + "'")
             raise MissingData()
 
-        # Get all of the unique track names found on the releases
-        tracks = self.get_all_unique_track_names(release_ids)
+        skipped = []
+        with self.registry.timer('phase_seconds', phase='tracks'):
+            tracks = list(self.__iter_unique_tracks(self.__iter_releases(release_ids, artist_mbid, skipped)))
 
         if len(tracks) == 0:
             log.error("No tracks found for artist '" + artist_name + "'")
             raise MissingData()
 
-        # Add the word counts of each track into a list
-        word_counts = self.get_lyric_counts_for_tracks(artist_name, tracks)
+        if rng == None:
+            rng = random.Random()
+        rng.shuffle(tracks)
+
+        with self.registry.timer('phase_seconds', phase='lyrics_sample'):
+            estimate, failed_lyrics = self.__sample_lyric_counts(artist_name, tracks, tolerance, budget, confidence, min_sample_size)
+
+        if failed_lyrics > 0 or len(skipped) > 0:
+            average_word_count = None
+            if estimate.sample_size > 0:
+                average_word_count = round(estimate.mean)
+
+            log.error("The lyrics of " + str(failed_lyrics) + " tracks and the tracks of " + str(len(skipped)) +
+                      " releases of artist '" + artist_name + "' could not be got, the estimate of the rest is " + str(estimate.to_dict()))
+            raise IncompleteData(average_word_count, failed_lyrics, len(skipped))
+
+        log.info("Estimated the average word count " + str(estimate.to_dict()) + " for artist '" + artist_name + "'")
+
+        return estimate
+
+    def __sample_lyric_counts(self, artist_name, tracks, tolerance, budget, confidence, min_sample_size):
+        """
+        Requests the lyrics of the tracks in the given order until the estimate is good enough, see estimate_average_lyric_count
+
+        The tracks whose lyrics could not be got are not counted as sampled.
+
+        :returns    tuple of (sampling.Estimate, number of tracks whose lyrics could not be got)
+        """
+
+        if budget == None or budget > len(tracks):
+            budget = len(tracks)
+
+        running_mean = sampling.RunningMean()
+        requested = 0
+        sampled = 0
+        failed_lyrics = 0
+        half_width = None
+        pending = set()
+
+        try:
+            while True:
+                while len(pending) < self.max_workers and requested < budget:
+                    pending.add(self.lyrics_executor.submit(self.lo_handler.get_lyric_word_count, artist_name, tracks[requested]))
+                    requested += 1
+
+                if len(pending) == 0:
+                    break
+
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        word_count = future.result()
+                    except lyricsovh.LyricsOvhHandlerError:
+                        failed_lyrics += 1
+                        continue
+
+                    sampled += 1
+                    if word_count != None:
+                        running_mean.add(word_count)
+
+                half_width = sampling.half_width(running_mean, confidence, sampled, len(tracks))
+                if running_mean.count >= min_sample_size and half_width != None and half_width <= tolerance * running_mean.mean:
+                    break
+        finally:
+            # The requests already sent are left to finish, as their responses may be cached
+            for future in pending:
+                future.cancel()
+
+        return sampling.Estimate(running_mean.mean, half_width, confidence, running_mean.count, sampled, len(tracks)), failed_lyrics
+
+    def get_average_lyric_counts(self, artist_names, max_artists=None, get_average=None):
+        """
+        Gets the average lyric counts of several artists
+
+        Up to max_artists artists are processed at the same time. They share this object's
+        MusicBrainz client, whose rate limit therefore applies to all of them together, and its
+        LyricsOvh worker pool.
+
+        :param      artist_names    iterable of artist names
+        :param      max_artists     maximum number of artists to process at the same time, by default
+                                    the max_artists given to the constructor
+        :param      get_average     optional function to get an artist's average with, by default
+                                    get_average_lyric_count
+
+        :returns    generator of (artist_name, average word count, exception) tuples in the order the
+                    artists finish, where either the average word count or the exception is None. Any
+                    exception of an artist is returned, so that it doesn't end the other artists.
+        """
+
+        if max_artists == None:
+            max_artists = self.max_artists
 
-        total_word_count = sum(word_counts)
-        found_lyrics = len(word_counts)
+        if max_artists < 1:
+            raise ValueError("max_artists must be at least 1")
+
+        if get_average == None:
+            get_average = self.get_average_lyric_count
+
+        with ThreadPoolExecutor(max_workers=max_artists) as executor:
+            futures = {}
+            for artist_name in artist_names:
+                futures[executor.submit(get_average, artist_name)] = artist_name
+
+            for future in as_completed(futures):
+                try:
+                    yield futures[future], future.result(), None
+                except Exception as e:
+                    if not isinstance(e, MissingData):
+                        log.error("Could not get the average word count of artist '" + futures[future] + "': " + type(e).__name__ + " " + str(e))
+                    yield futures[future], None, e
+
+async def _chain_pages(first_page, release_id_pages):
+    """
+    Yields a page of release IDs that was already taken from an async generator, and then the rest of its pages
+    """
+
+    yield first_page
+    async for release_ids in release_id_pages:
+        yield release_ids
+
+class AsyncAvgLyricCounter():
+    """
+    An asyncio version of AvgLyricCounter.
+
+    Any number of artists can be processed on one event loop by awaiting get_average_lyric_count
+    concurrently on the same object. The artists share the MusicBrainz rate limiter, and at most
+    max_workers LyricsOvh requests are in flight at the same time.
+    """
+    def __init__(self, max_workers=8, lyrics_timeout=10, response_cache=None, keep_alive=True, registry=None, mb_base_url=None, lyrics_base_url=None,
+                 lyric_store=None, stream_responses=False):
+        """
+        :param      max_workers     maximum number of LyricsOvh requests in flight at the same time
+        :param      lyrics_timeout  seconds to wait for a single LyricsOvh response
+        :param      response_cache  optional cache.ResponseCache shared by the MusicBrainz and LyricsOvh clients
+        :param      keep_alive      whether the clients keep their connections open between requests
+        :param      registry        optional metrics.Registry to record the requests and the phases in
+        :param      mb_base_url     optional url to send the MusicBrainz requests to, e.g. a local stub server's
+        :param      lyrics_base_url optional url to send the LyricsOvh requests to, e.g. a local stub server's
+        :param      lyric_store     optional lyricstore.LyricStore to keep the text of the lyrics in
+        :param      stream_responses    whether the large MusicBrainz responses are decoded while they
+                                        are received, see MusicBrainzClient
+        """
+
+        if max_workers < 1:
+            raise ValueError("max_workers must be at least 1")
+
+        self.max_workers = max_workers
+        self.lyrics_semaphore = asyncio.Semaphore(max_workers)
+
+        # The blocking requests are sent from these threads, one more for the MusicBrainz requests
+        self.executor = ThreadPoolExecutor(max_workers=max_workers + 1)
+
+        # exclude tracks with these strings in their titles
+        self.exclusion_filters = ['(instrumental)', '(live)']
+        self.response_cache = response_cache
+
+        if registry == None:
+            registry = metrics.Registry()
+        self.registry = registry
+
+        # The blocking MusicBrainz requests of all the artists are sent from the executor's threads, and
+        # the rate limiter spaces them by when they are sent, so as many of them may be in flight
+        self.mb_session = sessions.create_session(pool_size=max_workers + 1, keep_alive=keep_alive)
+        self.lo_session = sessions.create_session(pool_size=max_workers, keep_alive=keep_alive)
+
+        # Create MusicBrainz handler
+        self.mb_client = musicbrainz.AsyncMusicBrainzClient(cache=response_cache, session=self.mb_session, registry=registry,
+                                                       base_url=mb_base_url, streaming=stream_responses, executor=self.executor)
+        self.mb_handler = musicbrainz.AsyncMusicBrainzHandler(self.mb_client, registry=registry, cache=response_cache)
+
+        # Create LyricsOvh handler
+        self.lo_client = lyricsovh.AsyncLyricsOvhClient(timeout=lyrics_timeout, cache=response_cache, session=self.lo_session, registry=registry,
+                                                   base_url=lyrics_base_url, store=lyric_store, executor=self.executor)
+        self.lo_handler = lyricsovh.AsyncLyricsOvhHandler(self.lo_client, registry=registry)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Shuts down the request threads and closes the clients' connections
+        """
+
+        self.executor.shutdown(wait=True)
+        self.mb_session.close()
+        self.lo_session.close()
+
+    async def __get_lyric_word_count(self, artist_name, track):
+        """
+        Gets the word count of a track once fewer than max_workers LyricsOvh requests are in flight
+        """
+
+        async with self.lyrics_semaphore:
+            return await self.lo_handler.get_lyric_word_count(artist_name, track)
+
+    async def get_lyric_counts_for_releases(self, artist_name, release_ids, artist_mbid, failed=None, skipped=None):
+        """
+        Gets the lyric counts for all unique tracks found on the given releases, see
+        AvgLyricCounter.get_lyric_counts_for_releases
+
+        :param      artist_name     name of the artist whose tracks to search
+        :param      release_ids     list of release_id values to get tracks for
+        :param      artist_mbid     MBID of the artist the releases belong to
+        :param      failed          optional list to append the tracks whose lyrics could not be got
+                                    to, instead of raising
+        :param      skipped         optional list to append the IDs of the releases whose tracks could
+                                    not be got to
+
+        :returns    tuple of (number of unique tracks found, list of word counts of each track with lyrics)
+        """
+
+        return await self.__get_lyric_counts(artist_name, self.mb_handler.iter_releases(artist_mbid, release_ids, self.exclusion_filters, skipped=skipped),
+                                             failed)
+
+    async def get_lyric_counts_for_release_pages(self, artist_name, release_id_pages, artist_mbid, failed=None, skipped=None):
+        """
+        Gets the lyric counts for all unique tracks found on the given pages of releases, see
+        AvgLyricCounter.get_lyric_counts_for_release_pages
+
+        :param      artist_name         name of the artist whose tracks to search
+        :param      release_id_pages    async iterable of lists of release_id values to get tracks for
+        :param      artist_mbid         MBID of the artist the releases belong to
+        :param      failed              optional list to append the tracks whose lyrics could not be got to
+        :param      skipped             optional list to append the IDs of the releases whose tracks could
+                                        not be got to
+
+        :returns    tuple of (number of unique tracks found, list of word counts of each track with lyrics)
+        """
+
+        return await self.__get_lyric_counts(artist_name, self.mb_handler.iter_releases_by_page(artist_mbid, release_id_pages, self.exclusion_filters,
+                                                                                                skipped=skipped), failed)
+
+    async def __get_lyric_counts(self, artist_name, releases, failed=None):
+        """
+        Gets the lyric counts for all unique tracks found on the model.Releases of an async iterable
+        as they arrive
+        """
+
+        title_index = titles.TitleIndex()
+        tracks = []
+        tasks = []
+
+        try:
+            async for release in releases:
+                for track in release.tracks:
+                    # Filter out duplicate track names and other versions of the same song
+                    if title_index.add(track.title, track.recording_mbid):
+                        tracks.append(track.title)
+                        tasks.append(asyncio.ensure_future(self.__get_lyric_word_count(artist_name, track.title)))
+                    else:
+                        self.registry.inc('duplicate_tracks_total')
+        except:
+            for task in tasks:
+                task.cancel()
+            raise
+
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+
+        word_counts = []
+        for track, result in zip(tracks, results):
+            if isinstance(result, lyricsovh.LyricsOvhHandlerError) and failed != None:
+                failed.append(track)
+            elif isinstance(result, BaseException):
+                raise result
+            else:
+                word_counts.append(result)
+
+        # Only count the tracks whose lyrics were found
+        return len(tasks), [word_count for word_count in word_counts if word_count != None]
+
+    @metrics.timed('artist_seconds')
+    async def get_average_lyric_count(self, artist_name, artist_mbid=None):
+        """
+        Gets the average lyric count of an artist's songs, see AvgLyricCounter.get_average_lyric_count
+
+        :param      artist_name     name of the artist to get the average lyric count for
+        :param      artist_mbid     optional MBID of the artist, to use instead of the artist the name resolves to
+
+        :raises     MissingData if any of the required data values for calculating the
+                    average word count are missing, or IncompleteData if the lyrics of some tracks
+                    or the tracks of some releases could not be got
+
+        :returns    the average word count of the artist's songs with lyrics, rounded
+        """
+
+        if artist_name == '':
+            log.error("Given artist name was empty")
+            raise MissingData()
+
+        # Get the artist's MusicBrainz ID
+        with self.registry.timer('phase_seconds', phase='artist_search'):
+            if artist_mbid != None:
+                artist_mbid = self.mb_handler.pin_artist(artist_name, artist_mbid).mbid
+            else:
+                artist_mbid = await self.mb_handler.get_artist_mbid(artist_name)
+
+        if artist_mbid == '':
+            log.error("Could not find MBID for artist '" + artist_name + "'.")
+            raise MissingData()
+
+        # Get the first page of the artist's release IDs, the later pages are searched for while the
+        # tracks and lyrics of the earlier ones are got
+        release_id_pages = self.mb_handler.iter_release_id_pages(artist_name, artist_mbid)
+        with self.registry.timer('phase_seconds', phase='release_ids'):
+            try:
+                first_page = await release_id_pages.__anext__()
+            except StopAsyncIteration:
+                first_page = None
+
+        if first_page == None:
+            log.error("No releases found for artist '" + artist_name + "'")
+            raise MissingData()
+
+        # Get the word counts of all of the unique tracks found on the releases
+        failed = []
+        skipped = []
+        with self.registry.timer('phase_seconds', phase='tracks_and_lyrics'):
+            track_count, word_counts = await self.get_lyric_counts_for_release_pages(artist_name, _chain_pages(first_page, release_id_pages), artist_mbid,
+                                                                                     failed, skipped)
+
+        _check_complete(artist_name, word_counts, len(failed), len(skipped))
+
+        if track_count == 0:
+            log.error("No tracks found for artist '" + artist_name + "'")
+            raise MissingData()
 
-        log.info("Found " + str(len(tracks)) + " songs, of which " + str(found_lyrics) + " had recorded lyrics")
+        log.info("Found " + str(track_count) + " songs, of which " + str(len(word_counts)) + " had recorded lyrics")
 
-        # Check that we're not dividing by zero, then calculate the average word count of the found lyrics
-        if total_word_count > 0 and found_lyrics > 0:
-            average_word_count = total_word_count / found_lyrics
-        else:
-            average_word_count = 0
+        average_word_count = calculate_average_word_count(word_counts)
 
         log.info("The average word count of the found songs is " + str(average_word_count))
 
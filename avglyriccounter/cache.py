@@ -0,0 +1,302 @@
+import sqlite3
+import threading
+import json
+import time
+import os
+import logging
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode, quote, unquote
+
+log = logging.getLogger("avglyriccounter")
+
+def default_cache_path():
+    """
+    Gets the default location of the response cache database
+
+    Honors $XDG_CACHE_HOME and falls back to ~/.cache.
+
+    :returns    path to the default cache database file
+    """
+
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'avglyriccounter', 'responses.sqlite3')
+
+def normalize_url(url):
+    """
+    Normalizes a request URL so that equivalent requests map to the same cache key
+
+    The scheme and host are lower cased, the path and query are consistently percent-encoded
+    and the query parameters are sorted.
+
+    :param      url     the request URL to normalize
+
+    :returns    the normalized URL
+    """
+
+    parts = urlsplit(url)
+    path = quote(unquote(parts.path), safe="/:")
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)), quote_via=quote)
+
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), path, query, ''))
+
+class ResponseCache():
+    """
+    A persistent on-disk cache for decoded API responses, stored in an SQLite database.
+
+    Entries are keyed by the normalized request URL. Each entry belongs to an endpoint, e.g.
+    'release' or 'lyrics', which decides how long the entry stays valid. Responses with a 404
+    status code can be cached as well, so that missing lyrics are not requested on every run.
+
+    The total size of the cached response bodies is kept under max_size bytes by evicting the
+    least recently used entries.
+
+    The artists that artist names were resolved to are kept in a table of their own, so that a
+    name that was searched for once is not searched for again.
+    """
+
+    # Time to live per endpoint, in seconds
+    DEFAULT_TTLS = {
+        'artist': 7 * 24 * 3600,
+        'release-group': 7 * 24 * 3600,
+        'release': 90 * 24 * 3600,
+        'lyrics': 30 * 24 * 3600,
+        'artist-resolution': 90 * 24 * 3600
+    }
+
+    # Used for endpoints that are not in the ttls dict
+    FALLBACK_TTL = 24 * 3600
+
+    def __init__(self, path, ttls=None, negative_ttl=24 * 3600, max_size=256 * 1024 * 1024):
+        """
+        :param      path            path to the database file, created if it does not exist
+        :param      ttls            dict of endpoint name -> time to live in seconds, merged over DEFAULT_TTLS
+        :param      negative_ttl    time to live in seconds for cached 404 responses
+        :param      max_size        maximum total size of the cached response bodies in bytes
+        """
+
+        self.ttls = dict(self.DEFAULT_TTLS)
+        if ttls != None:
+            self.ttls.update(ttls)
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if path != ':memory:' and os.path.dirname(path) != '':
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS responses (
+                               url TEXT PRIMARY KEY,
+                               endpoint TEXT NOT NULL,
+                               status INTEGER NOT NULL,
+                               body TEXT,
+                               size INTEGER NOT NULL,
+                               expires REAL NOT NULL,
+                               last_used REAL NOT NULL)""")
+        self.db.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        # expires is NULL for the resolutions that were pinned, e.g. with an MBID given on the command line
+        self.db.execute("""CREATE TABLE IF NOT EXISTS artist_resolutions (
+                               name TEXT PRIMARY KEY,
+                               mbid TEXT NOT NULL,
+                               artist_name TEXT NOT NULL,
+                               expires REAL)""")
+        self.db.commit()
+
+        self.size = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def get(self, url):
+        """
+        Gets a cached response
+
+        :param      url     request URL of the response
+
+        :returns    tuple of (status code, decoded json body) if a valid entry was found, otherwise None
+        """
+
+        key = normalize_url(url)
+        now = time.time()
+
+        with self.lock:
+            row = self.db.execute("SELECT status, body, size, expires FROM responses WHERE url = ?", (key,)).fetchone()
+
+            if row == None:
+                self.misses += 1
+                return None
+
+            status, body, size, expires = row
+
+            if expires < now:
+                self.db.execute("DELETE FROM responses WHERE url = ?", (key,))
+                self.db.commit()
+                self.size -= size
+                self.misses += 1
+                return None
+
+            self.db.execute("UPDATE responses SET last_used = ? WHERE url = ?", (now, key))
+            self.db.commit()
+            self.hits += 1
+
+        log.debug("Cache hit for " + key)
+
+        return status, (json.loads(body) if body != None else None)
+
+    def put(self, url, body, endpoint, status=200):
+        """
+        Stores a response in the cache
+
+        :param      url         request URL of the response
+        :param      body        decoded json body of the response, None for error responses
+        :param      endpoint    name of the endpoint the response came from, selects the time to live
+        :param      status      HTTP status code of the response
+        """
+
+        key = normalize_url(url)
+        now = time.time()
+
+        if status == 200:
+            ttl = self.ttls.get(endpoint, self.FALLBACK_TTL)
+        else:
+            ttl = self.negative_ttl
+
+        if ttl <= 0:
+            return
+
+        body_text = json.dumps(body, separators=(',', ':')) if body != None else None
+        size = len(body_text) if body_text != None else 0
+
+        with self.lock:
+            row = self.db.execute("SELECT size FROM responses WHERE url = ?", (key,)).fetchone()
+            if row != None:
+                self.size -= row[0]
+
+            self.db.execute("INSERT OR REPLACE INTO responses (url, endpoint, status, body, size, expires, last_used) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                            (key, endpoint, status, body_text, size, now + ttl, now))
+            self.size += size
+
+            self.__evict()
+            self.db.commit()
+
+    def iter_entries(self, endpoint):
+        """
+        Iterates over the valid, successful responses of an endpoint, for bulk processing
+
+        The entries are read without updating their last use or the hit counter, and each body is
+        only decoded when the iteration reaches it.
+
+        :param      endpoint    name of the endpoint whose responses to iterate over
+
+        :returns    iterator of (url, decoded json body) tuples
+        """
+
+        with self.lock:
+            cursor = self.db.execute("SELECT url, body FROM responses WHERE endpoint = ? AND status = 200 AND expires >= ?",
+                                     (endpoint, time.time()))
+            rows = cursor.fetchall()
+
+        for url, body in rows:
+            yield url, json.loads(body)
+
+    def get_artist_resolution(self, name):
+        """
+        Gets the artist an artist name was resolved to
+
+        :param      name        artist name, see resolver.name_key
+
+        :returns    tuple of (artist MBID, artist name) if a valid resolution was found, otherwise None
+        """
+
+        with self.lock:
+            row = self.db.execute("SELECT mbid, artist_name, expires FROM artist_resolutions WHERE name = ?", (name,)).fetchone()
+
+            if row == None:
+                return None
+
+            mbid, artist_name, expires = row
+
+            if expires != None and expires < time.time():
+                self.db.execute("DELETE FROM artist_resolutions WHERE name = ?", (name,))
+                self.db.commit()
+                return None
+
+        return mbid, artist_name
+
+    def put_artist_resolution(self, name, mbid, artist_name, pinned=False):
+        """
+        Stores the artist an artist name was resolved to
+
+        A resolution that was found by a search expires like the cached responses do, but a pinned
+        one is kept until it is replaced by another pinned one.
+
+        :param      name            artist name, see resolver.name_key
+        :param      mbid            MBID of the artist
+        :param      artist_name     name of the artist in MusicBrainz
+        :param      pinned          True if the resolution was given instead of found by a search
+        """
+
+        if pinned:
+            expires = None
+        else:
+            ttl = self.ttls.get('artist-resolution', self.FALLBACK_TTL)
+            if ttl <= 0:
+                return
+            expires = time.time() + ttl
+
+        with self.lock:
+            if not pinned:
+                row = self.db.execute("SELECT expires FROM artist_resolutions WHERE name = ?", (name,)).fetchone()
+                if row != None and row[0] == None:
+                    return
+
+            self.db.execute("INSERT OR REPLACE INTO artist_resolutions (name, mbid, artist_name, expires) VALUES (?, ?, ?, ?)",
+                            (name, mbid, artist_name, expires))
+            self.db.commit()
+
+    def __evict(self):
+        """
+        Deletes the least recently used entries until the total size is within max_size
+
+        Must be called with the lock held.
+        """
+
+        while self.size > self.max_size:
+            rows = self.db.execute("SELECT url, size FROM responses ORDER BY last_used LIMIT 100").fetchall()
+            if len(rows) == 0:
+                self.size = 0
+                break
+
+            for url, size in rows:
+                self.db.execute("DELETE FROM responses WHERE url = ?", (url,))
+                self.size -= size
+                self.evictions += 1
+                if self.size <= self.max_size:
+                    break
+
+    def stats(self):
+        """
+        Gets the cache counters
+
+        :returns    dict with the hit, miss and eviction counts, the number of entries and their total size
+        """
+
+        with self.lock:
+            entries = self.db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': entries,
+                'size': self.size
+            }
+
+    def close(self):
+        """
+        Closes the database connection
+        """
+
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,107 @@
+import threading
+from concurrent.futures import Future
+import asyncio
+import logging
+
+log = logging.getLogger("avglyriccounter")
+
+class SingleFlight():
+    """
+    Coalesces concurrent calls with the same key into one.
+
+    The first caller for a key runs the function. Callers that arrive with the same key while the
+    function is still running wait for it and receive the same result, or the same exception.
+    Nothing is remembered after the call has finished.
+
+    do_async does the same for coroutine functions, without blocking the event loop while waiting.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight = {}
+        self.coalesced = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        """
+        Calls fn(*args, **kwargs), unless a call with the same key is already running
+
+        :param      key     hashable key identifying the call
+        :param      fn      function to call
+
+        :returns    the return value of the call
+        :raises     the exception raised by the call
+        """
+
+        with self.lock:
+            future = self.in_flight.get(key)
+            if future != None:
+                self.coalesced += 1
+                is_leader = False
+            else:
+                future = Future()
+                self.in_flight[key] = future
+                is_leader = True
+
+        if not is_leader:
+            log.debug("Waiting for the call in flight for " + str(key))
+            return future.result()
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self.lock:
+                del self.in_flight[key]
+
+    async def do_async(self, key, fn, *args, **kwargs):
+        """
+        Awaits fn(*args, **kwargs), unless a call with the same key is already running, see do
+
+        A caller that is cancelled while waiting doesn't cancel the call it waits for. If the call
+        itself is cancelled, a caller waiting for it makes the call instead.
+
+        :param      key     hashable key identifying the call
+        :param      fn      coroutine function to call
+
+        :returns    the return value of the call
+        :raises     the exception raised by the call
+        """
+
+        with self.lock:
+            future = self.in_flight.get(key)
+            if future != None:
+                self.coalesced += 1
+                is_leader = False
+            else:
+                future = Future()
+                self.in_flight[key] = future
+                is_leader = True
+
+        if not is_leader:
+            log.debug("Waiting for the call in flight for " + str(key))
+            try:
+                return await asyncio.shield(asyncio.wrap_future(future))
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+            return await self.do_async(key, fn, *args, **kwargs)
+
+        try:
+            result = await fn(*args, **kwargs)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self.lock:
+                del self.in_flight[key]
@@ -0,0 +1,213 @@
+try:
+    from . import resolver
+except ImportError:
+    # Running as a script, e.g. "python3 avglyriccounter", instead of as a package
+    import resolver
+from urllib.parse import quote
+import threading
+import json
+import time
+import os
+import logging
+
+log = logging.getLogger("avglyriccounter")
+
+class Crawl():
+    """
+    Progress of calculating an artist's average lyric count: the artist MBID and release IDs once
+    found, the tracks of each release received so far and the word counts of the tracks whose
+    lyrics have been requested.
+    """
+
+    def __init__(self, artist_name):
+        self.artist_name = artist_name
+        self.artist_mbid = None
+        # None until the artist's releases have been found
+        self.release_ids = None
+        # Release MBID -> list of the track names on that release
+        self.releases = {}
+        # Track name -> word count, None if the track has no lyrics
+        self.word_counts = {}
+
+    def apply(self, record):
+        """
+        Updates the progress with a journal record
+        """
+
+        if record['type'] == 'artist':
+            self.artist_mbid = record['artist_mbid']
+        elif record['type'] == 'releases':
+            self.release_ids = record['release_ids']
+        elif record['type'] == 'release':
+            self.releases[record['release_id']] = record['tracks']
+        elif record['type'] == 'lyrics':
+            self.word_counts[record['track']] = record['word_count']
+
+    def tracks(self):
+        """
+        :returns    list of the unique tracks on the releases received so far, in the order they were found
+        """
+
+        return list(dict.fromkeys(track for tracks in self.releases.values() for track in tracks))
+
+class Journal():
+    """
+    An append-only log of the progress of an artist's crawl, one JSON record per line.
+
+    Every record is written to the operating system as soon as it is appended, so a killed process
+    loses nothing. The file is synced to disk in batches, after batch_size records or sync_interval
+    seconds, so a crash of the whole machine loses at most one batch. A record cut short by the
+    crash is ignored when the journal is read.
+
+    Records can be appended from several threads at once.
+    """
+
+    def __init__(self, path, artist_name, batch_size=100, sync_interval=1.0):
+        """
+        Opens a journal, reading the progress already recorded in it
+
+        :param      path            path of the journal file, created if it does not exist
+        :param      artist_name     name of the artist whose crawl is recorded
+        :param      batch_size      number of records after which the file is synced to disk
+        :param      sync_interval   seconds after which the file is synced to disk
+        """
+
+        self.path = path
+        self.batch_size = batch_size
+        self.sync_interval = sync_interval
+        self.lock = threading.Lock()
+
+        self.crawl = Crawl(artist_name)
+        self.record_count = 0
+        for record in self.__read_records():
+            self.crawl.apply(record)
+            self.record_count += 1
+
+        self.file = open(path, 'a')
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def __read_records(self):
+        """
+        Reads the records of the journal file
+
+        A record cut short by a crash is truncated from the file, so that new records are not
+        appended after it.
+
+        :returns    list of the records
+        """
+
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return []
+
+        records = []
+        valid_length = 0
+        for line in data.splitlines(keepends=True):
+            try:
+                if not line.endswith(b"\n"):
+                    raise ValueError
+                records.append(json.loads(line))
+            except ValueError:
+                log.warning("Ignoring the incomplete record at the end of the journal " + self.path)
+                with open(self.path, 'r+b') as f:
+                    f.truncate(valid_length)
+                break
+            valid_length += len(line)
+
+        return records
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def append(self, record):
+        """
+        Appends a record to the journal and applies it to the crawl
+
+        :param      record      JSON serializable dict with a 'type' of 'artist', 'releases', 'release' or 'lyrics'
+        """
+
+        line = json.dumps(record) + "\n"
+
+        with self.lock:
+            self.crawl.apply(record)
+            self.file.write(line)
+            self.file.flush()
+            self.record_count += 1
+            self.unsynced += 1
+
+            if self.unsynced >= self.batch_size or time.monotonic() - self.last_sync >= self.sync_interval:
+                self.__sync()
+
+    def __sync(self):
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def set_artist_mbid(self, artist_mbid):
+        self.append({'type': 'artist', 'artist_mbid': artist_mbid})
+
+    def set_release_ids(self, release_ids):
+        self.append({'type': 'releases', 'release_ids': release_ids})
+
+    def add_release(self, release_id, tracks):
+        self.append({'type': 'release', 'release_id': release_id, 'tracks': tracks})
+
+    def set_word_count(self, track, word_count):
+        self.append({'type': 'lyrics', 'track': track, 'word_count': word_count})
+
+    def close(self):
+        """
+        Syncs the records appended so far to disk and closes the file
+        """
+
+        with self.lock:
+            if self.file.closed:
+                return
+            if self.unsynced > 0:
+                self.__sync()
+            self.file.close()
+
+class JournalStore():
+    """
+    Keeps a Journal per artist in a directory, until the artist's crawl has been completed
+    """
+
+    def __init__(self, directory, batch_size=100, sync_interval=1.0):
+        """
+        :param      directory       directory of the journal files, created if it does not exist
+        :param      batch_size      see Journal
+        :param      sync_interval   see Journal
+        """
+
+        self.directory = directory
+        self.batch_size = batch_size
+        self.sync_interval = sync_interval
+        os.makedirs(directory, exist_ok=True)
+
+    def __path(self, artist_name):
+        return os.path.join(self.directory, quote(resolver.name_key(artist_name), safe='') + '.jsonl')
+
+    def open(self, artist_name):
+        """
+        :param      artist_name     name of the artist
+
+        :returns    the artist's Journal, with the progress of an interrupted crawl if there was one
+        """
+
+        return Journal(self.__path(artist_name), artist_name, self.batch_size, self.sync_interval)
+
+    def remove(self, artist_name):
+        """
+        Removes the journal of an artist whose crawl has been completed
+        """
+
+        try:
+            os.unlink(self.__path(artist_name))
+        except FileNotFoundError:
+            pass
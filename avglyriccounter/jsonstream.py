@@ -0,0 +1,291 @@
+import codecs
+import json
+import re
+
+# Decoding a json document as it is received, keeping only some of its fields, so that a large
+# response never has to be held in memory as a whole, neither as text nor as decoded objects.
+#
+# The fields to keep are given as a specification in the shape of the document: a dict of the keys
+# to keep, each with the specification of its value, a list of one specification that every item of
+# an array is read with, or True to keep a value whole. E.g.
+#
+#   {'id': True, 'media': [{'tracks': [{'title': True}]}]}
+#
+# keeps the id of a release and the titles of its tracks, and the result has the same shape as the
+# whole document would, e.g. {'id': '...', 'media': [{'tracks': [{'title': '...'}, ...]}]}.
+#
+# Only the chunks of the document that are being read are kept. An object or array that is whole
+# within them is decoded with the json module's C decoder, and only the given fields of it are kept.
+# One that continues in the next chunk is read member by member, and the values that are not kept
+# are skipped with regular expressions, without decoding or validating them.
+
+WHITESPACE_RE = re.compile(r'[ \t\n\r]*')
+
+# A whole string, including its quotes
+STRING_RE = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"', re.DOTALL)
+
+# Anything but brackets, including whole strings, which may contain brackets
+SKIP_RE = re.compile(r'(?:[^"\[\]{}]+|"[^"\\]*(?:\\.[^"\\]*)*")*', re.DOTALL)
+
+# A number, true, false or null
+SCALAR_RE = re.compile(r'[^ \t\n\r,:\]}]*')
+
+# The key of an object member and the colon after it
+KEY_RE = re.compile(r'[ \t\n\r]*"([^"\\]*(?:\\.[^"\\]*)*)"[ \t\n\r]*:', re.DOTALL)
+
+# The comma after an object member or the end of the object
+MEMBER_SEPARATOR_RE = re.compile(r'[ \t\n\r]*([,}])')
+
+# The comma after an array item or the end of the array
+ITEM_SEPARATOR_RE = re.compile(r'[ \t\n\r]*([,\]])')
+
+DECODER = json.JSONDecoder()
+
+def _decode_string(data):
+    """
+    :param      data        a json string without its quotes
+
+    :returns    the decoded string
+    """
+
+    if '\\' not in data:
+        return data
+
+    return json.loads('"' + data + '"')
+
+def _select(value, fields):
+    """
+    :returns    the decoded value with only the given fields
+    """
+
+    if isinstance(fields, dict) and isinstance(value, dict):
+        return {key: _select(value[key], fields[key]) for key in fields if key in value}
+
+    if isinstance(fields, list) and isinstance(value, list):
+        return [_select(item, fields[0]) for item in value]
+
+    return value
+
+class _Reader():
+    """
+    Reads the values of a json document from an iterable of bytes chunks
+
+    Only the part of the document that is being read is kept in the buffer, and the chunks are
+    requested as they are needed.
+    """
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        # A character may be split between two chunks
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ''
+        self.pos = 0
+        # Offset of the start of the value being kept, which is not dropped from the buffer
+        self.mark = None
+
+    def __fill(self):
+        """
+        Drops what has been read from the buffer and appends the next chunk
+
+        :returns    False if there are no more chunks
+        """
+
+        keep_from = self.pos if self.mark == None else self.mark
+
+        for chunk in self.chunks:
+            text = self.decoder.decode(chunk)
+            if len(text) > 0:
+                self.buffer = self.buffer[keep_from:] + text
+                self.pos -= keep_from
+                if self.mark != None:
+                    self.mark -= keep_from
+                return True
+
+        # Raises on a character that was left incomplete
+        self.decoder.decode(b'', final=True)
+
+        return False
+
+    def __error(self, message):
+        return ValueError(message + " at character " + str(self.pos) + " of the json buffer")
+
+    def peek(self):
+        """
+        Skips whitespace
+
+        :returns    the next character, or None at the end of the document
+        """
+
+        while True:
+            self.pos = WHITESPACE_RE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.__fill():
+                return None
+
+    def __match(self, pattern, expected):
+        """
+        Reads past what the pattern matches at the current position
+
+        :param      pattern     compiled regular expression, which must not match a prefix of
+                                what it would match when more of the document was in the buffer
+        :param      expected    what the pattern matches, for the error message
+
+        :returns    the re.Match
+        """
+
+        while True:
+            match = pattern.match(self.buffer, self.pos)
+            if match != None:
+                self.pos = match.end()
+                return match
+            if not self.__fill():
+                raise self.__error("Expected " + expected)
+
+    def read_string(self):
+        """
+        :returns    the decoded string at the current position
+        """
+
+        return _decode_string(self.__match(STRING_RE, "a string").group()[1:-1])
+
+    def __skip_scalar(self):
+        while True:
+            end = SCALAR_RE.match(self.buffer, self.pos).end()
+            # The scalar may continue in the next chunk
+            if end < len(self.buffer) or not self.__fill():
+                break
+
+        if end == self.pos:
+            raise self.__error("Expected a value")
+        self.pos = end
+
+    def __skip_container(self):
+        depth = 0
+        while True:
+            self.pos = SKIP_RE.match(self.buffer, self.pos).end()
+            # At the end of the buffer or of a string that continues in the next chunk
+            if self.pos == len(self.buffer) or self.buffer[self.pos] == '"':
+                if not self.__fill():
+                    raise self.__error("Unexpected end of the document")
+                continue
+
+            if self.buffer[self.pos] in '[{':
+                depth += 1
+            else:
+                depth -= 1
+            self.pos += 1
+
+            if depth == 0:
+                return
+
+    def skip_value(self):
+        """
+        Skips the value at the current position without decoding it
+        """
+
+        char = self.peek()
+        if char == '"':
+            self.__match(STRING_RE, "a string")
+        elif char == '{' or char == '[':
+            self.__skip_container()
+        elif char == None:
+            raise self.__error("Unexpected end of the document")
+        else:
+            self.__skip_scalar()
+
+    def read_value(self):
+        """
+        :returns    the whole decoded value at the current position
+        """
+
+        if self.peek() == '"':
+            return self.read_string()
+
+        self.mark = self.pos
+        try:
+            self.skip_value()
+            return json.loads(self.buffer[self.mark:self.pos])
+        finally:
+            self.mark = None
+
+    def read(self, fields):
+        """
+        :param      fields      specification of the fields of the value to keep
+
+        :returns    the value at the current position, with only the given fields
+        """
+
+        char = self.peek()
+
+        if char == '{' or char == '[':
+            # A container that ends in the buffer is decoded whole, which is much faster than
+            # reading it here. The decoder fails on one that continues in the next chunk.
+            try:
+                value, self.pos = DECODER.raw_decode(self.buffer, self.pos)
+                return _select(value, fields)
+            except ValueError:
+                pass
+
+        if isinstance(fields, dict) and char == '{':
+            self.pos += 1
+            retval = {}
+            if self.peek() == '}':
+                self.pos += 1
+                return retval
+
+            while True:
+                key = _decode_string(self.__match(KEY_RE, "a key").group(1))
+
+                if key in fields:
+                    retval[key] = self.read(fields[key])
+                else:
+                    self.skip_value()
+
+                if self.__match(MEMBER_SEPARATOR_RE, "',' or '}'").group(1) == '}':
+                    return retval
+
+        if isinstance(fields, list) and char == '[':
+            self.pos += 1
+            retval = []
+            if self.peek() == ']':
+                self.pos += 1
+                return retval
+
+            while True:
+                retval.append(self.read(fields[0]))
+
+                if self.__match(ITEM_SEPARATOR_RE, "',' or ']'").group(1) == ']':
+                    return retval
+
+        # Kept whole, also when the value is of another type than the specification expects, e.g. null
+        return self.read_value()
+
+def load(chunks, fields):
+    """
+    Decodes a json document as its chunks are received, keeping only the given fields
+
+    :param      chunks      iterable of bytes chunks of the UTF-8 encoded document, e.g.
+                            requests.Response.iter_content()
+    :param      fields      specification of the fields to keep, see the top of this module
+
+    :returns    the document with only the given fields
+    :raises     ValueError if the document is not valid json
+    """
+
+    reader = _Reader(chunks)
+
+    retval = reader.read(fields)
+    if reader.peek() != None:
+        raise ValueError("Extra data after the json document")
+
+    return retval
+
+def loads(data, fields):
+    """
+    Decodes a json document, keeping only the given fields, see load
+
+    :param      data        bytes of the UTF-8 encoded document
+    """
+
+    return load([data], fields)
@@ -0,0 +1,149 @@
+import re
+
+# "Paroles de la chanson <track> par <artist>", prepended by LyricsOvh to many lyrics
+HEADER_RE = re.compile(r"\s*Paroles de la chanson [^\r\n]* par [^\r\n]*")
+
+# Lyrics that only say that the track is instrumental, e.g. "[Instrumental]"
+INSTRUMENTAL_RE = re.compile(r"\s*[\[\(<]?\s*instrumental\s*[\]\)>]?\s*", re.IGNORECASE)
+
+# Tokens that are not counted as sung words:
+# - repeat markers at the end of a line, e.g. "(2x)", "[x3]" or "x2"
+# - annotations in brackets, e.g. "[Chorus]" or "<Solo: Dave Murray>"
+# - tokens without a letter or a digit, e.g. "..." or "-"
+SPECIAL_TOKEN = r"""(?:
+    (?P<repeat>(?:[\(\[][ \t]*)?(?:x(?P<times>\d{1,2})|(?P<times_first>\d{1,2})x)(?:[ \t]*[\)\]])?)(?=[ \t]*(?:\r?\n|$))
+    |(?P<annotation>\[[^\]\n]*\]|<[^>\n]*>)(?!\S)
+    |(?P<nonword>(?:[^\w\s]|_)+)(?!\S)
+    )"""
+
+# Special tokens after whitespace. Tokens starting with any letter but x are skipped by the
+# lookahead, which lets the regex engine scan over most of the text without trying the alternatives.
+SPECIAL_RE = re.compile(r"\s(?=[^a-wyzA-WYZ])" + SPECIAL_TOKEN, re.VERBOSE | re.IGNORECASE)
+
+# A special token at the very beginning of the text
+FIRST_SPECIAL_RE = re.compile(SPECIAL_TOKEN, re.VERBOSE | re.IGNORECASE)
+
+def _iter_specials(text, start, end):
+    """
+    Iterates over the special tokens in text[start:end]
+
+    :returns    iterator of match objects, whose lastgroup is the kind of the token
+    """
+
+    if start == 0:
+        match = FIRST_SPECIAL_RE.match(text, 0, end)
+        if match != None:
+            yield match
+
+    # The whitespace before a token at the start of the range is part of the match
+    yield from SPECIAL_RE.finditer(text, max(start - 1, 0), end)
+
+def _line_words(text, start, end):
+    """
+    :returns    number of words in text[start:end]
+    """
+
+    count = len(text[start:end].split())
+    for match in _iter_specials(text, start, end):
+        count -= len(match.group(match.lastgroup).split())
+
+    return count
+
+def _lyrics_start(text):
+    """
+    :returns    index of the first character after the "Paroles de la chanson" header, 0 if there is none
+    """
+
+    match = HEADER_RE.match(text)
+    return match.end() if match != None else 0
+
+def _previous_line_words(text, line_start, lyrics_start):
+    """
+    :returns    number of words on the last line with words before line_start
+    """
+
+    end = line_start - 1
+    while end > lyrics_start:
+        start = max(text.rfind('\n', lyrics_start, end) + 1, lyrics_start)
+        count = _line_words(text, start, end)
+        if count > 0:
+            return count
+        end = start - 1
+
+    return 0
+
+def is_instrumental(text):
+    """
+    :param      text        lyrics as returned from LyricsOvh
+
+    :returns    True if the lyrics only say that the track is an instrumental, e.g. "[Instrumental]"
+    """
+
+    return INSTRUMENTAL_RE.fullmatch(text, _lyrics_start(text)) != None
+
+def count_words(text):
+    """
+    Counts the sung words of lyrics
+
+    The "Paroles de la chanson" header, annotations in brackets and tokens without letters or
+    digits are not counted. A line ending with a repeat marker, e.g. "Fear of the dark (2x)", is
+    counted as many times as the marker says. A marker on a line of its own repeats the previous
+    line with words.
+
+    The whitespace separated tokens are counted with a single str.split of the whole text, which
+    builds one short-lived list of them. Counting them with a regex scan instead avoids the list,
+    but is about three times slower, see benchmark/bench_lyrics.py. No lists of lines or filtered
+    tokens are built, and only the rare special tokens found in a single regex scan are handled
+    one by one.
+
+    :param      text        lyrics as returned from LyricsOvh
+
+    :returns    word count of the lyrics, 0 for instrumentals
+    """
+
+    lyrics_start = _lyrics_start(text)
+
+    if INSTRUMENTAL_RE.fullmatch(text, lyrics_start) != None:
+        return 0
+
+    word_count = len(text.split()) - len(text[:lyrics_start].split())
+
+    for match in _iter_specials(text, lyrics_start, len(text)):
+        word_count -= len(match.group(match.lastgroup).split())
+
+        if match.lastgroup != 'repeat':
+            continue
+
+        times = int(match.group('times') or match.group('times_first'))
+        marker_start = match.start('repeat')
+        line_start = max(text.rfind('\n', lyrics_start, marker_start) + 1, lyrics_start)
+        line_words = _line_words(text, line_start, marker_start)
+
+        if line_words == 0:
+            # Only the marker is on this line, so it repeats the previous line
+            line_words = _previous_line_words(text, line_start, lyrics_start)
+
+        # The line itself has already been counted once
+        word_count += line_words * max(times - 1, 0)
+
+    return word_count
+
+# A word for vocabulary purposes, e.g. "walking" or "no-one's"
+VOCABULARY_RE = re.compile(r"\[[^\]\n]*\]|<[^>\n]*>|(?<!\S)\(?(?:x\d{1,2}|\d{1,2}x)\)?(?!\S)|(?P<word>[^\W_]+(?:['’-][^\W_]+)*)", re.IGNORECASE)
+
+def iter_words(text):
+    """
+    Iterates over the words in lyrics, normalized for vocabulary statistics
+
+    The header and annotations are skipped, the words are lower cased and the punctuation around
+    them is dropped. Repeat markers are skipped, as repeating words doesn't add to the vocabulary.
+
+    :param      text        lyrics as returned from LyricsOvh
+
+    :returns    iterator of lower case words, in the order they appear in the lyrics
+    """
+
+    for match in VOCABULARY_RE.finditer(text, _lyrics_start(text)):
+        word = match.group('word')
+        if word != None:
+            yield word.lower()
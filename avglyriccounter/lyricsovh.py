@@ -1,5 +1,21 @@
+try:
+    from . import coalesce
+    from . import lyrics
+    from . import metrics
+    from . import resilience
+    from . import lyricstore
+except ImportError:
+    # Running as a script, e.g. "python3 avglyriccounter", instead of as a package
+    import coalesce
+    import lyrics
+    import metrics
+    import resilience
+    import lyricstore
 import requests
+import asyncio
+import functools
 import logging
+import time
 
 log = logging.getLogger("avglyriccounter")
 
@@ -8,10 +24,59 @@ class LyricsOvhClient():
     A class used to communicate with the LyricsOvh API.
 
     Wraps endpoints into easy to use methods.
+
+    Responses are served from the given cache when possible. Tracks without lyrics (404) are
+    cached too, so that they are not requested again until the negative cache entry expires.
+    Concurrent requests for the same lyrics are coalesced into one.
+
+    Timeouts, connection errors and 5xx responses are retried after a jittered backoff. When
+    LyricsOvh keeps failing, a circuit breaker stops sending requests for a while, so that the
+    remaining tracks fail fast instead of each waiting for its timeout.
+
+    With a lyric store, the text of the lyrics received is kept permanently, so that the lyrics
+    can be counted again later without requesting them, and the stored lyrics are not requested
+    again.
     """
-    def __init__(self):
-        self.base_url = "https://api.lyrics.ovh/v1/"
-    
+    def __init__(self, timeout=10, cache=None, session=None, registry=None, base_url=None, retry_policy=None, circuit_breaker=None, store=None):
+        """
+        :param      timeout     seconds to wait for a response before giving up on a request
+        :param      cache       optional ResponseCache to store the responses in
+        :param      session     optional requests.Session to send the requests with, so that
+                                connections are reused. By default a new session is created.
+        :param      registry    optional metrics.Registry to record the requests in
+        :param      base_url    url the artist and title are appended to, by default the LyricsOvh
+                                API's. Can point to e.g. a local stub server.
+        :param      retry_policy    optional resilience.RetryPolicy, by default one retrying twice
+        :param      circuit_breaker optional resilience.CircuitBreaker, by default one opening after
+                                    10 consecutive failures for 30 seconds
+        :param      store       optional lyricstore.LyricStore to keep the lyrics received in
+        """
+        if base_url == None:
+            base_url = "https://api.lyrics.ovh/v1/"
+        self.base_url = base_url
+        self.timeout = timeout
+        self.cache = cache
+        self.store = store
+
+        if retry_policy == None:
+            retry_policy = resilience.RetryPolicy(max_retries=2)
+        self.retry_policy = retry_policy
+
+        if circuit_breaker == None:
+            circuit_breaker = resilience.CircuitBreaker(failure_threshold=10, reset_timeout=30.0)
+        self.circuit_breaker = circuit_breaker
+
+        if session == None:
+            session = requests.Session()
+        self.session = session
+
+        if registry == None:
+            registry = metrics.Registry()
+        self.registry = registry
+
+        self.in_flight = coalesce.SingleFlight()
+
+    @metrics.timed('lyricsovh_get_lyrics_seconds')
     def get_lyrics(self, artist, title):
         """ https://lyricsovh.docs.apiary.io/#reference
 
@@ -22,30 +87,267 @@ class LyricsOvhClient():
 
         :returns    json response body returned from LyricsOvh API
         :raises     requests.exceptions.HTTPError if one occurred
+        :raises     requests.exceptions.Timeout if the server did not respond in time
+        :raises     resilience.CircuitOpenError if LyricsOvh has been failing and no request was sent
         :raises     ValueError if the response is not decodable json
         """
 
         url = self.base_url + str(artist) + "/" + str(title)
 
-        log.debug("Sending GET request to " + url)
-        res = requests.get(url)
-        res.raise_for_status()
+        return self._get_json(url, lyricstore.track_key(str(artist), str(title)))
+
+    def _get_json(self, url, store_key=None):
+        """
+        Gets the json response body for the given url, from the cache if possible
+
+        get_lyrics returns the result of this method, so overriding it with a coroutine function
+        turns get_lyrics into a coroutine function too (see AsyncLyricsOvhClient).
+
+        :param      url         url to send the request to
+        :param      store_key   key of the track in the lyric store, see lyricstore.track_key
+
+        :returns    json response body
+        :raises     requests.exceptions.HTTPError if one occurred, also for cached 404 responses
+        :raises     requests.exceptions.Timeout if the server did not respond in time
+        :raises     ValueError if the response is not decodable json
+        """
+
+        retval = self._get_cached(url, store_key)
+        if retval != None:
+            return retval
+
+        return self.in_flight.do(url, self.__fetch_json, url, store_key)
+
+    def __fetch_json(self, url, store_key):
+        """
+        Sends the request, retrying transient failures, and decodes the response, see _get_json
+        """
+
+        attempt = 0
+        while True:
+            self._check_circuit(url)
+
+            log.debug("Sending GET request to " + url)
+            try:
+                with self.registry.timer('lyricsovh_request_seconds'):
+                    res = self.session.get(url, timeout=self.timeout)
+            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+                delay = self._retry_delay(url, attempt, exception=e)
+                if delay == None:
+                    raise
+            except BaseException as e:
+                self._record_unexpected(e)
+                raise
+            else:
+                delay = self._retry_delay(url, attempt, res=res)
+                if delay == None:
+                    return self._decode_response(url, res, store_key)
+
+            time.sleep(delay)
+            attempt += 1
+
+    def _check_circuit(self, url):
+        """
+        :raises     resilience.CircuitOpenError if the circuit breaker does not allow a request
+        """
+
+        if not self.circuit_breaker.allow():
+            self.registry.inc('lyricsovh_responses_total', status='circuit_open')
+            raise resilience.CircuitOpenError("LyricsOvh has been failing, not requesting " + url)
+
+    def _record_unexpected(self, exception):
+        """
+        Records a request that raised something other than a timeout or a connection error in the
+        circuit breaker, so that a trial request never keeps the circuit from closing
+
+        :param      exception   exception raised by the request
+        """
+
+        if isinstance(exception, requests.exceptions.RequestException):
+            # e.g. TooManyRedirects or ChunkedEncodingError, which are not retried but are the server's
+            self.circuit_breaker.record_failure()
+        else:
+            # e.g. the task was cancelled, which says nothing about the server
+            self.circuit_breaker.release_trial()
+
+    def _retry_delay(self, url, attempt, res=None, exception=None):
+        """
+        Records the outcome of an attempt in the circuit breaker and decides whether to retry it
+
+        :param      url         url of the request
+        :param      attempt     number of the attempt, starting from 0
+        :param      res         requests.Response received, or None if the request raised
+        :param      exception   exception raised by the request, or None if a response was received
+
+        :returns    number of seconds to wait before retrying, or None if the request is not retried
+        """
+
+        if self.retry_policy.is_retryable(res, exception):
+            self.circuit_breaker.record_failure()
+        else:
+            self.circuit_breaker.record_success()
+
+        if not self.retry_policy.should_retry(attempt, res, exception):
+            return None
+
+        if res != None:
+            # The response of the final attempt is counted by _decode_response
+            self.registry.inc('lyricsovh_responses_total', status=str(res.status_code))
+            reason = str(res.status_code)
+        else:
+            reason = type(exception).__name__
+
+        delay = self.retry_policy.delay(attempt, res)
+        log.info("LyricsOvh request failed with " + reason + ", retrying " + url + " in " + str(round(delay, 2)) + "s")
+        self.registry.inc('lyricsovh_retries_total')
+
+        return delay
+
+    def _get_cached(self, url, store_key):
+        """
+        Gets a response from the lyric store or the cache
+
+        :param      url         url of the request
+        :param      store_key   key of the track in the lyric store, see lyricstore.track_key
+
+        :returns    json response body, or None if the response was not stored or cached
+        :raises     requests.exceptions.HTTPError if the cached response was 404
+        """
+
+        if self.store != None and store_key != None:
+            text = self.store.get(store_key)
+            self.registry.inc('lyric_store_lookups_total', result='hit' if text != None else 'miss')
+            if text != None:
+                return {'lyrics': text}
+
+        if self.cache != None:
+            cached = self.cache.get(url)
+            self.registry.inc('cache_lookups_total', api='lyricsovh', result='hit' if cached != None else 'miss')
+            if cached != None:
+                status, retval = cached
+                if status == 404:
+                    raise requests.exceptions.HTTPError("404 Client Error: Not Found (cached) for url: " + url)
+                return retval
+
+        return None
+
+    def _decode_response(self, url, res, store_key):
+        """
+        Decodes a response and stores it in the cache
+
+        :param      url         url of the request
+        :param      res         requests.Response received for the url
+        :param      store_key   key of the track in the lyric store, see lyricstore.track_key
+
+        :returns    json response body
+        :raises     requests.exceptions.HTTPError if one occurred
+        :raises     ValueError if the response is not decodable json
+        """
+
+        self.registry.inc('lyricsovh_responses_total', status=str(res.status_code))
+
+        try:
+            res.raise_for_status()
+        except requests.exceptions.HTTPError:
+            if self.cache != None and res.status_code == 404:
+                self.cache.put(url, None, "lyrics", status=404)
+            raise
 
         try:
             retval = res.json()
         except ValueError: # includes simplejson.decoder.JSONDecodeError
             raise ValueError # raise ValueError to abstract away simplejson
 
+        if self.cache != None:
+            self.cache.put(url, retval, "lyrics")
+
+        if self.store != None and store_key != None and isinstance(retval, dict) and isinstance(retval.get('lyrics'), str):
+            self.store.put(store_key, retval['lyrics'])
+
         return retval
 
+class AsyncLyricsOvhClient(LyricsOvhClient):
+    """
+    An asyncio version of LyricsOvhClient, whose get_lyrics is a coroutine function.
+
+    There is no asyncio HTTP library among the dependencies, so the blocking request is run in an
+    executor thread, which is only used while the request is in flight.
+    """
+    def __init__(self, timeout=10, cache=None, session=None, registry=None, base_url=None, retry_policy=None, circuit_breaker=None, store=None,
+                 executor=None):
+        """
+        :param      executor    optional concurrent.futures.Executor to send the requests in, by
+                                default the event loop's default executor
+
+        See LyricsOvhClient for the rest of the parameters.
+        """
+        super().__init__(timeout=timeout, cache=cache, session=session, registry=registry, base_url=base_url,
+                         retry_policy=retry_policy, circuit_breaker=circuit_breaker, store=store)
+        self.executor = executor
+
+    async def _get_json(self, url, store_key=None):
+        """
+        Gets the json response body for the given url, from the cache if possible
+
+        :param      url         url to send the request to
+        :param      store_key   key of the track in the lyric store, see lyricstore.track_key
+
+        :returns    json response body
+        :raises     requests.exceptions.HTTPError if one occurred, also for cached 404 responses
+        :raises     requests.exceptions.Timeout if the server did not respond in time
+        :raises     resilience.CircuitOpenError if LyricsOvh has been failing and no request was sent
+        :raises     ValueError if the response is not decodable json
+        """
+
+        retval = self._get_cached(url, store_key)
+        if retval != None:
+            return retval
+
+        loop = asyncio.get_running_loop()
+
+        attempt = 0
+        while True:
+            self._check_circuit(url)
+
+            log.debug("Sending GET request to " + url)
+            try:
+                with self.registry.timer('lyricsovh_request_seconds'):
+                    res = await loop.run_in_executor(self.executor, functools.partial(self.session.get, url, timeout=self.timeout))
+            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+                delay = self._retry_delay(url, attempt, exception=e)
+                if delay == None:
+                    raise
+            except BaseException as e:
+                self._record_unexpected(e)
+                raise
+            else:
+                delay = self._retry_delay(url, attempt, res=res)
+                if delay == None:
+                    return self._decode_response(url, res, store_key)
+
+            await asyncio.sleep(delay)
+            attempt += 1
+
+# The lyrics of a track could not be got, e.g. LyricsOvh timed out, unlike a track without lyrics
+class LyricsOvhHandlerError(Exception):
+    pass
+
 class LyricsOvhHandler():
     """
     Handler for abstracting LyricsOvh endpoint functionality
     """
 
-    def __init__(self, client):
+    def __init__(self, client, registry=None):
+        """
+        :param      client      LyricsOvhClient to send the requests with
+        :param      registry    optional metrics.Registry to record the results and the counting times in
+        """
         self.client = client
 
+        if registry == None:
+            registry = metrics.Registry()
+        self.registry = registry
+
     def get_lyric_word_count(self, artist, title):
         """
         Gets the lyrics to a song from LyricsOvh and returns its word count
@@ -53,7 +355,9 @@ class LyricsOvhHandler():
         :param      artist      name of the artist
         :param      title       title of the track whose lyrics to search for
 
-        :returns    word count if lyrics found, otherwise None
+        :returns    word count if lyrics found, None if not found or if the track is an instrumental
+        :raises     LyricsOvhHandlerError if the lyrics could not be got, e.g. the request timed out,
+                    LyricsOvh responded with a server error or it has been failing
         :raises     TypeError if the args are not strings
         """
 
@@ -62,19 +366,94 @@ class LyricsOvhHandler():
 
         try:
             lyrics_json = self.client.get_lyrics(artist, title)
-        except requests.exceptions.HTTPError:
-            # No lyrics were found for this song
-            return None
+        except requests.exceptions.HTTPError as e:
+            return self._http_error(e, artist, title)
+        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
+            log.warning("Could not get lyrics for " + artist + " - " + title + " in time")
+            self.registry.inc('lyrics_total', result='timeout')
+            raise LyricsOvhHandlerError
+        except resilience.CircuitOpenError:
+            log.debug("Skipping lyrics for " + artist + " - " + title + " while LyricsOvh is failing")
+            self.registry.inc('lyrics_total', result='circuit_open')
+            raise LyricsOvhHandlerError
         except ValueError:
             # JSON decoding error
+            log.warning("Could not decode the lyrics of " + artist + " - " + title)
+            self.registry.inc('lyrics_total', result='invalid')
+            raise LyricsOvhHandlerError
+
+        return self._count_words(lyrics_json, artist, title)
+
+    def _http_error(self, e, artist, title):
+        """
+        Handles an error response to a lyrics request
+
+        :returns    None if the song has no lyrics
+        :raises     LyricsOvhHandlerError if LyricsOvh responded with any other error than 404 Not Found
+        """
+
+        if e.response == None or e.response.status_code == 404:
+            # No lyrics were found for this song
+            self.registry.inc('lyrics_total', result='not_found')
             return None
 
-        # TODO: add handling for common non-words, e.g. ( 2x), (3x), (x3), .., - etc.
-        # TODO: trim "Paroles de la chanson [track] par [artist]" if present
-        # TODO: exclude if lyrics is [Instrumental]
+        log.warning("Could not get lyrics for " + artist + " - " + title + ", LyricsOvh responded with " + str(e.response.status_code))
+        self.registry.inc('lyrics_total', result='failed')
+        raise LyricsOvhHandlerError
+
+    @metrics.timed('lyrics_count_words_seconds')
+    def _count_words(self, lyrics_json, artist, title):
+        """
+        Counts the words in a lyrics response
+
+        :param      lyrics_json     json response body returned from LyricsOvh
+        :param      artist          name of the artist, for logging
+        :param      title           title of the track, for logging
+
+        :returns    word count of the lyrics, None for instrumentals
+        """
+
+        if lyrics.is_instrumental(lyrics_json['lyrics']):
+            log.info("Skipping instrumental " + artist + " - " + title)
+            self.registry.inc('lyrics_total', result='instrumental')
+            return None
 
-        word_count = len(lyrics_json['lyrics'].split())
+        word_count = lyrics.count_words(lyrics_json['lyrics'])
+        self.registry.inc('lyrics_total', result='found')
 
         log.info("The lyric word count (" + str(word_count) + ") for " + artist + " - " + title)
 
         return word_count
+
+class AsyncLyricsOvhHandler(LyricsOvhHandler):
+    """
+    An asyncio version of LyricsOvhHandler, to be used with an AsyncLyricsOvhClient.
+    """
+
+    async def get_lyric_word_count(self, artist, title):
+        """
+        Gets the lyrics to a song from LyricsOvh and returns its word count, see LyricsOvhHandler.get_lyric_word_count
+        """
+
+        if type(artist) != str or type(title) != str:
+            raise TypeError("Unsupported type(s) for args 'artist' and 'title'")
+
+        try:
+            lyrics_json = await self.client.get_lyrics(artist, title)
+        except requests.exceptions.HTTPError as e:
+            return self._http_error(e, artist, title)
+        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
+            log.warning("Could not get lyrics for " + artist + " - " + title + " in time")
+            self.registry.inc('lyrics_total', result='timeout')
+            raise LyricsOvhHandlerError
+        except resilience.CircuitOpenError:
+            log.debug("Skipping lyrics for " + artist + " - " + title + " while LyricsOvh is failing")
+            self.registry.inc('lyrics_total', result='circuit_open')
+            raise LyricsOvhHandlerError
+        except ValueError:
+            # JSON decoding error
+            log.warning("Could not decode the lyrics of " + artist + " - " + title)
+            self.registry.inc('lyrics_total', result='invalid')
+            raise LyricsOvhHandlerError
+
+        return self._count_words(lyrics_json, artist, title)
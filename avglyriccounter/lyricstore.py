@@ -0,0 +1,360 @@
+try:
+    from . import resolver
+except ImportError:
+    # Running as a script, e.g. "python3 avglyriccounter", instead of as a package
+    import resolver
+import threading
+import hashlib
+import struct
+import mmap
+import zlib
+import json
+import os
+import logging
+
+log = logging.getLogger("avglyriccounter")
+
+# Index record: text digest, offset and length of the compressed block, offset and length of the text in the decompressed block
+INDEX_RECORD = struct.Struct("<16sQIII")
+
+DIGEST_SIZE = 16
+
+def text_digest(data):
+    """
+    :param      data        UTF-8 encoded lyrics
+
+    :returns    the content address of the lyrics
+    """
+
+    return hashlib.blake2b(data, digest_size=DIGEST_SIZE).digest()
+
+# Separates the artist from the title in a track key. As whitespace is collapsed to spaces in both,
+# it never appears in either, unlike e.g. the slash in "AC/DC".
+TRACK_KEY_SEPARATOR = "\t"
+
+def track_key(artist, title):
+    """
+    :returns    the key of a track in the store, the artist and title in lower case with whitespace collapsed
+    """
+
+    return resolver.name_key(artist) + TRACK_KEY_SEPARATOR + resolver.name_key(title)
+
+def split_track_key(key):
+    """
+    :param      key         key of a track, see track_key
+
+    :returns    tuple of (artist, title)
+    """
+
+    if TRACK_KEY_SEPARATOR not in key:
+        # Keys stored before the separator was a tab are "artist/title", split at the first slash
+        artist, _, title = key.partition("/")
+        return artist, title
+
+    artist, _, title = key.partition(TRACK_KEY_SEPARATOR)
+
+    return artist, title
+
+class LyricStore():
+    """
+    A persistent, append-only store of lyrics in a directory.
+
+    Each distinct text is stored once, addressed by its hash, so the tracks that share lyrics, e.g.
+    the remasters of a song, share the stored text. The texts are packed into blocks of about
+    block_size bytes, which are compressed with zlib and appended to blocks.dat. index.dat has a
+    fixed size record per text locating it in the blocks, and tracks.jsonl maps each track to the
+    hash of its lyrics.
+
+    The blocks are read through a memory map of blocks.dat, so scanning the whole store with
+    iter_lyrics() decompresses one block at a time instead of reading everything into memory.
+
+    Texts are kept in memory until their block is full, and written by flush() or close(). After a
+    crash, the texts of an unwritten block are lost, and the tracks that refer to them are ignored.
+
+    All of the methods are thread safe.
+    """
+
+    def __init__(self, directory, block_size=256 * 1024, compression_level=6):
+        """
+        :param      directory           directory of the store files, created if it does not exist
+        :param      block_size          number of uncompressed bytes after which a block is written
+        :param      compression_level   zlib compression level of the blocks
+        """
+
+        self.directory = directory
+        self.block_size = block_size
+        self.compression_level = compression_level
+        self.lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+
+        self.blocks_path = os.path.join(directory, 'blocks.dat')
+        self.blocks_file = open(self.blocks_path, 'ab')
+        self.blocks_size = self.blocks_file.seek(0, os.SEEK_END)
+        self.blocks_map = None
+
+        # Digest -> (block offset, block length, text offset, text length)
+        self.locations = self.__read_index()
+        self.index_file = open(os.path.join(directory, 'index.dat'), 'ab')
+
+        # Track key -> digest
+        self.tracks = self.__read_tracks()
+        self.tracks_file = open(os.path.join(directory, 'tracks.jsonl'), 'a')
+
+        # Texts of the block being filled: digest -> (text offset, encoded text)
+        self.pending = {}
+        self.pending_size = 0
+
+        # The last decompressed block, as consecutive texts are usually read from the same block
+        self.cached_block = (None, None)
+
+    def __read_index(self):
+        path = os.path.join(self.directory, 'index.dat')
+
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return {}
+
+        torn_length = len(data) % INDEX_RECORD.size
+        if torn_length > 0:
+            log.warning("Ignoring the incomplete record at the end of the lyric store index " + path)
+            data = data[:len(data) - torn_length]
+            with open(path, 'r+b') as f:
+                f.truncate(len(data))
+
+        locations = {}
+        for digest, block_offset, block_length, text_offset, text_length in INDEX_RECORD.iter_unpack(data):
+            # A block that was indexed, but not written to disk before a crash
+            if block_offset + block_length <= self.blocks_size:
+                locations[digest] = (block_offset, block_length, text_offset, text_length)
+
+        return locations
+
+    def __read_tracks(self):
+        path = os.path.join(self.directory, 'tracks.jsonl')
+
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return {}
+
+        tracks = {}
+        valid_length = 0
+        for line in data.splitlines(keepends=True):
+            try:
+                if not line.endswith(b"\n"):
+                    raise ValueError
+                key, digest = json.loads(line)
+            except ValueError:
+                log.warning("Ignoring the incomplete record at the end of the lyric store tracks " + path)
+                with open(path, 'r+b') as f:
+                    f.truncate(valid_length)
+                break
+            valid_length += len(line)
+
+            digest = bytes.fromhex(digest)
+            # The lyrics of the track were in a block lost in a crash
+            if digest in self.locations:
+                tracks[key] = digest
+
+        return tracks
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def put(self, key, text):
+        """
+        Stores the lyrics of a track, replacing the previous lyrics of the track
+
+        :param      key         key of the track, see track_key
+        :param      text        lyrics of the track
+        """
+
+        data = text.encode('utf-8')
+        digest = text_digest(data)
+
+        with self.lock:
+            if self.tracks.get(key) == digest:
+                return
+
+            if digest not in self.locations and digest not in self.pending:
+                self.pending[digest] = (self.pending_size, data)
+                self.pending_size += len(data)
+
+            self.tracks[key] = digest
+            self.tracks_file.write(json.dumps([key, digest.hex()]) + "\n")
+            self.tracks_file.flush()
+
+            if self.pending_size >= self.block_size:
+                self.__write_block()
+
+    def get(self, key):
+        """
+        :param      key         key of the track, see track_key
+
+        :returns    the lyrics of the track, or None if they have not been stored
+        """
+
+        with self.lock:
+            digest = self.tracks.get(key)
+            if digest == None:
+                return None
+
+            if digest in self.pending:
+                return self.pending[digest][1].decode('utf-8')
+
+            block_offset, block_length, text_offset, text_length = self.locations[digest]
+            block = self.__read_block(block_offset, block_length)
+
+        return block[text_offset:text_offset + text_length].decode('utf-8')
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.tracks
+
+    def __len__(self):
+        with self.lock:
+            return len(self.tracks)
+
+    def __write_block(self):
+        """
+        Compresses the pending texts into a block and appends it, followed by the index records of its texts
+        """
+
+        if len(self.pending) == 0:
+            return
+
+        block = zlib.compress(b''.join(data for text_offset, data in self.pending.values()), self.compression_level)
+        block_offset = self.blocks_size
+
+        self.blocks_file.write(block)
+        self.blocks_file.flush()
+        # The block must be on disk before the index records pointing to it
+        os.fsync(self.blocks_file.fileno())
+        self.blocks_size += len(block)
+
+        for digest, (text_offset, data) in self.pending.items():
+            location = (block_offset, len(block), text_offset, len(data))
+            self.locations[digest] = location
+            self.index_file.write(INDEX_RECORD.pack(digest, *location))
+        self.index_file.flush()
+
+        log.debug("Wrote a lyric store block of " + str(len(self.pending)) + " texts, " + str(self.pending_size) + " bytes compressed to " + str(len(block)))
+
+        self.pending = {}
+        self.pending_size = 0
+
+    def __read_block(self, block_offset, block_length):
+        """
+        :returns    the decompressed block at the given offset of blocks.dat
+        """
+
+        if self.cached_block[0] == block_offset:
+            return self.cached_block[1]
+
+        # The map only covers the blocks that were written when it was created
+        if self.blocks_map == None or len(self.blocks_map) < block_offset + block_length:
+            if self.blocks_map != None:
+                self.blocks_map.close()
+            with open(self.blocks_path, 'rb') as f:
+                self.blocks_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        block = zlib.decompress(self.blocks_map[block_offset:block_offset + block_length])
+        self.cached_block = (block_offset, block)
+
+        return block
+
+    def layout(self):
+        """
+        Gets where the lyrics of the stored tracks are in blocks.dat, e.g. to read the blocks in
+        other processes. The pending texts are written first, so that every text is in a block.
+
+        :returns    tuple of (dict of digest -> list of the keys of the tracks with those lyrics,
+                    list of (block offset, block length, list of (text offset, text length, digest))
+                    tuples in the order of the blocks and of the texts in them)
+        """
+
+        with self.lock:
+            self.__write_block()
+
+            keys = {}
+            for key, digest in self.tracks.items():
+                keys.setdefault(digest, []).append(key)
+
+            # Block offset -> (block length, list of (text offset, text length, digest))
+            blocks = {}
+            for digest in keys:
+                block_offset, block_length, text_offset, text_length = self.locations[digest]
+                blocks.setdefault(block_offset, (block_length, []))[1].append((text_offset, text_length, digest))
+
+        return keys, [(block_offset, blocks[block_offset][0], sorted(blocks[block_offset][1])) for block_offset in sorted(blocks)]
+
+    def iter_lyrics(self):
+        """
+        Iterates over the lyrics of every stored track, one block at a time
+
+        :returns    generator of (track key, lyrics) tuples, in the order the texts are stored
+        """
+
+        keys, blocks = self.layout()
+
+        for block_offset, block_length, texts in blocks:
+            with self.lock:
+                block = self.__read_block(block_offset, block_length)
+
+            for text_offset, text_length, digest in texts:
+                text = block[text_offset:text_offset + text_length].decode('utf-8')
+                for key in keys[digest]:
+                    yield key, text
+
+    def stats(self):
+        """
+        :returns    dict of the number of 'tracks', the number of distinct 'texts', the total
+                    'text_bytes' of the distinct texts and the 'stored_bytes' of the written blocks
+        """
+
+        with self.lock:
+            text_bytes = sum(location[3] for location in self.locations.values()) + self.pending_size
+
+            return {
+                'tracks': len(self.tracks),
+                'texts': len(self.locations) + len(self.pending),
+                'text_bytes': text_bytes,
+                'stored_bytes': self.blocks_size
+            }
+
+    def flush(self):
+        """
+        Writes the pending texts to disk
+        """
+
+        with self.lock:
+            self.__write_block()
+            os.fsync(self.index_file.fileno())
+            self.tracks_file.flush()
+            os.fsync(self.tracks_file.fileno())
+
+    def close(self):
+        """
+        Writes the pending texts to disk and closes the files
+        """
+
+        with self.lock:
+            if self.blocks_file.closed:
+                return
+
+            self.__write_block()
+            os.fsync(self.index_file.fileno())
+            os.fsync(self.tracks_file.fileno())
+
+            if self.blocks_map != None:
+                self.blocks_map.close()
+            self.blocks_file.close()
+            self.index_file.close()
+            self.tracks_file.close()
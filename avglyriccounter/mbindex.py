@@ -0,0 +1,319 @@
+try:
+    from . import resolver
+except ImportError:
+    # Running as a script, e.g. "python3 avglyriccounter", instead of as a package
+    import resolver
+import sqlite3
+import tarfile
+import json
+import os
+import logging
+import requests
+
+log = logging.getLogger("avglyriccounter")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS artists (
+    mbid TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    name_key TEXT NOT NULL,
+    sort_name TEXT,
+    disambiguation TEXT
+);
+CREATE INDEX IF NOT EXISTS artists_name_key ON artists (name_key);
+
+CREATE TABLE IF NOT EXISTS release_groups (
+    mbid TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    primary_type TEXT,
+    secondary_types TEXT NOT NULL,
+    first_release_date TEXT,
+    first_release TEXT
+);
+
+CREATE TABLE IF NOT EXISTS release_group_artists (
+    release_group TEXT NOT NULL,
+    artist TEXT NOT NULL,
+    PRIMARY KEY (artist, release_group)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS releases (
+    mbid TEXT PRIMARY KEY,
+    release_group TEXT NOT NULL,
+    title TEXT NOT NULL,
+    date TEXT,
+    media TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS releases_release_group ON releases (release_group);
+"""
+
+def iter_dump_entities(dump_dir, entity):
+    """
+    Yields the entities of one type from a MusicBrainz JSON data dump
+
+    The dump can either be extracted, i.e. dump_dir/<entity> or dump_dir/mbdump/<entity>, or
+    the original dump_dir/<entity>.tar.xz archive, which is read as a stream.
+
+    :param      dump_dir    directory containing the dump files
+    :param      entity      entity type, e.g. 'artist', 'release-group' or 'release'
+
+    :returns    generator of the entities' json contents
+    """
+
+    for path in [os.path.join(dump_dir, entity), os.path.join(dump_dir, 'mbdump', entity)]:
+        if os.path.isfile(path):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    if line.strip() != '':
+                        yield json.loads(line)
+            return
+
+    archive_path = os.path.join(dump_dir, entity + '.tar.xz')
+    if os.path.isfile(archive_path):
+        with tarfile.open(archive_path, mode='r|xz') as archive:
+            for member in archive:
+                if member.name == 'mbdump/' + entity:
+                    for line in archive.extractfile(member):
+                        if line.strip() != b'':
+                            yield json.loads(line)
+                    return
+
+    raise FileNotFoundError("No '" + entity + "' dump found in " + dump_dir)
+
+def build_index(dump_dir, index_path, batch_size=10000):
+    """
+    Builds a local index from a MusicBrainz JSON data dump
+
+    Only the fields needed by MusicBrainzHandler are kept: artist names, album release groups and
+    their artists, and the track titles of the first release of each release group. The dumps are
+    read as streams, so they don't need to fit in memory.
+
+    :param      dump_dir        directory containing the 'artist', 'release-group' and 'release' dumps
+    :param      index_path      path of the index database to create
+    :param      batch_size      number of rows inserted per statement
+    """
+
+    if os.path.exists(index_path):
+        os.remove(index_path)
+
+    db = sqlite3.connect(index_path)
+    db.executescript(SCHEMA)
+
+    def insert_batches(sql, rows):
+        batch = []
+        count = 0
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                db.executemany(sql, batch)
+                count += len(batch)
+                batch = []
+        db.executemany(sql, batch)
+        return count + len(batch)
+
+    def artist_rows():
+        for artist in iter_dump_entities(dump_dir, 'artist'):
+            yield (artist['id'], artist['name'], resolver.name_key(artist['name']), artist.get('sort-name'), artist.get('disambiguation', ''))
+
+    count = insert_batches("INSERT OR REPLACE INTO artists VALUES (?, ?, ?, ?, ?)", artist_rows())
+    log.info("Indexed " + str(count) + " artists")
+
+    # Only albums are ever searched for, so the other release groups are left out
+    album_release_groups = set()
+    credits = []
+
+    def release_group_rows():
+        for release_group in iter_dump_entities(dump_dir, 'release-group'):
+            if release_group.get('primary-type') != 'Album':
+                continue
+
+            album_release_groups.add(release_group['id'])
+            for artist_credit in release_group.get('artist-credit', []):
+                credits.append((release_group['id'], artist_credit['artist']['id']))
+
+            yield (release_group['id'], release_group['title'], release_group.get('primary-type'),
+                   ','.join(release_group.get('secondary-types', [])), release_group.get('first-release-date', ''), None)
+
+    count = insert_batches("INSERT OR REPLACE INTO release_groups VALUES (?, ?, ?, ?, ?, ?)", release_group_rows())
+    insert_batches("INSERT OR IGNORE INTO release_group_artists VALUES (?, ?)", credits)
+    del credits
+    log.info("Indexed " + str(count) + " album release groups")
+
+    def release_rows():
+        for release in iter_dump_entities(dump_dir, 'release'):
+            release_group_mbid = release['release-group']['id']
+            if release_group_mbid not in album_release_groups:
+                continue
+
+            media = []
+            for medium in release.get('media', []):
+                media.append([[track['title'], track.get('recording', {}).get('id', '')] for track in medium.get('tracks', [])])
+
+            yield (release['id'], release_group_mbid, release['title'], release.get('date', ''), json.dumps(media, separators=(',', ':')))
+
+    count = insert_batches("INSERT OR REPLACE INTO releases VALUES (?, ?, ?, ?, ?)", release_rows())
+    log.info("Read " + str(count) + " album releases")
+
+    # The first release of a release group is the earliest one, releases without a date last
+    db.execute("""UPDATE release_groups SET first_release = (
+                      SELECT mbid FROM releases WHERE releases.release_group = release_groups.mbid
+                      ORDER BY COALESCE(NULLIF(date, ''), '9999'), mbid LIMIT 1)""")
+
+    # Keep the track titles of the first releases only
+    db.execute("DELETE FROM releases WHERE mbid NOT IN (SELECT first_release FROM release_groups WHERE first_release IS NOT NULL)")
+    db.execute("DELETE FROM release_groups WHERE first_release IS NULL")
+    db.execute("DELETE FROM release_group_artists WHERE release_group NOT IN (SELECT mbid FROM release_groups)")
+    db.commit()
+    db.execute("VACUUM")
+    db.close()
+
+class LocalMusicBrainzClient():
+    """
+    A MusicBrainzClient compatible backend that answers from a local index built with build_index.
+
+    The responses have the same shape as the MusicBrainz API's, limited to the fields used by
+    MusicBrainzHandler. No requests are made, so there is no rate limit.
+    """
+    def __init__(self, index_path):
+        """
+        :param      index_path      path of an index database created with build_index
+        """
+
+        if not os.path.isfile(index_path):
+            raise FileNotFoundError("No MusicBrainz index at " + index_path)
+
+        self.db = sqlite3.connect('file:' + index_path + '?mode=ro', uri=True, check_same_thread=False)
+
+    def close(self):
+        self.db.close()
+
+    def __not_found(self, what):
+        raise requests.exceptions.HTTPError("404 Client Error: Not Found in the local index: " + what)
+
+    def __release_json(self, mbid, title, media):
+        return {
+            'id': mbid,
+            'title': title,
+            'media': [{'position': i + 1, 'tracks': [{'title': track_title, 'recording': {'id': recording_id}} for track_title, recording_id in tracks]}
+                      for i, tracks in enumerate(json.loads(media))]
+        }
+
+    def search_artist(self, artist_name):
+        """
+        Finds the artists whose name matches the given name, ignoring case and extra whitespace
+
+        :param      artist_name     name of the artist to search for
+
+        :returns    json response body in the format returned by MusicBrainz
+        """
+
+        rows = self.db.execute("SELECT mbid, name, sort_name, disambiguation FROM artists WHERE name_key = ? ORDER BY mbid",
+                               (resolver.name_key(artist_name),)).fetchall()
+
+        artists = [{'id': mbid, 'name': name, 'sort-name': sort_name, 'disambiguation': disambiguation, 'score': 100}
+                   for mbid, name, sort_name, disambiguation in rows]
+
+        return {'count': len(artists), 'offset': 0, 'artists': artists}
+
+    def get_artist_with_releases(self, artist_mbid):
+        """
+        Gets the artist entity including the first releases of the artist's albums
+
+        :param      artist_mbid     MBID of the artist to get
+
+        :returns    json response body in the format returned by MusicBrainz
+        :raises     requests.HTTPError if the artist is not in the index
+        """
+
+        row = self.db.execute("SELECT mbid, name, sort_name, disambiguation FROM artists WHERE mbid = ?", (artist_mbid,)).fetchone()
+        if row == None:
+            self.__not_found("artist " + artist_mbid)
+
+        releases = self.db.execute("""SELECT releases.mbid, releases.title, releases.date FROM releases
+                                      JOIN release_group_artists ON release_group_artists.release_group = releases.release_group
+                                      WHERE release_group_artists.artist = ? ORDER BY releases.date, releases.mbid""", (artist_mbid,)).fetchall()
+
+        return {'id': row[0], 'name': row[1], 'sort-name': row[2], 'disambiguation': row[3],
+                'releases': [{'id': mbid, 'title': title, 'date': date} for mbid, title, date in releases]}
+
+    def get_release_with_recordings(self, release_mbid):
+        """
+        Gets a release including its tracks
+
+        :param      release_mbid    MBID of the release to get
+
+        :returns    json response body in the format returned by MusicBrainz
+        :raises     requests.HTTPError if the release is not in the index
+        """
+
+        row = self.db.execute("SELECT mbid, title, media FROM releases WHERE mbid = ?", (release_mbid,)).fetchone()
+        if row == None:
+            self.__not_found("release " + release_mbid)
+
+        return self.__release_json(*row)
+
+    def browse_artist_releases_with_recordings(self, artist_mbid, offset=0, limit=100):
+        """
+        Browses the first releases of an artist's albums including their tracks, one page at a time
+
+        :param      artist_mbid     MBID of the artist whose releases to get
+        :param      offset          index of the first release to get
+        :param      limit           maximum number of releases to get
+
+        :returns    json response body in the format returned by MusicBrainz
+        """
+
+        release_count = self.db.execute("""SELECT COUNT(*) FROM releases
+                                           JOIN release_group_artists ON release_group_artists.release_group = releases.release_group
+                                           WHERE release_group_artists.artist = ?""", (artist_mbid,)).fetchone()[0]
+
+        rows = self.db.execute("""SELECT releases.mbid, releases.title, releases.media FROM releases
+                                  JOIN release_group_artists ON release_group_artists.release_group = releases.release_group
+                                  WHERE release_group_artists.artist = ? ORDER BY releases.mbid LIMIT ? OFFSET ?""",
+                               (artist_mbid, limit, offset)).fetchall()
+
+        return {'release-count': release_count, 'release-offset': offset, 'releases': [self.__release_json(*row) for row in rows]}
+
+    def search_artist_release_groups(self, artist_name, **kwargs):
+        """
+        Finds the album release groups of the artists whose name matches the given name
+
+        Takes the same kwargs as MusicBrainzClient.search_artist_release_groups.
+
+        :param      artist_name     name of the artist to search for
+
+        :returns    json response body in the format returned by MusicBrainz
+        """
+
+        excluded_types = []
+        for kwarg, secondary_type in [('exclude_live', 'Live'), ('exclude_compilation', 'Compilation'), ('exclude_remix', 'Remix'), ('exclude_demo', 'Demo')]:
+            if kwarg in kwargs and kwargs[kwarg] == True:
+                excluded_types.append(secondary_type)
+
+        rows = self.db.execute("""SELECT release_groups.mbid, release_groups.title, release_groups.secondary_types,
+                                         release_groups.first_release_date, release_groups.first_release, artists.mbid, artists.name
+                                  FROM artists
+                                  JOIN release_group_artists ON release_group_artists.artist = artists.mbid
+                                  JOIN release_groups ON release_groups.mbid = release_group_artists.release_group
+                                  WHERE artists.name_key = ?
+                                  ORDER BY release_groups.first_release_date, release_groups.mbid""", (resolver.name_key(artist_name),)).fetchall()
+
+        release_groups = []
+        for mbid, title, secondary_types, first_release_date, first_release, artist_mbid, name in rows:
+            secondary_types = secondary_types.split(',') if secondary_types != '' else []
+            if any(secondary_type in excluded_types for secondary_type in secondary_types):
+                continue
+
+            release_groups.append({
+                'id': mbid,
+                'title': title,
+                'primary-type': 'Album',
+                'secondary-types': secondary_types,
+                'first-release-date': first_release_date,
+                'artist-credit': [{'name': name, 'artist': {'id': artist_mbid, 'name': name}}],
+                'releases': [{'id': first_release}]
+            })
+
+        offset = kwargs.get('offset', 0)
+
+        return {'count': len(release_groups), 'offset': offset, 'release-groups': release_groups[offset:offset + 100]}
@@ -0,0 +1,220 @@
+from contextlib import contextmanager
+from bisect import bisect_left
+import functools
+import inspect
+import threading
+import time
+
+# Upper bounds of the histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+def timed(name, **labels):
+    """
+    Decorator measuring the duration of each call of a method into a histogram of the
+    metrics.Registry in the object's registry attribute
+
+    If the method returns an awaitable, e.g. when an async subclass overrides a method it calls,
+    the duration is measured until the awaitable is done.
+
+    :param      name        name of the histogram
+    :param      labels      labels of the histogram, as strings
+    """
+
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                retval = method(self, *args, **kwargs)
+            except:
+                self.registry.observe(name, time.perf_counter() - start, **labels)
+                raise
+
+            if inspect.isawaitable(retval):
+                return _await_timed(self.registry, retval, start, name, labels)
+
+            self.registry.observe(name, time.perf_counter() - start, **labels)
+            return retval
+        return wrapper
+
+    return decorator
+
+async def _await_timed(registry, awaitable, start, name, labels):
+    try:
+        return await awaitable
+    finally:
+        registry.observe(name, time.perf_counter() - start, **labels)
+
+class Histogram():
+    """
+    Distribution of observed values, e.g. request durations, in cumulative buckets like Prometheus histograms
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        # The last count is for values above the largest bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if self.min == None or value < self.min:
+            self.min = value
+        if self.max == None or value > self.max:
+            self.max = value
+
+    def cumulative_counts(self):
+        """
+        :returns    list of (upper bound, number of values at most the upper bound) tuples, the last
+                    upper bound being '+Inf'
+        """
+
+        retval = []
+        total = 0
+        for upper_bound, count in zip(list(self.buckets) + ['+Inf'], self.counts):
+            total += count
+            retval.append((upper_bound, total))
+
+        return retval
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'min': self.min,
+            'max': self.max,
+            'mean': self.sum / self.count if self.count > 0 else None,
+            'buckets': [[upper_bound, count] for upper_bound, count in self.cumulative_counts()]
+        }
+
+class Registry():
+    """
+    A set of named counters and histograms, each of which can be split by labels, e.g.
+    registry.inc('musicbrainz_responses_total', status='200').
+
+    All of the methods are thread safe. The clients, handlers and the AvgLyricCounter using them
+    share one registry, from which a run report or a Prometheus exposition can be made.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """
+        :param      buckets     upper bounds of the histogram buckets
+        """
+
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        # (name, sorted tuple of label items) -> value or Histogram
+        self.counters = {}
+        self.histograms = {}
+
+    def inc(self, name, amount=1, **labels):
+        """
+        Increases a counter
+
+        :param      name        name of the counter
+        :param      amount      how much to increase the counter by
+        :param      labels      labels of the counter, as strings
+        """
+
+        key = (name, tuple(sorted(labels.items())))
+
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        """
+        Adds a value to a histogram
+
+        :param      name        name of the histogram
+        :param      value       value to add, e.g. a duration in seconds
+        :param      labels      labels of the histogram, as strings
+        """
+
+        key = (name, tuple(sorted(labels.items())))
+
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram == None:
+                histogram = Histogram(self.buckets)
+                self.histograms[key] = histogram
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """
+        Measures the duration of a with block into a histogram, also when the block raises
+        """
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def counter(self, name, **labels):
+        """
+        :returns    value of a counter, 0 if it has not been increased
+        """
+
+        with self.lock:
+            return self.counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def histogram(self, name, **labels):
+        """
+        :returns    a histogram, or None if nothing has been observed into it
+        """
+
+        with self.lock:
+            return self.histograms.get((name, tuple(sorted(labels.items()))))
+
+    def report(self):
+        """
+        :returns    dict with lists of the 'counters' and 'histograms', for a JSON run report
+        """
+
+        with self.lock:
+            return {
+                'counters': [{'name': name, 'labels': dict(labels), 'value': value}
+                             for (name, labels), value in sorted(self.counters.items())],
+                'histograms': [dict({'name': name, 'labels': dict(labels)}, **histogram.to_dict())
+                               for (name, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0])]
+            }
+
+    def to_prometheus(self, prefix='avglyriccounter_'):
+        """
+        :param      prefix      prefix of the metric names
+
+        :returns    the counters and histograms in the Prometheus text exposition format
+        """
+
+        def format_labels(labels, extra=()):
+            items = list(labels) + list(extra)
+            if len(items) == 0:
+                return ''
+            return '{' + ','.join(key + '="' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"' for key, value in items) + '}'
+
+        lines = []
+        typed = set()
+
+        with self.lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                if name not in typed:
+                    typed.add(name)
+                    lines.append('# TYPE ' + prefix + name + ' counter')
+                lines.append(prefix + name + format_labels(labels) + ' ' + str(value))
+
+            for (name, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+                if name not in typed:
+                    typed.add(name)
+                    lines.append('# TYPE ' + prefix + name + ' histogram')
+                for upper_bound, count in histogram.cumulative_counts():
+                    lines.append(prefix + name + '_bucket' + format_labels(labels, [('le', upper_bound)]) + ' ' + str(count))
+                lines.append(prefix + name + '_sum' + format_labels(labels) + ' ' + repr(histogram.sum))
+                lines.append(prefix + name + '_count' + format_labels(labels) + ' ' + str(histogram.count))
+
+        return '\n'.join(lines) + '\n'
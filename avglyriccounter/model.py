@@ -0,0 +1,128 @@
+from dataclasses import dataclass
+import sys
+
+# The records only keep the fields the pipeline needs, and are created while parsing a response so
+# that the response's json can be dropped right after. Titles are interned, so the same title on
+# the many releases and reissues of a discography is stored once.
+
+# The fields of the responses the records are parsed from, and the --stats analytics read from the
+# response cache, for decoding only them from large responses, see jsonstream
+RELEASE_FIELDS = {
+    'id': True,
+    'title': True,
+    'media': [{'tracks': [{'title': True, 'recording': {'id': True}}]}]
+}
+
+BROWSE_RELEASES_FIELDS = {
+    'release-count': True,
+    'releases': [RELEASE_FIELDS]
+}
+
+RELEASE_GROUP_SEARCH_FIELDS = {
+    'count': True,
+    'release-groups': [{
+        'id': True,
+        'title': True,
+        'first-release-date': True,
+        'artist-credit': [{'artist': {'id': True, 'name': True}}],
+        'releases': [{'id': True}]
+    }]
+}
+
+@dataclass(frozen=True)
+class Artist():
+    """
+    An artist found by a search
+    """
+
+    __slots__ = ('mbid', 'name')
+
+    mbid: str
+    name: str
+
+@dataclass(frozen=True)
+class ReleaseGroup():
+    """
+    A release group, e.g. an album, and the release of it whose tracks are counted
+    """
+
+    __slots__ = ('mbid', 'title', 'release_id')
+
+    mbid: str
+    # In lower case characters
+    title: str
+    release_id: str
+
+@dataclass(frozen=True)
+class Track():
+    """
+    A track on a release
+    """
+
+    __slots__ = ('title', 'recording_mbid')
+
+    # In lower case characters
+    title: str
+    # None if the response did not include the recording
+    recording_mbid: str
+
+@dataclass(frozen=True)
+class Release():
+    """
+    A release and the tracks on it that are counted
+    """
+
+    __slots__ = ('mbid', 'title', 'tracks')
+
+    mbid: str
+    title: str
+    # Tuple of Tracks
+    tracks: tuple
+
+    def track_titles(self):
+        """
+        :returns    list of the titles of the tracks
+        """
+
+        return [track.title for track in self.tracks]
+
+def parse_artist(artist_json):
+    """
+    :param      artist_json     json of an artist, e.g. an entry of an artist search's 'artists'
+
+    :returns    the Artist
+    """
+
+    return Artist(artist_json['id'], artist_json['name'])
+
+def parse_release_group(release_group_json):
+    """
+    :param      release_group_json  json of a release group including its releases
+
+    :returns    the ReleaseGroup, with its first release
+    """
+
+    return ReleaseGroup(release_group_json.get('id'), sys.intern(release_group_json['title'].lower()), release_group_json['releases'][0]['id'])
+
+def parse_release(release_json, exclusion_filters):
+    """
+    :param      release_json        json of a release including its recordings
+    :param      exclusion_filters   list of strings to use to exclude tracks with at least one of them in the title
+
+    :returns    tuple of (the Release with the tracks that are not excluded, number of excluded tracks)
+    """
+
+    tracks = []
+
+    tracks_on_release = 0
+    # Traverse through the 'media' array, which contains for example CDs
+    for media in release_json['media']:
+        tracks_on_release += len(media['tracks'])
+        for track in media['tracks']:
+            track_title = track['title'].lower()
+            # Don't add tracks with any of the exclusion filters in their titles
+            if not any(x in track_title for x in exclusion_filters):
+                recording_mbid = track['recording']['id'] if 'recording' in track else None
+                tracks.append(Track(sys.intern(track_title), recording_mbid))
+
+    return Release(release_json['id'], sys.intern(release_json.get('title', '')), tuple(tracks)), tracks_on_release - len(tracks)
@@ -1,10 +1,31 @@
+try:
+    from . import ratelimiter
+    from . import coalesce
+    from . import metrics
+    from . import resilience
+    from . import model
+    from . import jsonstream
+    from . import resolver
+except ImportError:
+    # Running as a script, e.g. "python3 avglyriccounter", instead of as a package
+    import ratelimiter
+    import coalesce
+    import metrics
+    import resilience
+    import model
+    import jsonstream
+    import resolver
 import requests
-import threading
-from time import sleep
+import asyncio
+import functools
+import itertools
 import logging
 
 log = logging.getLogger("avglyriccounter")
 
+# Size of the chunks streamed responses are read in
+STREAM_CHUNK_SIZE = 64 * 1024
+
 class MusicBrainzClient():
     """
     A class used to communicate with the MusicBrainz API.
@@ -12,66 +33,219 @@ class MusicBrainzClient():
     Wraps endpoints into easy to use methods.
 
     Only allows one request per second to honor MusicBrainz's rate limiting rules.
+
+    Responses are served from the given cache when possible, in which case no request is made.
+    Concurrent requests for the same url are coalesced into one.
+
+    With streaming, the release and release group responses, which can be several megabytes for
+    e.g. box sets, are decoded while they are received, and only the fields the handler and the
+    --stats analytics use are kept (see model.RELEASE_FIELDS). The endpoint methods return, and
+    cache, the responses with only those fields.
     """
-    def __init__(self):
-        self.base_url = "https://musicbrainz.org/ws/2/"
+    def __init__(self, cache=None, rate_limiter=None, max_retries=3, session=None, timeout=30, registry=None, base_url=None, retry_policy=None,
+                 streaming=False):
+        """
+        :param      cache           optional ResponseCache to store the responses in
+        :param      rate_limiter    optional RateLimiter to share with other clients, by default
+                                    one allowing one request per second
+        :param      max_retries     how many times a request is retried after a transient failure,
+                                    e.g. 503 Service Unavailable or a timeout
+        :param      session         optional requests.Session to send the requests with, so that
+                                    connections are reused. By default a new session is created.
+        :param      timeout         seconds to wait for a response before giving up on a request
+        :param      registry        optional metrics.Registry to record the requests in
+        :param      base_url        url the endpoint paths are appended to, by default the MusicBrainz
+                                    API's. Can point to e.g. a local stub server.
+        :param      retry_policy    optional resilience.RetryPolicy deciding which requests are retried
+                                    and how long to wait, by default one with max_retries retries
+        :param      streaming       whether the large responses are decoded while they are received,
+                                    keeping only the fields that are used
+        """
+        if base_url == None:
+            base_url = "https://musicbrainz.org/ws/2/"
+        self.base_url = base_url
         self.headers = {
             'User-Agent': 'AKWordAverageCounter/1.0 ( anttikyl@protonmail.com )'
         }
-        self.lock = threading.Lock()
+        self.cache = cache
+        self.timeout = timeout
+        self.streaming = streaming
 
-    def __unlock_calls(self):
-        """
-        Releases this object's lock after one second.
-        """
-        sleep(1)
-        self.lock.release()
-        log.debug("Released MusicBrainzClient lock")
+        if retry_policy == None:
+            retry_policy = resilience.RetryPolicy(max_retries=max_retries)
+        self.retry_policy = retry_policy
 
-    def __make_request(self, url):
+        if session == None:
+            session = requests.Session()
+        self.session = session
+
+        if rate_limiter == None:
+            rate_limiter = ratelimiter.RateLimiter(rate=1.0, burst=1)
+        self.rate_limiter = rate_limiter
+
+        if registry == None:
+            registry = metrics.Registry()
+        self.registry = registry
+
+        self.in_flight = coalesce.SingleFlight()
+
+    def __make_request(self, url, stream=False):
         """
-        This method takes a lock and defers the release of the lock to one (1) second later.
+        Sends a GET request once the rate limiter allows it.
 
         The MusicBrainz API has a restriction of 1 call per second per client. By using this method
         for every request, we ensure that we do not get blocked by making calls too frequently.
+
+        If the request fails transiently, e.g. MusicBrainz still responds with 503 Service
+        Unavailable or the request times out, all requests are paused for the time given in the
+        Retry-After header, or for a jittered exponential backoff, and the request is retried.
+
+        :param      url         url to send the request to
+        :param      stream      whether to return before the body of the response has been received
+
+        :raises     requests.exceptions.Timeout or ConnectionError if the last attempt raised one
         """
 
-        self.lock.acquire()
-        log.debug("Acquired MusicBrainzClient lock")
+        attempt = 0
+        while True:
+            with self.registry.timer('musicbrainz_rate_limit_wait_seconds'):
+                self.rate_limiter.acquire()
+
+            log.debug("Sending GET request to " + url)
+            try:
+                with self.registry.timer('musicbrainz_request_seconds'):
+                    res = self.session.get(url, headers=self.headers, timeout=self.timeout, stream=stream)
+            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+                self.registry.inc('musicbrainz_responses_total', status=type(e).__name__)
+                if not self._should_retry(attempt, exception=e):
+                    raise
+            else:
+                self.registry.inc('musicbrainz_responses_total', status=str(res.status_code))
+                if not self._should_retry(attempt, res=res):
+                    return res
+                # Releases the connection of a streamed response that is not read
+                res.close()
 
-        log.debug("Sending GET request to " + url)
-        res = requests.get(url, headers=self.headers)
+            attempt += 1
 
-        # Set off a lock release with a 1s sleep timer in another thread
-        unlock_thread = threading.Thread(target=self.__unlock_calls)
-        unlock_thread.start()
+    def _should_retry(self, attempt, res=None, exception=None):
+        """
+        Checks whether a request should be retried, and if so, pauses the rate limiter
 
-        return res
+        The rate limiter is shared by all of the requests, so the pause applies to all of them.
 
-    def search_artist(self, artist_name):
-        """ /artist?query=artist:<ARTIST_NAME>
+        :param      attempt     number of the attempt, starting from 0
+        :param      res         requests.Response received, or None if the request raised
+        :param      exception   exception raised by the request, or None if a response was received
 
-        Searches for an artist by their name
+        :returns    True if the request should be sent again
+        """
 
-        :param      artist_name     name of the artist to search for
+        if not self.retry_policy.should_retry(attempt, res, exception):
+            return False
 
-        :returns    json response body returned from MusicBrainz
+        delay = self.retry_policy.delay(attempt, res)
+        reason = str(res.status_code) if res != None else type(exception).__name__
+
+        log.warning("MusicBrainz request failed with " + reason + ", retrying in " + str(round(delay, 2)) + "s")
+        self.rate_limiter.defer(delay)
+        self.registry.inc('musicbrainz_retries_total')
+
+        return True
+
+    def _get_json(self, url, endpoint, fields=None, refresh=False):
+        """
+        Gets the json response body for the given url, from the cache if possible
+
+        All of the endpoint methods return the result of this method, so overriding it with a
+        coroutine function turns them into coroutine functions too (see AsyncMusicBrainzClient).
+
+        :param      url         url to send the request to
+        :param      endpoint    name of the endpoint, used to select the cache entry's time to live
+        :param      fields      optional jsonstream specification of the fields to keep when streaming
+        :param      refresh     whether to request the url even if its response is cached. The
+                                response received replaces the cached one.
+
+        :returns    json response body
         :raises     requests.HttpError if the returned HTTP status code was 4xx/5xx
         :raises     ValueError if the response is not decodable json
         """
 
-        url = self.base_url + "artist/" + "?query=artist:" + artist_name + "&fmt=json"
+        if self.cache != None and not refresh:
+            cached = self.cache.get(url)
+            self.registry.inc('cache_lookups_total', api='musicbrainz', result='hit' if cached != None else 'miss')
+            if cached != None:
+                return cached[1]
+
+        return self.in_flight.do(url, self.__fetch_json, url, endpoint, fields)
+
+    def _stream_fields(self, fields):
+        """
+        :returns    the fields to keep if the response is streamed, otherwise None
+        """
+
+        return fields if self.streaming else None
+
+    def __fetch_json(self, url, endpoint, fields):
+        """
+        Sends the request and decodes the response, see _get_json
+        """
+
+        fields = self._stream_fields(fields)
+        res = self.__make_request(url, stream=fields != None)
 
-        res = self.__make_request(url)
-        res.raise_for_status()
+        return self._decode_response(url, res, endpoint, fields)
+
+    def _decode_response(self, url, res, endpoint, fields=None):
+        """
+        Decodes a response and stores it in the cache
+
+        :param      url         url of the request
+        :param      res         requests.Response received for the url
+        :param      endpoint    name of the endpoint, used to select the cache entry's time to live
+        :param      fields      jsonstream specification of the fields to keep if the response is
+                                streamed, None to decode the whole response
+
+        :returns    json response body
+        :raises     requests.HttpError if the returned HTTP status code was 4xx/5xx
+        :raises     ValueError if the response is not decodable json
+        """
 
         try:
-            retval = res.json()
+            res.raise_for_status()
+
+            if fields != None:
+                with self.registry.timer('musicbrainz_stream_decode_seconds'):
+                    retval = jsonstream.load(res.iter_content(chunk_size=STREAM_CHUNK_SIZE), fields)
+            else:
+                retval = res.json()
         except ValueError: # includes simplejson.decoder.JSONDecodeError
             raise ValueError # raise ValueError to abstract away simplejson
+        finally:
+            if fields != None:
+                res.close()
+
+        if self.cache != None:
+            self.cache.put(url, retval, endpoint)
 
         return retval
 
+    def search_artist(self, artist_name):
+        """ /artist?query=artist:<ARTIST_NAME>
+
+        Searches for an artist by their name
+
+        :param      artist_name     name of the artist to search for
+
+        :returns    json response body returned from MusicBrainz
+        :raises     requests.HttpError if the returned HTTP status code was 4xx/5xx
+        :raises     ValueError if the response is not decodable json
+        """
+
+        url = self.base_url + "artist/" + "?query=artist:" + artist_name + "&fmt=json"
+
+        return self._get_json(url, "artist")
+
     def get_artist_with_releases(self, artist_mbid):
         """ /artist/<MBID>?inc=releases
 
@@ -86,15 +260,7 @@ class MusicBrainzClient():
 
         url = self.base_url + "artist/" + artist_mbid + "?inc=releases&fmt=json"
 
-        res = self.__make_request(url)
-        res.raise_for_status()
-
-        try:
-            retval = res.json()
-        except ValueError: # includes simplejson.decoder.JSONDecodeError
-            raise ValueError # raise ValueError to abstract away simplejson
-
-        return retval
+        return self._get_json(url, "artist")
 
     def get_release_with_recordings(self, release_mbid):
         """ /release/<MBID>
@@ -103,22 +269,37 @@ class MusicBrainzClient():
 
         :param      release_mbid    MBID of the release to get
 
-        :returns    json response body returned from MusicBrainz
+        :returns    json response body returned from MusicBrainz, with only the fields in
+                    model.RELEASE_FIELDS when streaming
         :raises     requests.HttpError if the returned HTTP status code was 4xx/5xx
         :raises     ValueError if the response is not decodable json
         """
 
         url = self.base_url + "release/" + release_mbid + "?inc=recordings&fmt=json"
 
-        res = self.__make_request(url)
-        res.raise_for_status()
+        return self._get_json(url, "release", model.RELEASE_FIELDS)
 
-        try:
-            retval = res.json()
-        except ValueError: # includes simplejson.decoder.JSONDecodeError
-            raise ValueError # raise ValueError to abstract away simplejson
+    def browse_artist_releases_with_recordings(self, artist_mbid, offset=0, limit=100):
+        """ /release?artist=<MBID>&type=album&inc=recordings
 
-        return retval
+        Browses an artist's album releases including their recordings, one page at a time
+
+        MusicBrainz may return fewer than limit releases per page when the releases have many
+        tracks, so the next offset should be calculated from the number of releases received.
+
+        :param      artist_mbid     MBID of the artist whose releases to get
+        :param      offset          index of the first release to get
+        :param      limit           maximum number of releases to get, at most 100
+
+        :returns    json response body returned from MusicBrainz, with only the fields in
+                    model.BROWSE_RELEASES_FIELDS when streaming
+        :raises     requests.HttpError if the returned HTTP status code was 4xx/5xx
+        :raises     ValueError if the response is not decodable json
+        """
+
+        url = self.base_url + "release?artist=" + artist_mbid + "&type=album&inc=recordings&limit=" + str(limit) + "&offset=" + str(offset) + "&fmt=json"
+
+        return self._get_json(url, "release", model.BROWSE_RELEASES_FIELDS)
 
     def search_artist_release_groups(self, artist_name, **kwargs):
         """ /release-group/?query=artist:<ARTIST>
@@ -128,12 +309,15 @@ class MusicBrainzClient():
         :param      artist_name             name of the artist to search for
 
         Kwargs:
+            offset (int)                    index of the first result to get, used for paging
             exclude_live (bool)             whether to exclude live releases from the search
             exclude_compilation (bool)      whether to exclude compilation releases from the search
             exclude_remix (bool)            whether to exclude remix releases from the search
             exclude_demo  (bool)            whether to exclude demo releases from the search
+            refresh (bool)                  whether to search again even if the results are cached
 
-        :returns    json response body returned from MusicBrainz
+        :returns    json response body returned from MusicBrainz, with only the fields in
+                    model.RELEASE_GROUP_SEARCH_FIELDS when streaming
         :raises     requests.HttpError if the returned HTTP status code was 4xx/5xx
         :raises     ValueError if the response is not decodable json
         """
@@ -151,33 +335,262 @@ class MusicBrainzClient():
         if 'exclude_demo' in kwargs and kwargs['exclude_demo'] == True:
             url += " AND NOT secondarytype:\"Demo\""
 
-        res = self.__make_request(url)
-        res.raise_for_status()
+        if 'offset' in kwargs and kwargs['offset'] > 0:
+            url += "&offset=" + str(kwargs['offset'])
 
-        try:
-            retval = res.json()
-        except ValueError: # includes simplejson.decoder.JSONDecodeError
-            raise ValueError # raise ValueError to abstract away simplejson
+        return self._get_json(url, "release-group", model.RELEASE_GROUP_SEARCH_FIELDS, refresh=kwargs.get('refresh', False))
 
-        return retval
+class AsyncMusicBrainzClient(MusicBrainzClient):
+    """
+    An asyncio version of MusicBrainzClient, whose endpoint methods are coroutine functions.
+
+    The rate limit is waited for in the calling coroutine, so any number of coroutines can share
+    the client's rate limiter. There is no asyncio HTTP library among the dependencies, so the
+    blocking request itself is run in an executor thread, which is only used while the request
+    is in flight.
+    """
+    def __init__(self, cache=None, rate_limiter=None, max_retries=3, session=None, timeout=30, registry=None, base_url=None, retry_policy=None,
+                 streaming=False, executor=None):
+        """
+        :param      executor        optional concurrent.futures.Executor to send the requests in, by
+                                    default the event loop's default executor
+
+        See MusicBrainzClient for the rest of the parameters.
+        """
+        super().__init__(cache=cache, rate_limiter=rate_limiter, max_retries=max_retries, session=session, timeout=timeout, registry=registry,
+                         base_url=base_url, retry_policy=retry_policy, streaming=streaming)
+        self.executor = executor
+
+    async def __make_request(self, url, stream=False):
+        """
+        Sends a GET request once the rate limiter allows it, see MusicBrainzClient.__make_request
+        """
+
+        loop = asyncio.get_running_loop()
+
+        attempt = 0
+        while True:
+            with self.registry.timer('musicbrainz_rate_limit_wait_seconds'):
+                await self.rate_limiter.acquire_async()
+
+            log.debug("Sending GET request to " + url)
+            try:
+                with self.registry.timer('musicbrainz_request_seconds'):
+                    res = await loop.run_in_executor(self.executor, functools.partial(self.session.get, url, headers=self.headers, timeout=self.timeout,
+                                                                                      stream=stream))
+            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+                self.registry.inc('musicbrainz_responses_total', status=type(e).__name__)
+                if not self._should_retry(attempt, exception=e):
+                    raise
+            else:
+                self.registry.inc('musicbrainz_responses_total', status=str(res.status_code))
+                if not self._should_retry(attempt, res=res):
+                    return res
+                # Releases the connection of a streamed response that is not read
+                res.close()
+
+            attempt += 1
+
+    async def _get_json(self, url, endpoint, fields=None, refresh=False):
+        """
+        Gets the json response body for the given url, from the cache if possible
+
+        :param      url         url to send the request to
+        :param      endpoint    name of the endpoint, used to select the cache entry's time to live
+        :param      fields      optional jsonstream specification of the fields to keep when streaming
+        :param      refresh     whether to request the url even if its response is cached
+
+        :returns    json response body
+        :raises     requests.HttpError if the returned HTTP status code was 4xx/5xx
+        :raises     ValueError if the response is not decodable json
+        """
+
+        if self.cache != None and not refresh:
+            cached = self.cache.get(url)
+            self.registry.inc('cache_lookups_total', api='musicbrainz', result='hit' if cached != None else 'miss')
+            if cached != None:
+                return cached[1]
+
+        return await self.in_flight.do_async(url, self.__fetch_json, url, endpoint, fields)
+
+    async def __fetch_json(self, url, endpoint, fields):
+        """
+        Sends the request and decodes the response, see _get_json
+        """
+
+        fields = self._stream_fields(fields)
+        res = await self.__make_request(url, stream=fields != None)
+
+        if fields != None:
+            # The body is read while it is decoded, which blocks
+            return await asyncio.get_running_loop().run_in_executor(self.executor, self._decode_response, url, res, endpoint, fields)
+
+        return self._decode_response(url, res, endpoint)
+
+async def _iter_async(items):
+    """
+    Yields the items of a list from an async generator, for the async functions that take an async iterable
+    """
+
+    for item in items:
+        yield item
 
 class MusicBrainzHandlerError(Exception):
     pass
 
+class _ReleaseGroupSearch():
+    """
+    The paging of a release group search, see MusicBrainzHandler._iter_release_group_pages
+
+    Shared by MusicBrainzHandler and AsyncMusicBrainzHandler, which only send the requests.
+    """
+
+    def __init__(self, handler, artist_name, artist_mbid):
+        self.handler = handler
+        self.artist_name = artist_name
+        self.artist_mbid = artist_mbid
+        # lower case title -> model.ReleaseGroup
+        self.release_groups = {}
+        self.offset = 0
+        self.done = False
+
+    def add_page(self, artist_json):
+        """
+        Adds a page of release group search results
+
+        :param      artist_json     json response body of the search for the page at offset
+
+        :returns    list of the artist's release groups on the page whose titles were not on an earlier page
+        """
+
+        found_before = len(self.release_groups)
+        valid_on_page = self.handler._parse_release_groups(artist_json, self.artist_mbid, self.release_groups)
+
+        self.offset += len(artist_json['release-groups'])
+        self.done = valid_on_page == 0 or self.offset >= artist_json['count']
+
+        page = list(itertools.islice(self.release_groups.values(), found_before, None))
+        if len(page) > 0:
+            log.info("Found releases " + str([release_group.title for release_group in page]) + " for artist_name " + self.artist_name)
+
+        return page
+
+class _ReleaseBrowse():
+    """
+    The paging of an artist's browsed releases, see MusicBrainzHandler.iter_releases_by_page
+
+    Shared by MusicBrainzHandler and AsyncMusicBrainzHandler, which only send the requests.
+    """
+
+    def __init__(self, handler, artist_mbid, exclusion_filters, page_size=100):
+        self.handler = handler
+        self.artist_mbid = artist_mbid
+        self.exclusion_filters = exclusion_filters
+        self.page_size = page_size
+        self.offset = 0
+        self.received = page_size
+        self.release_count = None
+        self.can_browse = True
+        # Browsed releases whose IDs are not on the pages taken so far
+        self.browsed = {}
+
+    def take_page(self, release_ids):
+        """
+        Takes the next page of release IDs
+
+        :param      release_ids     list of IDs of the releases to get
+
+        :returns    tuple of (list of the model.Releases that were already browsed, list of the IDs
+                    of the rest of the releases)
+        """
+
+        found = []
+        remaining = []
+        for release_id in release_ids:
+            release = self.browsed.pop(release_id, None)
+            if release == None:
+                remaining.append(release_id)
+            else:
+                self.handler._log_release(release)
+                found.append(release)
+
+        return found, remaining
+
+    def should_browse(self, remaining):
+        """
+        :param      remaining   list of the IDs of the releases not found yet
+
+        :returns    True if the next page of releases should be browsed instead of requesting the
+                    remaining releases separately
+        """
+
+        # A single release is cheaper to request directly
+        return self.can_browse and len(remaining) > 1 and \
+            (self.release_count == None or self.handler._should_browse_more(self.release_count, self.offset, self.received, self.page_size, len(remaining)))
+
+    def add_page(self, releases_json, remaining):
+        """
+        Adds the page of browsed releases at offset
+
+        :param      releases_json   json response body of the release browse request
+        :param      remaining       list of the IDs of the releases not found yet, from which the
+                                    IDs of the releases on the page are removed
+
+        :returns    list of the model.Releases on the page whose IDs are in remaining
+        """
+
+        found, self.release_count, self.received = self.handler._parse_browse_page(releases_json, remaining, self.exclusion_filters, self.browsed)
+        self.offset += self.received
+
+        for release in found:
+            remaining.remove(release.mbid)
+            self.handler._log_release(release)
+
+        return found
+
+    def fail(self):
+        """
+        Stops browsing after a failed browse request, the remaining releases are requested separately
+        """
+
+        log.warning("Browsing the releases of artist " + self.artist_mbid + " failed, requesting them separately")
+        self.can_browse = False
+
 class MusicBrainzHandler():
     """
     Handler for abstracting MusicBrainz endpoint functionality
+
+    The responses are parsed into the records of the model module, keeping only the fields that
+    are needed, and the json is dropped as soon as it has been parsed. get_artist_mbid,
+    get_release_ids, get_tracks and iter_tracks_for_releases return plain MBIDs and lists of
+    titles instead, for callers that don't need the records.
+
+    The artist an artist name resolves to is remembered, and kept in the cache if one is given, so
+    that resolving the same name again needs no search.
     """
-    def __init__(self, client):
+    def __init__(self, client, registry=None, cache=None):
+        """
+        :param      client      MusicBrainzClient compatible object to send the requests with
+        :param      registry    optional metrics.Registry to record the parsing times in
+        :param      cache       optional cache.ResponseCache to keep the artist name resolutions in
+        """
         self.client = client
+        self.cache = cache
 
-    def get_artist_mbid(self, artist_name):
+        if registry == None:
+            registry = metrics.Registry()
+        self.registry = registry
+
+        # resolver.name_key of an artist name -> model.Artist
+        self.resolutions = {}
+
+    def find_artist(self, artist_name):
         """
-        Gets the artist MBID by making a search in the MusicBrainz API
+        Finds an artist by making a search in the MusicBrainz API
 
         :param      artist_name     name of the artist to search for
 
-        :returns    artist MBID if artist was found, otherwise empty string
+        :returns    model.Artist of the best match, or None if the artist was not found
         :raises     MusicBrainzHandlerError on any caught exception
         :raises     TypeError if the arg is not a string
         """
@@ -186,21 +599,138 @@ class MusicBrainzHandler():
             raise TypeError("Unsupported type for arg 'artist_name'")
 
         try:
-            artist_json = self.client.search_artist(artist_name)
-
-            if len(artist_json['artists']) > 0:
-                # The artists received are in order of "score", with the highest being the best guess of what the search was after.
-                # In terms of usability, the user could be given a chance to select one of the results to see if that's what they
-                # meant, otherwise they will always get the most popular artist's results.
-                artist_mbid = artist_json['artists'][0]['id']
-            else:
-                artist_mbid = ""
+            artist = self._parse_artist(self.client.search_artist(artist_name), artist_name)
         except:
             raise MusicBrainzHandlerError
 
-        log.info("Found artist MBID " + artist_mbid + " for artist " + artist_name)
+        self._log_artist(artist, artist_name)
+
+        return artist
+
+    def resolve_artist(self, artist_name):
+        """
+        Resolves an artist name to an artist, by a search only if the name has not been resolved
+        before, see find_artist
+
+        :param      artist_name     name of the artist to resolve
+
+        :returns    model.Artist, or None if the artist was not found
+        :raises     MusicBrainzHandlerError on any caught exception
+        :raises     TypeError if the arg is not a string
+        """
+
+        if type(artist_name) != str:
+            raise TypeError("Unsupported type for arg 'artist_name'")
+
+        artist = self._get_resolution(artist_name)
+        if artist != None:
+            return artist
+
+        artist = self.find_artist(artist_name)
+        if artist != None:
+            self._put_resolution(artist_name, artist, False)
+
+        return artist
+
+    def pin_artist(self, artist_name, artist_mbid):
+        """
+        Resolves an artist name to the artist with the given MBID from now on, e.g. when the search
+        picks another artist with the same name
+
+        :param      artist_name     name of the artist
+        :param      artist_mbid     MBID of the artist
+
+        :returns    model.Artist
+        """
+
+        artist = model.Artist(artist_mbid, artist_name)
+        self._put_resolution(artist_name, artist, True)
+
+        log.info("Using artist MBID " + artist_mbid + " for artist " + artist_name)
+
+        return artist
+
+    def get_artist_mbid(self, artist_name):
+        """
+        Gets the artist MBID by making a search in the MusicBrainz API, unless the name has been
+        resolved before, see resolve_artist
+
+        :param      artist_name     name of the artist to search for
+
+        :returns    artist MBID if artist was found, otherwise empty string
+        :raises     MusicBrainzHandlerError on any caught exception
+        :raises     TypeError if the arg is not a string
+        """
+
+        artist = self.resolve_artist(artist_name)
+
+        return artist.mbid if artist != None else ""
+
+    def _get_resolution(self, artist_name):
+        """
+        :returns    model.Artist the name has been resolved to before, or None
+        """
+
+        key = resolver.name_key(artist_name)
+
+        artist = self.resolutions.get(key)
+        if artist == None and self.cache != None:
+            resolution = self.cache.get_artist_resolution(key)
+            if resolution != None:
+                artist = model.Artist(*resolution)
+                self.resolutions[key] = artist
 
-        return artist_mbid
+        self.registry.inc('artist_resolution_lookups_total', result='hit' if artist != None else 'miss')
+
+        if artist != None:
+            log.info("Resolved artist " + artist_name + " to artist MBID " + artist.mbid + " without a search")
+
+        return artist
+
+    def _put_resolution(self, artist_name, artist, pinned):
+        key = resolver.name_key(artist_name)
+
+        self.resolutions[key] = artist
+        if self.cache != None:
+            self.cache.put_artist_resolution(key, artist.mbid, artist.name, pinned=pinned)
+
+    def _log_artist(self, artist, artist_name):
+        if artist != None:
+            log.info("Found artist MBID " + artist.mbid + " for artist " + artist_name)
+        else:
+            log.info("Found no artist MBID for artist " + artist_name)
+
+    @metrics.timed('musicbrainz_parse_seconds', method='artist')
+    def _parse_artist(self, artist_json, artist_name):
+        """
+        Picks the best match from an artist search response
+
+        All the artists in the response are ranked, see resolver.rank, so that e.g. an artist with
+        exactly the searched name beats one MusicBrainz scores higher, and the original band beats
+        its tribute bands. When other artists are as plausible as the best match, they are logged
+        so that the user can pick one of them by its MBID instead.
+
+        :param      artist_json     json response body of an artist search
+        :param      artist_name     name of the artist searched for
+
+        :returns    model.Artist of the best match, or None if there were no results
+        """
+
+        ranked = resolver.rank_candidates(artist_json['artists'], artist_name)
+
+        if len(ranked) == 0:
+            return None
+
+        best = ranked[0]
+
+        rivals = resolver.rivals(ranked, artist_name)
+        if len(rivals) > 0:
+            log.warning("Artist name " + artist_name + " is ambiguous, picked " + resolver.describe(best) + " over " +
+                        ", ".join(resolver.describe(rival) for rival in rivals) + ". Give the MBID of the intended artist with --mbid to pick another one.")
+        elif resolver.name_match(best, artist_name) == resolver.NAME_MATCH_NONE:
+            log.warning("No artist is named " + artist_name + ", picked the closest match " + resolver.describe(best))
+
+        return model.parse_artist(best)
 
     def __is_valid_release_group(self, release_group, artist_mbid):
         """
@@ -210,57 +740,159 @@ class MusicBrainzHandler():
         :param      artist_mbid     MBID of the artist whose releases to filter by
 
         :returns    True if the release group is valid for the given artist, otherwise False
+        """
+
+        # If the artist_mbid is not in the artist credits for the release group, it's not valid
+        return any(artist_mbid == artist_credit['artist']['id'] for artist_credit in release_group['artist-credit'])
+
+    def _iter_release_group_pages(self, artist_name, artist_mbid, refresh=False):
+        """
+        Yields the artist's release groups a page of release group search results at a time
+
+        The search results are paged through 100 at a time. As the search also matches other artists
+        with similar names and the results are ordered by relevance, paging stops at the first page
+        that has no release groups by the given artist. The next page is only requested once the
+        release groups of the previous one have been consumed.
+
+        :param      artist_name     name of the artist to search for
+        :param      artist_mbid     MBID of the artist whose releases to filter by
+        :param      refresh         whether to search again instead of using cached search results,
+                                    which can be days old
+
+        :returns    generator of non-empty lists of model.ReleaseGroups, each holding the artist's
+                    release groups on a page whose titles were not on an earlier page
         :raises     MusicBrainzHandlerError on any caught exception
         :raises     TypeError if the args are not strings
         """
 
-        # If the artist_mbid is not in the artist credits for the release group, it's not valid
-        is_same_artist_id = False
-        for artist_credit in release_group['artist-credit']:
-            if artist_mbid == artist_credit['artist']['id']:
-                is_same_artist_id = True
+        if type(artist_name) != str and type(artist_mbid) != str:
+            raise TypeError("Unsupported type for args 'artist_name' and 'artist_mbid'")
 
-        if is_same_artist_id == False:
-            return False
+        search = _ReleaseGroupSearch(self, artist_name, artist_mbid)
 
-        return True
+        while not search.done:
+            try:
+                # The page's json is not kept around while the release groups are yielded
+                page = search.add_page(self.client.search_artist_release_groups(artist_name, offset=search.offset, exclude_compilation=True, exclude_live=True,
+                                                                                exclude_remix=True, exclude_demo=True, refresh=refresh))
+            except:
+                raise MusicBrainzHandlerError
+
+            if len(page) > 0:
+                yield page
+
+    def iter_release_id_pages(self, artist_name, artist_mbid):
+        """
+        Yields the artist's release_ids a page of release group search results at a time
+
+        Lets the tracks and lyrics of the releases on the first page be got while the next pages are
+        still to be searched, see iter_releases_by_page and _iter_release_group_pages.
+
+        :param      artist_name     name of the artist to search for
+        :param      artist_mbid     MBID of the artist whose releases to filter by
+
+        :returns    generator of non-empty lists of release_ids for the artist
+        :raises     MusicBrainzHandlerError on any caught exception
+        :raises     TypeError if the args are not strings
+        """
+
+        for page in self._iter_release_group_pages(artist_name, artist_mbid):
+            yield [release_group.release_id for release_group in page]
+
+    def get_release_groups(self, artist_name, artist_mbid, refresh=False):
+        """
+        Gets all of the artist's release groups, see _iter_release_group_pages
+
+        Collects every page before returning, for the callers that need the complete list: updating
+        an artist's state has to know which releases have been removed, a journal records the
+        releases of a crawl once before any of them is processed, and an estimate samples from all
+        of the artist's tracks. Otherwise iter_release_id_pages lets the work start sooner.
+
+        :param      artist_name     name of the artist to search for
+        :param      artist_mbid     MBID of the artist whose releases to filter by
+        :param      refresh         whether to search again instead of using cached search results
+
+        :returns    list of model.ReleaseGroups of the artist, one per title
+        :raises     MusicBrainzHandlerError on any caught exception
+        :raises     TypeError if the args are not strings
+        """
 
-    def get_release_ids(self, artist_name, artist_mbid):
+        return [release_group for page in self._iter_release_group_pages(artist_name, artist_mbid, refresh) for release_group in page]
+
+    def get_release_ids(self, artist_name, artist_mbid, refresh=False):
         """
-        Gets the artist's release_ids
+        Gets all of the artist's release_ids, see get_release_groups for why the complete list
 
         Using release-groups we get unique releases by picking the first index release in the
         'releases' array of the response.
 
         :param      artist_name     name of the artist to search for
         :param      artist_mbid     MBID of the artist whose releases to filter by
+        :param      refresh         whether to search again instead of using cached search results
 
         :returns    release_ids for the artist
         :raises     MusicBrainzHandlerError on any caught exception
         :raises     TypeError if the args are not strings
         """
 
-        if type(artist_name) != str and type(artist_mbid) != str:
-            raise TypeError("Unsupported type for args 'artist_name' and 'artist_mbid'")
+        return [release_group.release_id for release_group in self.get_release_groups(artist_name, artist_mbid, refresh)]
+
+    @metrics.timed('musicbrainz_parse_seconds', method='release_groups')
+    def _parse_release_groups(self, artist_json, artist_mbid, release_groups):
+        """
+        Picks the artist's release groups from a page of release group search results
+
+        :param      artist_json     json response body of a release group search
+        :param      artist_mbid     MBID of the artist whose releases to filter by
+        :param      release_groups  dict of lower case title -> model.ReleaseGroup to add the release groups to
 
-        releases = {}
+        :returns    the number of release groups on the page that belong to the artist
+        """
+
+        valid_on_page = 0
+        for release_group in artist_json['release-groups']:
+            if self.__is_valid_release_group(release_group, artist_mbid):
+                valid_on_page += 1
+                # Keep the first, most relevant, release group of each title
+                if release_group['title'].lower() not in release_groups:
+                    parsed = model.parse_release_group(release_group)
+                    release_groups[parsed.title] = parsed
+
+        return valid_on_page
+
+    @metrics.timed('musicbrainz_parse_seconds', method='tracks')
+    def _parse_release(self, release_json, exclusion_filters):
+        """
+        Gets a release and its tracks from a release's json, see model.parse_release
+
+        :returns    tuple of (model.Release, number of excluded tracks)
+        """
+
+        return model.parse_release(release_json, exclusion_filters)
+
+    def get_release(self, release_id, exclusion_filters):
+        """
+        Gets a release and the tracks found on it
+
+        :param      release_id          ID of the release to get
+        :param      exclusion_filters   list of strings to use to exclude tracks with at least one of them in the title
+
+        :returns    model.Release
+        :raises     MusicBrainzHandlerError on any caught exception
+        :raises     TypeError if the arg is not a string
+        """
+
+        if type(release_id) != str:
+            raise TypeError("Unsupported type for arg 'release_id'")
 
         try:
-            # A single search returns 100 results, but with compilation and live albums removed from the equation, it is very
-            # likely that all of the releases are included in the results.
-            # TODO: browse results by using an offset until all results have been checked
-            artist_json = self.client.search_artist_release_groups(artist_name, exclude_compilation=True, exclude_live=True, exclude_remix=True, exclude_demo=True)
-
-            for release_group in artist_json['release-groups']:
-                if self.__is_valid_release_group(release_group, artist_mbid):
-                    title = release_group['title'].lower()
-                    releases[title] = release_group['releases'][0]['id']
+            release, excluded_track_count = self._parse_release(self.client.get_release_with_recordings(release_id), exclusion_filters)
         except:
             raise MusicBrainzHandlerError
 
-        log.info("Found releases " + str(list(releases.keys())) + " for artist_name " + artist_name)
+        self._log_release(release, excluded_track_count)
 
-        return list(releases.values())
+        return release
 
     def get_tracks(self, release_id, exclusion_filters):
         """
@@ -274,28 +906,315 @@ class MusicBrainzHandler():
         :raises     TypeError if the arg is not a string
         """
 
+        return self.get_release(release_id, exclusion_filters).track_titles()
+
+    def _log_release(self, release, excluded_track_count=None):
+        log.info("Found " + str(len(release.tracks)) + " tracks: " + str(release.track_titles()) + " for release_id " + release.mbid +
+                 (" (excluded " + str(excluded_track_count) + " tracks)" if excluded_track_count != None else ""))
+
+    def iter_releases(self, artist_mbid, release_ids, exclusion_filters, skipped=None):
+        """
+        Yields the given releases of an artist with the tracks found on them
+
+        Instead of requesting each release separately, the artist's album releases are browsed up
+        to 100 releases per request. Browsing stops as soon as all of the given releases have been
+        found, or when requesting the missing releases one by one would take fewer requests than
+        browsing the rest of the pages. The releases that were not found while browsing are then
+        requested separately.
+
+        A release whose tracks cannot be got, even after the client's retries, is skipped, so that
+        the tracks already received for the other releases are not thrown away. The caller learns
+        of it through skipped, so that it can tell the tracks are incomplete.
+
+        :param      artist_mbid         MBID of the artist the releases belong to
+        :param      release_ids         list of IDs of the releases to get
+        :param      exclusion_filters   list of strings to use to exclude tracks with at least one of them in the title
+        :param      skipped             optional list to append the IDs of the skipped releases to
+
+        :returns    generator of model.Releases, in the order the releases were received
+        :raises     TypeError if the args are not strings
+        """
+
+        yield from self.iter_releases_by_page(artist_mbid, [release_ids], exclusion_filters, skipped)
+
+    def iter_releases_by_page(self, artist_mbid, release_id_pages, exclusion_filters, skipped=None):
+        """
+        Yields the given releases of an artist with the tracks found on them, a page of IDs at a time
+
+        Like iter_releases, but the IDs arrive in pages, e.g. from iter_release_id_pages, and the
+        next page is only taken once the releases of the previous one have been yielded. Browsing
+        continues from where the previous page left off, and the browsed releases whose IDs have
+        not arrived yet are kept for the later pages, so no page of releases is browsed twice.
+
+        :param      artist_mbid         MBID of the artist the releases belong to
+        :param      release_id_pages    iterable of lists of IDs of the releases to get
+        :param      exclusion_filters   list of strings to use to exclude tracks with at least one of them in the title
+        :param      skipped             optional list to append the IDs of the skipped releases to
+
+        :returns    generator of model.Releases, in the order the releases were received
+        :raises     TypeError if the args are not strings
+        """
+
+        if type(artist_mbid) != str:
+            raise TypeError("Unsupported type for arg 'artist_mbid'")
+
+        browse = _ReleaseBrowse(self, artist_mbid, exclusion_filters)
+
+        for release_ids in release_id_pages:
+            found, remaining = browse.take_page(release_ids)
+            yield from found
+
+            while browse.should_browse(remaining):
+                try:
+                    # The page's json is not kept around while the releases are yielded
+                    found = browse.add_page(self.client.browse_artist_releases_with_recordings(artist_mbid, offset=browse.offset, limit=browse.page_size),
+                                            remaining)
+                except:
+                    browse.fail()
+                    break
+
+                yield from found
+
+            for release_id in remaining:
+                try:
+                    release = self.get_release(release_id, exclusion_filters)
+                except MusicBrainzHandlerError:
+                    self._skip_release(release_id, skipped)
+                    continue
+
+                yield release
+
+    def iter_tracks_for_releases(self, artist_mbid, release_ids, exclusion_filters):
+        """
+        Yields the tracks found on the given releases of an artist, in lower case characters, see iter_releases
+
+        :param      artist_mbid         MBID of the artist the releases belong to
+        :param      release_ids         list of IDs of the releases whose tracks to get
+        :param      exclusion_filters   list of strings to use to exclude tracks with at least one of them in the title
+
+        :returns    generator of (release_id, list of tracks on the release) tuples, in the order the
+                    releases were received
+        :raises     TypeError if the args are not strings
+        """
+
+        for release in self.iter_releases(artist_mbid, release_ids, exclusion_filters):
+            yield release.mbid, release.track_titles()
+
+    def _skip_release(self, release_id, skipped=None):
+        """
+        Logs and counts a release whose tracks could not be got
+
+        :param      skipped     optional list to append the release ID to
+        """
+
+        log.warning("Skipping release " + release_id + ", whose tracks could not be got from MusicBrainz")
+        self.registry.inc('releases_skipped_total')
+
+        if skipped != None:
+            skipped.append(release_id)
+
+    @metrics.timed('musicbrainz_parse_seconds', method='browse_page')
+    def _parse_browse_page(self, releases_json, release_ids, exclusion_filters, others=None):
+        """
+        Picks the given releases from a page of browsed releases
+
+        :param      releases_json       json response body of a release browse request
+        :param      release_ids         list of IDs of the releases to pick
+        :param      exclusion_filters   list of strings to use to exclude tracks with at least one of them in the title
+        :param      others              optional dict of release ID -> model.Release to add the releases that were not picked to
+
+        :returns    tuple of (list of model.Releases, total number of releases, number of releases on the page)
+        """
+
+        found = []
+        for release_json in releases_json['releases']:
+            if release_json['id'] in release_ids:
+                found.append(model.parse_release(release_json, exclusion_filters)[0])
+            elif others != None:
+                others[release_json['id']] = model.parse_release(release_json, exclusion_filters)[0]
+
+        return found, releases_json['release-count'], len(releases_json['releases'])
+
+    def _should_browse_more(self, release_count, offset, received, page_size, remaining_count):
+        """
+        Decides whether browsing the next page is cheaper than requesting the remaining releases separately
+
+        :returns    True if the next page should be requested
+        """
+
+        pages_left = -(-(release_count - offset) // page_size)
+
+        return received > 0 and pages_left > 0 and pages_left < remaining_count
+
+class AsyncMusicBrainzHandler(MusicBrainzHandler):
+    """
+    An asyncio version of MusicBrainzHandler, to be used with an AsyncMusicBrainzClient.
+
+    Parses the responses exactly like MusicBrainzHandler does.
+    """
+
+    async def find_artist(self, artist_name):
+        """
+        Finds an artist by making a search in the MusicBrainz API, see MusicBrainzHandler.find_artist
+        """
+
+        if type(artist_name) != str:
+            raise TypeError("Unsupported type for arg 'artist_name'")
+
+        try:
+            artist = self._parse_artist(await self.client.search_artist(artist_name), artist_name)
+        except:
+            raise MusicBrainzHandlerError
+
+        self._log_artist(artist, artist_name)
+
+        return artist
+
+    async def resolve_artist(self, artist_name):
+        """
+        Resolves an artist name to an artist, see MusicBrainzHandler.resolve_artist
+        """
+
+        if type(artist_name) != str:
+            raise TypeError("Unsupported type for arg 'artist_name'")
+
+        artist = self._get_resolution(artist_name)
+        if artist != None:
+            return artist
+
+        artist = await self.find_artist(artist_name)
+        if artist != None:
+            self._put_resolution(artist_name, artist, False)
+
+        return artist
+
+    async def get_artist_mbid(self, artist_name):
+        """
+        Gets the artist MBID by making a search in the MusicBrainz API, see MusicBrainzHandler.get_artist_mbid
+        """
+
+        artist = await self.resolve_artist(artist_name)
+
+        return artist.mbid if artist != None else ""
+
+    async def _iter_release_group_pages(self, artist_name, artist_mbid, refresh=False):
+        """
+        Yields the artist's release groups a page of release group search results at a time, see
+        MusicBrainzHandler._iter_release_group_pages
+        """
+
+        if type(artist_name) != str and type(artist_mbid) != str:
+            raise TypeError("Unsupported type for args 'artist_name' and 'artist_mbid'")
+
+        search = _ReleaseGroupSearch(self, artist_name, artist_mbid)
+
+        while not search.done:
+            try:
+                page = search.add_page(await self.client.search_artist_release_groups(artist_name, offset=search.offset, exclude_compilation=True,
+                                                                                      exclude_live=True, exclude_remix=True, exclude_demo=True,
+                                                                                      refresh=refresh))
+            except:
+                raise MusicBrainzHandlerError
+
+            if len(page) > 0:
+                yield page
+
+    async def iter_release_id_pages(self, artist_name, artist_mbid):
+        """
+        Yields the artist's release_ids a page at a time, see MusicBrainzHandler.iter_release_id_pages
+        """
+
+        async for page in self._iter_release_group_pages(artist_name, artist_mbid):
+            yield [release_group.release_id for release_group in page]
+
+    async def get_release_groups(self, artist_name, artist_mbid, refresh=False):
+        """
+        Gets all of the artist's release groups, see MusicBrainzHandler.get_release_groups
+        """
+
+        return [release_group async for page in self._iter_release_group_pages(artist_name, artist_mbid, refresh) for release_group in page]
+
+    async def get_release_ids(self, artist_name, artist_mbid, refresh=False):
+        """
+        Gets all of the artist's release_ids, see MusicBrainzHandler.get_release_ids
+        """
+
+        return [release_group.release_id for release_group in await self.get_release_groups(artist_name, artist_mbid, refresh)]
+
+    async def get_release(self, release_id, exclusion_filters):
+        """
+        Gets a release and the tracks found on it, see MusicBrainzHandler.get_release
+        """
+
         if type(release_id) != str:
             raise TypeError("Unsupported type for arg 'release_id'")
 
-        tracks = []
-
         try:
-            recordings_json = self.client.get_release_with_recordings(release_id)
-
-            tracks_on_release = 0
-            # Traverse through the 'media' array, which contains for example CDs 
-            for media in recordings_json['media']:
-                tracks_on_release += len(media['tracks'])
-                # Add all the track on the media to a list
-                for track in media['tracks']:
-                    track_title = track['title'].lower()
-                    # Don't add tracks with any of the exclusion filters in their titles
-                    if not any(x in track_title for x in exclusion_filters):
-                        tracks.append(track_title)
+            release, excluded_track_count = self._parse_release(await self.client.get_release_with_recordings(release_id), exclusion_filters)
         except:
             raise MusicBrainzHandlerError
 
-        excluded_track_count = tracks_on_release - len(tracks)
-        log.info("Found " + str(len(tracks)) + " tracks: " + str(tracks) + " for release_id " + release_id + " (excluded " + str(excluded_track_count) + " tracks)" )
+        self._log_release(release, excluded_track_count)
+
+        return release
+
+    async def get_tracks(self, release_id, exclusion_filters):
+        """
+        Gets the tracks found on the given release, see MusicBrainzHandler.get_tracks
+        """
+
+        return (await self.get_release(release_id, exclusion_filters)).track_titles()
+
+    async def iter_releases(self, artist_mbid, release_ids, exclusion_filters, skipped=None):
+        """
+        Yields the given releases of an artist with the tracks found on them, see MusicBrainzHandler.iter_releases
+        """
+
+        async for release in self.iter_releases_by_page(artist_mbid, _iter_async([release_ids]), exclusion_filters, skipped):
+            yield release
+
+    async def iter_releases_by_page(self, artist_mbid, release_id_pages, exclusion_filters, skipped=None):
+        """
+        Yields the given releases of an artist with the tracks found on them, a page of IDs at a time,
+        see MusicBrainzHandler.iter_releases_by_page
+
+        :param      release_id_pages    async iterable of lists of IDs of the releases to get
+        """
+
+        if type(artist_mbid) != str:
+            raise TypeError("Unsupported type for arg 'artist_mbid'")
+
+        browse = _ReleaseBrowse(self, artist_mbid, exclusion_filters)
+
+        async for release_ids in release_id_pages:
+            found, remaining = browse.take_page(release_ids)
+            for release in found:
+                yield release
+
+            while browse.should_browse(remaining):
+                try:
+                    found = browse.add_page(await self.client.browse_artist_releases_with_recordings(artist_mbid, offset=browse.offset,
+                                                                                                     limit=browse.page_size), remaining)
+                except:
+                    browse.fail()
+                    break
+
+                for release in found:
+                    yield release
+
+            for release_id in remaining:
+                try:
+                    release = await self.get_release(release_id, exclusion_filters)
+                except MusicBrainzHandlerError:
+                    self._skip_release(release_id, skipped)
+                    continue
+
+                yield release
+
+    async def iter_tracks_for_releases(self, artist_mbid, release_ids, exclusion_filters):
+        """
+        Yields the tracks found on the given releases of an artist, see MusicBrainzHandler.iter_tracks_for_releases
+        """
 
-        return tracks
+        async for release in self.iter_releases(artist_mbid, release_ids, exclusion_filters):
+            yield release.mbid, release.track_titles()
@@ -0,0 +1,112 @@
+import threading
+import asyncio
+import time
+import logging
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+
+log = logging.getLogger("avglyriccounter")
+
+def parse_retry_after(value):
+    """
+    Parses the value of a Retry-After header
+
+    :param      value       header value, either a number of seconds or an HTTP date
+
+    :returns    number of seconds to wait, or None if the value could not be parsed
+    """
+
+    if value == None:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+    if retry_at.tzinfo == None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+class RateLimiter():
+    """
+    A token bucket rate limiter.
+
+    Allows on average rate calls per second, and up to burst calls at once after the limiter has
+    been idle. The calls are spaced by the time they are started, so a slow response does not lower
+    the rate.
+
+    Each caller reserves a time slot and then waits for it in its own thread (acquire) or in its own
+    coroutine (acquire_async), so no extra threads are created.
+    """
+
+    def __init__(self, rate=1.0, burst=1):
+        """
+        :param      rate        allowed number of calls per second
+        :param      burst       number of calls that may be made at once
+        """
+
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        if burst < 1:
+            raise ValueError("burst must be at least 1")
+
+        self.interval = 1.0 / rate
+        self.burst_allowance = (burst - 1) * self.interval
+        self.lock = threading.Lock()
+
+        # The time at which the bucket would be full again if no more calls were made
+        self.next_free = time.monotonic()
+
+    def __reserve(self):
+        """
+        Reserves the next free time slot
+
+        :returns    number of seconds to wait before the reserved slot begins
+        """
+
+        with self.lock:
+            now = time.monotonic()
+            next_free = max(self.next_free, now)
+            self.next_free = next_free + self.interval
+
+            return max(0.0, next_free - self.burst_allowance - now)
+
+    def acquire(self):
+        """
+        Blocks the calling thread until a call is allowed
+        """
+
+        wait = self.__reserve()
+        if wait > 0:
+            log.debug("Waiting " + str(round(wait, 3)) + "s for the rate limit")
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        """
+        Waits in the calling coroutine until a call is allowed
+        """
+
+        wait = self.__reserve()
+        if wait > 0:
+            log.debug("Waiting " + str(round(wait, 3)) + "s for the rate limit")
+            await asyncio.sleep(wait)
+
+    def defer(self, seconds):
+        """
+        Prevents new time slots from starting within the given number of seconds
+
+        Used when the server asks us to back off, e.g. with a Retry-After header. Callers that
+        have already reserved a slot are not affected.
+
+        :param      seconds     number of seconds from now before the next call may be made
+        """
+
+        with self.lock:
+            self.next_free = max(self.next_free, time.monotonic() + seconds + self.burst_allowance)
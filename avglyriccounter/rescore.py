@@ -0,0 +1,141 @@
+try:
+    from . import lyrics
+    from . import titles
+    from . import lyricstore
+except ImportError:
+    # Running as a script, e.g. "python3 avglyriccounter", instead of as a package
+    import lyrics
+    import titles
+    import lyricstore
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import array
+import mmap
+import zlib
+import math
+import os
+import logging
+
+log = logging.getLogger("avglyriccounter")
+
+# Word count of an instrumental in the results of the workers, which are left out of the averages
+INSTRUMENTAL = -1
+
+def _count_blocks(blocks_path, blocks, count_words):
+    """
+    Counts the words of the texts in some of the blocks of a lyric store, in a worker process
+
+    :param      blocks_path     path of the store's blocks.dat
+    :param      blocks          list of (block offset, block length, list of (text offset, text length)) tuples
+    :param      count_words     function counting the words of a text
+
+    :returns    array of the word counts of the texts in the order given, INSTRUMENTAL for instrumentals
+    """
+
+    word_counts = array.array('q')
+
+    with open(blocks_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as blocks_map:
+        for block_offset, block_length, texts in blocks:
+            block = zlib.decompress(blocks_map[block_offset:block_offset + block_length])
+            for text_offset, text_length in texts:
+                text = block[text_offset:text_offset + text_length].decode('utf-8')
+                word_counts.append(INSTRUMENTAL if lyrics.is_instrumental(text) else count_words(text))
+
+    return word_counts
+
+def _split_chunks(blocks, processes, max_chunk_blocks):
+    """
+    Splits the blocks into chunks for the workers, at least a few per process so that a slow
+    chunk doesn't leave the other processes idle at the end
+
+    :returns    list of lists of blocks
+    """
+
+    chunk_blocks = max(1, min(max_chunk_blocks, math.ceil(len(blocks) / (processes * 4))))
+
+    return [blocks[i:i + chunk_blocks] for i in range(0, len(blocks), chunk_blocks)]
+
+def _mp_context():
+    """
+    Forked workers don't import the __main__ module again, which would run the command line
+    interface in every worker when running as a script
+    """
+
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork')
+
+    return None
+
+def rescore(store, processes=None, count_words=lyrics.count_words, max_chunk_blocks=16):
+    """
+    Counts the words of every track in a lyric store again and calculates the average word count per artist
+
+    The blocks of the store are split into chunks, which are decompressed and counted by a pool of
+    processes, so the counting isn't limited to one core by the GIL. The workers read the blocks
+    themselves, and only the layout of the chunk and the array of its word counts are sent between
+    the processes. The word counts are merged into the averages in this process.
+
+    Like in AvgLyricCounter, the different versions of a song, e.g. "song (remastered)", are
+    counted once, and instrumentals are left out.
+
+    :param      store               lyricstore.LyricStore of the lyrics
+    :param      processes           number of worker processes, by default the number of CPUs. With
+                                    1, the words are counted in this process.
+    :param      count_words         function counting the words of a text, which must be picklable,
+                                    i.e. defined at the top level of a module
+    :param      max_chunk_blocks    maximum number of blocks, of 256 KiB of lyrics by default, per chunk
+
+    :returns    list of dicts of the 'artist', the rounded 'average_word_count' and the number of
+                'songs' with lyrics, sorted by artist. Artists without any word counts are left out.
+    """
+
+    if processes == None:
+        processes = os.cpu_count() or 1
+
+    if processes < 1:
+        raise ValueError("processes must be at least 1")
+
+    keys, blocks = store.layout()
+
+    chunks = _split_chunks(blocks, processes, max_chunk_blocks)
+    chunk_layouts = [[(block_offset, block_length, [(text_offset, text_length) for text_offset, text_length, digest in texts])
+                      for block_offset, block_length, texts in chunk] for chunk in chunks]
+    chunk_paths = [store.blocks_path] * len(chunks)
+    count_functions = [count_words] * len(chunks)
+
+    log.info("Rescoring " + str(len(keys)) + " texts in " + str(len(blocks)) + " blocks with " + str(processes) + " processes")
+
+    if processes == 1:
+        results = map(_count_blocks, chunk_paths, chunk_layouts, count_functions)
+        return _merge(keys, chunks, results)
+
+    with ProcessPoolExecutor(max_workers=processes, mp_context=_mp_context()) as executor:
+        results = executor.map(_count_blocks, chunk_paths, chunk_layouts, count_functions)
+        return _merge(keys, chunks, results)
+
+def _merge(keys, chunks, results):
+    """
+    Merges the word counts of the chunks into the average word count per artist
+
+    :param      keys        dict of digest -> list of the keys of the tracks with those lyrics
+    :param      chunks      list of the chunks of blocks with the digests of their texts
+    :param      results     iterable of the word count arrays of the chunks, in the same order
+
+    :returns    see rescore
+    """
+
+    # Artist -> [TitleIndex of the songs, sum of the word counts, number of songs with lyrics]
+    artists = {}
+
+    for chunk, word_counts in zip(chunks, results):
+        digests = (digest for block_offset, block_length, texts in chunk for text_offset, text_length, digest in texts)
+        for digest, word_count in zip(digests, word_counts):
+            for key in keys[digest]:
+                artist, title = lyricstore.split_track_key(key)
+                artist_totals = artists.setdefault(artist, [titles.TitleIndex(), 0, 0])
+                if artist_totals[0].add(title) and word_count != INSTRUMENTAL:
+                    artist_totals[1] += word_count
+                    artist_totals[2] += 1
+
+    return [{'artist': artist, 'average_word_count': round(word_count_sum / song_count), 'songs': song_count}
+            for artist, (title_index, word_count_sum, song_count) in sorted(artists.items()) if song_count > 0]
@@ -0,0 +1,179 @@
+try:
+    from . import ratelimiter
+except ImportError:
+    # Running as a script, e.g. "python3 avglyriccounter", instead of as a package
+    import ratelimiter
+import requests
+import threading
+import random
+import time
+import logging
+
+log = logging.getLogger("avglyriccounter")
+
+# Statuses of responses to transient failures, after which a request is worth sending again
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of sending a request while a CircuitBreaker is open
+    """
+    pass
+
+class RetryPolicy():
+    """
+    Decides which failed requests are retried and how long to wait before each retry.
+
+    Responses with one of the retry statuses, timeouts and connection errors are retried. Other
+    responses, e.g. 404 Not Found, are final. The waits grow exponentially with "full jitter": each
+    wait is picked at random between zero and the exponential backoff, so that clients failing at
+    the same time don't retry at the same time. A Retry-After header sent by the server is honored
+    instead.
+    """
+
+    def __init__(self, max_retries=3, backoff=0.5, max_backoff=30.0, retry_statuses=RETRY_STATUSES, rng=None):
+        """
+        :param      max_retries     how many times a request is retried at most
+        :param      backoff         upper bound of the first wait, in seconds
+        :param      max_backoff     upper bound of any wait, in seconds
+        :param      retry_statuses  HTTP status codes of the responses that are retried
+        :param      rng             optional random.Random to pick the waits with
+        """
+
+        if max_retries < 0:
+            raise ValueError("max_retries must not be negative")
+
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retry_statuses = retry_statuses
+        self.rng = rng if rng != None else random.Random()
+
+    def is_retryable(self, res=None, exception=None):
+        """
+        Classifies the outcome of a request
+
+        :param      res         requests.Response received, or None if the request raised
+        :param      exception   exception raised by the request, or None if a response was received
+
+        :returns    True if the outcome is a transient failure
+        """
+
+        if exception != None:
+            return isinstance(exception, (requests.exceptions.Timeout, requests.exceptions.ConnectionError))
+
+        return res.status_code in self.retry_statuses
+
+    def should_retry(self, attempt, res=None, exception=None):
+        """
+        :param      attempt     number of the failed attempt, starting from 0
+        :param      res         requests.Response received, or None if the request raised
+        :param      exception   exception raised by the request, or None if a response was received
+
+        :returns    True if the request should be sent again
+        """
+
+        return attempt < self.max_retries and self.is_retryable(res, exception)
+
+    def delay(self, attempt, res=None):
+        """
+        :param      attempt     number of the failed attempt, starting from 0
+        :param      res         requests.Response received, or None if the request raised
+
+        :returns    number of seconds to wait before the next attempt
+        """
+
+        if res != None:
+            retry_after = ratelimiter.parse_retry_after(res.headers.get('Retry-After'))
+            if retry_after != None:
+                return min(retry_after, self.max_backoff)
+
+        return self.rng.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+class CircuitBreaker():
+    """
+    Stops sending requests to a failing server for a while.
+
+    The circuit is closed while requests succeed. After failure_threshold consecutive failures it
+    opens, and requests fail immediately without waiting for timeouts. Once reset_timeout seconds
+    have passed, the circuit is half open: a single trial request is let through, which closes the
+    circuit if it succeeds and opens it again if it fails.
+
+    All of the methods are thread safe.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, clock=time.monotonic):
+        """
+        :param      failure_threshold   number of consecutive failures after which the circuit opens
+        :param      reset_timeout       seconds the circuit stays open before a trial request
+        :param      clock               function returning the current time in seconds
+        """
+
+        if failure_threshold < 1:
+            raise ValueError("failure_threshold must be at least 1")
+
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.lock = threading.Lock()
+
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    @property
+    def state(self):
+        with self.lock:
+            return self.__state()
+
+    def __state(self):
+        if self.opened_at == None:
+            return CircuitBreaker.CLOSED
+        if self.clock() - self.opened_at < self.reset_timeout:
+            return CircuitBreaker.OPEN
+        return CircuitBreaker.HALF_OPEN
+
+    def allow(self):
+        """
+        Checks whether a request may be sent, reserving the trial request if the circuit is half open
+
+        :returns    True if the request may be sent
+        """
+
+        with self.lock:
+            state = self.__state()
+            if state == CircuitBreaker.CLOSED:
+                return True
+            if state == CircuitBreaker.HALF_OPEN and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            if self.opened_at != None:
+                log.info("Circuit closed again")
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def release_trial(self):
+        """
+        Lets another trial request through when the one reserved by allow() ended without telling
+        whether the server works, e.g. because its task was cancelled
+        """
+
+        with self.lock:
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial_in_flight or (self.opened_at == None and self.failures >= self.failure_threshold):
+                log.warning("Circuit opened after " + str(self.failures) + " consecutive failures, pausing requests for " + str(self.reset_timeout) + "s")
+                self.opened_at = self.clock()
+            self.trial_in_flight = False
@@ -0,0 +1,139 @@
+import unicodedata
+import re
+
+# Words in a disambiguation that mark an artist as not being the original one, e.g. a tribute band
+# with the same name as the band it plays the songs of
+IMITATOR_RE = re.compile(r"\b(?:tribute|cover|covers|karaoke|parody|impersonator|fictional)\b", re.IGNORECASE)
+
+MBID_RE = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$")
+
+# How well the name of a candidate matches the name searched for, higher is better
+NAME_MATCH_NONE = 0
+NAME_MATCH_ALIAS = 1
+NAME_MATCH_NORMALIZED = 2
+NAME_MATCH_EXACT = 3
+
+# Runs of anything but letters and digits
+NON_WORD_RE = re.compile(r"[\W_]+")
+
+def is_mbid(text):
+    """
+    :returns    True if the text is a MusicBrainz ID, i.e. a UUID in lower case
+    """
+
+    return MBID_RE.match(text) != None
+
+def name_key(name):
+    """
+    Normalizes a name for exact lookups. Used for every key made of an artist name, e.g. of the
+    name's resolution, the artist's state and journal and the artist's tracks in a lyric store.
+
+    :returns    the name in lower case with runs of whitespace collapsed
+    """
+
+    return ' '.join(name.lower().split())
+
+def normalize_name(artist_name):
+    """
+    Normalizes an artist name for comparing it loosely, e.g. "The Beatles", "beatles" and
+    "Beatles, The" are all "beatles", and "Motörhead" is "motorhead"
+
+    :param      artist_name     artist name, or sort name
+
+    :returns    the normalized name
+    """
+
+    # "Beatles, The" -> "The Beatles", "Hendrix, Jimi" -> "Jimi Hendrix"
+    last, separator, first = artist_name.rpartition(", ")
+    if separator != '' and ',' not in last:
+        artist_name = first + " " + last
+
+    decomposed = unicodedata.normalize('NFKD', artist_name.replace("&", " and "))
+    without_diacritics = ''.join(char for char in decomposed if not unicodedata.combining(char))
+    words = NON_WORD_RE.sub(' ', without_diacritics.casefold()).split()
+
+    if len(words) > 1 and words[0] == "the":
+        words = words[1:]
+
+    return ' '.join(words) if len(words) > 0 else name_key(artist_name)
+
+def name_match(candidate, artist_name):
+    """
+    :param      candidate       json of an artist in the results of an artist search
+    :param      artist_name     name searched for
+
+    :returns    one of the NAME_MATCH_ constants
+    """
+
+    if name_key(candidate.get('name', '')) == name_key(artist_name):
+        return NAME_MATCH_EXACT
+
+    key = normalize_name(artist_name)
+    if normalize_name(candidate.get('name', '')) == key or normalize_name(candidate.get('sort-name', '')) == key:
+        return NAME_MATCH_NORMALIZED
+
+    if any(normalize_name(alias.get('name', '')) == key for alias in candidate.get('aliases', [])):
+        return NAME_MATCH_ALIAS
+
+    return NAME_MATCH_NONE
+
+def is_imitator(candidate):
+    """
+    :returns    True if the candidate's disambiguation says it is e.g. a tribute or cover band
+    """
+
+    return IMITATOR_RE.search(candidate.get('disambiguation') or '') != None
+
+def rank(candidate, artist_name):
+    """
+    Scores a candidate of an artist search
+
+    The name match decides first, so that an artist with exactly the name searched for beats one
+    that MusicBrainz scores higher for e.g. an alias. Between artists with equally matching names,
+    the original artist beats its tribute bands, and then the MusicBrainz score decides.
+
+    :param      candidate       json of an artist in the results of an artist search
+    :param      artist_name     name searched for
+
+    :returns    tuple to sort the candidates by, higher is better
+    """
+
+    return (name_match(candidate, artist_name), 0 if is_imitator(candidate) else 1, int(candidate.get('score', 0)))
+
+def rank_candidates(candidates, artist_name):
+    """
+    :param      candidates      list of the json of the artists in the results of an artist search
+    :param      artist_name     name searched for
+
+    :returns    list of the candidates, best first. Equally ranked candidates keep the order of the
+                search results.
+    """
+
+    return sorted(candidates, key=lambda candidate: rank(candidate, artist_name), reverse=True)
+
+def rivals(ranked, artist_name):
+    """
+    Finds the candidates that are as plausible as the best one, apart from the MusicBrainz score,
+    e.g. the other bands with exactly the same name
+
+    :param      ranked          list of candidates, best first, see rank_candidates
+    :param      artist_name     name searched for
+
+    :returns    list of the rival candidates of the best candidate, if its name matches
+    """
+
+    if len(ranked) < 2 or name_match(ranked[0], artist_name) == NAME_MATCH_NONE:
+        return []
+
+    best = rank(ranked[0], artist_name)[:2]
+
+    return [candidate for candidate in ranked[1:] if rank(candidate, artist_name)[:2] == best]
+
+def describe(candidate):
+    """
+    :returns    the name, disambiguation and MBID of a candidate, for logging
+    """
+
+    disambiguation = candidate.get('disambiguation') or ''
+
+    return candidate.get('name', '') + (" (" + disambiguation + ")" if disambiguation != '' else "") + " " + candidate['id']
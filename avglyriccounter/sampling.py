@@ -0,0 +1,108 @@
+from statistics import NormalDist
+import math
+
+class RunningMean():
+    """
+    Mean and variance of a stream of values, updated one value at a time with Welford's algorithm,
+    which doesn't lose precision like summing the squares would
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        # Sum of the squared differences from the mean
+        self.m2 = 0.0
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    @property
+    def variance(self):
+        """
+        Sample variance of the values, 0 if there are fewer than two
+        """
+
+        if self.count < 2:
+            return 0.0
+
+        return self.m2 / (self.count - 1)
+
+def half_width(running_mean, confidence, sampled, population_size):
+    """
+    Calculates the half width of the confidence interval of a mean estimated from a simple random sample
+
+    The values are only known for part of the sampled units, e.g. the mean word count is over the
+    tracks with lyrics, but the finite population correction is based on the share of the units
+    sampled, so the interval shrinks to nothing once every unit has been sampled.
+
+    :param      running_mean        RunningMean of the known values
+    :param      confidence          confidence level of the interval, e.g. 0.95
+    :param      sampled             number of units sampled
+    :param      population_size     number of units in the population
+
+    :returns    the half width, 0 if the whole population has been sampled, or None if there are
+                too few values to estimate it
+    """
+
+    if sampled >= population_size:
+        return 0.0
+
+    if running_mean.count < 2:
+        return None
+
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+    finite_population_correction = 1 - sampled / population_size
+
+    return z * math.sqrt(running_mean.variance / running_mean.count * finite_population_correction)
+
+class Estimate():
+    """
+    An average word count estimated from a sample of an artist's tracks
+    """
+
+    def __init__(self, mean, half_width, confidence, sample_size, lyrics_requests, track_count):
+        """
+        :param      mean                estimated average word count
+        :param      half_width          half width of the confidence interval, None if unknown
+        :param      confidence          confidence level of the interval
+        :param      sample_size         number of sampled tracks with lyrics
+        :param      lyrics_requests     number of tracks whose lyrics were requested
+        :param      track_count         number of the artist's unique tracks
+        """
+
+        self.mean = mean
+        self.half_width = half_width
+        self.confidence = confidence
+        self.sample_size = sample_size
+        self.lyrics_requests = lyrics_requests
+        self.track_count = track_count
+
+    @property
+    def exact(self):
+        return self.lyrics_requests >= self.track_count
+
+    def interval(self):
+        """
+        :returns    (low, high) tuple of the confidence interval, or None if unknown
+        """
+
+        if self.half_width == None:
+            return None
+
+        return (self.mean - self.half_width, self.mean + self.half_width)
+
+    def to_dict(self):
+        interval = self.interval()
+
+        return {
+            'average_word_count': round(self.mean),
+            'confidence_interval': [round(bound, 1) for bound in interval] if interval != None else None,
+            'confidence': self.confidence,
+            'sample_size': self.sample_size,
+            'lyrics_requests': self.lyrics_requests,
+            'tracks': self.track_count,
+            'exact': self.exact
+        }
@@ -0,0 +1,246 @@
+try:
+    from . import resolver
+except ImportError:
+    # Running as a script, e.g. "python3 avglyriccounter", instead of as a package
+    import resolver
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+import threading
+import json
+import time
+import uuid
+import logging
+
+log = logging.getLogger("avglyriccounter")
+
+class Job():
+    """
+    A request to get the average lyric count of an artist
+    """
+
+    def __init__(self, artist_name):
+        self.id = uuid.uuid4().hex
+        self.artist_name = artist_name
+        self.status = 'queued'
+        self.average_word_count = None
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self.done = threading.Event()
+
+    def to_dict(self):
+        """
+        :returns    dict describing the job, for the JSON responses
+        """
+
+        retval = {'id': self.id, 'artist': self.artist_name, 'status': self.status}
+
+        if self.status == 'done':
+            retval['average_word_count'] = self.average_word_count
+        elif self.status == 'failed':
+            retval['error'] = self.error
+
+        return retval
+
+class JobManager():
+    """
+    Runs the average lyric count jobs on a shared AvgLyricCounter.
+
+    Requests for an artist that already has a queued or running job, or one that succeeded less
+    than result_ttl seconds ago, get that job instead of a new one. A failed job is not reused, so
+    the next request for the artist tries again. Combined with the clients
+    coalescing identical requests in flight, concurrent users never cause duplicate upstream
+    requests for the same artist, release or track.
+    """
+
+    def __init__(self, alc, max_artists=4, result_ttl=3600):
+        """
+        :param      alc             AvgLyricCounter used for all of the jobs
+        :param      max_artists     maximum number of jobs running at the same time
+        :param      result_ttl      seconds a successful job's result is reused for new requests
+        """
+
+        self.alc = alc
+        self.result_ttl = result_ttl
+        self.executor = ThreadPoolExecutor(max_workers=max_artists)
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.jobs_by_artist = {}
+
+    def submit(self, artist_name):
+        """
+        Gets the job for an artist, starting a new one if needed
+
+        :param      artist_name     name of the artist
+
+        :returns    the Job
+        """
+
+        key = resolver.name_key(artist_name)
+        now = time.time()
+
+        with self.lock:
+            self.__remove_expired(now)
+
+            job = self.jobs_by_artist.get(key)
+            if job != None:
+                return job
+
+            job = Job(artist_name)
+            self.jobs[job.id] = job
+            self.jobs_by_artist[key] = job
+
+        self.executor.submit(self.__run, job)
+
+        return job
+
+    def get(self, job_id):
+        """
+        :returns    the Job with the given id, or None if there is no such job
+        """
+
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def __run(self, job):
+        job.status = 'running'
+
+        try:
+            job.average_word_count = self.alc.get_average_lyric_count(job.artist_name)
+            job.status = 'done'
+        except Exception as e:
+            log.error("Job for artist '" + job.artist_name + "' failed: " + type(e).__name__)
+
+            # Only successful results are reused, the failed job can still be looked up by its id
+            key = resolver.name_key(job.artist_name)
+            with self.lock:
+                if self.jobs_by_artist.get(key) == job:
+                    del self.jobs_by_artist[key]
+
+            job.error = type(e).__name__
+            job.status = 'failed'
+
+        job.finished = time.time()
+        job.done.set()
+
+    def __remove_expired(self, now):
+        """
+        Forgets the jobs that finished more than result_ttl seconds ago
+
+        Must be called with the lock held.
+        """
+
+        for job_id, job in list(self.jobs.items()):
+            if job.finished != None and job.finished + self.result_ttl < now:
+                del self.jobs[job_id]
+                key = resolver.name_key(job.artist_name)
+                if self.jobs_by_artist.get(key) == job:
+                    del self.jobs_by_artist[key]
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """
+    HTTP API:
+
+    POST /jobs                      body {"artist": "<name>"}, starts a job, responds 202 with the job
+    GET  /jobs/<id>                 responds with the job, including the result once it is done
+    GET  /average?artist=<name>     starts a job and waits up to wait=<seconds> (default 10) for it,
+                                    responds 200 with the job if it finished, otherwise 202
+    GET  /metrics                   responds with the request, cache and phase metrics in the
+                                    Prometheus text format
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_text(self, status, text, content_type="text/plain; charset=utf-8"):
+        data = text.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+
+        if url.path.startswith('/jobs/'):
+            job = self.server.jobs.get(url.path[len('/jobs/'):])
+            if job == None:
+                self.send_json(404, {'error': 'No such job'})
+            else:
+                self.send_json(200, job.to_dict())
+        elif url.path == '/average':
+            if 'artist' not in query or query['artist'][0].strip() == '':
+                self.send_json(400, {'error': 'Missing artist'})
+                return
+
+            try:
+                wait = min(float(query.get('wait', ['10'])[0]), self.server.max_wait)
+            except ValueError:
+                self.send_json(400, {'error': 'Invalid wait'})
+                return
+
+            job = self.server.jobs.submit(query['artist'][0].strip())
+            job.done.wait(timeout=wait)
+            self.send_json(200 if job.done.is_set() else 202, job.to_dict())
+        elif url.path == '/metrics':
+            self.send_text(200, self.server.jobs.alc.registry.to_prometheus(), "text/plain; version=0.0.4; charset=utf-8")
+        else:
+            self.send_json(404, {'error': 'Not found'})
+
+    def do_POST(self):
+        if urlsplit(self.path).path != '/jobs':
+            self.send_json(404, {'error': 'Not found'})
+            return
+
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            artist_name = json.loads(self.rfile.read(length))['artist'].strip()
+            if artist_name == '':
+                raise ValueError
+        except (ValueError, KeyError, TypeError, AttributeError):
+            self.send_json(400, {'error': 'Expected a JSON body with a non-empty "artist"'})
+            return
+
+        job = self.server.jobs.submit(artist_name)
+        self.send_json(202, job.to_dict())
+
+    def log_message(self, format, *args):
+        log.debug(self.address_string() + " " + (format % args))
+
+class LyricCountServer(ThreadingHTTPServer):
+    """
+    A long-running HTTP server that keeps one AvgLyricCounter, and therefore its clients,
+    connections and caches, warm between requests.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, alc, max_artists=4, result_ttl=3600, max_wait=60):
+        """
+        :param      address         (host, port) tuple to listen on
+        :param      alc             AvgLyricCounter used for all of the requests
+        :param      max_artists     maximum number of artists processed at the same time
+        :param      result_ttl      seconds a successful artist's result is reused for new requests
+        :param      max_wait        maximum number of seconds a GET /average request is held open
+        """
+
+        super().__init__(address, RequestHandler)
+        self.jobs = JobManager(alc, max_artists=max_artists, result_ttl=result_ttl)
+        self.max_wait = max_wait
+
+    def server_close(self):
+        super().server_close()
+        self.jobs.shutdown()
@@ -0,0 +1,36 @@
+import requests
+from requests.adapters import HTTPAdapter
+
+def create_session(pool_size=10, keep_alive=True, headers=None, pool_block=False):
+    """
+    Creates a requests session that reuses its connections
+
+    Without a session every request opens a new TCP connection and does a new TLS handshake,
+    which is a large part of the latency of a single request.
+
+    :param      pool_size       maximum number of connections kept open per host, should be at least
+                                the number of threads using the session at the same time
+    :param      keep_alive      whether connections are kept open between requests
+    :param      headers         optional dict of headers sent with every request
+    :param      pool_block      whether a thread waits for a pooled connection when pool_size are in
+                                use, instead of opening one that is discarded after the request
+
+    :returns    requests.Session, which should be closed when it is no longer needed
+    """
+
+    if pool_size < 1:
+        raise ValueError("pool_size must be at least 1")
+
+    session = requests.Session()
+
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, pool_block=pool_block)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+    if headers != None:
+        session.headers.update(headers)
+
+    if not keep_alive:
+        session.headers['Connection'] = 'close'
+
+    return session
@@ -0,0 +1,158 @@
+try:
+    from . import resolver
+except ImportError:
+    # Running as a script, e.g. "python3 avglyriccounter", instead of as a package
+    import resolver
+from urllib.parse import quote
+import tempfile
+import json
+import time
+import os
+import logging
+
+log = logging.getLogger("avglyriccounter")
+
+def default_state_dir():
+    """
+    Gets the default location of the per-artist state files
+
+    Honors $XDG_STATE_HOME and falls back to ~/.local/state.
+
+    :returns    path to the default state directory
+    """
+
+    state_home = os.environ.get('XDG_STATE_HOME') or os.path.join(os.path.expanduser('~'), '.local', 'state')
+    return os.path.join(state_home, 'avglyriccounter', 'artists')
+
+class ArtistState():
+    """
+    What is known about an artist from a previous run: the releases seen, their tracks and the
+    word counts of the tracks.
+
+    The sum and the number of the word counts are kept up to date as tracks are added and
+    removed, so the average is available without going through all of the tracks.
+    """
+
+    def __init__(self, artist_name):
+        self.artist_name = artist_name
+        self.artist_mbid = None
+        # Release MBID -> list of the track names on that release
+        self.releases = {}
+        # Track name -> word count, None if no lyrics have been found yet
+        self.word_counts = {}
+        self.word_count_sum = 0
+        self.lyrics_count = 0
+        self.updated = None
+
+    def set_word_count(self, track, word_count):
+        """
+        Sets the word count of a track, None if it has no lyrics, keeping the running sum and count up to date
+        """
+
+        self.remove_track(track)
+
+        self.word_counts[track] = word_count
+        if word_count != None:
+            self.word_count_sum += word_count
+            self.lyrics_count += 1
+
+    def remove_track(self, track):
+        """
+        Forgets a track, e.g. when the release it was on is no longer one of the artist's releases
+        """
+
+        old_word_count = self.word_counts.pop(track, None)
+        if old_word_count != None:
+            self.word_count_sum -= old_word_count
+            self.lyrics_count -= 1
+
+    def tracks_without_lyrics(self):
+        """
+        :returns    list of the tracks whose lyrics have not been found yet
+        """
+
+        return [track for track, word_count in self.word_counts.items() if word_count == None]
+
+    def average_word_count(self):
+        """
+        :returns    the average word count of the tracks with lyrics, or 0 if there are none
+        """
+
+        if self.lyrics_count > 0:
+            return self.word_count_sum / self.lyrics_count
+
+        return 0
+
+    def to_dict(self):
+        return {
+            'artist': self.artist_name,
+            'artist_mbid': self.artist_mbid,
+            'releases': self.releases,
+            'word_counts': self.word_counts,
+            'updated': self.updated
+        }
+
+    @classmethod
+    def from_dict(cls, state_dict):
+        state = cls(state_dict['artist'])
+        state.artist_mbid = state_dict['artist_mbid']
+        state.releases = state_dict['releases']
+        state.updated = state_dict['updated']
+
+        # The sum and count are derived from the word counts rather than stored, so they can't get out of sync
+        for track, word_count in state_dict['word_counts'].items():
+            state.set_word_count(track, word_count)
+
+        return state
+
+class StateStore():
+    """
+    Stores an ArtistState per artist as a JSON file in a directory.
+
+    The files are replaced atomically, so an interrupted run leaves the previous state intact.
+    """
+
+    def __init__(self, directory):
+        """
+        :param      directory       directory of the state files, created if it does not exist
+        """
+
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def __path(self, artist_name):
+        return os.path.join(self.directory, quote(resolver.name_key(artist_name), safe='') + '.json')
+
+    def load(self, artist_name):
+        """
+        :param      artist_name     name of the artist
+
+        :returns    the artist's ArtistState, or None if the artist has not been processed before
+        """
+
+        try:
+            with open(self.__path(artist_name)) as f:
+                return ArtistState.from_dict(json.load(f))
+        except FileNotFoundError:
+            return None
+        except (ValueError, KeyError, TypeError, AttributeError):
+            log.warning("Ignoring the invalid state file of artist '" + artist_name + "'")
+            return None
+
+    def save(self, state):
+        """
+        Writes an artist's state, replacing the previous one
+
+        :param      state       the ArtistState to save
+        """
+
+        state.updated = time.time()
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(state.to_dict(), f)
+            os.replace(tmp_path, self.__path(state.artist_name))
+        except:
+            os.unlink(tmp_path)
+            raise
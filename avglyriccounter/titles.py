@@ -0,0 +1,136 @@
+import unicodedata
+import re
+
+# Words that mark a title suffix as naming a version of the song rather than a different song,
+# e.g. "(Remastered)", "[Demo Version]", "(feat. Someone)" or "- 2015 Remaster"
+VERSION_WORDS = (r"(?:remaster(?:ed)?|re-?master(?:ed)?|remix(?:ed)?|mix|version|edit|demo|live|mono|stereo|acoustic|"
+                 r"unplugged|single|radio|extended|deluxe|bonus|alternate|take\s+\d+|re-?recorded|explicit|clean|"
+                 r"instrumental|feat\.?|ft\.?|featuring)(?!\w)")
+
+# A version suffix in parentheses or brackets at the end of a title
+BRACKETED_SUFFIX_RE = re.compile(r"\s*[\(\[][^\(\)\[\]]*\b" + VERSION_WORDS + r"[^\(\)\[\]]*[\)\]]\s*$", re.IGNORECASE)
+
+# A version suffix after a dash at the end of a title, e.g. "Song - 2015 Remaster"
+DASHED_SUFFIX_RE = re.compile(r"\s+[-–—]\s+[^-–—]*\b" + VERSION_WORDS + r"[^-–—]*$", re.IGNORECASE)
+
+# Runs of anything but letters and digits
+NON_WORD_RE = re.compile(r"[\W_]+")
+
+def strip_version(title):
+    """
+    Strips the version suffixes from the end of a title, e.g. "Song (Demo) [2015 Remaster]" -> "Song"
+
+    :param      title       track title
+
+    :returns    the title without version suffixes, or the title itself if it is nothing but one
+    """
+
+    stripped = title
+    while True:
+        shorter = DASHED_SUFFIX_RE.sub('', BRACKETED_SUFFIX_RE.sub('', stripped))
+        if shorter == stripped:
+            break
+        stripped = shorter
+
+    return stripped if stripped.strip() != '' else title
+
+def title_key(title):
+    """
+    Gets the canonical key of a track title, the same for the different versions of a song
+
+    The version suffixes are stripped, diacritics are removed, the case is folded and punctuation
+    and whitespace are collapsed, e.g. "Café del Mar (Remastered)" and "cafe del mar - 2015 remaster"
+    both have the key "cafe del mar".
+
+    :param      title       track title
+
+    :returns    the key of the title
+    """
+
+    decomposed = unicodedata.normalize('NFKD', strip_version(title))
+    without_diacritics = ''.join(char for char in decomposed if not unicodedata.combining(char))
+    key = NON_WORD_RE.sub(' ', without_diacritics.casefold()).strip()
+
+    # A title of nothing but punctuation, e.g. "...", is its own key
+    return key if key != '' else ' '.join(title.casefold().split())
+
+class TitleIndex():
+    """
+    De-duplicates track titles by their canonical key, and optionally by their recording MBID, in a
+    single pass: each title is looked up and added with a couple of dict operations.
+
+    The first title added of each song is its canonical title, which the later versions of the song
+    map to.
+    """
+
+    def __init__(self, titles=()):
+        """
+        :param      titles      optional titles to add to the index
+        """
+
+        # Title key -> canonical title
+        self.keys = {}
+        # Recording MBID -> canonical title
+        self.recordings = {}
+        self.song_count = 0
+
+        for title in titles:
+            self.add(title)
+
+    def add(self, title, recording_mbid=None):
+        """
+        Adds a title to the index
+
+        :param      title           track title
+        :param      recording_mbid  optional MBID of the track's recording, which groups differently
+                                    titled tracks of the same recording
+
+        :returns    True if the title is the first of its song, False if it is a duplicate
+        """
+
+        key = title_key(title)
+        canonical = self.keys.get(key)
+        if canonical == None and recording_mbid != None:
+            canonical = self.recordings.get(recording_mbid)
+
+        if canonical != None:
+            # Either identity of the duplicate now leads to the same song
+            self.keys.setdefault(key, canonical)
+            if recording_mbid != None:
+                self.recordings.setdefault(recording_mbid, canonical)
+            return False
+
+        self.keys[key] = title
+        if recording_mbid != None:
+            self.recordings[recording_mbid] = title
+        self.song_count += 1
+
+        return True
+
+    def canonical(self, title, recording_mbid=None):
+        """
+        :returns    the canonical title of the title's song, or None if the song is not in the index
+        """
+
+        canonical = self.keys.get(title_key(title))
+        if canonical == None and recording_mbid != None:
+            canonical = self.recordings.get(recording_mbid)
+
+        return canonical
+
+    def __contains__(self, title):
+        return title_key(title) in self.keys
+
+    def __len__(self):
+        return self.song_count
+
+def unique_titles(titles):
+    """
+    :param      titles      iterable of track titles
+
+    :returns    list of the canonical titles of the songs, in the order they were found
+    """
+
+    index = TitleIndex()
+
+    return [title for title in titles if index.add(title)]
@@ -0,0 +1,41 @@
+"""
+Measures the vectorized group-by aggregations of the analytics over a large synthetic corpus
+
+Run from the repository root with:
+    python3 -m benchmark.bench_analytics [number_of_tracks] [number_of_artists]
+"""
+
+from avglyriccounter.analytics import group_stats, group_histograms, group_vocabulary_sizes, DEFAULT_PERCENTILES, DEFAULT_BINS
+import numpy as np
+import time
+import sys
+
+def measure(name, fn):
+    start = time.perf_counter()
+    fn()
+    print(name.ljust(28) + str(round(time.perf_counter() - start, 3)).rjust(8) + " s")
+
+def main():
+    n_tracks = int(sys.argv[1]) if len(sys.argv) > 1 else 2000000
+    n_artists = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+    words_per_track = 50
+
+    rng = np.random.default_rng(0)
+    artists = rng.integers(0, n_artists, n_tracks)
+    releases = artists * 10 + rng.integers(0, 10, n_tracks)
+    years = rng.integers(1960, 2026, n_tracks)
+    word_counts = rng.gamma(4, 50, n_tracks).astype(np.int64)
+    token_tracks = np.repeat(np.arange(n_tracks), words_per_track)
+    token_words = rng.zipf(1.5, n_tracks * words_per_track) % 50000
+
+    percentiles = (50,) + DEFAULT_PERCENTILES
+
+    print(str(n_tracks) + " tracks, " + str(n_artists) + " artists, " + str(len(token_tracks)) + " (track, word) pairs")
+    measure("stats by artist", lambda: group_stats(artists, word_counts, n_artists, percentiles))
+    measure("stats by release", lambda: group_stats(releases, word_counts, n_artists * 10, percentiles))
+    measure("stats by year", lambda: group_stats(years - 1960, word_counts, 66, percentiles))
+    measure("histograms by artist", lambda: group_histograms(artists, word_counts, n_artists, DEFAULT_BINS))
+    measure("vocabulary by artist", lambda: group_vocabulary_sizes(artists, token_tracks, token_words, n_artists))
+
+if __name__ == "__main__":
+    main()
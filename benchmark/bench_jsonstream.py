@@ -0,0 +1,125 @@
+"""
+Compares decoding large MusicBrainz responses whole to decoding them with jsonstream
+
+The responses are generated in the format MusicBrainz returns them in: a box set release with many
+media, a page of 100 browsed releases and a page of 100 release group search results, with the
+recordings, artist credits and other fields the handler doesn't use. Each response is fed in 64
+KiB chunks, like requests.Response.iter_content gives them, and decoded both whole, the way
+requests.Response.json() does after reading the whole body, and with jsonstream.load keeping only
+the fields in model. The best time of a few runs and the peak memory allocated while decoding,
+measured with tracemalloc in a separate run, are reported per response.
+
+Run from the repository root with:
+    python3 -m benchmark.bench_jsonstream [number_of_runs]
+"""
+
+from avglyriccounter import jsonstream
+from avglyriccounter import model
+from benchmark.bench_lyrics import WORDS
+import tracemalloc
+import random
+import json
+import time
+import uuid
+import sys
+
+CHUNK_SIZE = 64 * 1024
+
+def _mbid(rng):
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+def _title(rng):
+    return " ".join(rng.choices(WORDS, k=rng.randint(1, 4))).title()
+
+def _artist_credit(rng, artist):
+    return [{'name': artist['name'], 'joinphrase': '', 'artist': dict(artist, **{'type': 'Group', 'disambiguation': '',
+                                                                                 'genres': [], 'type-id': _mbid(rng)})}]
+
+def _release(rng, artist, media_count, tracks_per_medium):
+    media = []
+    for i in range(media_count):
+        tracks = []
+        for j in range(tracks_per_medium):
+            title = _title(rng)
+            length = rng.randint(60000, 600000)
+            tracks.append({'id': _mbid(rng), 'number': str(j + 1), 'position': j + 1, 'title': title, 'length': length,
+                           'artist-credit': _artist_credit(rng, artist),
+                           'recording': {'id': _mbid(rng), 'title': title, 'length': length, 'disambiguation': '', 'video': False,
+                                         'first-release-date': str(rng.randint(1970, 2020)) + '-01-01',
+                                         'artist-credit': _artist_credit(rng, artist)}})
+        media.append({'position': i + 1, 'format': 'CD', 'format-id': _mbid(rng), 'title': '', 'track-count': len(tracks),
+                      'track-offset': 0, 'tracks': tracks})
+
+    return {'id': _mbid(rng), 'title': _title(rng), 'status': 'Official', 'status-id': _mbid(rng), 'quality': 'normal',
+            'date': '2001-01-01', 'country': 'XE', 'barcode': str(rng.getrandbits(40)), 'packaging': 'Box', 'disambiguation': '',
+            'text-representation': {'language': 'eng', 'script': 'Latn'}, 'cover-art-archive': {'front': True, 'count': 3},
+            'release-events': [{'date': '2001-01-01', 'area': {'id': _mbid(rng), 'name': 'Europe', 'iso-3166-1-codes': ['XE']}}],
+            'artist-credit': _artist_credit(rng, artist), 'media': media}
+
+def _release_group(rng, artist):
+    return {'id': _mbid(rng), 'type-id': _mbid(rng), 'score': rng.randint(50, 100), 'count': 8, 'title': _title(rng),
+            'first-release-date': str(rng.randint(1970, 2020)), 'primary-type': 'Album', 'primary-type-id': _mbid(rng),
+            'secondary-types': [], 'artist-credit': _artist_credit(rng, artist),
+            'releases': [{'id': _mbid(rng), 'status-id': _mbid(rng), 'title': _title(rng), 'status': 'Official'} for i in range(rng.randint(1, 30))],
+            'tags': [{'count': rng.randint(1, 10), 'name': rng.choice(WORDS)} for i in range(5)]}
+
+def generate_responses(seed=0):
+    """
+    :returns    dict of name -> (UTF-8 encoded response body, fields to keep)
+    """
+
+    rng = random.Random(seed)
+    artist = {'id': _mbid(rng), 'name': "Benchmark Artist", 'sort-name': "Artist, Benchmark"}
+
+    box_set = _release(rng, artist, 40, 50)
+    browse_page = {'release-count': 250, 'release-offset': 0, 'releases': [_release(rng, artist, rng.randint(1, 3), 12) for i in range(100)]}
+    search_page = {'created': '2021-01-01T00:00:00.000Z', 'count': 800, 'offset': 0,
+                   'release-groups': [_release_group(rng, artist) for i in range(100)]}
+
+    return {
+        'box-set release': (json.dumps(box_set).encode(), model.RELEASE_FIELDS),
+        'browse page': (json.dumps(browse_page).encode(), model.BROWSE_RELEASES_FIELDS),
+        'release group search': (json.dumps(search_page).encode(), model.RELEASE_GROUP_SEARCH_FIELDS)
+    }
+
+def _chunks(data):
+    for i in range(0, len(data), CHUNK_SIZE):
+        yield data[i:i + CHUNK_SIZE]
+
+def decode_whole(data, fields):
+    return json.loads(b''.join(_chunks(data)).decode('utf-8'))
+
+def decode_streaming(data, fields):
+    return jsonstream.load(_chunks(data), fields)
+
+def measure(decode, data, fields, runs):
+    """
+    :returns    tuple of (best time in seconds, peak memory in bytes)
+    """
+
+    best = None
+    for i in range(runs):
+        start = time.perf_counter()
+        decode(data, fields)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best == None else min(best, elapsed)
+
+    tracemalloc.start()
+    decode(data, fields)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return best, peak
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+    print("response".ljust(22) + "size".rjust(10) + "decoding".rjust(12) + "time".rjust(10) + "peak memory".rjust(14))
+    for name, (data, fields) in generate_responses().items():
+        for decoding, decode in [('whole', decode_whole), ('streaming', decode_streaming)]:
+            best, peak = measure(decode, data, fields, runs)
+            print(name.ljust(22) + (str(round(len(data) / 1024 / 1024, 1)) + " MiB").rjust(10) + decoding.rjust(12) +
+                  (str(round(best * 1000, 1)) + " ms").rjust(10) + (str(round(peak / 1024 / 1024, 2)) + " MiB").rjust(14))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Measures the throughput of lyric word counting, comparing lyrics.count_words to len(str.split())
+
+The corpus is read from the lyrics in a response cache database if one is given, otherwise a
+synthetic corpus with headers, repeat markers, annotations and punctuation is generated.
+
+Run from the repository root with:
+    python3 -m benchmark.bench_lyrics [number_of_lyrics] [cache_path]
+"""
+
+from avglyriccounter import lyrics
+import sqlite3
+import random
+import json
+import time
+import sys
+
+WORDS = ("fear of the dark I am a man who walks alone and when I'm walking road at night or strolling "
+         "through park light begins to change sometimes feel little strange anxious when it's").split()
+NOISE = ["...", "-", "(2x)", "x3", "!", "[Chorus]"]
+
+def generate_lyrics(rng):
+    lines = ["Paroles de la chanson " + " ".join(rng.choices(WORDS, k=3)) + " par Iron Maiden\r"]
+    for i in range(rng.randint(20, 60)):
+        line = rng.choices(WORDS, k=rng.randint(3, 10))
+        if rng.random() < 0.1:
+            line.append(rng.choice(NOISE))
+        lines.append(" ".join(line))
+        if rng.random() < 0.15:
+            lines.append("")
+
+    return "\n".join(lines)
+
+def load_corpus(count, cache_path):
+    """
+    :returns    list of lyrics texts
+    """
+
+    if cache_path == None:
+        rng = random.Random(0)
+        return [generate_lyrics(rng) for i in range(count)]
+
+    db = sqlite3.connect(cache_path)
+    rows = db.execute("SELECT body FROM responses WHERE endpoint = 'lyrics' AND status = 200 LIMIT ?", (count,)).fetchall()
+    db.close()
+
+    corpus = [json.loads(body)['lyrics'] for (body,) in rows]
+    if len(corpus) == 0:
+        sys.exit("No lyrics in " + cache_path)
+
+    # Repeat the cached lyrics to get a corpus of the requested size
+    return [corpus[i % len(corpus)] for i in range(count)]
+
+def measure(name, count_words, corpus, size):
+    start = time.perf_counter()
+    total = 0
+    for text in corpus:
+        total += count_words(text)
+    elapsed = time.perf_counter() - start
+
+    print(name.ljust(20) + str(round(len(corpus) / elapsed)).rjust(9) + " lyrics/s" +
+          str(round(size / elapsed / 1024 / 1024, 1)).rjust(9) + " MiB/s" +
+          "   " + str(total) + " words")
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    cache_path = sys.argv[2] if len(sys.argv) > 2 else None
+
+    corpus = load_corpus(count, cache_path)
+    size = sum(len(text) for text in corpus)
+
+    print(str(len(corpus)) + " lyrics, " + str(round(size / 1024 / 1024, 1)) + " MiB")
+    measure("len(str.split())", lambda text: len(text.split()), corpus, size)
+    measure("lyrics.count_words", lyrics.count_words, corpus, size)
+
+if __name__ == "__main__":
+    main()
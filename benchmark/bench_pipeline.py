@@ -0,0 +1,176 @@
+"""
+Measures the whole pipeline end to end against the local MusicBrainz and LyricsOvh stubs
+
+Each scenario of benchmark.stubserver is served by stubs in a separate process, and the average
+word count of its artist is calculated with an AvgLyricCounter without a response cache. The wall
+time, the number of requests received by the stubs and the client's retries are reported per
+scenario. The peak memory allocated by the pipeline is measured with tracemalloc in a second run,
+as tracing the allocations slows the pipeline down several times.
+
+No network access is needed, so the results are comparable between runs, e.g. in CI.
+
+Run from the repository root with:
+    python3 -m benchmark.bench_pipeline [scenario ...] [--latency <s>] [--error-rate <r>]
+        [--mb-rate <n>] [--mb-rate-limit <n>] [--workers <n>] [--stream-responses] [--no-memory] [--json]
+
+--latency and --error-rate apply to both stubs, --mb-rate is the client's MusicBrainz rate limit
+(default 1 request per second like against the real API) and --mb-rate-limit the rate above which
+the MusicBrainz stub responds with 503. --stream-responses decodes the MusicBrainz responses while
+they are received, see MusicBrainzClient. --no-memory skips the memory measurement run.
+"""
+
+from avglyriccounter.avglyriccounter import AvgLyricCounter
+from avglyriccounter.musicbrainz import MusicBrainzClient
+from avglyriccounter.ratelimiter import RateLimiter
+from avglyriccounter.sessions import create_session
+from avglyriccounter.metrics import Registry
+from benchmark.stubserver import SCENARIOS, ARTIST_NAME, serve_scenario
+import multiprocessing
+import urllib.request
+import tracemalloc
+import json
+import time
+import sys
+
+USAGE = ("Usage: python3 -m benchmark.bench_pipeline [" + "|".join(SCENARIOS) + " ...] [--latency <s>] [--error-rate <r>] "
+         "[--mb-rate <n>] [--mb-rate-limit <n>] [--workers <n>] [--stream-responses] [--no-memory] [--json]")
+
+def handle_args():
+    options = {
+        'scenarios': [],
+        'latency': 0.0,
+        'error_rate': 0.0,
+        'mb_rate': 1.0,
+        'mb_rate_limit': None,
+        'workers': 8,
+        'stream_responses': False,
+        'memory': True,
+        'json': False
+    }
+
+    args = sys.argv[1:]
+    i = 0
+    try:
+        while i < len(args):
+            arg = args[i]
+            if arg in SCENARIOS:
+                options['scenarios'].append(arg)
+            elif arg == "--stream-responses":
+                options['stream_responses'] = True
+            elif arg == "--no-memory":
+                options['memory'] = False
+            elif arg == "--json":
+                options['json'] = True
+            elif arg == "--workers":
+                i += 1
+                options['workers'] = int(args[i])
+            elif arg in ("--latency", "--error-rate", "--mb-rate", "--mb-rate-limit"):
+                i += 1
+                options[arg[2:].replace('-', '_')] = float(args[i])
+            else:
+                sys.exit(USAGE)
+            i += 1
+    except (IndexError, ValueError):
+        sys.exit(USAGE)
+
+    if len(options['scenarios']) == 0:
+        options['scenarios'] = list(SCENARIOS)
+
+    return options
+
+def get_stats(base_url):
+    root = base_url[:base_url.index('/', len("http://"))]
+    with urllib.request.urlopen(root + "/_stats", timeout=10) as res:
+        return json.loads(res.read())
+
+def run_pipeline(mb_base_url, lyrics_base_url, options):
+    """
+    Calculates the average word count of the scenario's artist from the stubs
+
+    :returns    tuple of (average word count, metrics.Registry of the run)
+    """
+
+    registry = Registry()
+    mb_session = create_session(pool_size=1)
+    mb_client = MusicBrainzClient(rate_limiter=RateLimiter(rate=options['mb_rate']), session=mb_session, registry=registry, base_url=mb_base_url,
+                                  streaming=options['stream_responses'])
+
+    try:
+        with AvgLyricCounter(max_workers=options['workers'], mb_client=mb_client, registry=registry, lyrics_base_url=lyrics_base_url) as alc:
+            return alc.get_average_lyric_count(ARTIST_NAME), registry
+    finally:
+        mb_session.close()
+
+def measure_peak_memory(mb_base_url, lyrics_base_url, options):
+    """
+    :returns    the peak number of bytes allocated while running the pipeline
+    """
+
+    tracemalloc.start()
+    try:
+        run_pipeline(mb_base_url, lyrics_base_url, options)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def run_scenario(scenario, options):
+    """
+    Runs the pipeline against the stubs of a scenario
+
+    :returns    dict of the results
+    """
+
+    stub_options = {'latency': options['latency'], 'error_rate': options['error_rate']}
+    mb_options = dict(stub_options, rate_limit=options['mb_rate_limit'])
+
+    started = multiprocessing.Queue()
+    stubs = multiprocessing.Process(target=serve_scenario, args=(scenario, mb_options, stub_options, started), daemon=True)
+    stubs.start()
+
+    try:
+        mb_base_url, lyrics_base_url, expected_average = started.get(timeout=60)
+
+        start = time.perf_counter()
+        average, registry = run_pipeline(mb_base_url, lyrics_base_url, options)
+        elapsed = time.perf_counter() - start
+
+        result = {
+            'scenario': scenario,
+            'average_word_count': average,
+            'expected_average_word_count': expected_average,
+            'seconds': elapsed,
+            'musicbrainz': get_stats(mb_base_url),
+            'lyricsovh': get_stats(lyrics_base_url),
+            'musicbrainz_retries': registry.counter('musicbrainz_retries_total'),
+            'peak_memory_bytes': None
+        }
+
+        if options['memory']:
+            result['peak_memory_bytes'] = measure_peak_memory(mb_base_url, lyrics_base_url, options)
+
+        return result
+    finally:
+        stubs.terminate()
+        stubs.join()
+
+def print_result(result):
+    print(result['scenario'].ljust(12) +
+          str(round(result['seconds'], 2)).rjust(8) + " s" +
+          str(result['musicbrainz']['requests']).rjust(6) + " MB requests (" + str(result['musicbrainz_retries']) + " retried)" +
+          str(result['lyricsovh']['requests']).rjust(6) + " lyrics requests" +
+          (str(round(result['peak_memory_bytes'] / 1024 / 1024, 1)).rjust(7) + " MiB peak" if result['peak_memory_bytes'] != None else "") +
+          "   average " + str(result['average_word_count']) +
+          ("" if result['average_word_count'] == result['expected_average_word_count'] else " (expected " + str(result['expected_average_word_count']) + ")"))
+
+def main():
+    options = handle_args()
+
+    for scenario in options['scenarios']:
+        result = run_scenario(scenario, options)
+        if options['json']:
+            print(json.dumps(result))
+        else:
+            print_result(result)
+
+if __name__ == "__main__":
+    main()
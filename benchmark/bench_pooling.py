@@ -0,0 +1,103 @@
+"""
+Measures the per-request latency of LyricsOvh-like requests with and without connection pooling
+
+Starts a local HTTPS server with a self-signed certificate (requires the openssl command) and
+sends the same requests with the module-level requests.get and with a pooled session.
+
+Run from the repository root with:
+    python3 -m benchmark.bench_pooling [number_of_requests]
+"""
+
+from avglyriccounter.sessions import create_session
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import requests
+import urllib3
+import subprocess
+import tempfile
+import threading
+import statistics
+import time
+import ssl
+import sys
+import os
+
+class LyricsHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        body = b'{"lyrics": "la la la"}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_https_server(cert_dir):
+    """
+    Starts the stub server in a background thread
+
+    :returns    the server and its base url
+    """
+
+    cert_file = os.path.join(cert_dir, "cert.pem")
+    key_file = os.path.join(cert_dir, "key.pem")
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=localhost",
+                    "-keyout", key_file, "-out", cert_file], check=True, capture_output=True)
+
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert_file, key_file)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), LyricsHandler)
+    server.socket = context.wrap_socket(server.socket, server_side=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server, "https://127.0.0.1:" + str(server.server_address[1]) + "/v1/"
+
+def measure(get, base_url, count):
+    """
+    :returns    list of request latencies in milliseconds
+    """
+
+    latencies = []
+    for i in range(count):
+        start = time.perf_counter()
+        res = get(base_url + "artist/track" + str(i), verify=False, timeout=10)
+        res.raise_for_status()
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    return latencies
+
+def report(name, latencies):
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(name.ljust(12) + " mean " + str(round(statistics.mean(latencies), 2)).rjust(7) + " ms" +
+          "   median " + str(round(statistics.median(latencies), 2)).rjust(7) + " ms" +
+          "   p95 " + str(round(p95, 2)).rjust(7) + " ms")
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+
+    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+    with tempfile.TemporaryDirectory() as cert_dir:
+        server, base_url = start_https_server(cert_dir)
+
+        try:
+            without_pooling = measure(requests.get, base_url, count)
+
+            session = create_session(pool_size=1)
+            with session:
+                with_pooling = measure(session.get, base_url, count)
+        finally:
+            server.shutdown()
+
+    print(str(count) + " sequential HTTPS requests to a local stub server")
+    report("requests.get", without_pooling)
+    report("session", with_pooling)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Measures how the rescoring of a lyric store scales with the number of processes
+
+A lyric store of synthetic lyrics (see bench_lyrics) is written to a temporary directory, or an
+existing store is used if one is given, and rescore.rescore is run over it with 1, 2, 4, ...
+processes up to the number of CPUs.
+
+Run from the repository root with:
+    python3 -m benchmark.bench_rescore [number_of_tracks] [lyric_store_dir]
+"""
+
+from avglyriccounter.lyricstore import LyricStore
+from avglyriccounter.rescore import rescore
+from benchmark.bench_lyrics import generate_lyrics
+import tempfile
+import random
+import time
+import sys
+import os
+
+def build_store(store_dir, n_tracks):
+    rng = random.Random(0)
+
+    with LyricStore(store_dir) as store:
+        for i in range(n_tracks):
+            store.put("artist" + str(i % 1000) + "/track" + str(i), generate_lyrics(rng))
+
+def main():
+    n_tracks = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        store_dir = sys.argv[2] if len(sys.argv) > 2 else tmp_dir
+        if len(sys.argv) <= 2:
+            build_store(store_dir, n_tracks)
+
+        with LyricStore(store_dir) as store:
+            stats = store.stats()
+            print(str(stats['tracks']) + " tracks, " + str(round(stats['text_bytes'] / 1024 / 1024, 1)) + " MiB of lyrics in " +
+                  str(round(stats['stored_bytes'] / 1024 / 1024, 1)) + " MiB")
+
+            processes = 1
+            single_process_seconds = None
+            while True:
+                start = time.perf_counter()
+                rescore(store, processes=processes)
+                elapsed = time.perf_counter() - start
+
+                if single_process_seconds == None:
+                    single_process_seconds = elapsed
+
+                print((str(processes) + " processes").ljust(14) + str(round(elapsed, 2)).rjust(8) + " s" +
+                      str(round(stats['text_bytes'] / 1024 / 1024 / elapsed, 1)).rjust(8) + " MiB/s" +
+                      str(round(single_process_seconds / elapsed, 2)).rjust(7) + "x")
+
+                if processes >= (os.cpu_count() or 1):
+                    break
+                processes = min(processes * 2, os.cpu_count())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,366 @@
+"""
+Local stand-ins for the MusicBrainz and LyricsOvh APIs, serving fixed fixtures
+
+The fixtures of a scenario are generated deterministically from its seed: an artist with a number
+of albums, each with a reissue, release groups and artists with similar names in the search
+results, live and instrumental tracks, and lyrics for most of the tracks. They are recorded as the
+response bodies of the exact urls the clients request, so the stubs answer like the real APIs
+would, including paging.
+
+The stubs can add latency, answer a share of the requests with 500 Internal Server Error, and
+answer requests that come faster than a given rate with 503 Service Unavailable and a Retry-After
+header like MusicBrainz does. The errors are picked from the url and the number of times it has
+been requested, so they are the same on every run. GET /_stats responds with the number of
+requests received and the responses sent per status code.
+
+Run the stubs of a scenario on their own with:
+    python3 -m benchmark.stubserver <scenario> [--latency <s>] [--error-rate <r>] [--mb-rate-limit <n>]
+"""
+
+from avglyriccounter.musicbrainz import MusicBrainzClient
+from avglyriccounter.lyricsovh import LyricsOvhClient
+from avglyriccounter import lyrics
+from benchmark.bench_lyrics import WORDS, generate_lyrics
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import unquote
+import threading
+import random
+import json
+import time
+import uuid
+import sys
+
+# Scenario name -> (number of albums, tracks per album)
+SCENARIOS = {
+    '10-albums': (10, 10),
+    '100-albums': (100, 8),
+    '1000-tracks': (25, 40)
+}
+
+ARTIST_NAME = "Benchmark Artist"
+
+class _UrlRecorder(MusicBrainzClient):
+    """
+    Returns the url an endpoint method would request instead of requesting it
+    """
+
+    def _get_json(self, url, endpoint, fields=None, refresh=False):
+        return url
+
+class _LyricsUrlRecorder(LyricsOvhClient):
+    """
+    Returns the url get_lyrics would request instead of requesting it
+    """
+
+    def _get_json(self, url, store_key=None):
+        return url
+
+class Fixtures():
+    """
+    Response bodies of the MusicBrainz and LyricsOvh stubs, keyed by the url relative to the API's base url
+    """
+
+    def __init__(self, artist_name):
+        self.artist_name = artist_name
+        # Relative url -> json response body
+        self.musicbrainz = {}
+        self.lyricsovh = {}
+        # Lower case track title -> word count, None without lyrics, of the tracks the average is calculated from
+        self.word_counts = {}
+
+    def expected_average(self):
+        """
+        :returns    the average word count the pipeline should find for the artist
+        """
+
+        word_counts = [word_count for word_count in self.word_counts.values() if word_count != None]
+        return round(sum(word_counts) / len(word_counts)) if len(word_counts) > 0 else 0
+
+def _mbid(rng):
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+def _title(rng, taken):
+    while True:
+        title = " ".join(rng.choices(WORDS, k=rng.randint(1, 4))).title()
+        if title.lower() not in taken:
+            taken.add(title.lower())
+            return title
+
+def _release_json(release):
+    return {'id': release['id'], 'title': release['title'], 'media': [{'tracks': [{'title': title} for title in release['tracks']]}]}
+
+def build_fixtures(album_count, tracks_per_album, artist_name=ARTIST_NAME, seed=0, lyrics_ratio=0.85):
+    """
+    Generates the fixtures of an artist
+
+    :param      album_count         number of albums, each of which also has a reissue with a bonus track
+    :param      tracks_per_album    number of tracks per album, a few of which are live or instrumental versions
+    :param      artist_name         name of the artist, which is also the name to request the average for
+    :param      seed                seed of the generated mbids, titles and lyrics
+    :param      lyrics_ratio        share of the tracks with lyrics on LyricsOvh
+
+    :returns    Fixtures
+    """
+
+    rng = random.Random(seed)
+    mb = _UrlRecorder(base_url="")
+    lo = _LyricsUrlRecorder(base_url="")
+    fixtures = Fixtures(artist_name)
+
+    artist_mbid = _mbid(rng)
+    similar_mbid = _mbid(rng)
+    fixtures.musicbrainz[mb.search_artist(artist_name)] = {
+        'artists': [{'id': artist_mbid, 'name': artist_name, 'score': 100},
+                    {'id': similar_mbid, 'name': artist_name + " Tribute", 'score': 80}]
+    }
+
+    taken = set()
+    release_groups = []
+    releases = []
+    for i in range(album_count):
+        tracks = [_title(rng, taken) for j in range(tracks_per_album)]
+        for j in range(len(tracks)):
+            if rng.random() < 0.05:
+                tracks[j] += rng.choice([" (Live)", " (Instrumental)"])
+
+        title = _title(rng, taken)
+        first = {'id': _mbid(rng), 'title': title, 'tracks': tracks}
+        reissue = {'id': _mbid(rng), 'title': title, 'tracks': tracks + [_title(rng, taken)]}
+        releases += [first, reissue]
+        release_groups.append({'title': title, 'artist-credit': [{'artist': {'id': artist_mbid}}],
+                               'releases': [{'id': first['id']}, {'id': reissue['id']}]})
+
+        for track in tracks:
+            if "(live)" not in track.lower() and "(instrumental)" not in track.lower():
+                fixtures.word_counts[track.lower()] = None
+
+    # The search also matches the similar artist, whose release groups are less relevant
+    for i in range(max(album_count // 10, 1)):
+        release_groups.append({'title': _title(rng, taken), 'artist-credit': [{'artist': {'id': similar_mbid}}],
+                               'releases': [{'id': _mbid(rng)}]})
+
+    for offset in range(0, len(release_groups), 100):
+        url = mb.search_artist_release_groups(artist_name, offset=offset, exclude_compilation=True, exclude_live=True, exclude_remix=True, exclude_demo=True)
+        fixtures.musicbrainz[url] = {'count': len(release_groups), 'offset': offset, 'release-groups': release_groups[offset:offset + 100]}
+
+    for offset in range(0, len(releases), 100):
+        url = mb.browse_artist_releases_with_recordings(artist_mbid, offset=offset, limit=100)
+        fixtures.musicbrainz[url] = {'release-count': len(releases), 'release-offset': offset,
+                                     'releases': [_release_json(release) for release in releases[offset:offset + 100]]}
+
+    for release in releases:
+        fixtures.musicbrainz[mb.get_release_with_recordings(release['id'])] = _release_json(release)
+
+    for track in sorted(taken):
+        if rng.random() < lyrics_ratio:
+            text = generate_lyrics(rng)
+            fixtures.lyricsovh[lo.get_lyrics(artist_name, track)] = {'lyrics': text}
+            if track in fixtures.word_counts:
+                fixtures.word_counts[track] = lyrics.count_words(text)
+
+    return fixtures
+
+def scenario_fixtures(scenario, seed=0):
+    """
+    :param      scenario    name of one of the SCENARIOS
+
+    :returns    Fixtures of the scenario
+    """
+
+    album_count, tracks_per_album = SCENARIOS[scenario]
+    return build_fixtures(album_count, tracks_per_album, seed=seed)
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        if self.path == "/_stats":
+            self.send_json(200, self.server.stats())
+            return
+
+        key = unquote(self.path[len(self.server.prefix):]) if self.path.startswith(self.server.prefix) else None
+        status, body, headers = self.server.respond(key)
+        self.send_json(status, body, headers)
+
+    def send_json(self, status, body, headers={}):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+class StubServer(ThreadingHTTPServer):
+    """
+    A stub API serving the response bodies of a fixture dict
+    """
+
+    daemon_threads = True
+
+    def __init__(self, responses, prefix, address=("127.0.0.1", 0), latency=0.0, jitter=0.0, error_rate=0.0,
+                 rate_limit=None, retry_after=1, seed=0):
+        """
+        :param      responses       dict of url relative to the prefix -> json response body. Other
+                                    urls are answered with 404 Not Found.
+        :param      prefix          path of the API's base url, e.g. "/ws/2/"
+        :param      address         (host, port) to listen on, by default a free port on localhost
+        :param      latency         seconds to wait before responding
+        :param      jitter          up to this many seconds are added to the latency at random
+        :param      error_rate      share of the requests answered with 500 Internal Server Error
+        :param      rate_limit      requests per second above which requests are answered with
+                                    503 Service Unavailable, None for no limit
+        :param      retry_after     seconds sent in the Retry-After header of the 503 responses
+        :param      seed            seed of the latency jitter and of the errors
+        """
+
+        super().__init__(address, StubHandler)
+        self.responses = responses
+        self.prefix = prefix
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.seed = seed
+
+        self.lock = threading.Lock()
+        self.last_accepted = None
+        # Relative url -> number of times it has been requested
+        self.attempts = {}
+        self.status_counts = {}
+
+    @property
+    def base_url(self):
+        return "http://127.0.0.1:" + str(self.server_address[1]) + self.prefix
+
+    def __is_rate_limited(self):
+        if self.rate_limit == None:
+            return False
+
+        with self.lock:
+            now = time.monotonic()
+            if self.last_accepted != None and now - self.last_accepted < 1 / self.rate_limit:
+                return True
+            self.last_accepted = now
+            return False
+
+    def respond(self, key):
+        """
+        :param      key     requested url relative to the prefix, None if the path is outside of it
+
+        :returns    tuple of (status code, json response body, dict of extra headers)
+        """
+
+        with self.lock:
+            attempt = self.attempts.get(key, 0)
+            self.attempts[key] = attempt + 1
+
+        if self.__is_rate_limited():
+            status, body, headers = 503, {'error': "Rate limit exceeded"}, {'Retry-After': str(self.retry_after)}
+        else:
+            # The same url gets the same latency and errors on every run
+            rng = random.Random(str(self.seed) + ":" + str(key) + ":" + str(attempt))
+            time.sleep(self.latency + rng.random() * self.jitter)
+
+            if rng.random() < self.error_rate:
+                status, body, headers = 500, {'error': "Internal Server Error"}, {}
+            elif key in self.responses:
+                status, body, headers = 200, self.responses[key], {}
+            else:
+                status, body, headers = 404, {'error': "Not Found"}, {}
+
+        with self.lock:
+            self.status_counts[status] = self.status_counts.get(status, 0) + 1
+
+        return status, body, headers
+
+    def stats(self):
+        """
+        :returns    dict with the number of 'requests' received and the number of 'responses' per status code
+        """
+
+        with self.lock:
+            return {'requests': sum(self.status_counts.values()),
+                    'responses': {str(status): count for status, count in sorted(self.status_counts.items())}}
+
+def start_stub_servers(fixtures, mb_options={}, lyrics_options={}):
+    """
+    Starts the MusicBrainz and LyricsOvh stubs in background threads
+
+    :param      fixtures        Fixtures to serve
+    :param      mb_options      keyword arguments of the MusicBrainz StubServer
+    :param      lyrics_options  keyword arguments of the LyricsOvh StubServer
+
+    :returns    tuple of (MusicBrainz StubServer, LyricsOvh StubServer), whose base_url the clients
+                should be given. Stop them with shutdown() and server_close().
+    """
+
+    mb_server = StubServer(fixtures.musicbrainz, "/ws/2/", **mb_options)
+    lyrics_server = StubServer(fixtures.lyricsovh, "/v1/", **lyrics_options)
+
+    for server in (mb_server, lyrics_server):
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return mb_server, lyrics_server
+
+def serve_scenario(scenario, mb_options, lyrics_options, started):
+    """
+    Serves the stubs of a scenario until the process is terminated
+
+    Meant to be run in a separate process, so that the stubs don't compete with the measured
+    client for the GIL and their memory use is not measured with the client's.
+
+    :param      started     multiprocessing queue to put the (MusicBrainz base url, LyricsOvh base
+                            url, expected average) tuple in once the stubs are listening
+    """
+
+    fixtures = scenario_fixtures(scenario)
+    mb_server, lyrics_server = start_stub_servers(fixtures, mb_options, lyrics_options)
+    started.put((mb_server.base_url, lyrics_server.base_url, fixtures.expected_average()))
+
+    threading.Event().wait()
+
+def main():
+    usage = "Usage: python3 -m benchmark.stubserver <" + "|".join(SCENARIOS) + "> [--latency <s>] [--error-rate <r>] [--mb-rate-limit <n>]"
+
+    args = sys.argv[1:]
+    if len(args) == 0 or args[0] not in SCENARIOS:
+        sys.exit(usage)
+
+    options = {}
+    mb_options = {}
+    i = 1
+    try:
+        while i < len(args):
+            if args[i] == "--latency":
+                options['latency'] = float(args[i + 1])
+            elif args[i] == "--error-rate":
+                options['error_rate'] = float(args[i + 1])
+            elif args[i] == "--mb-rate-limit":
+                mb_options['rate_limit'] = float(args[i + 1])
+            else:
+                sys.exit(usage)
+            i += 2
+    except (IndexError, ValueError):
+        sys.exit(usage)
+
+    fixtures = scenario_fixtures(args[0])
+    mb_server, lyrics_server = start_stub_servers(fixtures, dict(options, **mb_options), options)
+
+    print("MusicBrainz: " + mb_server.base_url)
+    print("LyricsOvh:   " + lyrics_server.base_url)
+    print("Expected average for '" + fixtures.artist_name + "': " + str(fixtures.expected_average()))
+
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+import unittest
+
+from avglyriccounter import analytics
+from avglyriccounter.analytics import Corpus, group_stats, group_histograms, group_vocabulary_sizes, describe, load_corpus
+from avglyriccounter.cache import ResponseCache
+
+np = analytics.np
+
+@unittest.skipIf(np == None, "NumPy is not installed")
+class TestGroupAggregations(unittest.TestCase):
+    def test_group_stats_match_numpy(self):
+        rng = np.random.default_rng(0)
+        groups = rng.integers(0, 20, 5000)
+        values = rng.integers(0, 800, 5000)
+
+        stats = group_stats(groups, values, 21, (10, 50, 90))
+
+        for group in range(20):
+            group_values = values[groups == group]
+            self.assertEqual(stats['count'][group], len(group_values))
+            self.assertAlmostEqual(stats['mean'][group], group_values.mean())
+            self.assertEqual(stats['min'][group], group_values.min())
+            self.assertEqual(stats['max'][group], group_values.max())
+            np.testing.assert_allclose(stats['percentiles'][group], np.percentile(group_values, [10, 50, 90]))
+
+        # The last group has no values
+        self.assertEqual(stats['count'][20], 0)
+        self.assertTrue(np.isnan(stats['mean'][20]))
+
+    def test_group_histograms(self):
+        groups = np.array([0, 0, 0, 1, 1])
+        values = np.array([0, 49, 50, 1000, 5000])
+
+        actual = group_histograms(groups, values, 2, (0, 50, 1000))
+        self.assertEqual(actual.tolist(), [[2, 1, 0], [0, 0, 2]])
+
+    def test_group_vocabulary_sizes(self):
+        # Tracks 0 and 1 are in group 0, track 2 in group 1
+        groups = np.array([0, 0, 1])
+        token_tracks = np.array([0, 0, 1, 1, 2])
+        token_words = np.array([0, 1, 1, 2, 0])
+
+        actual = group_vocabulary_sizes(groups, token_tracks, token_words, 2)
+        self.assertEqual(actual.tolist(), [3, 1])
+
+@unittest.skipIf(np == None, "NumPy is not installed")
+class TestDescribe(unittest.TestCase):
+    def setUp(self):
+        self.corpus = Corpus(vocabulary=True)
+        self.corpus.add_track('iron maiden', 'release-1', 1992, 100, ['fear', 'of', 'the', 'dark'])
+        self.corpus.add_track('iron maiden', 'release-1', 1992, 200, ['fear', 'the', 'reaper'])
+        self.corpus.add_track('iron maiden', 'release-2', 0, 300, [])
+        self.corpus.add_track('hallatar', 'release-3', 1992, 50, ['melt'])
+
+    def test_describe_by_artist(self):
+        actual = describe(self.corpus, by='artist', percentiles=(25,), bins=(0, 150))
+
+        self.assertEqual(actual, [
+            {'artist': 'iron maiden', 'tracks': 3, 'mean': 200.0, 'median': 200.0, 'p25': 150.0, 'min': 100, 'max': 300, 'histogram': [1, 2], 'vocabulary': 5},
+            {'artist': 'hallatar', 'tracks': 1, 'mean': 50.0, 'median': 50.0, 'p25': 50.0, 'min': 50, 'max': 50, 'histogram': [1, 0], 'vocabulary': 1}
+        ])
+
+    def test_describe_by_release(self):
+        actual = describe(self.corpus, by='release')
+
+        self.assertEqual([(result['artist'], result['release'], result['tracks']) for result in actual],
+                         [('iron maiden', 'release-1', 2), ('iron maiden', 'release-2', 1), ('hallatar', 'release-3', 1)])
+
+    def test_describe_by_year(self):
+        actual = describe(self.corpus, by='year')
+
+        # Tracks whose year is unknown are grouped under None
+        self.assertEqual([(result['year'], result['tracks'], result['mean']) for result in actual],
+                         [(None, 1, 300.0), (1992, 3, 116.7)])
+
+    def test_describe_invalid_grouping(self):
+        with self.assertRaises(ValueError):
+            describe(self.corpus, by='label')
+
+@unittest.skipIf(np == None, "NumPy is not installed")
+class TestLoadCorpus(unittest.TestCase):
+    def setUp(self):
+        self.cache = ResponseCache(':memory:')
+
+        credit = [{'artist': {'id': 'maiden-mbid', 'name': 'Iron Maiden'}}]
+        other_credit = [{'artist': {'id': 'other-mbid', 'name': 'Iron Maiden Tribute'}}]
+
+        self.cache.put("https://musicbrainz.org/ws/2/artist/?query=artist:iron maiden&fmt=json",
+                       {'artists': [{'id': 'maiden-mbid'}]}, 'artist')
+        self.cache.put("https://musicbrainz.org/ws/2/release-group?limit=100&fmt=json&query=artist:iron maiden AND primarytype:\"album\"",
+                       {'count': 2, 'release-groups': [
+                           {'title': 'Fear of the Dark', 'first-release-date': '1992-05-11', 'artist-credit': credit, 'releases': [{'id': 'fotd'}]},
+                           {'title': 'Tribute', 'first-release-date': '2005', 'artist-credit': other_credit, 'releases': [{'id': 'tribute'}]}
+                       ]}, 'release-group')
+        self.cache.put("https://musicbrainz.org/ws/2/release/fotd?inc=recordings&fmt=json",
+                       {'id': 'fotd', 'media': [{'tracks': [{'title': 'Fear of the Dark'}, {'title': 'Wasting Love'}, {'title': 'Transylvania'}, {'title': 'Fear of the Dark (Live)'}]}]}, 'release')
+        self.cache.put("https://musicbrainz.org/ws/2/release/tribute?inc=recordings&fmt=json",
+                       {'id': 'tribute', 'media': [{'tracks': [{'title': 'Wasting Love'}]}]}, 'release')
+
+        self.cache.put("https://api.lyrics.ovh/v1/iron maiden/fear of the dark", {'lyrics': "Paroles de la chanson Fear Of The Dark par Iron Maiden\r\nFear of the dark (2x)"}, 'lyrics')
+        self.cache.put("https://api.lyrics.ovh/v1/iron maiden/transylvania", {'lyrics': "[Instrumental]"}, 'lyrics')
+        self.cache.put("https://api.lyrics.ovh/v1/iron maiden/fear of the dark (live)", {'lyrics': "Fear"}, 'lyrics')
+        self.cache.put("https://api.lyrics.ovh/v1/iron maiden/wasting love", None, 'lyrics', status=404)
+
+    def tearDown(self):
+        self.cache.close()
+
+    def test_load_corpus(self):
+        corpus = load_corpus(self.cache, vocabulary=True)
+
+        # Only "fear of the dark" has lyrics, the instrumental, the live track and the tribute album are left out
+        self.assertEqual(len(corpus), 1)
+        self.assertEqual(describe(corpus, by='year'),
+                         [{'year': 1992, 'tracks': 1, 'mean': 8.0, 'median': 8.0, 'p10': 8.0, 'p25': 8.0, 'p75': 8.0, 'p90': 8.0,
+                           'min': 8, 'max': 8, 'histogram': [1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0], 'vocabulary': 4}])
+
+    def test_load_corpus_counts_each_song_once(self):
+        self.cache.put("https://musicbrainz.org/ws/2/release/fotd?inc=recordings&fmt=json",
+                       {'id': 'fotd', 'media': [{'tracks': [{'title': 'Fear of the Dark', 'recording': {'id': 'recording1'}},
+                                                            {'title': 'Fear of the Dark (2015 Remaster)'},
+                                                            {'title': 'Afraid of the Dark', 'recording': {'id': 'recording1'}}]}]}, 'release')
+        self.cache.put("https://api.lyrics.ovh/v1/iron maiden/fear of the dark (2015 remaster)", {'lyrics': "Fear of the dark"}, 'lyrics')
+        self.cache.put("https://api.lyrics.ovh/v1/iron maiden/afraid of the dark", {'lyrics': "Fear of the dark"}, 'lyrics')
+
+        # The other versions of the song are left out, like the ones that AvgLyricCounter never requests
+        self.assertEqual(len(load_corpus(self.cache)), 1)
+
+    def test_load_corpus_uses_pinned_resolution(self):
+        self.cache.put("https://api.lyrics.ovh/v1/iron maiden/wasting love", {'lyrics': "Wasting love"}, 'lyrics')
+        self.cache.put_artist_resolution('iron maiden', 'other-mbid', 'Iron Maiden Tribute', pinned=True)
+
+        corpus = load_corpus(self.cache)
+
+        self.assertEqual(len(corpus), 1)
+        self.assertEqual([result['year'] for result in describe(corpus, by='year')], [2005])
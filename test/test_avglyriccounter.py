@@ -0,0 +1,557 @@
+import unittest
+from unittest.mock import Mock, AsyncMock
+from time import sleep
+from threading import Event
+import tempfile
+import random
+
+from avglyriccounter.avglyriccounter import AvgLyricCounter, AsyncAvgLyricCounter, MissingData, IncompleteData
+from avglyriccounter.lyricsovh import LyricsOvhHandlerError
+from avglyriccounter.state import StateStore, ArtistState
+from avglyriccounter.journal import JournalStore
+from avglyriccounter.model import Artist, Release, Track
+from avglyriccounter.musicbrainz import MusicBrainzClient, MusicBrainzHandler
+from avglyriccounter.ratelimiter import RateLimiter
+from avglyriccounter.cache import ResponseCache
+
+def release(release_id, titles):
+    return Release(release_id, '', tuple(Track(title, None) for title in titles))
+
+class TestAvgLyricCounter(unittest.TestCase):
+    def setUp(self):
+        self.alc = AvgLyricCounter(max_workers=4)
+        self.alc.mb_handler = Mock()
+        self.alc.lo_handler = Mock()
+
+    def tearDown(self):
+        self.alc.close()
+
+    # ------------------------------------------------------------------------------------------------
+    # AvgLyricCounter.get_lyric_counts_for_tracks()
+
+    def test_get_lyric_counts_for_tracks_keeps_track_order(self):
+        word_counts = {'first': 10, 'second': 20, 'third': None, 'fourth': 40}
+        delays = {'first': 0.05, 'second': 0.0, 'third': 0.02, 'fourth': 0.01}
+
+        # Make the first track finish last to make sure the order does not depend on completion order
+        def get_lyric_word_count(artist, title):
+            sleep(delays[title])
+            return word_counts[title]
+
+        self.alc.lo_handler.get_lyric_word_count.side_effect = get_lyric_word_count
+
+        actual = self.alc.get_lyric_counts_for_tracks('artist', ['first', 'second', 'third', 'fourth'])
+        self.assertEqual(actual, [10, 20, 40])
+
+    def test_get_lyric_counts_for_tracks_no_lyrics(self):
+        self.alc.lo_handler.get_lyric_word_count.return_value = None
+
+        actual = self.alc.get_lyric_counts_for_tracks('artist', ['first', 'second'])
+        self.assertEqual(actual, [])
+
+    def test_invalid_max_workers(self):
+        with self.assertRaises(ValueError):
+            AvgLyricCounter(max_workers=0)
+
+    # ------------------------------------------------------------------------------------------------
+    # AvgLyricCounter.get_lyric_counts_for_releases()
+
+    def test_get_lyric_counts_for_releases_filters_duplicates(self):
+        tracks = {'release1': ['first', 'second'], 'release2': ['second', 'third']}
+        word_counts = {'first': 10, 'second': 20, 'third': None}
+
+        self.alc.mb_handler.get_release.side_effect = lambda release_id, exclusion_filters: release(release_id, tracks[release_id])
+        self.alc.lo_handler.get_lyric_word_count.side_effect = lambda artist, title: word_counts[title]
+
+        actual = self.alc.get_lyric_counts_for_releases('artist', ['release1', 'release2'])
+        self.assertEqual(actual, (3, [10, 20]))
+        self.assertEqual(self.alc.lo_handler.get_lyric_word_count.call_count, 3)
+
+    def test_get_lyric_counts_for_releases_filters_other_versions(self):
+        tracks = {'release1': ['first', 'second'], 'release2': ['first (2015 remaster)', 'second - demo version', 'third']}
+
+        self.alc.mb_handler.get_release.side_effect = lambda release_id, exclusion_filters: release(release_id, tracks[release_id])
+        self.alc.lo_handler.get_lyric_word_count.return_value = 10
+
+        self.assertEqual(self.alc.get_lyric_counts_for_releases('artist', ['release1', 'release2']), (3, [10, 10, 10]))
+        self.assertEqual([call.args[1] for call in self.alc.lo_handler.get_lyric_word_count.call_args_list], ['first', 'second', 'third'])
+        self.assertEqual(self.alc.registry.counter('duplicate_tracks_total'), 2)
+
+    def test_get_lyric_counts_for_releases_groups_recordings(self):
+        releases = {'release1': Release('release1', '', (Track('first', 'recording1'),)),
+                    'release2': Release('release2', '', (Track('first, part one', 'recording1'), Track('second', 'recording2')))}
+
+        self.alc.mb_handler.get_release.side_effect = lambda release_id, exclusion_filters: releases[release_id]
+        self.alc.lo_handler.get_lyric_word_count.return_value = 10
+
+        self.assertEqual(self.alc.get_lyric_counts_for_releases('artist', ['release1', 'release2']), (2, [10, 10]))
+
+    def test_get_lyric_counts_for_releases_overlaps_requests(self):
+        first_lyrics_requested = Event()
+
+        # The second release is only returned after the lyrics of the first release's track have been
+        # requested, which never happens if the lyrics are only fetched after all of the releases
+        def get_release(release_id, exclusion_filters):
+            if release_id == 'release2':
+                self.assertTrue(first_lyrics_requested.wait(timeout=5))
+                return release(release_id, ['second'])
+            return release(release_id, ['first'])
+
+        def get_lyric_word_count(artist, title):
+            first_lyrics_requested.set()
+            return 5
+
+        self.alc.mb_handler.get_release.side_effect = get_release
+        self.alc.lo_handler.get_lyric_word_count.side_effect = get_lyric_word_count
+
+        actual = self.alc.get_lyric_counts_for_releases('artist', ['release1', 'release2'])
+        self.assertEqual(actual, (2, [5, 5]))
+
+    def test_get_lyric_counts_for_release_pages_overlaps_search(self):
+        first_lyrics_requested = Event()
+
+        # The second page of release IDs is only searched for after the lyrics of the first page's
+        # track have been requested, which never happens if all of the pages are collected first
+        def iter_release_id_pages():
+            yield ['release1']
+            self.assertTrue(first_lyrics_requested.wait(timeout=5))
+            yield ['release2']
+
+        def get_lyric_word_count(artist, title):
+            first_lyrics_requested.set()
+            return 5
+
+        self.alc.mb_handler.get_release.side_effect = lambda release_id, exclusion_filters: release(release_id, [release_id])
+        self.alc.lo_handler.get_lyric_word_count.side_effect = get_lyric_word_count
+
+        actual = self.alc.get_lyric_counts_for_release_pages('artist', iter_release_id_pages())
+        self.assertEqual(actual, (2, [5, 5]))
+
+    # ------------------------------------------------------------------------------------------------
+    # AvgLyricCounter.get_average_lyric_counts()
+
+    def test_get_average_lyric_counts(self):
+        averages = {'first': 100, 'second': MissingData(), 'third': 300, 'fourth': RuntimeError("unexpected")}
+
+        def get_average_lyric_count(artist_name):
+            if isinstance(averages[artist_name], Exception):
+                raise averages[artist_name]
+            return averages[artist_name]
+
+        self.alc.get_average_lyric_count = Mock(side_effect=get_average_lyric_count)
+
+        actual = sorted(self.alc.get_average_lyric_counts(['first', 'second', 'third', 'fourth'], max_artists=2), key=lambda result: result[0])
+        # An unexpected error of one artist doesn't end the others
+        self.assertEqual(actual, [('first', 100, None), ('fourth', None, averages['fourth']), ('second', None, averages['second']),
+                                  ('third', 300, None)])
+
+    # ------------------------------------------------------------------------------------------------
+    # AvgLyricCounter.get_average_lyric_count()
+
+    def test_failed_lookups_are_reported(self):
+        word_counts = {'first': 10, 'second': LyricsOvhHandlerError(), 'third': None}
+
+        def iter_releases_by_page(artist_mbid, release_id_pages, exclusion_filters, skipped=None):
+            skipped.append('release2')
+            yield release('release1', ['first', 'second', 'third'])
+
+        def get_lyric_word_count(artist, title):
+            if isinstance(word_counts[title], Exception):
+                raise word_counts[title]
+            return word_counts[title]
+
+        self.alc.mb_handler.get_artist_mbid.return_value = 'artist-mbid'
+        self.alc.mb_handler.iter_release_id_pages.return_value = iter([['release1', 'release2']])
+        self.alc.mb_handler.iter_releases_by_page.side_effect = iter_releases_by_page
+        self.alc.lo_handler.get_lyric_word_count.side_effect = get_lyric_word_count
+
+        with self.assertRaises(IncompleteData) as context:
+            self.alc.get_average_lyric_count('artist')
+
+        self.assertEqual(context.exception.to_dict(), {'partial_average_word_count': 10, 'failed_lyrics': 1, 'skipped_releases': 1})
+
+    # ------------------------------------------------------------------------------------------------
+    # AvgLyricCounter.report()
+
+    def test_report_times_phases(self):
+        self.alc.mb_handler.get_artist_mbid.return_value = 'artist-mbid'
+        self.alc.mb_handler.iter_release_id_pages.return_value = iter([['release1']])
+        self.alc.mb_handler.iter_releases_by_page.side_effect = lambda artist_mbid, release_id_pages, exclusion_filters, skipped=None: \
+            (release(release_id, ['first', 'second']) for release_ids in release_id_pages for release_id in release_ids)
+        self.alc.lo_handler.get_lyric_word_count.return_value = 10
+
+        self.assertEqual(self.alc.get_average_lyric_count('artist'), 10)
+
+        report = self.alc.report()
+        histograms = {(histogram['name'], histogram['labels'].get('phase')): histogram['count'] for histogram in report['histograms']}
+        self.assertEqual(histograms[('artist_seconds', None)], 1)
+        for phase in ('artist_search', 'release_ids', 'tracks_and_lyrics'):
+            self.assertEqual(histograms[('phase_seconds', phase)], 1)
+        self.assertEqual(report['coalesced_requests'], {'lyricsovh': 0, 'musicbrainz': 0})
+
+class TestEstimateAvgLyricCounter(unittest.TestCase):
+    def setUp(self):
+        self.alc = AvgLyricCounter(max_workers=4)
+        self.alc.mb_handler = Mock()
+        self.alc.lo_handler = Mock()
+
+        self.tracks = ['track' + str(i) for i in range(1000)]
+        self.alc.mb_handler.get_artist_mbid.return_value = 'artist-mbid'
+        self.alc.mb_handler.get_release_ids.return_value = ['release1']
+        self.alc.mb_handler.iter_releases.side_effect = lambda artist_mbid, release_ids, exclusion_filters, skipped=None: iter([release('release1', self.tracks)])
+        # Word counts 180-220, every tenth track without lyrics
+        self.alc.lo_handler.get_lyric_word_count.side_effect = lambda artist, title: None if int(title[5:]) % 10 == 0 else 180 + int(title[5:]) % 41
+
+    def tearDown(self):
+        self.alc.close()
+
+    def test_stops_once_within_tolerance(self):
+        estimate = self.alc.estimate_average_lyric_count('artist', tolerance=0.02, rng=random.Random(0))
+
+        self.assertFalse(estimate.exact)
+        self.assertLess(estimate.lyrics_requests, 100)
+        self.assertLessEqual(estimate.half_width, 0.02 * estimate.mean)
+        self.assertAlmostEqual(estimate.mean, 200, delta=estimate.half_width)
+
+    def test_budget(self):
+        estimate = self.alc.estimate_average_lyric_count('artist', tolerance=0.0001, budget=50, rng=random.Random(0))
+        self.assertEqual(estimate.lyrics_requests, 50)
+
+    def test_exact_when_every_track_is_requested(self):
+        self.tracks = self.tracks[:30]
+        estimate = self.alc.estimate_average_lyric_count('artist', tolerance=0.0001)
+
+        self.assertTrue(estimate.exact)
+        self.assertEqual(estimate.half_width, 0.0)
+        self.assertEqual(estimate.sample_size, 27)
+
+    def test_failed_lookups_are_reported(self):
+        self.tracks = self.tracks[:30]
+
+        def get_lyric_word_count(artist, title):
+            if title == 'track1':
+                raise LyricsOvhHandlerError()
+            return 100 + int(title[5:])
+
+        self.alc.lo_handler.get_lyric_word_count.side_effect = get_lyric_word_count
+
+        # The word counts vary too much to stop sampling before every track has been requested
+        with self.assertRaises(IncompleteData) as context:
+            self.alc.estimate_average_lyric_count('artist', tolerance=0.0001)
+
+        self.assertEqual(context.exception.to_dict(), {'partial_average_word_count': 115, 'failed_lyrics': 1, 'skipped_releases': 0})
+
+class TestIncrementalAvgLyricCounter(unittest.TestCase):
+    def setUp(self):
+        self.state_dir = tempfile.TemporaryDirectory()
+        self.state_store = StateStore(self.state_dir.name)
+
+        self.alc = AvgLyricCounter(max_workers=4, state_store=self.state_store)
+        self.alc.mb_handler = Mock()
+        self.alc.lo_handler = Mock()
+
+        self.tracks = {'release1': ['first', 'second'], 'release2': ['second', 'third'], 'release3': ['fourth']}
+        self.word_counts = {'first': 10, 'second': 20, 'third': None, 'fourth': 40}
+
+        self.alc.mb_handler.get_artist_mbid.return_value = 'artist-mbid'
+        self.alc.mb_handler.iter_releases.side_effect = lambda artist_mbid, release_ids, exclusion_filters, skipped=None: \
+            (release(release_id, self.tracks[release_id]) for release_id in release_ids)
+        self.alc.lo_handler.get_lyric_word_count.side_effect = lambda artist, title: self.word_counts[title]
+
+    def tearDown(self):
+        self.alc.close()
+        self.state_dir.cleanup()
+
+    def requested_tracks(self):
+        return sorted(call.args[1] for call in self.alc.lo_handler.get_lyric_word_count.call_args_list)
+
+    def test_first_run_processes_everything(self):
+        self.alc.mb_handler.get_release_ids.return_value = ['release1', 'release2']
+
+        self.assertEqual(self.alc.get_average_lyric_count('Artist'), 15)
+        self.assertEqual(self.requested_tracks(), ['first', 'second', 'third'])
+
+        artist_state = self.state_store.load('artist')
+        self.assertEqual(artist_state.word_counts, {'first': 10, 'second': 20, 'third': None})
+        self.assertEqual((artist_state.word_count_sum, artist_state.lyrics_count), (30, 2))
+
+    def test_refresh_requests_only_new_releases_and_missing_lyrics(self):
+        self.alc.mb_handler.get_release_ids.return_value = ['release1', 'release2']
+        self.alc.get_average_lyric_count('artist')
+        self.alc.mb_handler.reset_mock()
+        self.alc.lo_handler.get_lyric_word_count.reset_mock()
+
+        # A new album came out, and the lyrics of "third" have been added to LyricsOvh since
+        self.alc.mb_handler.get_release_ids.return_value = ['release1', 'release2', 'release3']
+        self.word_counts['third'] = 30
+
+        self.assertEqual(self.alc.get_average_lyric_count('artist'), 25)
+
+        self.alc.mb_handler.get_artist_mbid.assert_not_called()
+        self.alc.mb_handler.iter_releases.assert_called_once_with('artist-mbid', ['release3'], self.alc.exclusion_filters, skipped=[])
+        self.assertEqual(self.requested_tracks(), ['fourth', 'third'])
+
+    def test_refresh_ignores_cached_release_group_search(self):
+        def search_response(release_ids):
+            res = Mock(status_code=200, headers={})
+            res.json.return_value = {'count': len(release_ids), 'release-groups': [
+                {'title': release_id, 'artist-credit': [{'artist': {'id': 'artist-mbid'}}], 'releases': [{'id': release_id}]} for release_id in release_ids]}
+            return res
+
+        response_cache = ResponseCache(':memory:')
+        session = Mock()
+        session.get.side_effect = [search_response(['release1', 'release2']), search_response(['release1', 'release2', 'release3'])]
+        mb_handler = MusicBrainzHandler(MusicBrainzClient(cache=response_cache, rate_limiter=RateLimiter(rate=1000), session=session))
+        mb_handler.get_artist_mbid = self.alc.mb_handler.get_artist_mbid
+        mb_handler.iter_releases = self.alc.mb_handler.iter_releases
+        self.alc.mb_handler = mb_handler
+
+        self.alc.get_average_lyric_count('artist')
+
+        # The first run's search results are still cached, but the new release is found
+        self.assertEqual(self.alc.get_average_lyric_count('artist'), 23)
+        self.assertEqual(session.get.call_count, 2)
+        self.assertIn('fourth', self.state_store.load('artist').word_counts)
+        response_cache.close()
+
+    def test_refresh_drops_removed_releases(self):
+        self.alc.mb_handler.get_release_ids.return_value = ['release1', 'release2']
+        self.alc.get_average_lyric_count('artist')
+
+        # "second" is still on release1, "third" was only on release2
+        self.alc.mb_handler.get_release_ids.return_value = ['release1']
+
+        self.assertEqual(self.alc.get_average_lyric_count('artist'), 15)
+        self.assertEqual(self.state_store.load('artist').word_counts, {'first': 10, 'second': 20})
+
+    def test_refresh_counts_other_version_of_dropped_track(self):
+        self.tracks['release4'] = ['second (remastered)']
+        self.word_counts['second (remastered)'] = 22
+        self.alc.mb_handler.get_release_ids.return_value = ['release1', 'release4']
+        self.alc.get_average_lyric_count('artist')
+        self.assertEqual(self.requested_tracks(), ['first', 'second'])
+
+        # The counted version was only on release1
+        self.alc.mb_handler.get_release_ids.return_value = ['release4']
+
+        self.assertEqual(self.alc.get_average_lyric_count('artist'), 22)
+        self.assertEqual(self.state_store.load('artist').word_counts, {'second (remastered)': 22})
+
+    def test_refresh_drops_duplicate_versions_of_old_states(self):
+        artist_state = ArtistState('artist')
+        artist_state.artist_mbid = 'artist-mbid'
+        artist_state.releases = {'release1': ['first', 'first (live at wembley)']}
+        artist_state.set_word_count('first', 10)
+        artist_state.set_word_count('first (live at wembley)', 30)
+        self.state_store.save(artist_state)
+        self.alc.mb_handler.get_release_ids.return_value = ['release1']
+
+        self.assertEqual(self.alc.get_average_lyric_count('artist'), 10)
+        self.alc.lo_handler.get_lyric_word_count.assert_not_called()
+
+    def test_failed_refresh_keeps_previous_state(self):
+        self.alc.mb_handler.get_release_ids.return_value = ['release1']
+        self.alc.get_average_lyric_count('artist')
+
+        self.alc.mb_handler.get_release_ids.return_value = ['release1', 'release2']
+        self.alc.mb_handler.iter_releases.side_effect = MissingData
+
+        with self.assertRaises(MissingData):
+            self.alc.get_average_lyric_count('artist')
+
+        self.assertEqual(list(self.state_store.load('artist').releases), ['release1'])
+
+    def test_failed_lookups_are_requested_again(self):
+        self.alc.mb_handler.get_release_ids.return_value = ['release1', 'release2']
+        self.word_counts['second'] = LyricsOvhHandlerError()
+
+        def get_lyric_word_count(artist, title):
+            if isinstance(self.word_counts[title], Exception):
+                raise self.word_counts[title]
+            return self.word_counts[title]
+
+        self.alc.lo_handler.get_lyric_word_count.side_effect = get_lyric_word_count
+
+        with self.assertRaises(IncompleteData) as context:
+            self.alc.get_average_lyric_count('artist')
+
+        self.assertEqual(context.exception.average_word_count, 10)
+        # The track that failed is not recorded as a track without lyrics
+        self.assertEqual(self.state_store.load('artist').word_counts, {'first': 10, 'third': None})
+
+        self.word_counts['second'] = 20
+        self.alc.lo_handler.get_lyric_word_count.reset_mock()
+
+        self.assertEqual(self.alc.get_average_lyric_count('artist'), 15)
+        self.assertEqual(self.requested_tracks(), ['second', 'third'])
+
+    def test_given_mbid_of_another_artist_starts_over(self):
+        self.alc.mb_handler.get_release_ids.return_value = ['release1']
+        self.alc.get_average_lyric_count('artist')
+
+        self.tracks['release3'] = ['fourth']
+        self.alc.mb_handler.get_release_ids.return_value = ['release3']
+        self.alc.mb_handler.pin_artist.side_effect = lambda artist_name, artist_mbid: Artist(artist_mbid, artist_name)
+
+        self.assertEqual(self.alc.get_average_lyric_count('artist', artist_mbid='other-mbid'), 40)
+        self.alc.mb_handler.get_release_ids.assert_called_with('artist', 'other-mbid', refresh=True)
+        artist_state = self.state_store.load('artist')
+        self.assertEqual((artist_state.artist_mbid, artist_state.word_counts), ('other-mbid', {'fourth': 40}))
+
+        # The same MBID again updates the state as usual
+        self.alc.mb_handler.pin_artist.reset_mock()
+        self.alc.get_average_lyric_count('artist', artist_mbid='other-mbid')
+        self.alc.mb_handler.pin_artist.assert_not_called()
+
+class TestResumableAvgLyricCounter(unittest.TestCase):
+    def setUp(self):
+        self.journal_dir = tempfile.TemporaryDirectory()
+        self.journal_store = JournalStore(self.journal_dir.name)
+
+        self.alc = AvgLyricCounter(max_workers=4, journal_store=self.journal_store)
+        self.alc.mb_handler = Mock()
+        self.alc.lo_handler = Mock()
+
+        self.tracks = {'release1': ['first', 'second'], 'release2': ['second', 'third']}
+        self.word_counts = {'first': 10, 'second': 20, 'third': 30}
+
+        self.alc.mb_handler.get_artist_mbid.return_value = 'artist-mbid'
+        self.alc.mb_handler.get_release_ids.return_value = ['release1', 'release2']
+        self.alc.lo_handler.get_lyric_word_count.side_effect = lambda artist, title: self.word_counts[title]
+
+    def tearDown(self):
+        self.alc.close()
+        self.journal_dir.cleanup()
+
+    def recorded_crawl(self):
+        with self.journal_store.open('artist') as journal:
+            return journal.crawl
+
+    def test_resumes_after_interruption(self):
+        def interrupted(artist_mbid, release_ids, exclusion_filters, skipped=None):
+            yield release('release1', self.tracks['release1'])
+            # Interrupt once the lyrics of the first release have been recorded
+            for i in range(500):
+                if len(self.recorded_crawl().word_counts) == 2:
+                    break
+                sleep(0.01)
+            raise KeyboardInterrupt
+
+        self.alc.mb_handler.iter_releases.side_effect = interrupted
+        with self.assertRaises(KeyboardInterrupt):
+            self.alc.get_average_lyric_count('artist')
+
+        self.alc.mb_handler.reset_mock()
+        self.alc.lo_handler.get_lyric_word_count.reset_mock()
+        self.alc.mb_handler.iter_releases.side_effect = lambda artist_mbid, release_ids, exclusion_filters, skipped=None: \
+            (release(release_id, self.tracks[release_id]) for release_id in release_ids)
+
+        self.assertEqual(self.alc.get_average_lyric_count('artist'), 20)
+
+        # Only the release and the lyrics that were not done before the interruption are requested
+        self.alc.mb_handler.get_artist_mbid.assert_not_called()
+        self.alc.mb_handler.get_release_ids.assert_not_called()
+        self.alc.mb_handler.iter_releases.assert_called_once_with('artist-mbid', ['release2'], self.alc.exclusion_filters, skipped=[])
+        self.alc.lo_handler.get_lyric_word_count.assert_called_once_with('artist', 'third')
+
+        # The journal of a completed artist is removed
+        self.assertEqual(self.recorded_crawl().artist_mbid, None)
+
+    def test_failed_lookups_are_not_journaled(self):
+        self.word_counts['third'] = LyricsOvhHandlerError()
+
+        def get_lyric_word_count(artist, title):
+            if isinstance(self.word_counts[title], Exception):
+                raise self.word_counts[title]
+            return self.word_counts[title]
+
+        self.alc.lo_handler.get_lyric_word_count.side_effect = get_lyric_word_count
+        self.alc.mb_handler.iter_releases.side_effect = lambda artist_mbid, release_ids, exclusion_filters, skipped=None: \
+            (release(release_id, self.tracks[release_id]) for release_id in release_ids)
+
+        with self.assertRaises(IncompleteData) as context:
+            self.alc.get_average_lyric_count('artist')
+
+        self.assertEqual(context.exception.to_dict(), {'partial_average_word_count': 15, 'failed_lyrics': 1, 'skipped_releases': 0})
+        self.assertEqual(self.recorded_crawl().word_counts, {'first': 10, 'second': 20})
+
+        # The journal is kept, so only the lyrics that failed are requested again
+        self.word_counts['third'] = 30
+        self.alc.lo_handler.get_lyric_word_count.reset_mock()
+
+        self.assertEqual(self.alc.get_average_lyric_count('artist'), 20)
+        self.alc.lo_handler.get_lyric_word_count.assert_called_once_with('artist', 'third')
+
+    def test_journal_of_another_artist_is_discarded(self):
+        with self.journal_store.open('artist') as journal:
+            journal.set_artist_mbid('artist-mbid')
+            journal.set_release_ids(['release1'])
+        self.alc.mb_handler.pin_artist.side_effect = lambda artist_name, artist_mbid: Artist(artist_mbid, artist_name)
+        self.alc.mb_handler.iter_releases.side_effect = lambda artist_mbid, release_ids, exclusion_filters, skipped=None: \
+            (release(release_id, self.tracks[release_id]) for release_id in release_ids)
+
+        self.assertEqual(self.alc.get_average_lyric_count('artist', artist_mbid='other-mbid'), 20)
+        self.alc.mb_handler.get_artist_mbid.assert_not_called()
+        self.alc.mb_handler.get_release_ids.assert_called_once_with('artist', 'other-mbid')
+        self.alc.mb_handler.iter_releases.assert_called_once_with('other-mbid', ['release1', 'release2'], self.alc.exclusion_filters, skipped=[])
+
+class TestAsyncAvgLyricCounter(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.alc = AsyncAvgLyricCounter(max_workers=2)
+        self.alc.mb_handler = AsyncMock()
+        self.alc.lo_handler = AsyncMock()
+
+    async def asyncTearDown(self):
+        self.alc.close()
+
+    async def test_get_average_lyric_count(self):
+        tracks = {'release1': ['first', 'second'], 'release2': ['second', 'third']}
+
+        async def iter_release_id_pages(artist_name, artist_mbid):
+            yield ['release1']
+            yield ['release2']
+
+        async def iter_releases_by_page(artist_mbid, release_id_pages, exclusion_filters, skipped=None):
+            async for release_ids in release_id_pages:
+                for release_id in release_ids:
+                    yield release(release_id, tracks[release_id])
+
+        word_counts = {'first': 10, 'second': 21, 'third': None}
+
+        self.alc.mb_handler.get_artist_mbid.return_value = 'artist'
+        self.alc.mb_handler.iter_release_id_pages = iter_release_id_pages
+        self.alc.mb_handler.iter_releases_by_page = iter_releases_by_page
+        self.alc.lo_handler.get_lyric_word_count.side_effect = lambda artist, title: word_counts[title]
+
+        actual = await self.alc.get_average_lyric_count('artist name')
+        self.assertEqual(actual, 16)
+        self.assertEqual(self.alc.lo_handler.get_lyric_word_count.await_count, 3)
+
+    async def test_get_average_lyric_count_artist_not_found(self):
+        self.alc.mb_handler.get_artist_mbid.return_value = ''
+
+        with self.assertRaises(MissingData):
+            await self.alc.get_average_lyric_count('artist name')
+
+    async def test_failed_lookups_are_reported(self):
+        async def iter_release_id_pages(artist_name, artist_mbid):
+            yield ['release1']
+
+        async def iter_releases_by_page(artist_mbid, release_id_pages, exclusion_filters, skipped=None):
+            async for release_ids in release_id_pages:
+                yield release('release1', ['first', 'second'])
+
+        def get_lyric_word_count(artist, title):
+            if title == 'second':
+                raise LyricsOvhHandlerError()
+            return 10
+
+        self.alc.mb_handler.get_artist_mbid.return_value = 'artist'
+        self.alc.mb_handler.iter_release_id_pages = iter_release_id_pages
+        self.alc.mb_handler.iter_releases_by_page = iter_releases_by_page
+        self.alc.lo_handler.get_lyric_word_count.side_effect = get_lyric_word_count
+
+        with self.assertRaises(IncompleteData) as context:
+            await self.alc.get_average_lyric_count('artist name')
+
+        self.assertEqual(context.exception.to_dict(), {'partial_average_word_count': 10, 'failed_lyrics': 1, 'skipped_releases': 0})
@@ -0,0 +1,96 @@
+import unittest
+from unittest.mock import patch
+import time
+
+from avglyriccounter.cache import ResponseCache, normalize_url
+
+class TestNormalizeUrl(unittest.TestCase):
+    def test_equivalent_urls_are_equal(self):
+        a = normalize_url("HTTPS://MusicBrainz.org/ws/2/release/abc?inc=recordings&fmt=json")
+        b = normalize_url("https://musicbrainz.org/ws/2/release/abc?fmt=json&inc=recordings")
+        self.assertEqual(a, b)
+
+    def test_encoding_is_consistent(self):
+        a = normalize_url("https://api.lyrics.ovh/v1/iron maiden/fear of the dark")
+        b = normalize_url("https://api.lyrics.ovh/v1/iron%20maiden/fear%20of%20the%20dark")
+        self.assertEqual(a, b)
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = ResponseCache(':memory:')
+        self.now = time.time()
+
+    def tearDown(self):
+        self.cache.close()
+
+    def test_get_miss(self):
+        self.assertEqual(self.cache.get("https://example.org/a"), None)
+        self.assertEqual(self.cache.stats()['misses'], 1)
+
+    def test_put_and_get(self):
+        self.cache.put("https://example.org/a?x=1&y=2", {'lyrics': 'la la'}, 'lyrics')
+
+        actual = self.cache.get("https://example.org/a?y=2&x=1")
+        self.assertEqual(actual, (200, {'lyrics': 'la la'}))
+        self.assertEqual(self.cache.stats()['hits'], 1)
+
+    def test_negative_entry(self):
+        self.cache.put("https://example.org/missing", None, 'lyrics', status=404)
+
+        actual = self.cache.get("https://example.org/missing")
+        self.assertEqual(actual, (404, None))
+
+    def test_expired_entry(self):
+        self.cache = ResponseCache(':memory:', ttls={'release': 10})
+
+        with patch('avglyriccounter.cache.time.time', return_value=self.now):
+            self.cache.put("https://example.org/release", {'media': []}, 'release')
+
+        with patch('avglyriccounter.cache.time.time', return_value=self.now + 5):
+            self.assertNotEqual(self.cache.get("https://example.org/release"), None)
+
+        with patch('avglyriccounter.cache.time.time', return_value=self.now + 11):
+            self.assertEqual(self.cache.get("https://example.org/release"), None)
+
+    def test_zero_ttl_is_not_stored(self):
+        self.cache = ResponseCache(':memory:', negative_ttl=0)
+        self.cache.put("https://example.org/missing", None, 'lyrics', status=404)
+
+        self.assertEqual(self.cache.stats()['entries'], 0)
+
+    def test_lru_eviction(self):
+        body = {'lyrics': 'x' * 100}
+        self.cache = ResponseCache(':memory:', max_size=250)
+
+        with patch('avglyriccounter.cache.time.time', return_value=self.now):
+            self.cache.put("https://example.org/1", body, 'lyrics')
+        with patch('avglyriccounter.cache.time.time', return_value=self.now + 1):
+            self.cache.put("https://example.org/2", body, 'lyrics')
+        # Use the first entry so that the second one is the least recently used
+        with patch('avglyriccounter.cache.time.time', return_value=self.now + 2):
+            self.cache.get("https://example.org/1")
+        with patch('avglyriccounter.cache.time.time', return_value=self.now + 3):
+            self.cache.put("https://example.org/3", body, 'lyrics')
+
+        self.assertNotEqual(self.cache.get("https://example.org/1"), None)
+        self.assertEqual(self.cache.get("https://example.org/2"), None)
+        self.assertNotEqual(self.cache.get("https://example.org/3"), None)
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+
+    def test_artist_resolution(self):
+        self.cache = ResponseCache(':memory:', ttls={'artist-resolution': 10})
+
+        with patch('avglyriccounter.cache.time.time', return_value=self.now):
+            self.cache.put_artist_resolution('nirvana', 'nirvana-us', 'Nirvana')
+            self.cache.put_artist_resolution('hallatar', 'artist1', 'Hallatar')
+
+        with patch('avglyriccounter.cache.time.time', return_value=self.now + 5):
+            self.assertEqual(self.cache.get_artist_resolution('nirvana'), ('nirvana-us', 'Nirvana'))
+            self.assertEqual(self.cache.get_artist_resolution('mayhem'), None)
+            self.cache.put_artist_resolution('nirvana', 'nirvana-uk', 'Nirvana', pinned=True)
+
+        with patch('avglyriccounter.cache.time.time', return_value=self.now + 11):
+            # A search doesn't replace a pinned resolution, which doesn't expire
+            self.cache.put_artist_resolution('nirvana', 'nirvana-us', 'Nirvana')
+            self.assertEqual(self.cache.get_artist_resolution('nirvana'), ('nirvana-uk', 'Nirvana'))
+            self.assertEqual(self.cache.get_artist_resolution('hallatar'), None)
@@ -0,0 +1,103 @@
+import unittest
+from unittest.mock import Mock
+from threading import Event, Thread
+from time import sleep
+import asyncio
+
+from avglyriccounter.coalesce import SingleFlight
+
+class TestSingleFlight(unittest.TestCase):
+    def setUp(self):
+        self.single_flight = SingleFlight()
+
+    def test_concurrent_calls_are_coalesced(self):
+        release = Event()
+        fn = Mock(side_effect=lambda: release.wait(timeout=5) and 'result')
+        results = []
+
+        threads = [Thread(target=lambda: results.append(self.single_flight.do('key', fn))) for i in range(3)]
+        for thread in threads:
+            thread.start()
+
+        # Let the first call finish only once the other two are waiting for it
+        while self.single_flight.coalesced < 2:
+            sleep(0.001)
+        release.set()
+
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, ['result', 'result', 'result'])
+        self.assertEqual(fn.call_count, 1)
+
+    def test_sequential_calls_are_not_coalesced(self):
+        fn = Mock(return_value='result')
+
+        self.single_flight.do('key', fn)
+        self.single_flight.do('key', fn)
+
+        self.assertEqual(fn.call_count, 2)
+
+    def test_exception_is_raised(self):
+        fn = Mock(side_effect=ValueError)
+
+        with self.assertRaises(ValueError):
+            self.single_flight.do('key', fn)
+
+        # The failed call is not remembered
+        self.assertEqual(self.single_flight.in_flight, {})
+
+class TestAsyncSingleFlight(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.single_flight = SingleFlight()
+
+    async def test_concurrent_calls_are_coalesced(self):
+        release = asyncio.Event()
+        calls = []
+
+        async def fn():
+            calls.append(1)
+            await release.wait()
+            return 'result'
+
+        tasks = [asyncio.ensure_future(self.single_flight.do_async('key', fn)) for i in range(3)]
+        while self.single_flight.coalesced < 2:
+            await asyncio.sleep(0.001)
+        release.set()
+
+        self.assertEqual(await asyncio.gather(*tasks), ['result', 'result', 'result'])
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(self.single_flight.in_flight, {})
+
+    async def test_exception_is_raised(self):
+        async def fn():
+            raise ValueError
+
+        with self.assertRaises(ValueError):
+            await self.single_flight.do_async('key', fn)
+
+        self.assertEqual(self.single_flight.in_flight, {})
+
+    async def test_cancelled_call_is_made_again(self):
+        started = asyncio.Event()
+        calls = []
+
+        async def fn():
+            calls.append(1)
+            started.set()
+            if len(calls) == 1:
+                await asyncio.sleep(10)
+            return 'result'
+
+        leader = asyncio.ensure_future(self.single_flight.do_async('key', fn))
+        await started.wait()
+        follower = asyncio.ensure_future(self.single_flight.do_async('key', fn))
+        while self.single_flight.coalesced < 1:
+            await asyncio.sleep(0.001)
+
+        # The waiting caller makes the call itself instead of being cancelled too
+        leader.cancel()
+
+        self.assertEqual(await follower, 'result')
+        self.assertEqual(len(calls), 2)
+        self.assertTrue(leader.cancelled())
@@ -0,0 +1,104 @@
+import unittest
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from avglyriccounter.avglyriccounter import AvgLyricCounter, AsyncAvgLyricCounter
+from avglyriccounter.musicbrainz import MusicBrainzClient
+from avglyriccounter.ratelimiter import RateLimiter
+from avglyriccounter.metrics import Registry
+from avglyriccounter.cache import ResponseCache
+from benchmark.stubserver import build_fixtures, start_stub_servers
+
+class TestEndToEnd(unittest.TestCase):
+    def setUp(self):
+        self.fixtures = build_fixtures(album_count=3, tracks_per_album=5)
+        self.servers = []
+
+    def tearDown(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+
+    def start_stubs(self, mb_options={}, lyrics_options={}):
+        self.servers = start_stub_servers(self.fixtures, mb_options, lyrics_options)
+        return self.servers
+
+    def test_average_from_stubs(self):
+        mb_server, lyrics_server = self.start_stubs()
+        mb_client = MusicBrainzClient(rate_limiter=RateLimiter(rate=1000), base_url=mb_server.base_url)
+
+        with AvgLyricCounter(max_workers=4, mb_client=mb_client, lyrics_base_url=lyrics_server.base_url) as alc:
+            self.assertEqual(alc.get_average_lyric_count(self.fixtures.artist_name), self.fixtures.expected_average())
+
+        # Artist search, release group search and one page of browsed releases
+        self.assertEqual(mb_server.stats(), {'requests': 3, 'responses': {'200': 3}})
+        self.assertEqual(lyrics_server.stats()['requests'], len(self.fixtures.word_counts))
+
+    def test_resolved_artist_is_not_searched_again(self):
+        mb_server, lyrics_server = self.start_stubs()
+        response_cache = ResponseCache(':memory:', ttls={'artist': 0, 'release-group': 0, 'release': 0, 'lyrics': 0})
+        mb_client = MusicBrainzClient(rate_limiter=RateLimiter(rate=1000), base_url=mb_server.base_url)
+        artist_mbid = next(body['artists'][0]['id'] for body in self.fixtures.musicbrainz.values() if 'artists' in body)
+
+        # Pinned to the MBID, so neither run searches for the artist
+        with AvgLyricCounter(max_workers=4, mb_client=mb_client, lyrics_base_url=lyrics_server.base_url, response_cache=response_cache) as alc:
+            self.assertEqual(alc.get_average_lyric_count(self.fixtures.artist_name, artist_mbid=artist_mbid), self.fixtures.expected_average())
+        with AvgLyricCounter(max_workers=4, mb_client=mb_client, lyrics_base_url=lyrics_server.base_url, response_cache=response_cache) as alc:
+            self.assertEqual(alc.get_average_lyric_count(self.fixtures.artist_name), self.fixtures.expected_average())
+        response_cache.close()
+
+        # Release group search and one page of browsed releases per run
+        self.assertEqual(mb_server.stats(), {'requests': 4, 'responses': {'200': 4}})
+
+    def test_concurrent_musicbrainz_requests_reuse_their_connections(self):
+        mb_server, lyrics_server = self.start_stubs(mb_options={'latency': 0.3})
+        urls = [mb_server.base_url + url for url in list(self.fixtures.musicbrainz)[:3]]
+
+        with AvgLyricCounter(max_workers=4, mb_base_url=mb_server.base_url, lyrics_base_url=lyrics_server.base_url, max_artists=3) as alc:
+            # Like the requests of three artists, each sent while the others' responses are slow to arrive.
+            # A pool of one connection discarded the connections of the overflowing requests.
+            with self.assertNoLogs('urllib3', level='WARNING'):
+                with ThreadPoolExecutor(max_workers=3) as executor:
+                    for i in range(2):
+                        statuses = list(executor.map(lambda url: alc.mb_session.get(url).status_code, urls))
+
+        self.assertEqual(statuses, [200] * 3)
+
+    def test_rate_limited_requests_are_retried(self):
+        mb_server, lyrics_server = self.start_stubs(mb_options={'rate_limit': 20, 'retry_after': 0.1})
+        registry = Registry()
+        mb_client = MusicBrainzClient(rate_limiter=RateLimiter(rate=1000), base_url=mb_server.base_url, registry=registry)
+
+        with AvgLyricCounter(max_workers=4, mb_client=mb_client, lyrics_base_url=lyrics_server.base_url, registry=registry) as alc:
+            self.assertEqual(alc.get_average_lyric_count(self.fixtures.artist_name), self.fixtures.expected_average())
+
+        self.assertGreater(mb_server.stats()['responses']['503'], 0)
+        self.assertEqual(registry.counter('musicbrainz_retries_total'), mb_server.stats()['responses']['503'])
+
+    def test_streamed_responses_from_stubs(self):
+        mb_server, lyrics_server = self.start_stubs(mb_options={'rate_limit': 20, 'retry_after': 0.1})
+        mb_client = MusicBrainzClient(rate_limiter=RateLimiter(rate=1000), base_url=mb_server.base_url, streaming=True)
+
+        with AvgLyricCounter(max_workers=4, mb_client=mb_client, lyrics_base_url=lyrics_server.base_url) as alc:
+            self.assertEqual(alc.get_average_lyric_count(self.fixtures.artist_name), self.fixtures.expected_average())
+
+        self.assertGreater(mb_server.stats()['responses']['503'], 0)
+
+    def test_async_average_from_stubs(self):
+        mb_server, lyrics_server = self.start_stubs()
+
+        async def get_average():
+            async with AsyncAvgLyricCounter(max_workers=4, mb_base_url=mb_server.base_url, lyrics_base_url=lyrics_server.base_url) as alc:
+                return await alc.get_average_lyric_count(self.fixtures.artist_name)
+
+        self.assertEqual(asyncio.run(get_average()), self.fixtures.expected_average())
+
+    def test_async_streamed_responses_from_stubs(self):
+        mb_server, lyrics_server = self.start_stubs()
+
+        async def get_average():
+            async with AsyncAvgLyricCounter(max_workers=4, mb_base_url=mb_server.base_url, lyrics_base_url=lyrics_server.base_url,
+                                            stream_responses=True) as alc:
+                return await alc.get_average_lyric_count(self.fixtures.artist_name)
+
+        self.assertEqual(asyncio.run(get_average()), self.fixtures.expected_average())
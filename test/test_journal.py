@@ -0,0 +1,66 @@
+import unittest
+import tempfile
+import os
+
+from avglyriccounter.journal import Journal, JournalStore
+
+class TestJournal(unittest.TestCase):
+    def setUp(self):
+        self.journal_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.journal_dir.name, 'artist.jsonl')
+
+    def tearDown(self):
+        self.journal_dir.cleanup()
+
+    def test_progress_is_replayed(self):
+        with Journal(self.path, 'artist') as journal:
+            journal.set_artist_mbid('artist-mbid')
+            journal.set_release_ids(['release1', 'release2'])
+            journal.add_release('release1', ['first', 'second'])
+            journal.set_word_count('first', 10)
+            journal.set_word_count('second', None)
+
+        with Journal(self.path, 'artist') as journal:
+            crawl = journal.crawl
+            self.assertEqual(crawl.artist_mbid, 'artist-mbid')
+            self.assertEqual(crawl.release_ids, ['release1', 'release2'])
+            self.assertEqual(crawl.releases, {'release1': ['first', 'second']})
+            self.assertEqual(crawl.word_counts, {'first': 10, 'second': None})
+            self.assertEqual(journal.record_count, 5)
+
+    def test_records_are_written_before_closing(self):
+        journal = Journal(self.path, 'artist', batch_size=1000, sync_interval=1000)
+        journal.set_artist_mbid('artist-mbid')
+
+        # A killed process doesn't close the journal, but the record has already been written
+        with Journal(self.path, 'artist') as reopened:
+            self.assertEqual(reopened.crawl.artist_mbid, 'artist-mbid')
+        journal.close()
+
+    def test_incomplete_record_is_truncated(self):
+        with Journal(self.path, 'artist') as journal:
+            journal.add_release('release1', ['first'])
+
+        with open(self.path, 'a') as f:
+            f.write('{"type": "release", "release_id": "rele')
+
+        with Journal(self.path, 'artist') as journal:
+            self.assertEqual(journal.crawl.releases, {'release1': ['first']})
+            journal.add_release('release2', ['second'])
+
+        with Journal(self.path, 'artist') as journal:
+            self.assertEqual(journal.crawl.releases, {'release1': ['first'], 'release2': ['second']})
+
+class TestJournalStore(unittest.TestCase):
+    def test_open_and_remove(self):
+        with tempfile.TemporaryDirectory() as journal_dir:
+            journal_store = JournalStore(journal_dir)
+            with journal_store.open('Iron  Maiden') as journal:
+                journal.set_artist_mbid('artist-mbid')
+
+            with journal_store.open('iron maiden') as journal:
+                self.assertEqual(journal.crawl.artist_mbid, 'artist-mbid')
+
+            journal_store.remove('iron maiden')
+            with journal_store.open('iron maiden') as journal:
+                self.assertEqual(journal.crawl.artist_mbid, None)
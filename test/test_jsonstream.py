@@ -0,0 +1,49 @@
+import unittest
+import json
+
+from avglyriccounter.jsonstream import load, loads
+from avglyriccounter.model import RELEASE_FIELDS, RELEASE_GROUP_SEARCH_FIELDS
+
+def chunked(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+class TestJsonStream(unittest.TestCase):
+    def setUp(self):
+        self.release = {
+            'id': 'release1', 'title': 'Köln [Live] "1975"', 'status': None, 'barcode': 12.5e3,
+            'media': [{'format': 'CD', 'tracks': [
+                {'title': 'Part I {a} [b]', 'length': 1560000, 'recording': {'id': 'recording1', 'artist-credit': [{'name': 'Keith ]}'}]}},
+                {'title': 'Part \\ II ♪', 'recording': None}]},
+                {'tracks': []}],
+            'tags': [1, [2, {}], True, False, None, "\\\"", "é"]
+        }
+        self.expected = {'id': 'release1', 'title': 'Köln [Live] "1975"', 'media': [
+            {'tracks': [{'title': 'Part I {a} [b]', 'recording': {'id': 'recording1'}}, {'title': 'Part \\ II ♪', 'recording': None}]},
+            {'tracks': []}]}
+
+    def test_keeps_only_the_given_fields(self):
+        self.assertEqual(loads(json.dumps(self.release).encode(), RELEASE_FIELDS), self.expected)
+
+    def test_any_chunk_size(self):
+        for ensure_ascii in [True, False]:
+            data = json.dumps(self.release, ensure_ascii=ensure_ascii, indent=1).encode()
+            for size in [1, 2, 3, 7, 64]:
+                self.assertEqual(load(chunked(data, size), RELEASE_FIELDS), self.expected)
+                self.assertEqual(load(chunked(data, size), True), self.release)
+
+    def test_release_group_search(self):
+        search_json = {'count': 2, 'offset': 0, 'release-groups': [
+            {'id': 'group1', 'score': 100, 'title': 'Album', 'first-release-date': '1992', 'artist-credit': [{'name': 'A', 'artist': {'id': 'artist1', 'name': 'A', 'type': 'Group'}}],
+             'releases': [{'id': 'release1', 'status': 'Official'}], 'tags': [{'count': 1, 'name': 'metal'}]}]}
+
+        actual = load(chunked(json.dumps(search_json).encode(), 5), RELEASE_GROUP_SEARCH_FIELDS)
+        self.assertEqual(actual, {'count': 2, 'release-groups': [
+            {'id': 'group1', 'title': 'Album', 'first-release-date': '1992', 'artist-credit': [{'artist': {'id': 'artist1', 'name': 'A'}}],
+             'releases': [{'id': 'release1'}]}]})
+
+    def test_invalid_json(self):
+        for data in [b'', b'{"id": "release1"', b'{"id" "release1"}', b'{"media": [{"tracks": [}]}', b'{"title": "unterminated}',
+                     b'{"media": [{"tracks": [{"title": tru}]}]}', b'{"id": "release1"} {}', b'{"id": "\xc3"}']:
+            for size in [1, 100]:
+                with self.assertRaises(ValueError, msg=data):
+                    load(chunked(data, size), RELEASE_FIELDS)
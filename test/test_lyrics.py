@@ -0,0 +1,38 @@
+import unittest
+
+from avglyriccounter.lyrics import count_words, is_instrumental
+
+class TestLyrics(unittest.TestCase):
+    def test_count_words_plain(self):
+        self.assertEqual(count_words("I am a man who walks alone\nAnd when I'm walking a dark road"), 14)
+        self.assertEqual(count_words(""), 0)
+
+    def test_count_words_strips_header(self):
+        self.assertEqual(count_words("Paroles de la chanson Fear Of The Dark par Iron Maiden\r\nI am a man who walks alone"), 7)
+
+        # The header is only stripped from the beginning of the lyrics
+        self.assertEqual(count_words("I am a man\nParoles de la chanson X par Y"), 11)
+
+    def test_count_words_skips_non_words(self):
+        self.assertEqual(count_words("Fear of the dark ... - fear of the dark!\n--\n*"), 8)
+        self.assertEqual(count_words("no-one's there, 666"), 3)
+
+    def test_count_words_skips_annotations(self):
+        self.assertEqual(count_words("[Chorus]\nFear of the dark\n<Guitar solo: Dave Murray>\n[Verse 2: Bruce]"), 4)
+
+    def test_count_words_repeat_markers(self):
+        # A marker at the end of a line repeats that line
+        self.assertEqual(count_words("Fear of the dark (2x)\nI have a phobia"), 12)
+        self.assertEqual(count_words("Fear of the dark x3\nI have a phobia [X2]"), 20)
+
+        # A marker on a line of its own repeats the previous line with words
+        self.assertEqual(count_words("Fear of the dark\n\n(3x)\nI have a phobia"), 16)
+
+        # Numbers and x's that are not markers are counted as words
+        self.assertEqual(count_words("2 x 4\nMalcolm X"), 5)
+
+    def test_instrumental(self):
+        self.assertTrue(is_instrumental("[Instrumental]"))
+        self.assertTrue(is_instrumental("Paroles de la chanson Transylvania par Iron Maiden\r\n (instrumental)\n"))
+        self.assertFalse(is_instrumental("Instrumental to my heart"))
+        self.assertEqual(count_words("[Instrumental]"), 0)
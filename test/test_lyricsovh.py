@@ -1,8 +1,101 @@
 import unittest
-from unittest.mock import Mock
+from unittest.mock import Mock, AsyncMock
+import tempfile
 
-from avglyriccounter.lyricsovh import LyricsOvhHandler
-from requests.exceptions import HTTPError
+from avglyriccounter.lyricsovh import LyricsOvhClient, LyricsOvhHandler, AsyncLyricsOvhClient, AsyncLyricsOvhHandler, LyricsOvhHandlerError
+from avglyriccounter.lyricstore import LyricStore, track_key
+from avglyriccounter.resilience import RetryPolicy, CircuitBreaker, CircuitOpenError
+from avglyriccounter.metrics import Registry
+from requests.exceptions import HTTPError, Timeout, TooManyRedirects
+import asyncio
+
+class TestLyricsOvhClient(unittest.TestCase):
+    def setUp(self):
+        self.mock_session = Mock()
+        self.breaker = CircuitBreaker(failure_threshold=3)
+        self.lo_client = LyricsOvhClient(session=self.mock_session, retry_policy=RetryPolicy(max_retries=2, backoff=0), circuit_breaker=self.breaker)
+
+    def test_transient_failures_are_retried(self):
+        ok = Mock(status_code=200)
+        ok.json.return_value = {'lyrics': "la la la"}
+        self.mock_session.get.side_effect = [Timeout(), Mock(status_code=502, headers={}), ok]
+
+        self.assertEqual(self.lo_client.get_lyrics("artist", "title"), {'lyrics': "la la la"})
+        self.assertEqual(self.mock_session.get.call_count, 3)
+        self.assertEqual(self.lo_client.registry.counter('lyricsovh_retries_total'), 2)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_not_found_is_not_retried(self):
+        not_found = Mock(status_code=404)
+        not_found.raise_for_status.side_effect = HTTPError
+        self.mock_session.get.return_value = not_found
+
+        with self.assertRaises(HTTPError):
+            self.lo_client.get_lyrics("artist", "title")
+        self.assertEqual(self.mock_session.get.call_count, 1)
+
+    def test_circuit_opens_after_failures(self):
+        self.mock_session.get.side_effect = Timeout
+
+        # Three failed attempts of the first request open the circuit
+        with self.assertRaises(Timeout):
+            self.lo_client.get_lyrics("artist", "first")
+        with self.assertRaises(CircuitOpenError):
+            self.lo_client.get_lyrics("artist", "second")
+        self.assertEqual(self.mock_session.get.call_count, 3)
+
+    def test_unexpected_trial_errors_release_the_trial(self):
+        self.now = 0.0
+        self.lo_client.circuit_breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10.0, clock=lambda: self.now)
+        self.lo_client.circuit_breaker.record_failure()
+        ok = Mock(status_code=200)
+        ok.json.return_value = {'lyrics': "la la la"}
+
+        # A request error that is not retried opens the circuit again
+        self.now = 10.0
+        self.mock_session.get.side_effect = TooManyRedirects
+        with self.assertRaises(TooManyRedirects):
+            self.lo_client.get_lyrics("artist", "first")
+        self.assertEqual(self.lo_client.circuit_breaker.state, CircuitBreaker.OPEN)
+
+        # Any other error lets the next trial through
+        self.now = 20.0
+        self.mock_session.get.side_effect = RuntimeError
+        with self.assertRaises(RuntimeError):
+            self.lo_client.get_lyrics("artist", "second")
+        self.mock_session.get.side_effect = [ok]
+        self.assertEqual(self.lo_client.get_lyrics("artist", "third"), {'lyrics': "la la la"})
+        self.assertEqual(self.lo_client.circuit_breaker.state, CircuitBreaker.CLOSED)
+
+    def test_lyric_store(self):
+        ok = Mock(status_code=200)
+        ok.json.return_value = {'lyrics': "la la la"}
+        self.mock_session.get.return_value = ok
+
+        with tempfile.TemporaryDirectory() as store_dir:
+            with LyricStore(store_dir) as store:
+                self.lo_client.store = store
+
+                self.assertEqual(self.lo_client.get_lyrics("Some Artist", "Title"), {'lyrics': "la la la"})
+                self.assertEqual(store.get(track_key("some artist", "title")), "la la la")
+
+                # Served from the store without a request
+                self.assertEqual(self.lo_client.get_lyrics("some artist", "title"), {'lyrics': "la la la"})
+                self.assertEqual(self.mock_session.get.call_count, 1)
+                self.assertEqual(self.lo_client.registry.counter('lyric_store_lookups_total', result='hit'), 1)
+
+    def test_lyric_store_key_of_names_with_slashes(self):
+        ok = Mock(status_code=200)
+        ok.json.return_value = {'lyrics': "rock"}
+        self.mock_session.get.return_value = ok
+
+        with tempfile.TemporaryDirectory() as store_dir:
+            with LyricStore(store_dir) as store:
+                self.lo_client.store = store
+
+                self.lo_client.get_lyrics("AC/DC", "100% Rock")
+                self.assertEqual(store.get(track_key("ac/dc", "100% rock")), "rock")
+                self.assertEqual(store.get(track_key("ac", "dc/100% rock")), None)
 
 class TestLyricsOvhHandler(unittest.TestCase):
     def setUp(self):
@@ -13,9 +106,16 @@ class TestLyricsOvhHandler(unittest.TestCase):
         # json response value from https://api.lyrics.ovh/v1/iron%20maiden/fear%20of%20the%20dark
         self.mock_client.get_lyrics.return_value = {'lyrics': "Paroles de la chanson Fear Of The Dark par Iron Maiden\r\nI am a man who walks alone\nAnd when I'm walking a dark road\nAt night or strolling through the park\n\nWhen the light begins to change\nI sometimes feel a little strange\nA little anxious when it's dark\n\nFear of the dark, fear of the dark\nI have a constant fear that something's always near\nFear of the dark, fear of the dark\nI have a phobia that someone's always there\n\nHave you run your fingers down the wall\nAnd have you felt your neck skin crawl\n\nWhen you're searching for the light?\n\nSometimes when you're scared to take a look\nAt the corner of the room\nYou've sensed that something's watching you\n\nFear of the dark, fear of the dark\nI have constant fear that something's always near\nFear of the dark, fear of the dark\nI have a phobia that someone's always there\n\nHave you ever been alone at night\nThought you heard footsteps behind\nAnd turned around and no-one's there?\n\nAnd as you quicken up your pace\nYou find it hard to look again\nBecause you're sure there's someone there\n\n\nFear of the dark, fear of the dark\nI have constant fear that something's always near\nFear of the dark, fear of the dark\nI have a phobia that someone's always there\n\nFear of the dark\nFear of the dark\nFear of the dark\nFear of the dark\nFear of the dark\nFear of the dark\nFear of the dark\nFear of the dark\n\nWatching horror films the night before\nDebating witches and folklore\nThe unknown troubles on your mind\n\n\nMaybe your mind is playing tricks\nYou sense, and suddenly eyes fix\nOn dancing shadows from behind\n\nFear of the dark, fear of the dark\nI have constant fear that something's always near\nFear of the dark, fear of the dark\nI have a phobia that someone's always there\nFear of the dark, fear of the dark\nI have constant fear that something's always near\nFear of the dark, fear of the dark\nI have a phobia that someone's always there\n\nWhen I'm walking a dark road\nI am a man who walks alone"}
 
-        # In a success case, the returned value is the actual word count
+        # In a success case, the returned value is the actual word count, without the 11 words of the "Paroles de la chanson" header
         actual = self.lo_handler.get_lyric_word_count("iron maiden", "fear of the dark")
-        self.assertEqual(actual, 369)
+        self.assertEqual(actual, 358)
+
+    def test_get_lyric_word_count_instrumental(self):
+        self.mock_client.get_lyrics.return_value = {'lyrics': "Paroles de la chanson Transylvania par Iron Maiden\r\n[Instrumental]"}
+
+        # Instrumentals are left out of the average like songs without lyrics
+        actual = self.lo_handler.get_lyric_word_count("iron maiden", "transylvania")
+        self.assertEqual(actual, None)
 
     def test_get_lyric_word_count_http_error(self):
         self.mock_client.get_lyrics.side_effect = HTTPError
@@ -27,9 +127,33 @@ class TestLyricsOvhHandler(unittest.TestCase):
     def test_get_lyric_word_count_value_error(self):
         self.mock_client.get_lyrics.side_effect = ValueError
         
-        # In a failure case where the LyricsOvh server would return an invalid JSON response, expect None
-        actual = self.lo_handler.get_lyric_word_count("pink floyd", "time")
-        self.assertEqual(actual, None)
+        # An invalid JSON response is a failure, not a song without lyrics
+        with self.assertRaises(LyricsOvhHandlerError):
+            self.lo_handler.get_lyric_word_count("pink floyd", "time")
+
+    def test_get_lyric_word_count_timeout(self):
+        self.mock_client.get_lyrics.side_effect = Timeout
+
+        # A request that times out is not treated as a song without lyrics
+        with self.assertRaises(LyricsOvhHandlerError):
+            self.lo_handler.get_lyric_word_count("pink floyd", "time")
+
+    def test_get_lyric_word_count_server_error(self):
+        self.lo_handler.registry = Registry()
+        self.mock_client.get_lyrics.side_effect = HTTPError(response=Mock(status_code=500))
+
+        # A server error that persisted through the retries is not counted as a song without lyrics
+        with self.assertRaises(LyricsOvhHandlerError):
+            self.lo_handler.get_lyric_word_count("pink floyd", "time")
+        self.assertEqual(self.lo_handler.registry.counter('lyrics_total', result='failed'), 1)
+        self.assertEqual(self.lo_handler.registry.counter('lyrics_total', result='not_found'), 0)
+
+    def test_get_lyric_word_count_circuit_open(self):
+        self.mock_client.get_lyrics.side_effect = CircuitOpenError
+
+        with self.assertRaises(LyricsOvhHandlerError):
+            self.lo_handler.get_lyric_word_count("pink floyd", "time")
+        self.assertEqual(self.lo_handler.registry.counter('lyrics_total', result='circuit_open'), 1)
 
     def test_get_lyric_word_count_invalid_input_type(self):
         # Test a couple of invalid input types
@@ -42,3 +166,41 @@ class TestLyricsOvhHandler(unittest.TestCase):
         with self.assertRaises(TypeError):
             self.lo_handler.get_lyric_word_count(1, 2)
 
+
+class TestAsyncLyricsOvh(unittest.IsolatedAsyncioTestCase):
+    async def test_get_lyric_word_count_success(self):
+        mock_session = Mock()
+        mock_session.get.return_value.json.return_value = {'lyrics': "I am a man who walks alone"}
+        lo_handler = AsyncLyricsOvhHandler(AsyncLyricsOvhClient(session=mock_session))
+
+        actual = await lo_handler.get_lyric_word_count("iron maiden", "fear of the dark")
+        self.assertEqual(actual, 7)
+        mock_session.get.assert_called_once_with("https://api.lyrics.ovh/v1/iron maiden/fear of the dark", timeout=10)
+
+    async def test_cancelled_trial_is_released(self):
+        now = [0.0]
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10.0, clock=lambda: now[0])
+        breaker.record_failure()
+        now[0] = 10.0
+
+        mock_session = Mock()
+        lo_client = AsyncLyricsOvhClient(session=mock_session, circuit_breaker=breaker)
+        lo_client.executor = Mock()
+        lo_client.executor.submit.side_effect = lambda fn, *args: asyncio.get_running_loop().create_future()
+
+        # The trial request hangs until its task is cancelled
+        task = asyncio.ensure_future(lo_client.get_lyrics("artist", "first"))
+        await asyncio.sleep(0)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+
+        self.assertTrue(breaker.allow())
+
+    async def test_get_lyric_word_count_http_error(self):
+        mock_client = AsyncMock()
+        mock_client.get_lyrics.side_effect = HTTPError
+        lo_handler = AsyncLyricsOvhHandler(mock_client)
+
+        actual = await lo_handler.get_lyric_word_count("nonexistant imaginary artist", "hcvhjhjsdfhsklajfdc")
+        self.assertEqual(actual, None)
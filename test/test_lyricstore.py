@@ -0,0 +1,88 @@
+import unittest
+import tempfile
+import os
+
+from avglyriccounter.lyricstore import LyricStore, track_key, split_track_key, INDEX_RECORD
+
+class TestLyricStore(unittest.TestCase):
+    def setUp(self):
+        self.store_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.store_dir.cleanup()
+
+    def open_store(self, **kwargs):
+        return LyricStore(self.store_dir.name, **kwargs)
+
+    def test_track_key(self):
+        self.assertEqual(track_key("Iron  Maiden", "Fear Of The Dark "), "iron maiden\tfear of the dark")
+        self.assertEqual(split_track_key(track_key("AC/DC", "Back\tin Black")), ("ac/dc", "back in black"))
+        # Keys stored before the separator was a tab
+        self.assertEqual(split_track_key("iron maiden/fear of the dark"), ("iron maiden", "fear of the dark"))
+
+    def test_put_and_get(self):
+        with self.open_store() as store:
+            store.put("artist/first", "la la la")
+            store.put("artist/second", "ääkköset ♪")
+
+            self.assertEqual(store.get("artist/first"), "la la la")
+            self.assertEqual(store.get("artist/second"), "ääkköset ♪")
+            self.assertEqual(store.get("artist/third"), None)
+            self.assertIn("artist/first", store)
+            self.assertEqual(len(store), 2)
+
+    def test_persists_across_opens(self):
+        with self.open_store(block_size=64) as store:
+            for i in range(50):
+                store.put("artist/track" + str(i), "lyrics of track " + str(i) + " " * i)
+
+        with self.open_store() as store:
+            self.assertEqual(len(store), 50)
+            self.assertEqual(store.get("artist/track42"), "lyrics of track 42" + " " * 42)
+
+    def test_same_lyrics_are_stored_once(self):
+        with self.open_store() as store:
+            store.put("artist/song", "the same words " * 100)
+            store.put("artist/song (remastered)", "the same words " * 100)
+            store.flush()
+
+            stats = store.stats()
+            self.assertEqual((stats['tracks'], stats['texts'], stats['text_bytes']), (2, 1, 1500))
+            # Compressed
+            self.assertLess(stats['stored_bytes'], 100)
+
+    def test_put_replaces_lyrics(self):
+        with self.open_store() as store:
+            store.put("artist/song", "old")
+            store.put("artist/song", "new")
+
+        with self.open_store() as store:
+            self.assertEqual(store.get("artist/song"), "new")
+
+    def test_iter_lyrics(self):
+        lyrics = {"artist/track" + str(i): "words " * (i % 7) + str(i) for i in range(200)}
+
+        with self.open_store(block_size=256) as store:
+            for key, text in lyrics.items():
+                store.put(key, text)
+
+            self.assertEqual(dict(store.iter_lyrics()), lyrics)
+            self.assertGreater(store.stats()['stored_bytes'], 256)
+
+    def test_ignores_records_torn_by_a_crash(self):
+        with self.open_store() as store:
+            store.put("artist/first", "la la la")
+
+        with open(os.path.join(self.store_dir.name, 'index.dat'), 'ab') as f:
+            f.write(b"\0" * (INDEX_RECORD.size // 2))
+        with open(os.path.join(self.store_dir.name, 'tracks.jsonl'), 'a') as f:
+            # A track whose block was never written, and a torn line
+            f.write('["artist/lost", "' + "00" * 16 + '"]\n["artist/se')
+
+        with self.open_store() as store:
+            self.assertEqual(len(store), 1)
+            self.assertEqual(store.get("artist/first"), "la la la")
+            store.put("artist/second", "la")
+
+        with self.open_store() as store:
+            self.assertEqual(dict(store.iter_lyrics()), {"artist/first": "la la la", "artist/second": "la"})
@@ -0,0 +1,64 @@
+import unittest
+import tempfile
+import os
+
+from avglyriccounter.mbindex import build_index, LocalMusicBrainzClient
+from avglyriccounter.musicbrainz import MusicBrainzHandler, MusicBrainzHandlerError
+from requests.exceptions import HTTPError
+
+FIXTURE_DUMP = os.path.join(os.path.dirname(__file__), 'fixtures', 'mbdump')
+
+HALLATAR_MBID = '7f0d27cb-d636-40c3-a92d-cd44e880658e'
+
+class TestLocalMusicBrainzClient(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        cls.index_path = os.path.join(cls.tmp_dir.name, 'index.sqlite3')
+        build_index(FIXTURE_DUMP, cls.index_path)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp_dir.cleanup()
+
+    def setUp(self):
+        self.mb_client = LocalMusicBrainzClient(self.index_path)
+        self.mb_handler = MusicBrainzHandler(self.mb_client)
+
+    def tearDown(self):
+        self.mb_client.close()
+
+    def test_search_artist(self):
+        actual = self.mb_client.search_artist('  HALLATAR ')
+        self.assertEqual([artist['id'] for artist in actual['artists']], [HALLATAR_MBID])
+
+        actual = self.mb_client.search_artist('qwertyuip')
+        self.assertEqual(actual['artists'], [])
+
+    def test_get_release_with_recordings_not_found(self):
+        with self.assertRaises(HTTPError):
+            self.mb_client.get_release_with_recordings('0faafa6d-c03e-4aa7-ac5e-094474c344d0')
+
+    def test_handler_get_artist_mbid(self):
+        self.assertEqual(self.mb_handler.get_artist_mbid('hallatar'), HALLATAR_MBID)
+
+    def test_handler_get_release_ids(self):
+        # The live album is excluded, the single is not an album and the earliest release of the album is picked
+        actual = self.mb_handler.get_release_ids('hallatar', HALLATAR_MBID)
+        self.assertEqual(actual, ['37179bef-eaa3-4f70-bc06-ff08c956d354'])
+
+    def test_handler_get_tracks(self):
+        actual = self.mb_handler.get_tracks('37179bef-eaa3-4f70-bc06-ff08c956d354', [])
+        self.assertEqual(actual, ['mirrors', 'melt', 'severed eyes', 'my mind is a mountain'])
+
+    def test_handler_get_tracks_pruned_release(self):
+        # Only the first release of each release group is kept in the index
+        with self.assertRaises(MusicBrainzHandlerError):
+            self.mb_handler.get_tracks('9568867f-2994-4ffe-a7c8-834b8eaa3432', [])
+
+    def test_handler_iter_tracks_for_releases(self):
+        release_ids = ['37179bef-eaa3-4f70-bc06-ff08c956d354', 'e4c8d3a7-4c76-4f6b-a06d-b05e3c9dae44']
+
+        actual = dict(self.mb_handler.iter_tracks_for_releases(HALLATAR_MBID, release_ids, ['(live)']))
+        self.assertEqual(actual, {'37179bef-eaa3-4f70-bc06-ff08c956d354': ['mirrors', 'melt', 'severed eyes', 'my mind is a mountain'],
+                                  'e4c8d3a7-4c76-4f6b-a06d-b05e3c9dae44': []})
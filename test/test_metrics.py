@@ -0,0 +1,91 @@
+import unittest
+import asyncio
+
+from avglyriccounter.metrics import Registry, timed
+
+class Timed():
+    def __init__(self, registry):
+        self.registry = registry
+
+    @timed('sync_seconds', kind='sync')
+    def sync_method(self, fail=False):
+        if fail:
+            raise ValueError
+        return 'sync'
+
+    @timed('async_seconds')
+    def async_method(self):
+        async def inner():
+            await asyncio.sleep(0)
+            return 'async'
+        return inner()
+
+class TestRegistry(unittest.TestCase):
+    def setUp(self):
+        self.registry = Registry(buckets=(0.1, 1))
+
+    def test_counters(self):
+        self.registry.inc('responses_total', status='200')
+        self.registry.inc('responses_total', amount=2, status='200')
+        self.registry.inc('responses_total', status='503')
+
+        self.assertEqual(self.registry.counter('responses_total', status='200'), 3)
+        self.assertEqual(self.registry.counter('responses_total', status='503'), 1)
+        self.assertEqual(self.registry.counter('responses_total', status='404'), 0)
+
+    def test_histogram_buckets(self):
+        for value in (0.05, 0.5, 0.5, 2):
+            self.registry.observe('request_seconds', value)
+
+        histogram = self.registry.histogram('request_seconds')
+        self.assertEqual(histogram.count, 4)
+        self.assertEqual(histogram.sum, 3.05)
+        self.assertEqual(histogram.min, 0.05)
+        self.assertEqual(histogram.max, 2)
+        self.assertEqual(histogram.cumulative_counts(), [(0.1, 1), (1, 3), ('+Inf', 4)])
+        self.assertEqual(self.registry.histogram('unknown_seconds'), None)
+
+    def test_timer_observes_when_raising(self):
+        with self.assertRaises(ValueError):
+            with self.registry.timer('phase_seconds', phase='search'):
+                raise ValueError
+
+        self.assertEqual(self.registry.histogram('phase_seconds', phase='search').count, 1)
+
+    def test_timed_method(self):
+        obj = Timed(self.registry)
+        self.assertEqual(obj.sync_method(), 'sync')
+        with self.assertRaises(ValueError):
+            obj.sync_method(fail=True)
+
+        self.assertEqual(self.registry.histogram('sync_seconds', kind='sync').count, 2)
+
+    def test_timed_coroutine(self):
+        obj = Timed(self.registry)
+        self.assertEqual(asyncio.run(obj.async_method()), 'async')
+        self.assertEqual(self.registry.histogram('async_seconds').count, 1)
+
+    def test_report(self):
+        self.registry.inc('responses_total', status='200')
+        self.registry.observe('request_seconds', 0.5)
+
+        report = self.registry.report()
+        self.assertEqual(report['counters'], [{'name': 'responses_total', 'labels': {'status': '200'}, 'value': 1}])
+        self.assertEqual(report['histograms'][0]['name'], 'request_seconds')
+        self.assertEqual(report['histograms'][0]['mean'], 0.5)
+        self.assertEqual(report['histograms'][0]['buckets'], [[0.1, 0], [1, 1], ['+Inf', 1]])
+
+    def test_prometheus_format(self):
+        self.registry.inc('responses_total', status='200')
+        self.registry.observe('request_seconds', 0.5, api='lyricsovh')
+
+        self.assertEqual(self.registry.to_prometheus().splitlines(), [
+            '# TYPE avglyriccounter_responses_total counter',
+            'avglyriccounter_responses_total{status="200"} 1',
+            '# TYPE avglyriccounter_request_seconds histogram',
+            'avglyriccounter_request_seconds_bucket{api="lyricsovh",le="0.1"} 0',
+            'avglyriccounter_request_seconds_bucket{api="lyricsovh",le="1"} 1',
+            'avglyriccounter_request_seconds_bucket{api="lyricsovh",le="+Inf"} 1',
+            'avglyriccounter_request_seconds_sum{api="lyricsovh"} 0.5',
+            'avglyriccounter_request_seconds_count{api="lyricsovh"} 1'
+        ])
@@ -0,0 +1,34 @@
+import unittest
+import dataclasses
+
+from avglyriccounter.model import Artist, Release, Track, ReleaseGroup, parse_release, parse_release_group
+
+class TestModel(unittest.TestCase):
+    def test_parse_release(self):
+        release_json = {'id': 'release1', 'title': 'Album', 'media': [
+            {'tracks': [{'title': 'First', 'recording': {'id': 'recording1'}}, {'title': 'Interlude (Instrumental)', 'recording': {'id': 'recording2'}}]},
+            {'tracks': [{'title': 'Second'}]}]}
+
+        release, excluded_track_count = parse_release(release_json, ['(instrumental)'])
+
+        self.assertEqual(release, Release('release1', 'Album', (Track('first', 'recording1'), Track('second', None))))
+        self.assertEqual(release.track_titles(), ['first', 'second'])
+        self.assertEqual(excluded_track_count, 1)
+
+    def test_titles_are_interned(self):
+        first, excluded = parse_release({'id': 'release1', 'media': [{'tracks': [{'title': 'A ' + 'Song'}]}]}, [])
+        second, excluded = parse_release({'id': 'release2', 'media': [{'tracks': [{'title': 'a ' + 'song'}]}]}, [])
+
+        self.assertIs(first.tracks[0].title, second.tracks[0].title)
+
+    def test_parse_release_group(self):
+        release_group = parse_release_group({'id': 'group1', 'title': 'Album', 'releases': [{'id': 'release1'}, {'id': 'release2'}]})
+        self.assertEqual(release_group, ReleaseGroup('group1', 'album', 'release1'))
+
+    def test_records_are_slotted_and_frozen(self):
+        artist = Artist('artist1', 'Artist')
+
+        self.assertFalse(hasattr(artist, '__dict__'))
+        with self.assertRaises(dataclasses.FrozenInstanceError):
+            artist.name = 'Other'
+        self.assertEqual(len({Track('first', None), Track('first', None)}), 1)
@@ -1,8 +1,112 @@
 import unittest
-from unittest.mock import Mock
-
-from avglyriccounter.musicbrainz import MusicBrainzHandler, MusicBrainzHandlerError
-from requests.exceptions import HTTPError
+import json
+import asyncio
+from unittest.mock import Mock, AsyncMock
+
+from avglyriccounter.musicbrainz import MusicBrainzClient, MusicBrainzHandler, MusicBrainzHandlerError, AsyncMusicBrainzClient, AsyncMusicBrainzHandler
+from avglyriccounter.ratelimiter import RateLimiter
+from avglyriccounter.metrics import Registry
+from avglyriccounter.cache import ResponseCache
+from avglyriccounter.model import Artist, Release, Track
+from requests.exceptions import HTTPError, Timeout
+
+class TestMusicBrainzClient(unittest.TestCase):
+    def setUp(self):
+        self.mock_session = Mock()
+        self.registry = Registry()
+        self.mb_client = MusicBrainzClient(rate_limiter=RateLimiter(rate=1000), session=self.mock_session, registry=self.registry)
+
+    def test_retry_after_service_unavailable(self):
+        mock_get = self.mock_session.get
+        unavailable = Mock(status_code=503, headers={'Retry-After': '0'})
+        ok = Mock(status_code=200, headers={})
+        ok.json.return_value = {'artists': []}
+        mock_get.side_effect = [unavailable, ok]
+
+        actual = self.mb_client.search_artist('hallatar')
+        self.assertEqual(actual, {'artists': []})
+        self.assertEqual(mock_get.call_count, 2)
+        self.assertEqual(self.registry.counter('musicbrainz_retries_total'), 1)
+        self.assertEqual(self.registry.counter('musicbrainz_responses_total', status='503'), 1)
+        self.assertEqual(self.registry.histogram('musicbrainz_request_seconds').count, 2)
+
+    def test_timeouts_and_server_errors_are_retried(self):
+        mock_get = self.mock_session.get
+        ok = Mock(status_code=200, headers={})
+        ok.json.return_value = {'artists': []}
+        mock_get.side_effect = [Timeout(), Mock(status_code=500, headers={'Retry-After': '0'}), ok]
+
+        actual = self.mb_client.search_artist('hallatar')
+        self.assertEqual(actual, {'artists': []})
+        self.assertEqual(mock_get.call_count, 3)
+        self.assertEqual(self.registry.counter('musicbrainz_retries_total'), 2)
+
+    def test_client_errors_are_not_retried(self):
+        mock_get = self.mock_session.get
+        bad_request = Mock(status_code=400, headers={})
+        bad_request.raise_for_status.side_effect = HTTPError
+        mock_get.return_value = bad_request
+
+        with self.assertRaises(HTTPError):
+            self.mb_client.search_artist('hallatar')
+        self.assertEqual(mock_get.call_count, 1)
+
+    def test_retries_exhausted(self):
+        mock_get = self.mock_session.get
+        unavailable = Mock(status_code=503, headers={'Retry-After': '0'})
+        unavailable.raise_for_status.side_effect = HTTPError
+        mock_get.return_value = unavailable
+
+        with self.assertRaises(HTTPError):
+            self.mb_client.search_artist('hallatar')
+        self.assertEqual(mock_get.call_count, 4)
+
+    def test_streaming_keeps_only_the_used_fields(self):
+        mock_cache = Mock()
+        mock_cache.get.return_value = None
+        mb_client = MusicBrainzClient(rate_limiter=RateLimiter(rate=1000), session=self.mock_session, registry=self.registry, cache=mock_cache, streaming=True)
+        body = json.dumps({'id': 'release1', 'title': 'Deathcrush', 'status': 'Official', 'media': [
+            {'format': 'CD', 'tracks': [{'title': 'Silent Night', 'length': 1000, 'recording': {'id': 'recording1', 'length': 1000}}]}]}).encode()
+        ok = Mock(status_code=200, headers={})
+        ok.iter_content.return_value = [body[i:i + 10] for i in range(0, len(body), 10)]
+        self.mock_session.get.return_value = ok
+
+        expected = {'id': 'release1', 'title': 'Deathcrush', 'media': [{'tracks': [{'title': 'Silent Night', 'recording': {'id': 'recording1'}}]}]}
+        actual = mb_client.get_release_with_recordings('release1')
+        self.assertEqual(actual, expected)
+        self.assertEqual(self.mock_session.get.call_args.kwargs['stream'], True)
+        ok.json.assert_not_called()
+        ok.close.assert_called_once()
+        mock_cache.put.assert_called_once_with(self.mock_session.get.call_args.args[0], expected, "release")
+
+    def test_streaming_closes_retried_responses(self):
+        mb_client = MusicBrainzClient(rate_limiter=RateLimiter(rate=1000), session=self.mock_session, registry=self.registry, streaming=True)
+        unavailable = Mock(status_code=503, headers={'Retry-After': '0'})
+        ok = Mock(status_code=200, headers={})
+        ok.iter_content.return_value = [b'{"count": 0, "release-groups": []}']
+        self.mock_session.get.side_effect = [unavailable, ok]
+
+        self.assertEqual(mb_client.search_artist_release_groups('mayhem'), {'count': 0, 'release-groups': []})
+        unavailable.close.assert_called_once()
+
+    def test_streaming_invalid_json(self):
+        mb_client = MusicBrainzClient(rate_limiter=RateLimiter(rate=1000), session=self.mock_session, registry=self.registry, streaming=True)
+        ok = Mock(status_code=200, headers={})
+        ok.iter_content.return_value = [b'{"id": "release1", "media": [']
+        self.mock_session.get.return_value = ok
+
+        with self.assertRaises(ValueError):
+            mb_client.get_release_with_recordings('release1')
+        ok.close.assert_called_once()
+
+    def test_artist_search_is_not_streamed(self):
+        mb_client = MusicBrainzClient(rate_limiter=RateLimiter(rate=1000), session=self.mock_session, registry=self.registry, streaming=True)
+        ok = Mock(status_code=200, headers={})
+        ok.json.return_value = {'artists': []}
+        self.mock_session.get.return_value = ok
+
+        self.assertEqual(mb_client.search_artist('hallatar'), {'artists': []})
+        self.assertEqual(self.mock_session.get.call_args.kwargs['stream'], False)
 
 class TestMusicBrainzHandler(unittest.TestCase):
     def setUp(self):
@@ -20,6 +124,13 @@ class TestMusicBrainzHandler(unittest.TestCase):
         actual = self.mb_handler.get_artist_mbid('hallatar')
         self.assertEqual(actual, '7f0d27cb-d636-40c3-a92d-cd44e880658e')
 
+    def test_find_artist(self):
+        self.mock_client.search_artist.return_value = {'count': 1, 'offset': 0, 'artists': [{'id': 'artist1', 'name': 'Hallatar', 'score': 100, 'tags': []}]}
+        self.assertEqual(self.mb_handler.find_artist('hallatar'), Artist('artist1', 'Hallatar'))
+
+        self.mock_client.search_artist.return_value = {'count': 0, 'offset': 0, 'artists': []}
+        self.assertEqual(self.mb_handler.find_artist('hallatar'), None)
+
     def test_get_artist_mbid_not_found(self):
         # json response value from https://musicbrainz.org/ws/2/artist/query=artist:qwertyuip
         self.mock_client.search_artist.return_value = {'created': '2022-02-19T16:07:13.447Z', 'count': 0, 'offset': 0, 'artists': []}
@@ -51,6 +162,54 @@ class TestMusicBrainzHandler(unittest.TestCase):
         with self.assertRaises(TypeError):
             self.mb_handler.get_artist_mbid(1)
 
+    def test_find_artist_ranks_all_candidates(self):
+        self.mock_client.search_artist.return_value = {'count': 3, 'offset': 0, 'artists': [
+            {'id': 'alias', 'name': 'Someone', 'score': 100, 'aliases': [{'name': 'Queen'}]},
+            {'id': 'tribute', 'name': 'Queen', 'score': 98, 'disambiguation': 'Queen tribute band'},
+            {'id': 'original', 'name': 'Queen', 'score': 95, 'disambiguation': 'UK rock group'}]}
+
+        with self.assertLogs('avglyriccounter', level='INFO') as logs:
+            self.assertEqual(self.mb_handler.find_artist('queen'), Artist('original', 'Queen'))
+        self.assertFalse(any('ambiguous' in line for line in logs.output))
+
+    def test_find_artist_warns_of_ambiguous_name(self):
+        self.mock_client.search_artist.return_value = {'count': 2, 'offset': 0, 'artists': [
+            {'id': 'us', 'name': 'Nirvana', 'score': 100, 'disambiguation': '90s US grunge band'},
+            {'id': 'uk', 'name': 'Nirvana', 'score': 100, 'disambiguation': '60s band from the UK'}]}
+
+        with self.assertLogs('avglyriccounter', level='WARNING') as logs:
+            self.assertEqual(self.mb_handler.find_artist('nirvana'), Artist('us', 'Nirvana'))
+        self.assertIn('Nirvana (60s band from the UK) uk', logs.output[0])
+        self.assertIn('--mbid', logs.output[0])
+
+    def test_resolve_artist_searches_once(self):
+        self.mock_client.search_artist.return_value = {'count': 1, 'offset': 0, 'artists': [{'id': 'artist1', 'name': 'Hallatar', 'score': 100}]}
+
+        self.assertEqual(self.mb_handler.resolve_artist('hallatar'), Artist('artist1', 'Hallatar'))
+        self.assertEqual(self.mb_handler.get_artist_mbid(' Hallatar '), 'artist1')
+        self.mock_client.search_artist.assert_called_once_with('hallatar')
+        self.assertEqual(self.mb_handler.registry.counter('artist_resolution_lookups_total', result='hit'), 1)
+
+    def test_resolutions_are_kept_in_the_cache(self):
+        cache = ResponseCache(':memory:')
+        self.mock_client.search_artist.return_value = {'count': 1, 'offset': 0, 'artists': [{'id': 'artist1', 'name': 'Hallatar', 'score': 100}]}
+        MusicBrainzHandler(self.mock_client, cache=cache).get_artist_mbid('hallatar')
+        MusicBrainzHandler(self.mock_client, cache=cache).pin_artist('nirvana', 'nirvana-uk')
+
+        self.mock_client.reset_mock()
+        mb_handler = MusicBrainzHandler(self.mock_client, cache=cache)
+        self.assertEqual(mb_handler.get_artist_mbid('hallatar'), 'artist1')
+        self.assertEqual(mb_handler.resolve_artist('Nirvana'), Artist('nirvana-uk', 'nirvana'))
+        self.mock_client.search_artist.assert_not_called()
+        cache.close()
+
+    def test_missing_artist_is_not_resolved(self):
+        self.mock_client.search_artist.return_value = {'count': 0, 'offset': 0, 'artists': []}
+
+        self.assertEqual(self.mb_handler.get_artist_mbid('qwertyuip'), '')
+        self.assertEqual(self.mb_handler.get_artist_mbid('qwertyuip'), '')
+        self.assertEqual(self.mock_client.search_artist.call_count, 2)
+
     # ------------------------------------------------------------------------------------------------
     # MusicBrainzHandler.get_release_ids()
 
@@ -70,6 +229,46 @@ class TestMusicBrainzHandler(unittest.TestCase):
         actual = self.mb_handler.get_release_ids('dghfdfghdfgh', '4e304316-386d-3409-af2e-78857eec5cfe')
         self.assertEqual(actual, [])
 
+    def make_release_group(self, title, release_id, artist_mbid):
+        # Manually built release group with only the fields that are used
+        return {'title': title, 'artist-credit': [{'artist': {'id': artist_mbid}}], 'releases': [{'id': release_id}]}
+
+    def test_get_release_ids_paging(self):
+        first_page = {'count': 101, 'offset': 0, 'release-groups': [self.make_release_group('album' + str(i), 'release' + str(i), 'artist') for i in range(100)]}
+        second_page = {'count': 101, 'offset': 100, 'release-groups': [self.make_release_group('album100', 'release100', 'artist')]}
+        self.mock_client.search_artist_release_groups.side_effect = [first_page, second_page]
+
+        actual = self.mb_handler.get_release_ids('artist name', 'artist')
+        self.assertEqual(len(actual), 101)
+        self.assertEqual(actual[-1], 'release100')
+        self.assertEqual(self.mock_client.search_artist_release_groups.call_args.kwargs['offset'], 100)
+
+    def test_get_release_ids_paging_stops_without_matches(self):
+        # The second page only has release groups by other artists, so the remaining pages are not requested
+        first_page = {'count': 1000, 'offset': 0, 'release-groups': [self.make_release_group('album' + str(i), 'release' + str(i), 'artist' if i < 50 else 'other') for i in range(100)]}
+        second_page = {'count': 1000, 'offset': 100, 'release-groups': [self.make_release_group('other' + str(i), 'other' + str(i), 'other') for i in range(100)]}
+        self.mock_client.search_artist_release_groups.side_effect = [first_page, second_page]
+
+        actual = self.mb_handler.get_release_ids('artist name', 'artist')
+        self.assertEqual(len(actual), 50)
+        self.assertEqual(self.mock_client.search_artist_release_groups.call_count, 2)
+
+    def test_iter_release_id_pages(self):
+        first_page = {'count': 101, 'offset': 0, 'release-groups': [self.make_release_group('album' + str(i), 'release' + str(i), 'artist') for i in range(100)]}
+        second_page = {'count': 101, 'offset': 100, 'release-groups': [self.make_release_group('ALBUM0', 'reissue0', 'artist'),
+                                                                      self.make_release_group('album100', 'release100', 'artist')]}
+        self.mock_client.search_artist_release_groups.side_effect = [first_page, second_page]
+
+        pages = self.mb_handler.iter_release_id_pages('artist name', 'artist')
+
+        # The next page is only searched for once the previous one has been taken
+        self.assertEqual(len(next(pages)), 100)
+        self.assertEqual(self.mock_client.search_artist_release_groups.call_count, 1)
+
+        # Titles already found on an earlier page are left out
+        self.assertEqual(list(pages), [['release100']])
+        self.assertEqual(self.mock_client.search_artist_release_groups.call_count, 2)
+
     def test_get_release_ids_http_error(self):
         self.mock_client.search_artist_release_groups.side_effect = HTTPError
 
@@ -104,6 +303,15 @@ class TestMusicBrainzHandler(unittest.TestCase):
         actual = self.mb_handler.get_tracks('42929a80-440e-4e25-84ff-e6435a690f15', [])
         self.assertEqual(actual, ['infection', 'realms', 'eyes: closed', 'eyes: open', 'oscillator', 'apparition', 'predator'])
 
+    def test_get_release_keeps_recordings(self):
+        self.mock_client.get_release_with_recordings.return_value = {'id': 'release1', 'title': 'Album', 'media': [{'tracks': [
+            {'title': 'First', 'recording': {'id': 'recording1', 'title': 'First'}},
+            {'title': 'First (Live)', 'recording': {'id': 'recording2', 'title': 'First'}},
+            {'title': 'Second'}]}]}
+
+        actual = self.mb_handler.get_release('release1', ['(live)'])
+        self.assertEqual(actual, Release('release1', 'Album', (Track('first', 'recording1'), Track('second', None))))
+
     def test_get_tracks_none_found(self):
         # It's unlikely that a release that has been added to the database does not have any tracks on it,
         # so use a manually modified json payload to mock the expected response
@@ -145,3 +353,136 @@ class TestMusicBrainzHandler(unittest.TestCase):
 
         with self.assertRaises(TypeError):
             self.mb_handler.get_tracks(1)
+
+    # ------------------------------------------------------------------------------------------------
+    # MusicBrainzHandler.iter_tracks_for_releases()
+
+    def make_release(self, release_id, titles):
+        # Manually built release with only the fields that are used
+        return {'id': release_id, 'title': release_id, 'media': [{'position': 1, 'tracks': [{'title': title} for title in titles]}]}
+
+    def test_iter_tracks_for_releases_browse(self):
+        self.mock_client.browse_artist_releases_with_recordings.return_value = {'release-count': 3, 'release-offset': 0, 'releases': [
+            self.make_release('release1', ['Infection', 'Realms']),
+            self.make_release('other', ['Something Else']),
+            self.make_release('release2', ['Predator', 'Predator (Instrumental)'])]}
+
+        actual = list(self.mb_handler.iter_tracks_for_releases('artist', ['release1', 'release2'], ['(instrumental)']))
+        self.assertEqual(actual, [('release1', ['infection', 'realms']), ('release2', ['predator'])])
+        self.mock_client.get_release_with_recordings.assert_not_called()
+
+    def test_iter_tracks_for_releases_paging(self):
+        first_page = {'release-count': 150, 'release-offset': 0, 'releases': [self.make_release('release1', ['Infection'])] + [self.make_release('other' + str(i), ['Other']) for i in range(99)]}
+        second_page = {'release-count': 150, 'release-offset': 100, 'releases': [self.make_release('release2', ['Realms']), self.make_release('release3', ['Apparition'])]}
+        self.mock_client.browse_artist_releases_with_recordings.side_effect = [first_page, second_page]
+
+        actual = list(self.mb_handler.iter_tracks_for_releases('artist', ['release1', 'release2', 'release3'], []))
+        self.assertEqual(actual, [('release1', ['infection']), ('release2', ['realms']), ('release3', ['apparition'])])
+        self.mock_client.browse_artist_releases_with_recordings.assert_called_with('artist', offset=100, limit=100)
+
+    def test_iter_releases_by_page_browses_each_page_once(self):
+        first_page = {'release-count': 150, 'release-offset': 0, 'releases': [self.make_release('release' + str(i), ['Track' + str(i)]) for i in range(100)]}
+        second_page = {'release-count': 150, 'release-offset': 100, 'releases': [self.make_release('release' + str(i), ['Track' + str(i)]) for i in range(100, 150)]}
+        self.mock_client.browse_artist_releases_with_recordings.side_effect = [first_page, second_page]
+
+        release_id_pages = [['release0', 'release120', 'release130'], ['release1', 'release2'], ['release140']]
+
+        actual = [release.mbid for release in self.mb_handler.iter_releases_by_page('artist', release_id_pages, [])]
+        self.assertEqual(actual, ['release0', 'release120', 'release130', 'release1', 'release2', 'release140'])
+        # The releases of the later pages of IDs were kept while browsing for the first one
+        self.assertEqual(self.mock_client.browse_artist_releases_with_recordings.call_count, 2)
+        self.mock_client.get_release_with_recordings.assert_not_called()
+
+    def test_iter_tracks_for_releases_fallback(self):
+        # Only one of the releases is on the single page of results, so the other one is requested separately
+        self.mock_client.browse_artist_releases_with_recordings.return_value = {'release-count': 1, 'release-offset': 0, 'releases': [self.make_release('release1', ['Infection'])]}
+        self.mock_client.get_release_with_recordings.return_value = self.make_release('release2', ['Realms'])
+
+        actual = list(self.mb_handler.iter_tracks_for_releases('artist', ['release1', 'release2'], []))
+        self.assertEqual(actual, [('release1', ['infection']), ('release2', ['realms'])])
+        self.mock_client.get_release_with_recordings.assert_called_once_with('release2')
+
+    def test_iter_tracks_for_releases_skips_failed_release(self):
+        self.mock_client.browse_artist_releases_with_recordings.side_effect = HTTPError
+        self.mock_client.get_release_with_recordings.side_effect = [self.make_release('release1', ['Infection']), HTTPError, self.make_release('release3', ['Realms'])]
+
+        # The tracks of the other releases are kept when a release fails
+        actual = list(self.mb_handler.iter_tracks_for_releases('artist', ['release1', 'release2', 'release3'], []))
+        self.assertEqual(actual, [('release1', ['infection']), ('release3', ['realms'])])
+        self.assertEqual(self.mb_handler.registry.counter('releases_skipped_total'), 1)
+
+    def test_iter_tracks_for_releases_browse_error(self):
+        self.mock_client.browse_artist_releases_with_recordings.side_effect = HTTPError
+        self.mock_client.get_release_with_recordings.side_effect = [self.make_release('release1', ['Infection']), self.make_release('release2', ['Realms'])]
+
+        actual = list(self.mb_handler.iter_tracks_for_releases('artist', ['release1', 'release2'], []))
+        self.assertEqual(actual, [('release1', ['infection']), ('release2', ['realms'])])
+
+class TestAsyncMusicBrainz(unittest.IsolatedAsyncioTestCase):
+    async def test_client_retry_after_service_unavailable(self):
+        mock_session = Mock()
+        unavailable = Mock(status_code=503, headers={'Retry-After': '0'})
+        ok = Mock(status_code=200, headers={})
+        ok.json.return_value = {'artists': []}
+        mock_session.get.side_effect = [unavailable, ok]
+        mb_client = AsyncMusicBrainzClient(rate_limiter=RateLimiter(rate=1000), session=mock_session)
+
+        actual = await mb_client.search_artist('hallatar')
+        self.assertEqual(actual, {'artists': []})
+        self.assertEqual(mock_session.get.call_count, 2)
+
+    async def test_client_streaming(self):
+        mock_session = Mock()
+        ok = Mock(status_code=200, headers={})
+        ok.iter_content.return_value = [b'{"release-count": 1, "release-offset": 0, "releases": [{"id": "release1", "media": [',
+                                        b'{"tracks": [{"title": "Infection", "number": "1"}]}]}]}']
+        mock_session.get.return_value = ok
+        mb_client = AsyncMusicBrainzClient(rate_limiter=RateLimiter(rate=1000), session=mock_session, streaming=True)
+
+        actual = await mb_client.browse_artist_releases_with_recordings('artist')
+        self.assertEqual(actual, {'release-count': 1, 'releases': [{'id': 'release1', 'media': [{'tracks': [{'title': 'Infection'}]}]}]})
+        ok.close.assert_called_once()
+
+    async def test_client_coalesces_concurrent_requests(self):
+        mock_session = Mock()
+        ok = Mock(status_code=200, headers={})
+        ok.json.return_value = {'artists': []}
+        mock_session.get.return_value = ok
+        mb_client = AsyncMusicBrainzClient(rate_limiter=RateLimiter(rate=1000), session=mock_session)
+
+        actual = await asyncio.gather(mb_client.search_artist('hallatar'), mb_client.search_artist('hallatar'))
+        self.assertEqual(actual, [{'artists': []}, {'artists': []}])
+        self.assertEqual(mock_session.get.call_count, 1)
+        self.assertEqual(mb_client.in_flight.coalesced, 1)
+
+    async def test_handler_get_artist_mbid(self):
+        mock_client = AsyncMock()
+        mock_client.search_artist.return_value = {'count': 1, 'offset': 0, 'artists': [{'id': '7f0d27cb-d636-40c3-a92d-cd44e880658e', 'score': 100, 'name': 'Hallatar'}]}
+        mb_handler = AsyncMusicBrainzHandler(mock_client)
+
+        actual = await mb_handler.get_artist_mbid('hallatar')
+        self.assertEqual(actual, '7f0d27cb-d636-40c3-a92d-cd44e880658e')
+
+        # The name has been resolved
+        self.assertEqual(await mb_handler.get_artist_mbid('Hallatar'), '7f0d27cb-d636-40c3-a92d-cd44e880658e')
+        mock_client.search_artist.assert_awaited_once_with('hallatar')
+
+    async def test_handler_iter_release_id_pages(self):
+        mock_client = AsyncMock()
+        mock_client.search_artist_release_groups.side_effect = [
+            {'count': 2, 'offset': 0, 'release-groups': [{'title': 'Mirrors', 'artist-credit': [{'artist': {'id': 'artist'}}], 'releases': [{'id': 'release1'}]}]},
+            {'count': 2, 'offset': 1, 'release-groups': [{'title': 'Dreams', 'artist-credit': [{'artist': {'id': 'artist'}}], 'releases': [{'id': 'release2'}]}]}]
+        mb_handler = AsyncMusicBrainzHandler(mock_client)
+
+        actual = [page async for page in mb_handler.iter_release_id_pages('artist name', 'artist')]
+        self.assertEqual(actual, [['release1'], ['release2']])
+
+    async def test_handler_iter_tracks_for_releases(self):
+        mock_client = AsyncMock()
+        mock_client.browse_artist_releases_with_recordings.return_value = {'release-count': 1, 'release-offset': 0, 'releases': [
+            {'id': 'release1', 'media': [{'tracks': [{'title': 'Infection'}]}]}]}
+        mock_client.get_release_with_recordings.return_value = {'id': 'release2', 'media': [{'tracks': [{'title': 'Realms'}]}]}
+        mb_handler = AsyncMusicBrainzHandler(mock_client)
+
+        actual = [result async for result in mb_handler.iter_tracks_for_releases('artist', ['release1', 'release2'], [])]
+        self.assertEqual(actual, [('release1', ['infection']), ('release2', ['realms'])])
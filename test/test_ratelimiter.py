@@ -0,0 +1,72 @@
+import unittest
+import asyncio
+import time
+from email.utils import format_datetime
+from datetime import datetime, timedelta, timezone
+
+from avglyriccounter.ratelimiter import RateLimiter, parse_retry_after
+
+class TestRateLimiter(unittest.TestCase):
+    def test_calls_are_spaced(self):
+        limiter = RateLimiter(rate=50)
+
+        start = time.monotonic()
+        for i in range(5):
+            limiter.acquire()
+        elapsed = time.monotonic() - start
+
+        # The first call is free, the next four wait 20ms each
+        self.assertGreaterEqual(elapsed, 0.075)
+
+    def test_burst(self):
+        limiter = RateLimiter(rate=1, burst=3)
+
+        start = time.monotonic()
+        for i in range(3):
+            limiter.acquire()
+        elapsed = time.monotonic() - start
+
+        self.assertLess(elapsed, 0.5)
+
+    def test_defer(self):
+        limiter = RateLimiter(rate=1000)
+        limiter.defer(0.1)
+
+        start = time.monotonic()
+        limiter.acquire()
+        elapsed = time.monotonic() - start
+
+        self.assertGreaterEqual(elapsed, 0.09)
+
+    def test_acquire_async(self):
+        limiter = RateLimiter(rate=50)
+
+        async def acquire_all():
+            await asyncio.gather(*[limiter.acquire_async() for i in range(5)])
+
+        start = time.monotonic()
+        asyncio.run(acquire_all())
+        elapsed = time.monotonic() - start
+
+        self.assertGreaterEqual(elapsed, 0.075)
+
+    def test_invalid_arguments(self):
+        with self.assertRaises(ValueError):
+            RateLimiter(rate=0)
+
+        with self.assertRaises(ValueError):
+            RateLimiter(burst=0)
+
+class TestParseRetryAfter(unittest.TestCase):
+    def test_seconds(self):
+        self.assertEqual(parse_retry_after("3"), 3.0)
+
+    def test_http_date(self):
+        retry_at = datetime.now(timezone.utc) + timedelta(seconds=30)
+
+        actual = parse_retry_after(format_datetime(retry_at, usegmt=True))
+        self.assertAlmostEqual(actual, 30, delta=2)
+
+    def test_invalid(self):
+        self.assertEqual(parse_retry_after(None), None)
+        self.assertEqual(parse_retry_after("soon"), None)
@@ -0,0 +1,46 @@
+import unittest
+import tempfile
+
+from avglyriccounter.lyricstore import LyricStore, track_key
+from avglyriccounter.rescore import rescore
+
+def count_characters(text):
+    return len(text)
+
+class TestRescore(unittest.TestCase):
+    def setUp(self):
+        self.store_dir = tempfile.TemporaryDirectory()
+        self.store = LyricStore(self.store_dir.name, block_size=64)
+
+        self.store.put(track_key("first artist", "one"), "one two three")
+        self.store.put(track_key("first artist", "one (remastered)"), "one two three four")
+        self.store.put(track_key("first artist", "two"), "one two three four five")
+        self.store.put(track_key("first artist", "interlude"), "[Instrumental]")
+        self.store.put(track_key("second artist", "one"), "one two three")
+        for i in range(50):
+            self.store.put(track_key("third artist", "track" + str(i)), "la " * i)
+        self.store.put(track_key("fourth artist", "interlude"), "[Instrumental]")
+        self.store.put(track_key("AC/DC", "Back in Black"), "back in black")
+
+    def tearDown(self):
+        self.store.close()
+        self.store_dir.cleanup()
+
+    def expected(self, third_average):
+        return [{'artist': 'ac/dc', 'average_word_count': 3, 'songs': 1},
+                {'artist': 'first artist', 'average_word_count': 4, 'songs': 2},
+                {'artist': 'second artist', 'average_word_count': 3, 'songs': 1},
+                {'artist': 'third artist', 'average_word_count': third_average, 'songs': 50}]
+
+    def test_rescore_in_process(self):
+        self.assertEqual(rescore(self.store, processes=1), self.expected(24))
+
+    def test_rescore_with_process_pool(self):
+        self.assertEqual(rescore(self.store, processes=2, max_chunk_blocks=1), self.expected(24))
+
+    def test_custom_word_counting(self):
+        self.assertEqual(rescore(self.store, processes=2, count_words=count_characters)[3]['average_word_count'], 74)
+
+    def test_invalid_processes(self):
+        with self.assertRaises(ValueError):
+            rescore(self.store, processes=0)
@@ -0,0 +1,92 @@
+import unittest
+from unittest.mock import Mock
+import random
+
+from avglyriccounter.resilience import RetryPolicy, CircuitBreaker
+from requests.exceptions import Timeout, ConnectionError, HTTPError
+
+class TestRetryPolicy(unittest.TestCase):
+    def setUp(self):
+        self.policy = RetryPolicy(max_retries=2, backoff=1.0, max_backoff=3.0, rng=random.Random(0))
+
+    def test_classification(self):
+        self.assertTrue(self.policy.should_retry(0, res=Mock(status_code=503)))
+        self.assertTrue(self.policy.should_retry(0, res=Mock(status_code=502)))
+        self.assertTrue(self.policy.should_retry(0, exception=Timeout()))
+        self.assertTrue(self.policy.should_retry(0, exception=ConnectionError()))
+        self.assertFalse(self.policy.should_retry(0, res=Mock(status_code=404)))
+        self.assertFalse(self.policy.should_retry(0, res=Mock(status_code=200)))
+        self.assertFalse(self.policy.should_retry(0, exception=HTTPError()))
+
+    def test_max_retries(self):
+        self.assertTrue(self.policy.should_retry(1, res=Mock(status_code=503)))
+        self.assertFalse(self.policy.should_retry(2, res=Mock(status_code=503)))
+
+    def test_jittered_exponential_backoff(self):
+        for attempt, upper_bound in ((0, 1.0), (1, 2.0), (2, 3.0), (5, 3.0)):
+            delays = [self.policy.delay(attempt) for i in range(100)]
+            self.assertTrue(all(0 <= delay <= upper_bound for delay in delays))
+            self.assertGreater(max(delays), upper_bound / 2)
+
+    def test_retry_after(self):
+        self.assertEqual(self.policy.delay(0, Mock(headers={'Retry-After': '2'})), 2.0)
+        self.assertEqual(self.policy.delay(0, Mock(headers={'Retry-After': '120'})), 3.0)
+        self.assertLessEqual(self.policy.delay(0, Mock(headers={})), 1.0)
+
+class TestCircuitBreaker(unittest.TestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.breaker = CircuitBreaker(failure_threshold=3, reset_timeout=10.0, clock=lambda: self.now)
+
+    def test_opens_after_consecutive_failures(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.assertTrue(self.breaker.allow())
+
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(self.breaker.allow())
+
+    def test_half_open_trial(self):
+        for i in range(3):
+            self.breaker.record_failure()
+
+        self.now = 10.0
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertTrue(self.breaker.allow())
+        # Only one trial request at a time
+        self.assertFalse(self.breaker.allow())
+
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.assertTrue(self.breaker.allow())
+
+    def test_failed_trial_opens_again(self):
+        for i in range(3):
+            self.breaker.record_failure()
+
+        self.now = 10.0
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+
+        self.now = 15.0
+        self.assertFalse(self.breaker.allow())
+        self.now = 20.0
+        self.assertTrue(self.breaker.allow())
+
+    def test_released_trial(self):
+        for i in range(3):
+            self.breaker.record_failure()
+
+        self.now = 10.0
+        self.assertTrue(self.breaker.allow())
+        self.breaker.release_trial()
+
+        # Still half open, and another trial is let through
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertTrue(self.breaker.allow())
@@ -0,0 +1,58 @@
+import unittest
+
+from avglyriccounter.resolver import normalize_name, name_match, rank_candidates, rivals, is_mbid, NAME_MATCH_EXACT, NAME_MATCH_NORMALIZED, NAME_MATCH_ALIAS, NAME_MATCH_NONE
+
+def candidate(mbid, name, score=100, disambiguation='', sort_name=None, aliases=[]):
+    return {'id': mbid, 'name': name, 'sort-name': sort_name if sort_name != None else name, 'score': score,
+            'disambiguation': disambiguation, 'aliases': [{'name': alias} for alias in aliases]}
+
+class TestResolver(unittest.TestCase):
+    def test_normalize_name(self):
+        self.assertEqual(normalize_name("The Beatles"), "beatles")
+        self.assertEqual(normalize_name("Beatles, The"), "beatles")
+        self.assertEqual(normalize_name("  BEATLES "), "beatles")
+        self.assertEqual(normalize_name("Motörhead"), "motorhead")
+        self.assertEqual(normalize_name("Simon & Garfunkel"), "simon and garfunkel")
+        self.assertEqual(normalize_name("AC/DC"), "ac dc")
+        # Names that are nothing but an article or punctuation are kept
+        self.assertEqual(normalize_name("The The"), "the")
+        self.assertEqual(normalize_name("!!!"), "!!!")
+
+    def test_name_match(self):
+        self.assertEqual(name_match(candidate('1', "Hallatar"), "hallatar"), NAME_MATCH_EXACT)
+        self.assertEqual(name_match(candidate('1', "Motörhead"), "motorhead"), NAME_MATCH_NORMALIZED)
+        self.assertEqual(name_match(candidate('1', "The Beatles", sort_name="Beatles, The"), "beatles"), NAME_MATCH_NORMALIZED)
+        self.assertEqual(name_match(candidate('1', "Prince", aliases=["The Artist Formerly Known as Prince"]), "artist formerly known as prince"), NAME_MATCH_ALIAS)
+        self.assertEqual(name_match(candidate('1', "Hallatar"), "Trees of Eternity"), NAME_MATCH_NONE)
+
+    def test_exact_name_beats_higher_score(self):
+        candidates = [candidate('alias', "Something Else", score=100, aliases=["Mayhem"]), candidate('exact', "Mayhem", score=90)]
+
+        self.assertEqual([c['id'] for c in rank_candidates(candidates, "mayhem")], ['exact', 'alias'])
+
+    def test_original_beats_tribute_band(self):
+        candidates = [candidate('tribute', "Queen", score=100, disambiguation="Queen tribute band"), candidate('original', "Queen", score=95)]
+
+        self.assertEqual([c['id'] for c in rank_candidates(candidates, "queen")], ['original', 'tribute'])
+
+    def test_equal_candidates_keep_search_order(self):
+        candidates = [candidate(str(i), "Nirvana", score=100) for i in range(5)]
+
+        self.assertEqual([c['id'] for c in rank_candidates(candidates, "nirvana")], ['0', '1', '2', '3', '4'])
+
+    def test_rivals(self):
+        ranked = rank_candidates([candidate('us', "Nirvana", score=100, disambiguation="90s US grunge band"),
+                                  candidate('uk', "Nirvana", score=98, disambiguation="60s band from the UK"),
+                                  candidate('tribute', "Nirvana", score=99, disambiguation="Nirvana tribute"),
+                                  candidate('other', "Nirvana Tribute Band", score=80)], "nirvana")
+
+        self.assertEqual([c['id'] for c in rivals(ranked, "nirvana")], ['uk'])
+        self.assertEqual(rivals(ranked[:1], "nirvana"), [])
+        # No candidate is named what was searched for
+        self.assertEqual(rivals([candidate('1', "A"), candidate('2', "B")], "c"), [])
+
+    def test_is_mbid(self):
+        self.assertTrue(is_mbid('7f0d27cb-d636-40c3-a92d-cd44e880658e'))
+        self.assertFalse(is_mbid('7F0D27CB-D636-40C3-A92D-CD44E880658E'))
+        self.assertFalse(is_mbid('7f0d27cb-d636-40c3-a92d-cd44e880658'))
+        self.assertFalse(is_mbid('Hallatar'))
@@ -0,0 +1,44 @@
+import unittest
+import statistics
+
+from avglyriccounter.sampling import RunningMean, Estimate, half_width
+
+class TestRunningMean(unittest.TestCase):
+    def test_mean_and_variance(self):
+        values = [120, 340, 95, 260, 180, 410, 75]
+        running_mean = RunningMean()
+        for value in values:
+            running_mean.add(value)
+
+        self.assertEqual(running_mean.count, 7)
+        self.assertAlmostEqual(running_mean.mean, statistics.mean(values))
+        self.assertAlmostEqual(running_mean.variance, statistics.variance(values))
+
+    def test_single_value(self):
+        running_mean = RunningMean()
+        running_mean.add(100)
+        self.assertEqual((running_mean.mean, running_mean.variance), (100, 0.0))
+
+class TestHalfWidth(unittest.TestCase):
+    def setUp(self):
+        self.running_mean = RunningMean()
+        for value in [100, 200, 300, 400]:
+            self.running_mean.add(value)
+
+    def test_finite_population_correction(self):
+        # Standard error of 4 values with a standard deviation of 129.1 is 64.55
+        self.assertAlmostEqual(half_width(self.running_mean, 0.95, 4, 10 ** 9), 1.96 * 64.55, places=0)
+        self.assertAlmostEqual(half_width(self.running_mean, 0.95, 4, 8), 1.96 * 64.55 * 0.5 ** 0.5, places=0)
+        self.assertEqual(half_width(self.running_mean, 0.95, 8, 8), 0.0)
+
+    def test_too_few_values(self):
+        running_mean = RunningMean()
+        running_mean.add(100)
+        self.assertEqual(half_width(running_mean, 0.95, 5, 100), None)
+
+class TestEstimate(unittest.TestCase):
+    def test_to_dict(self):
+        estimate = Estimate(178.4, 6.25, 0.95, 40, 52, 900)
+        self.assertEqual(estimate.to_dict(), {'average_word_count': 178, 'confidence_interval': [172.2, 184.7], 'confidence': 0.95,
+                                              'sample_size': 40, 'lyrics_requests': 52, 'tracks': 900, 'exact': False})
+        self.assertTrue(Estimate(178.4, 0.0, 0.95, 700, 900, 900).exact)
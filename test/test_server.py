@@ -0,0 +1,92 @@
+import unittest
+from unittest.mock import Mock
+from threading import Event, Thread
+import urllib.request
+import urllib.error
+import json
+
+from avglyriccounter.server import LyricCountServer
+from avglyriccounter.metrics import Registry
+
+class TestLyricCountServer(unittest.TestCase):
+    def setUp(self):
+        self.release = Event()
+        self.mock_alc = Mock()
+        self.mock_alc.get_average_lyric_count.side_effect = lambda artist_name: self.release.wait(timeout=5) and 123
+
+        self.server = LyricCountServer(('127.0.0.1', 0), self.mock_alc)
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = "http://127.0.0.1:" + str(self.server.server_address[1])
+
+    def tearDown(self):
+        self.release.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def request(self, path, body=None):
+        data = json.dumps(body).encode() if body != None else None
+        try:
+            with urllib.request.urlopen(self.base_url + path, data=data, timeout=5) as res:
+                return res.status, json.loads(res.read())
+        except urllib.error.HTTPError as e:
+            return e.code, json.loads(e.read())
+
+    def test_jobs_for_the_same_artist_are_coalesced(self):
+        status, first = self.request('/jobs', {'artist': 'Iron Maiden'})
+        self.assertEqual(status, 202)
+
+        status, second = self.request('/jobs', {'artist': 'iron  maiden'})
+        self.assertEqual(second['id'], first['id'])
+
+        self.release.set()
+        status, job = self.request('/average?artist=iron+maiden&wait=5')
+        self.assertEqual(status, 200)
+        self.assertEqual(job, {'id': first['id'], 'artist': 'Iron Maiden', 'status': 'done', 'average_word_count': 123})
+        self.assertEqual(self.mock_alc.get_average_lyric_count.call_count, 1)
+
+    def test_slow_artist_returns_job(self):
+        status, job = self.request('/average?artist=hallatar&wait=0')
+        self.assertEqual(status, 202)
+
+        self.release.set()
+        self.server.jobs.get(job['id']).done.wait(timeout=5)
+
+        status, job = self.request('/jobs/' + job['id'])
+        self.assertEqual(status, 200)
+        self.assertEqual(job['average_word_count'], 123)
+
+    def test_failed_job(self):
+        self.mock_alc.get_average_lyric_count.side_effect = ValueError
+
+        status, job = self.request('/average?artist=hallatar&wait=5')
+        self.assertEqual(job['status'], 'failed')
+        self.assertEqual(job['error'], 'ValueError')
+
+    def test_failed_job_is_not_reused(self):
+        self.mock_alc.get_average_lyric_count.side_effect = [ValueError, 123]
+
+        status, failed = self.request('/average?artist=hallatar&wait=5')
+        self.assertEqual(failed['status'], 'failed')
+
+        status, job = self.request('/average?artist=hallatar&wait=5')
+        self.assertNotEqual(job['id'], failed['id'])
+        self.assertEqual(job['average_word_count'], 123)
+        self.assertEqual(self.mock_alc.get_average_lyric_count.call_count, 2)
+
+        # The failed job can still be looked up
+        self.assertEqual(self.request('/jobs/' + failed['id'])[1]['status'], 'failed')
+
+    def test_invalid_requests(self):
+        self.assertEqual(self.request('/jobs', {'name': 'hallatar'})[0], 400)
+        self.assertEqual(self.request('/average')[0], 400)
+        self.assertEqual(self.request('/jobs/unknown')[0], 404)
+        self.assertEqual(self.request('/unknown')[0], 404)
+
+    def test_metrics(self):
+        self.mock_alc.registry = Registry()
+        self.mock_alc.registry.inc('lyrics_total', result='found')
+
+        with urllib.request.urlopen(self.base_url + '/metrics', timeout=5) as res:
+            self.assertEqual(res.status, 200)
+            self.assertTrue(res.headers['Content-Type'].startswith('text/plain'))
+            self.assertIn('avglyriccounter_lyrics_total{result="found"} 1', res.read().decode().splitlines())
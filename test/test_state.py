@@ -0,0 +1,55 @@
+import unittest
+import tempfile
+import os
+
+from avglyriccounter.state import ArtistState, StateStore
+
+class TestArtistState(unittest.TestCase):
+    def test_running_sum_and_count(self):
+        artist_state = ArtistState('artist')
+        artist_state.set_word_count('first', 10)
+        artist_state.set_word_count('second', None)
+        artist_state.set_word_count('third', 30)
+        self.assertEqual(artist_state.average_word_count(), 20)
+
+        # Replacing and removing word counts keeps the sum and count up to date
+        artist_state.set_word_count('second', 50)
+        artist_state.remove_track('first')
+        self.assertEqual((artist_state.word_count_sum, artist_state.lyrics_count), (80, 2))
+        self.assertEqual(artist_state.tracks_without_lyrics(), [])
+
+    def test_average_without_lyrics(self):
+        artist_state = ArtistState('artist')
+        artist_state.set_word_count('first', None)
+        self.assertEqual(artist_state.average_word_count(), 0)
+        self.assertEqual(artist_state.tracks_without_lyrics(), ['first'])
+
+class TestStateStore(unittest.TestCase):
+    def setUp(self):
+        self.state_dir = tempfile.TemporaryDirectory()
+        self.state_store = StateStore(self.state_dir.name)
+
+    def tearDown(self):
+        self.state_dir.cleanup()
+
+    def test_save_and_load(self):
+        artist_state = ArtistState('AC/DC')
+        artist_state.artist_mbid = 'mbid'
+        artist_state.releases = {'release1': ['first', 'second']}
+        artist_state.set_word_count('first', 10)
+        artist_state.set_word_count('second', None)
+        self.state_store.save(artist_state)
+
+        # The artist name is matched like in the server, ignoring case and extra whitespace
+        actual = self.state_store.load('  ac/dc ')
+        self.assertEqual(actual.to_dict(), artist_state.to_dict())
+        self.assertEqual((actual.word_count_sum, actual.lyrics_count), (10, 1))
+        self.assertEqual(os.listdir(self.state_dir.name), ['ac%2Fdc.json'])
+
+    def test_load_missing_or_invalid(self):
+        self.assertEqual(self.state_store.load('artist'), None)
+
+        with open(os.path.join(self.state_dir.name, 'artist.json'), 'w') as f:
+            f.write('{"artist": ')
+
+        self.assertEqual(self.state_store.load('artist'), None)
@@ -0,0 +1,49 @@
+import unittest
+
+from avglyriccounter.titles import TitleIndex, title_key, strip_version, unique_titles
+
+class TestTitleKey(unittest.TestCase):
+    def test_strips_version_suffixes(self):
+        for title in ["song", "Song (Remastered)", "song - 2015 remaster", "song (demo version)", "Song [Live at Wembley]",
+                      "song (feat. someone)", "Song (Demo) [2011 Remaster]", "song - single edit", "song (take 2)"]:
+            self.assertEqual(title_key(title), "song", title)
+
+    def test_normalizes_punctuation_and_diacritics(self):
+        self.assertEqual(title_key("Café del Mar"), "cafe del mar")
+        self.assertEqual(title_key("Don't  Stop -  Me Now!"), "don t stop me now")
+        self.assertEqual(title_key("Motörhead"), title_key("motorhead"))
+
+    def test_keeps_other_suffixes(self):
+        self.assertEqual(title_key("song (part two)"), "song part two")
+        self.assertEqual(title_key("song - part two"), "song part two")
+        self.assertEqual(title_key("re-edit"), "re edit")
+
+    def test_title_of_nothing_but_a_suffix_or_punctuation(self):
+        self.assertEqual(strip_version("(live)"), "(live)")
+        self.assertEqual(title_key("..."), "...")
+
+class TestTitleIndex(unittest.TestCase):
+    def test_add(self):
+        index = TitleIndex()
+
+        self.assertTrue(index.add("song"))
+        self.assertFalse(index.add("Song (Remastered)"))
+        self.assertTrue(index.add("other song"))
+
+        self.assertEqual(len(index), 2)
+        self.assertIn("song - 2015 remaster", index)
+        self.assertEqual(index.canonical("song (demo)"), "song")
+        self.assertEqual(index.canonical("unknown"), None)
+
+    def test_groups_by_recording_mbid(self):
+        index = TitleIndex()
+
+        self.assertTrue(index.add("song", 'recording1'))
+        self.assertFalse(index.add("song, part one", 'recording1'))
+        # The other title of the recording is now known without its MBID
+        self.assertFalse(index.add("song, part one"))
+        self.assertTrue(index.add("other", 'recording2'))
+        self.assertEqual(index.canonical("whatever", 'recording2'), "other")
+
+    def test_unique_titles(self):
+        self.assertEqual(unique_titles(["b", "a", "B (Remix)", "a - live", "c"]), ["b", "a", "c"])